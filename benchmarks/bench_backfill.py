@@ -0,0 +1,75 @@
+"""Measures backfilling dumps of 128 kbps MP3 frames, and checks that the
+segments hold the dumps byte for byte.
+
+``--hours`` of audio are split into ``--files`` dumps, backfilled by
+``--workers`` processes. The time is extrapolated to a day of audio.
+
+    python -m benchmarks.bench_backfill --hours 4 --files 4 --workers 4
+"""
+import argparse
+import hashlib
+import json
+import tempfile
+import time
+
+from benchmarks.bench_merge import FRAME_SAMPLES, SAMPLE_RATE, START_TS, frame
+from streamrec.backfill import backfill
+from streamrec.config import RecordingConfig
+from streamrec.store import SegmentStore
+
+
+def write_dump(path: str, first: int, count: int) -> bytes:
+    digest = hashlib.sha256()
+    with open(path, "wb") as f:
+        for start in range(first, first + count, 10000):
+            data = b"".join(frame(i) for i in range(start, min(start + 10000, first + count)))
+            digest.update(data)
+            f.write(data)
+    return digest.digest()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--hours", type=float, default=4)
+    parser.add_argument("--files", type=int, default=4)
+    parser.add_argument("--workers", type=int, default=1)
+    args = parser.parse_args()
+
+    frames = int(args.hours * 3600 * SAMPLE_RATE / FRAME_SAMPLES) // args.files
+    seconds = frames * FRAME_SAMPLES / SAMPLE_RATE
+    with tempfile.TemporaryDirectory() as tmp:
+        sources, digests = [], []
+        for i in range(args.files):
+            path = f"{tmp}/dump{i}.mp3"
+            digests.append(write_dump(path, i * frames, frames))
+            sources.append((path, START_TS + i * seconds))
+        config = RecordingConfig(url="", output_folder=f"{tmp}/out", durability="none")
+
+        start = time.perf_counter()
+        results = backfill(config, sources, workers=args.workers)
+        elapsed = time.perf_counter() - start
+
+        store = SegmentStore(config.output_folder)
+        try:
+            identical = all(
+                hashlib.sha256(b"".join(bytes(view) for view in store.read(
+                    start_ts, start_ts + seconds))).digest() == digest
+                for (_, start_ts), digest in zip(sources, digests))
+        finally:
+            store.close()
+
+    hours = args.files * seconds / 3600
+    print(json.dumps({
+        "hours": round(hours, 2),
+        "files": args.files,
+        "workers": args.workers,
+        "seconds": round(elapsed, 2),
+        "per_file_seconds": [round(r.elapsed, 2) for r in results],
+        "segments": sum(r.segments for r in results),
+        "day_estimate_seconds": round(elapsed * 24 / hours, 1),
+        "identical": identical,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""Records many concurrent streams from the local test server with one Engine.
+
+    python -m benchmarks.bench_engine --streams 500 --duration 60
+"""
+import argparse
+import json
+import logging
+from multiprocessing import Process
+from pathlib import Path
+import resource
+import shutil
+import socket
+import tempfile
+import threading
+import time
+
+from streamrec.config import RecordingConfig
+from streamrec.engine import Engine
+from tests.test_server import test_server_start
+
+
+def rss_mb() -> float:
+    with open("/proc/self/status", encoding="ascii") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def wait_for_server(port: int):
+    while True:
+        try:
+            with socket.create_connection(("localhost", port), timeout=1):
+                return
+        except ConnectionRefusedError:
+            time.sleep(0.1)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--streams", type=int, default=500)
+    parser.add_argument("--duration", type=float, default=60)
+    parser.add_argument("--speed", type=float, default=0.25,
+                        help="Playback speed of the test server (0.25 = 32 kbps)")
+    parser.add_argument("--port", type=int, default=8010)
+    parser.add_argument("--max-workers", type=int, default=None)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+    server = Process(target=test_server_start, args=(args.port,), daemon=True)
+    server.start()
+    wait_for_server(args.port)
+
+    output = Path(tempfile.mkdtemp(prefix="streamrec-bench-"))
+    configs = [RecordingConfig(url=f"http://localhost:{args.port}/?speed={args.speed}",
+                               output_folder=str(output / f"stream{i}"),
+                               initial_writer_delay=1,
+                               segment_duration=10,
+                               write_period=1)
+               for i in range(args.streams)]
+    engine = Engine(configs, max_workers=args.max_workers)
+
+    samples = []
+
+    def sample():
+        start = time.time()
+        while time.time() - start < args.duration:
+            time.sleep(1)
+            samples.append(round(rss_mb(), 1))
+        engine.stop()
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    cpu_start = time.process_time()
+    wall_start = time.time()
+    sampler.start()
+    engine.start()
+    cpu = time.process_time() - cpu_start
+    wall = time.time() - wall_start
+    server.terminate()
+
+    written = sum(f.stat().st_size for f in output.glob("*/*.mp3"))
+    failed = sum(1 for s in engine.streams if s.recorder.reader_unhandled_exception)
+    shutil.rmtree(output)
+    print(json.dumps({
+        "streams": args.streams,
+        "wall_seconds": round(wall, 2),
+        "cpu_seconds": round(cpu, 2),
+        "cpu_percent_per_stream": round(100 * cpu / wall / args.streams, 4),
+        "rss_mb_first": samples[0] if samples else None,
+        "rss_mb_last": samples[-1] if samples else None,
+        "rss_mb_max": max(samples) if samples else None,
+        "bytes_written": written,
+        "failed_streams": failed,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""Compares extracting a time range through the segment index, cut at frame
+boundaries and copied with sendfile, against finding the files by name and
+remuxing them with libav.
+
+    python -m benchmarks.bench_extract --minutes 60
+"""
+import argparse
+from datetime import datetime, timezone
+from fractions import Fraction
+import json
+from pathlib import Path
+import tempfile
+import time
+
+import av
+
+from streamrec.config import RecordingConfig
+from streamrec.index import SEGMENT_NAME, IndexWriter
+from streamrec.packet import PacketBatchBuilder
+from streamrec.segmentfile import SegmentFile
+from streamrec.session import RecordingSession
+from streamrec.store import SegmentStore
+
+FRAME_SAMPLES = 1152
+SAMPLE_RATE = 44100
+# MPEG-1 Layer III, 128 kbps, 44100 Hz
+FRAME = bytes([0xFF, 0xFB, 0x90, 0x64]) + bytes(413)
+START_TS = 1_700_000_000.0
+
+
+def record(folder: str, minutes: int):
+    config = RecordingConfig(url="", output_folder=folder, segment_duration=60)
+    session = RecordingSession(config, adjusted_ts_start=START_TS)
+    index = IndexWriter(folder, session.uuid)
+    time_base = Fraction(1, SAMPLE_RATE)
+    packets_per_minute = round(60 * SAMPLE_RATE / FRAME_SAMPLES)
+    segment = None
+    pts = 0
+    for _ in range(minutes):
+        builder = PacketBatchBuilder(session)
+        for _ in range(packets_per_minute):
+            packet = av.Packet(FRAME)
+            packet.pts = pts
+            packet.duration = FRAME_SAMPLES
+            packet.time_base = time_base
+            builder.append(packet)
+            pts += FRAME_SAMPLES
+        for segment_ts, batch in builder.build().split_by_segment():
+            if segment and segment.segment_ts != segment_ts:
+                segment.close()
+                segment = None
+            segment = segment or SegmentFile(session, segment_ts, index=index)
+            segment.write(batch)
+    segment.close()
+    index.close()
+
+
+def extract_by_name(folder: str, start: float, end: float, output: str) -> int:
+    """List the folder, pick files by name and remux the packets in range."""
+    files = []
+    for path in sorted(Path(folder).iterdir()):
+        match = SEGMENT_NAME.match(path.name)
+        if match:
+            ts = datetime.strptime(match["ts"], "%Y%m%d-%H%M%S").replace(
+                tzinfo=timezone.utc).timestamp()
+            files.append((ts, path))
+    written = 0
+    with av.open(output, mode="w", format="mp3") as out:
+        out_stream = None
+        for i, (ts, path) in enumerate(files):
+            next_ts = files[i + 1][0] if i + 1 < len(files) else float("inf")
+            if next_ts <= start or ts >= end:
+                continue
+            with av.open(str(path)) as container:
+                stream = container.streams.audio[0]
+                if out_stream is None:
+                    out_stream = out.add_stream_from_template(stream)
+                for packet in container.demux(stream):
+                    if packet.pts is None or not packet.size:
+                        continue
+                    packet_ts = ts + float(packet.pts * packet.time_base)
+                    if start <= packet_ts < end:
+                        packet.stream = out_stream
+                        written += packet.size
+                        out.mux(packet)
+    return written
+
+
+def measure(fn):
+    cpu = time.process_time()
+    wall = time.perf_counter()
+    result = fn()
+    return result, time.process_time() - cpu, time.perf_counter() - wall
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--minutes", type=int, default=60)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        record(folder, args.minutes + 2)
+        start = START_TS + 30.5
+        end = start + args.minutes * 60
+        output = str(Path(folder) / "out.bin")
+
+        by_name, by_name_cpu, by_name_wall = measure(
+            lambda: extract_by_name(folder, start, end, output))
+
+        def extract_indexed():
+            store = SegmentStore(folder)
+            with open(output, "wb") as f:
+                written = store.extract(start, end, f)
+            store.close()
+            return written
+
+        indexed, indexed_cpu, indexed_wall = measure(extract_indexed)
+
+    print(json.dumps({
+        "minutes": args.minutes,
+        "by_name": {"bytes": by_name, "cpu_seconds": round(by_name_cpu, 4),
+                    "wall_seconds": round(by_name_wall, 4)},
+        "indexed": {"bytes": indexed, "cpu_seconds": round(indexed_cpu, 4),
+                    "wall_seconds": round(indexed_wall, 4)},
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
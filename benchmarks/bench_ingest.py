@@ -0,0 +1,142 @@
+"""Compares the CPU cost of turning an MP3 or ADTS stream body into packets
+with libav, as the engine does by default, against the native frame parser
+(``native_ingest``).
+
+The body is fed in network-sized chunks. Each path is measured alone and
+followed by Recorder.enqueue, which both share.
+
+    python -m benchmarks.bench_ingest --minutes 10
+"""
+import argparse
+import io
+import json
+import time
+
+import av
+import numpy as np
+
+from streamrec.config import RecordingConfig
+from streamrec.engine import AVIO_BUFFER_SIZE, CHUNK_SIZE
+from streamrec.ingest import NativeDemuxer
+from streamrec.journal import MemoryBudget
+from streamrec.recorder import Recorder
+
+SAMPLE_RATE = 44100
+# Packets queued before the benchmark empties the recorder queue
+QUEUE_PACKETS = 4096
+
+
+def encode(codec: str, fmt: str, minutes: float) -> bytes:
+    output = io.BytesIO()
+    container = av.open(output, mode="w", format=fmt)
+    stream = container.add_stream(codec, rate=SAMPLE_RATE)
+    stream.bit_rate = 128000
+    rng = np.random.default_rng(0)
+    for _ in range(int(minutes * 60)):
+        samples = (rng.uniform(-1, 1, (1, SAMPLE_RATE)) * 2**14).astype(np.int16)
+        frame = av.AudioFrame.from_ndarray(samples, format="s16", layout="mono")
+        frame.sample_rate = SAMPLE_RATE
+        for packet in stream.encode(frame):
+            container.mux(packet)
+    for packet in stream.encode(None):
+        container.mux(packet)
+    container.close()
+    return output.getvalue()
+
+
+class ChunkReader:
+    """File-like object returning the body in CHUNK_SIZE chunks, like StreamFeed."""
+
+    def __init__(self, data: bytes):
+        self.data = memoryview(data)
+        self.offset = 0
+
+    def read(self, size: int) -> bytes:
+        size = min(size, CHUNK_SIZE)
+        chunk = bytes(self.data[self.offset:self.offset + size])
+        self.offset += len(chunk)
+        return chunk
+
+
+def make_recorder() -> Recorder:
+    config = RecordingConfig(url="", output_folder="/nonexistent", index=False,
+                             max_queue_bytes=0)
+    recorder = Recorder(config)
+    recorder.budget = MemoryBudget()
+    recorder.session.ts_start = time.time()
+    return recorder
+
+
+def drain(recorder: Recorder):
+    if len(recorder.queue) >= QUEUE_PACKETS:
+        with recorder.queue_lock:
+            recorder.reset_queue()
+
+
+def libav_ingest(data: bytes, fmt: str, recorder: Recorder) -> int:
+    count = 0
+    with av.open(ChunkReader(data), format=fmt, buffer_size=AVIO_BUFFER_SIZE) as container:
+        stream = next(s for s in container.streams if s.type == "audio")
+        for packet in container.demux(stream):
+            if not packet.size:
+                continue
+            count += 1
+            if recorder:
+                recorder.enqueue(packet)
+                drain(recorder)
+    return count
+
+
+def native_ingest(data: bytes, fmt: str, recorder: Recorder) -> int:
+    count = 0
+    demuxer = NativeDemuxer(fmt)
+    for offset in range(0, len(data), CHUNK_SIZE):
+        packets = demuxer.feed(data[offset:offset + CHUNK_SIZE])
+        count += len(packets)
+        if recorder and packets:
+            recorder.enqueue_many(packets)
+            drain(recorder)
+    return count
+
+
+def measure(ingest, data: bytes, fmt: str, enqueue: bool, seconds: float) -> dict:
+    recorder = make_recorder() if enqueue else None
+    start = time.process_time()
+    packets = ingest(data, fmt, recorder)
+    cpu = time.process_time() - start
+    return {
+        "packets": packets,
+        "cpu_seconds": round(cpu, 3),
+        "us_per_packet": round(cpu / packets * 1e6, 2),
+        "cpu_percent_per_stream": round(100 * cpu / seconds, 4),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--minutes", type=float, default=10)
+    parser.add_argument("--formats", nargs="+", choices=["mp3", "aac"], default=["mp3", "aac"])
+    args = parser.parse_args()
+
+    codecs = {"mp3": ("mp3", "mp3"), "aac": ("aac", "adts")}
+    results = {}
+    for fmt in args.formats:
+        codec, container = codecs[fmt]
+        data = encode(codec, container, args.minutes)
+        seconds = args.minutes * 60
+        result = {}
+        for enqueue in (False, True):
+            stage = "with_enqueue" if enqueue else "demux_only"
+            libav = measure(libav_ingest, data, fmt, enqueue, seconds)
+            native = measure(native_ingest, data, fmt, enqueue, seconds)
+            result[stage] = {
+                "libav": libav,
+                "native": native,
+                "speedup": round(libav["cpu_seconds"] / max(native["cpu_seconds"], 1e-9), 1),
+            }
+        results[fmt] = result
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
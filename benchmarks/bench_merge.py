@@ -0,0 +1,123 @@
+"""Measures merging redundant recordings of a stream, and checks the result.
+
+Each of ``--replicas`` recordings of ``--hours`` of 128 kbps MP3 frames has
+its own clock offset and random gaps, which never overlap across replicas.
+The time to merge is extrapolated to a day of audio.
+
+    python -m benchmarks.bench_merge --hours 2 --replicas 3
+"""
+import argparse
+from fractions import Fraction
+import hashlib
+import json
+import resource
+import tempfile
+import time
+
+import numpy as np
+
+from streamrec.config import RecordingConfig
+from streamrec.index import IndexWriter
+from streamrec.merge import merge
+from streamrec.packet import PacketBatch
+from streamrec.segmentfile import SegmentFile
+from streamrec.session import RecordingSession
+from streamrec.store import SegmentStore
+
+HEADER = b"\xff\xfb\x90\x64"  # 128 kbps, 44.1 kHz MPEG-1 layer 3
+FRAME_SIZE = 417
+FRAME_SAMPLES = 1152
+SAMPLE_RATE = 44100
+START_TS = 1_700_000_000.0
+# Gaps per replica and hour, and their length in frames
+GAPS_PER_HOUR = 4
+GAP_FRAMES = 1000
+
+
+def frame(i: int) -> bytes:
+    return HEADER + (i.to_bytes(8, "little") * 52)[:FRAME_SIZE - len(HEADER)]
+
+
+def write_replica(folder: str, frames: int, offset: float, missing: np.ndarray):
+    config = RecordingConfig(url="", output_folder=folder, durability="none")
+    session = RecordingSession(config=config, adjusted_ts_start=START_TS + offset)
+    index = IndexWriter(folder, session.uuid)
+    segment = None
+    # One minute at a time
+    for start in range(0, frames, 2297):
+        ids = np.arange(start, min(start + 2297, frames))
+        ids = ids[~missing[ids]]
+        if not len(ids):
+            continue
+        payload = b"".join(frame(int(i)) for i in ids)
+        batch = PacketBatch(session, Fraction(1, SAMPLE_RATE), ids * FRAME_SAMPLES,
+                            np.full(len(ids), FRAME_SAMPLES), np.zeros(len(ids)),
+                            np.full(len(ids), FRAME_SIZE), memoryview(payload))
+        for segment_ts, packets in batch.split_by_segment():
+            if segment and segment.segment_ts != segment_ts:
+                segment.close()
+                segment = None
+            if not segment:
+                segment = SegmentFile(session, segment_ts, index=index)
+            segment.write(packets)
+    if segment:
+        segment.close()
+    index.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--hours", type=float, default=2)
+    parser.add_argument("--replicas", type=int, default=3)
+    args = parser.parse_args()
+
+    frames = int(args.hours * 3600 * SAMPLE_RATE / FRAME_SAMPLES)
+    rng = np.random.default_rng(0)
+    owner = rng.integers(0, args.replicas, int(args.hours * GAPS_PER_HOUR * args.replicas))
+    starts = rng.integers(0, frames - GAP_FRAMES, len(owner))
+    with tempfile.TemporaryDirectory() as tmp:
+        folders = [f"{tmp}/{i}" for i in range(args.replicas)]
+        covered = np.zeros(frames, dtype=bool)
+        for i, folder in enumerate(folders):
+            missing = np.zeros(frames, dtype=bool)
+            for start in starts[owner == i]:
+                missing[start:start + GAP_FRAMES] = True
+            if i == args.replicas - 1:
+                # Whatever no replica had so far
+                missing &= covered
+            covered |= ~missing
+            write_replica(folder, frames, rng.uniform(-0.2, 0.2), missing)
+
+        start = time.perf_counter()
+        cpu = time.process_time()
+        result = merge(folders, f"{tmp}/merged")
+        cpu = time.process_time() - cpu
+        seconds = time.perf_counter() - start
+
+        expected = hashlib.sha256()
+        for i in range(frames):
+            expected.update(frame(i))
+        merged = hashlib.sha256()
+        store = SegmentStore(f"{tmp}/merged")
+        try:
+            for view in store.read(0, float("inf")):
+                merged.update(view)
+        finally:
+            store.close()
+
+    day = 24 / args.hours
+    print(json.dumps({
+        "hours": args.hours,
+        "replicas": args.replicas,
+        "merge_seconds": round(seconds, 2),
+        "merge_cpu_seconds": round(cpu, 2),
+        "day_estimate_minutes": round(seconds * day / 60, 1),
+        "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "gap_seconds": round(result.gap_seconds, 3),
+        "used_seconds": [round(s, 1) for s in result.used.values()],
+        "identical": merged.hexdigest() == expected.hexdigest(),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""Measures what metrics cost: the counter updates of Recorder.enqueue against
+the rest of it, and collecting and rendering the metrics of many streams.
+
+    python -m benchmarks.bench_metrics --packets 200000 --streams 500
+"""
+import argparse
+from fractions import Fraction
+import json
+import logging
+import tempfile
+import time
+
+import av
+
+from streamrec.config import RecordingConfig
+from streamrec.metrics import render
+from streamrec.recorder import Recorder
+
+FRAME_SAMPLES = 1152
+SAMPLE_RATE = 44100
+FRAME_SIZE = 417
+
+
+def make_recorder(folder: str) -> Recorder:
+    config = RecordingConfig(url="", output_folder=folder, index=False, max_queue_bytes=0)
+    recorder = Recorder(config)
+    recorder.session.ts_start = time.time()
+    return recorder
+
+
+def enqueue_seconds(recorder: Recorder, packets: list[av.Packet]) -> float:
+    start = time.thread_time()
+    for packet in packets:
+        recorder.enqueue(packet)
+        if len(recorder.queue) >= 1000:
+            recorder.queue = type(recorder.queue)(recorder.session)
+    return time.thread_time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--packets", type=int, default=200000)
+    parser.add_argument("--streams", type=int, default=500)
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    packets = []
+    for i in range(args.packets):
+        packet = av.Packet(bytes(FRAME_SIZE))
+        packet.pts = i * FRAME_SAMPLES
+        packet.time_base = Fraction(1, SAMPLE_RATE)
+        packets.append(packet)
+
+    with tempfile.TemporaryDirectory() as folder:
+        recorder = make_recorder(folder)
+        total = enqueue_seconds(recorder, packets)
+        # The same updates as Recorder.enqueue, on their own, minus the loop
+        metrics = recorder.metrics
+        start = time.thread_time()
+        for packet in packets:
+            metrics.packets += 1
+            metrics.packet_bytes += packet.size
+        counters = time.thread_time() - start
+        start = time.thread_time()
+        for packet in packets:
+            _ = packet.size
+        counters -= time.thread_time() - start
+
+        recorders = [make_recorder(folder) for _ in range(args.streams)]
+        for r in recorders:
+            r.enqueue(packets[0])
+        start = time.perf_counter()
+        text = render({str(i): r.stats() for i, r in enumerate(recorders)})
+        collect = time.perf_counter() - start
+
+    print(json.dumps({
+        "enqueue_us_per_packet": round(total / args.packets * 1e6, 3),
+        "counters_us_per_packet": round(counters / args.packets * 1e6, 3),
+        "counters_share_of_enqueue": round(counters / total, 4),
+        "streams": args.streams,
+        "collect_and_render_ms": round(collect * 1000, 2),
+        "exposition_bytes": len(text),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
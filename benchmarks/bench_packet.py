@@ -0,0 +1,87 @@
+"""Compares per-packet memory and segment grouping time of PacketWithReceivedTS
+lists against columnar PacketBatch objects.
+
+    python -m benchmarks.bench_packet --packets 100000
+"""
+import argparse
+from fractions import Fraction
+import gc
+from itertools import groupby
+import json
+import time
+import tracemalloc
+
+import av
+
+from streamrec.config import RecordingConfig
+from streamrec.packet import PacketBatchBuilder, PacketWithReceivedTS
+from streamrec.session import RecordingSession
+
+FRAME_SAMPLES = 1152
+SAMPLE_RATE = 44100
+FRAME_SIZE = 417
+
+
+def demuxed_packets(n: int):
+    time_base = Fraction(1, SAMPLE_RATE)
+    for i in range(n):
+        packet = av.Packet(bytes(FRAME_SIZE))
+        packet.pts = i * FRAME_SAMPLES
+        packet.duration = FRAME_SAMPLES
+        packet.time_base = time_base
+        yield packet
+
+
+def measure(build, n: int):
+    gc.collect()
+    tracemalloc.start()
+    result = build(demuxed_packets(n))
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, current / n
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--packets", type=int, default=100_000)
+    parser.add_argument("--segment-duration", type=int, default=60)
+    args = parser.parse_args()
+
+    config = RecordingConfig(url="", output_folder="",
+                             segment_duration=args.segment_duration)
+    session = RecordingSession(config, adjusted_ts_start=1_700_000_000.0)
+
+    def build_objects(packets):
+        return [PacketWithReceivedTS(session, p) for p in packets]
+
+    def build_batch(packets):
+        builder = PacketBatchBuilder(session)
+        for p in packets:
+            builder.append(p)
+        return builder
+
+    objects, objects_bytes = measure(build_objects, args.packets)
+    builder, batch_bytes = measure(build_batch, args.packets)
+
+    start = time.perf_counter()
+    object_groups = [(ts, list(g)) for ts, g in
+                     groupby(objects, key=lambda p: p.get_segment_ts())]
+    objects_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    batch_groups = builder.build().split_by_segment()
+    batch_seconds = time.perf_counter() - start
+
+    assert [ts for ts, _ in object_groups] == [ts for ts, _ in batch_groups]
+    print(json.dumps({
+        "packets": args.packets,
+        "segments": len(batch_groups),
+        "objects": {"bytes_per_packet": round(objects_bytes, 1),
+                    "grouping_seconds": round(objects_seconds, 4)},
+        "batch": {"bytes_per_packet": round(batch_bytes, 1),
+                  "grouping_seconds": round(batch_seconds, 4)},
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""Measures crash recovery of open segments in an output folder holding many
+closed ones, against the time it takes to glob the folder for .tmp files.
+
+    python -m benchmarks.bench_recovery --closed 50000 --open 200
+"""
+import argparse
+import json
+import os
+from pathlib import Path
+import tempfile
+import time
+
+from streamrec.index import connect, INDEX_FILENAME
+from streamrec.recovery import recover_open_segments
+
+FRAME = b"\xff\xfb\x90\x64" + bytes(413)  # 128 kbps, 44.1 kHz MPEG-1 layer 3
+FRAMES_PER_SEGMENT = 2297  # About 60 seconds
+CHECKPOINT_AGE_FRAMES = 383  # About 10 seconds
+
+
+def populate(folder: Path, closed: int, open_segments: int):
+    segment = FRAME * FRAMES_PER_SEGMENT
+    conn = connect(folder / INDEX_FILENAME)
+    with conn:
+        for i in range(closed + open_segments):
+            name = f"{i:08d}.mp3"
+            is_open = i >= closed
+            if is_open:
+                # A partial frame at the end, as left by a crash
+                (folder / (name + ".tmp")).write_bytes(segment + FRAME[:100])
+            else:
+                (folder / name).write_bytes(b"")
+            cursor = conn.execute(
+                "INSERT INTO segments (path, session, start_ts, end_ts, size) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (name, "s", i * 60.0, None if is_open else (i + 1) * 60.0, 0))
+            if is_open:
+                # The index commits checkpoints every COMMIT_INTERVAL seconds, so
+                # the last one is at most that old
+                frame = FRAMES_PER_SEGMENT - CHECKPOINT_AGE_FRAMES
+                conn.execute("INSERT INTO checkpoints VALUES (?, ?, ?)",
+                             (cursor.lastrowid, i * 60.0 + frame * 1152 / 44100,
+                              frame * len(FRAME)))
+    conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--closed", type=int, default=50000)
+    parser.add_argument("--open", type=int, default=200)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as folder:
+        folder = Path(folder)
+        populate(folder, args.closed, args.open)
+        os.sync()
+
+        start = time.perf_counter()
+        found = len(list(folder.glob("*.tmp")))
+        glob_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        recovered = recover_open_segments(folder, sync=False)
+        recover_seconds = time.perf_counter() - start
+        truncated = sum(1 for p in folder.iterdir()
+                        if p.suffix == ".mp3" and p.stat().st_size % len(FRAME))
+    print(json.dumps({
+        "closed_segments": args.closed,
+        "open_segments": args.open,
+        "glob_found": found,
+        "glob_seconds": round(glob_seconds, 3),
+        "recovered": recovered,
+        "recover_seconds": round(recover_seconds, 3),
+        "recover_ms_per_segment": round(recover_seconds / max(recovered, 1) * 1000, 3),
+        "partial_frames_left": truncated,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
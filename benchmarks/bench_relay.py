@@ -0,0 +1,101 @@
+"""Measures the recorder side cost of relaying packets (CPU time of the thread
+calling Relay.write) as the number of listeners grows.
+
+    python -m benchmarks.bench_relay --listeners 0 10 100 300 --seconds 5
+"""
+import argparse
+import asyncio
+import json
+from multiprocessing import Process
+import threading
+import time
+
+from streamrec.relay import Relay, RelayServer
+
+FRAME_SIZE = 417
+# Packets per second of a 128 kbps MP3 stream
+PACKET_RATE = 38.28
+
+
+def run_listeners(port: int, count: int, seconds: float):
+    async def listen():
+        try:
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        except OSError:
+            return
+        writer.write(b"GET /station HTTP/1.0\r\n\r\n")
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            try:
+                data = await asyncio.wait_for(reader.read(65536), 1)
+            except asyncio.TimeoutError:
+                continue
+            if not data:
+                break
+        writer.close()
+
+    async def main():
+        await asyncio.gather(*[listen() for _ in range(count)])
+
+    asyncio.run(main())
+
+
+def measure(listeners: int, seconds: float, streams: int) -> dict:
+    server = RelayServer(host="127.0.0.1", port=0)
+    server.start()
+    relay = Relay("station")
+    server.add(relay)
+    process = Process(target=run_listeners, args=(server.port, listeners, seconds + 2))
+    process.start()
+    while relay.listeners < listeners:
+        time.sleep(0.05)
+
+    # One writer thread standing in for `streams` recorders
+    packet = bytes(FRAME_SIZE)
+    interval = 1 / (PACKET_RATE * streams)
+    result = {}
+
+    def write():
+        packets = 0
+        cpu = time.thread_time()
+        latencies = []
+        deadline = time.monotonic() + seconds
+        next_ts = time.monotonic()
+        while time.monotonic() < deadline:
+            start = time.perf_counter()
+            relay.write(packet)
+            latencies.append(time.perf_counter() - start)
+            packets += 1
+            next_ts += interval
+            time.sleep(max(0, next_ts - time.monotonic()))
+        latencies.sort()
+        result.update({
+            "listeners": listeners,
+            "packets": packets,
+            "writer_cpu_us_per_packet": round((time.thread_time() - cpu) / packets * 1e6, 2),
+            "write_p50_us": round(latencies[len(latencies) // 2] * 1e6, 2),
+            "write_p99_us": round(latencies[int(len(latencies) * 0.99)] * 1e6, 2),
+        })
+
+    thread = threading.Thread(target=write)
+    thread.start()
+    thread.join()
+    result["dropped"] = relay.dropped
+    process.join()
+    server.stop()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--listeners", type=int, nargs="+", default=[0, 10, 100, 300])
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--streams", type=int, default=10,
+                        help="Packet rate as a multiple of one 128 kbps stream")
+    args = parser.parse_args()
+    print(json.dumps([measure(n, args.seconds, args.streams) for n in args.listeners],
+                     indent=2))
+
+
+if __name__ == "__main__":
+    main()
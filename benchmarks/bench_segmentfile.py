@@ -0,0 +1,124 @@
+"""Compares the syscalls of the previous SegmentFile write path with the current one.
+
+The previous path reopened the .tmp file in "ab" mode on every flush and
+wrote packet by packet. Opens are counted with an audit hook and write
+syscalls (write/writev) with /proc/self/io, so this runs on Linux only.
+
+    python -m benchmarks.bench_segmentfile --segments 10
+"""
+import argparse
+from fractions import Fraction
+import json
+import os
+import sys
+import tempfile
+import time
+
+import av
+
+from streamrec.config import RecordingConfig
+from streamrec.packet import PacketBatchBuilder, PacketWithReceivedTS
+from streamrec.segmentfile import SegmentFile
+from streamrec.session import RecordingSession
+
+FRAME_SAMPLES = 1152
+SAMPLE_RATE = 44100
+FRAME_SIZE = 417
+
+opens = 0
+
+
+def audit(event, args):
+    # pylint: disable=global-statement
+    global opens
+    if event == "open" and not str(args[0]).startswith("/proc/"):
+        opens += 1
+
+
+def write_syscalls() -> int:
+    with open("/proc/self/io", encoding="ascii") as f:
+        for line in f:
+            if line.startswith("syscw:"):
+                return int(line.split()[1])
+    raise RuntimeError("syscw not available")
+
+
+class LegacySegmentFile(SegmentFile):
+    def write(self, packets):
+        if self.first_ts is None:
+            self.first_ts = packets[0].get_adjusted_ts()
+        with open(self.get_path(tmp=True), "ab") as file:
+            for packet in packets:
+                file.write(packet.packet)
+
+    def close(self):
+        os.rename(self.get_path(tmp=True), self.get_path())
+
+
+def make_flushes(session: RecordingSession, segments: int, segment_duration: int,
+                 write_period: float, batches: bool):
+    frames_per_flush = int(write_period * SAMPLE_RATE / FRAME_SAMPLES)
+    flushes_per_segment = int(segment_duration / write_period)
+    pts = 0
+    for _ in range(segments):
+        segment = []
+        for _ in range(flushes_per_segment):
+            flush = []
+            for _ in range(frames_per_flush):
+                packet = av.Packet(bytes(FRAME_SIZE))
+                packet.pts = pts
+                packet.time_base = Fraction(1, SAMPLE_RATE)
+                pts += FRAME_SAMPLES
+                flush.append(PacketWithReceivedTS(session=session, packet=packet))
+            if batches:
+                builder = PacketBatchBuilder(session)
+                for p in flush:
+                    builder.append(p.packet)
+                flush = builder.build()
+            segment.append(flush)
+        yield segment
+
+
+def run(segment_class, args) -> dict:
+    # pylint: disable=global-statement
+    global opens
+    with tempfile.TemporaryDirectory() as folder:
+        config = RecordingConfig(url="", output_folder=folder,
+                                 segment_duration=args.segment_duration,
+                                 durability=args.durability)
+        session = RecordingSession(config, adjusted_ts_start=1_700_000_000.0)
+        batches = segment_class is SegmentFile
+        segments = list(make_flushes(session, args.segments, args.segment_duration,
+                                     args.write_period, batches))
+        opens = 0
+        writes_start = write_syscalls()
+        start = time.perf_counter()
+        for flushes in segments:
+            first = flushes[0]
+            segment_ts = first.split_by_segment()[0][0] if batches else first[0].get_segment_ts()
+            segment = segment_class(session, segment_ts)
+            for packets in flushes:
+                segment.write(packets)
+            segment.close()
+        elapsed = time.perf_counter() - start
+        writes = write_syscalls() - writes_start
+    return {"opens": opens, "write_syscalls": writes,
+            "seconds": round(elapsed, 4)}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--segments", type=int, default=10)
+    parser.add_argument("--segment-duration", type=int, default=60)
+    parser.add_argument("--write-period", type=float, default=1)
+    parser.add_argument("--durability", default="none")
+    args = parser.parse_args()
+    sys.addaudithook(audit)
+    print(json.dumps({
+        "previous": run(LegacySegmentFile, args),
+        "current": run(SegmentFile, args),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
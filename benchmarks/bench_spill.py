@@ -0,0 +1,122 @@
+"""Measures the memory of recorders whose writer is stalled, with and without a
+queue cap, and checks that every packet is written once the writer resumes.
+
+The stall is simulated: ``--minutes`` of 128 kbps packets are enqueued as fast
+as possible into ``--streams`` recorders while SegmentFile.write is blocked.
+
+    python -m benchmarks.bench_spill --minutes 10 --streams 10
+"""
+import argparse
+from fractions import Fraction
+import hashlib
+import json
+from pathlib import Path
+import tempfile
+import threading
+import time
+import tracemalloc
+
+import av
+
+from streamrec.config import RecordingConfig
+from streamrec.journal import MemoryBudget
+from streamrec.recorder import Recorder
+from streamrec.segmentfile import SegmentFile
+
+FRAME_SAMPLES = 1152
+SAMPLE_RATE = 44100
+FRAME_SIZE = 417
+
+
+def run(minutes: float, streams: int, max_queue_bytes: int) -> dict:
+    release = threading.Event()
+    original_write = SegmentFile.write
+
+    def stalled_write(segment, packets):
+        release.wait()
+        original_write(segment, packets)
+
+    packets = int(minutes * 60 * SAMPLE_RATE / FRAME_SAMPLES)
+    with tempfile.TemporaryDirectory() as folder:
+        budget = MemoryBudget()
+        recorders = []
+        for i in range(streams):
+            config = RecordingConfig(url="", output_folder=f"{folder}/{i}",
+                                     initial_writer_delay=0, index=False,
+                                     max_queue_bytes=max_queue_bytes,
+                                     spill_folder=f"{folder}/spill")
+            recorder = Recorder(config)
+            recorder.budget = budget
+            recorder.prepare_output()
+            recorder.session.ts_start = time.time()
+            recorder.session.adjusted_ts_start = recorder.session.ts_start
+            recorders.append(recorder)
+
+        SegmentFile.write = stalled_write
+        writers = [threading.Thread(target=r.file_writer) for r in recorders]
+        tracemalloc.start()
+        try:
+            for writer in writers:
+                writer.start()
+            start = time.perf_counter()
+            digest = hashlib.sha256()
+            for i in range(packets):
+                payload = i.to_bytes(4, "little") * (FRAME_SIZE // 4)
+                digest.update(payload)
+                for recorder in recorders:
+                    packet = av.Packet(payload)
+                    packet.pts = i * FRAME_SAMPLES
+                    packet.time_base = Fraction(1, SAMPLE_RATE)
+                    recorder.enqueue(packet)
+            enqueue_seconds = time.perf_counter() - start
+            _, stalled_peak = tracemalloc.get_traced_memory()
+            spilled = sum(r.spilled_bytes for r in recorders)
+            lag = max(r.replay_lag for r in recorders)
+
+            start = time.perf_counter()
+            release.set()
+            for recorder in recorders:
+                with recorder.queue_lock:
+                    recorder.reader_finished = True
+                    recorder.wake_writer()
+            for writer in writers:
+                writer.join()
+            replay_seconds = time.perf_counter() - start
+        finally:
+            tracemalloc.stop()
+            SegmentFile.write = original_write
+
+        expected = digest.hexdigest()
+        intact = 0
+        for i in range(streams):
+            written = hashlib.sha256()
+            for path in sorted(Path(f"{folder}/{i}").iterdir()):
+                written.update(path.read_bytes())
+            intact += written.hexdigest() == expected
+
+    return {
+        "max_queue_bytes": max_queue_bytes,
+        "streams": streams,
+        "stall_minutes": minutes,
+        "packets_per_stream": packets,
+        "peak_traced_mb": round(stalled_peak / 2**20, 1),
+        "spilled_mb": round(spilled / 2**20, 1),
+        "replay_lag_at_release": round(lag, 2),
+        "enqueue_us_per_packet": round(enqueue_seconds / packets / streams * 1e6, 2),
+        "replay_seconds": round(replay_seconds, 2),
+        "streams_intact": intact,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--minutes", type=float, default=10)
+    parser.add_argument("--streams", type=int, default=10)
+    parser.add_argument("--caps", type=int, nargs="+", default=[0, 1024 * 1024],
+                        help="max_queue_bytes values to compare (0: no limit)")
+    args = parser.parse_args()
+    print(json.dumps([run(args.minutes, args.streams, cap) for cap in args.caps], indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+"""Throughput and latency of the Engine against the local test server, for a
+set of reproducible scenarios, optionally compared against a stored baseline.
+
+The server sends faster than real time (``--speed``) to ``--streams``
+concurrent streams. The scenarios add stalls (the server pauses every few
+seconds) and disconnects (the server closes every connection after a few
+seconds and the recorders reconnect), or a server clock running 500 ppm slow
+at real time speed. For each scenario the suite reports packets written per
+second, CPU per stream, RSS, packet-to-disk latency percentiles, read/write
+syscall counts, how long each stream took to write its first packet and how
+far the written timestamps were from the time packets were received.
+
+    python -m benchmarks.bench_suite --streams 50 --speed 8 --output baseline.json
+    python -m benchmarks.bench_suite --streams 50 --speed 8 --baseline baseline.json
+
+With ``--baseline``, the exit status is 1 if any metric got worse by more
+than ``--tolerance``.
+"""
+import argparse
+import json
+import logging
+from multiprocessing import Process
+from pathlib import Path
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import urlencode
+
+import numpy as np
+
+from benchmarks.bench_engine import rss_mb, wait_for_server
+from streamrec.config import RecordingConfig
+from streamrec.engine import Engine
+from streamrec.segmentfile import SegmentFile
+from tests.test_server import test_server_start
+
+# Seconds of audio in each packet sent by the test server
+FRAME_SECONDS = 1152 / 44100
+# Test server query parameters of each scenario, over --speed and --bitrate
+SCENARIOS = {
+    "steady": {},
+    "stalls": {"stall_every": 5, "stall_for": 2},
+    "disconnects": {"limit": 5, "initial_burst": 1},
+    "drift": {"speed": 0.9995},
+}
+# Compared metrics: 1 when higher is better, -1 when lower is better
+DIRECTIONS = {
+    "packets_per_second": 1,
+    "cpu_percent_per_stream": -1,
+    "rss_mb_max": -1,
+    "latency_ms_p50": -1,
+    "latency_ms_p99": -1,
+    "latency_ms_max": -1,
+    "read_syscalls_per_packet": -1,
+    "write_syscalls_per_packet": -1,
+    "context_switches_per_packet": -1,
+    "startup_seconds_max": -1,
+    "clock_error_ms_p99": -1,
+}
+
+
+def proc_io() -> dict[str, int]:
+    """Read and write syscalls of this process so far, from /proc/self/io."""
+    values = {}
+    try:
+        with open("/proc/self/io", encoding="ascii") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                values[key] = int(value)
+    except OSError:
+        pass
+    return {"syscr": values.get("syscr", 0), "syscw": values.get("syscw", 0)}
+
+
+def context_switches() -> int:
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_nvcsw + usage.ru_nivcsw
+
+
+# pylint: disable=too-many-locals
+def run(scenario: str, args: argparse.Namespace) -> dict:
+    latencies = []
+    clock_errors = []
+    first_writes = {}
+    original_write = SegmentFile.write
+
+    def timed_write(segment, packets):
+        original_write(segment, packets)
+        now = time.time()
+        latencies.append(now - packets.received_ts)
+        clock_errors.append(float(np.min(packets.received_ts - packets.adjusted_ts())))
+        first_writes.setdefault(segment.session.uuid, now - segment.session.ts_start)
+
+    query = urlencode({"speed": args.speed, "bitrate": args.bitrate, **SCENARIOS[scenario]})
+    url = f"http://localhost:{args.port}/?{query}"
+    output = Path(tempfile.mkdtemp(prefix="streamrec-bench-"))
+    configs = [RecordingConfig(url=url,
+                               output_folder=str(output / f"stream{i}"),
+                               name=f"stream{i}",
+                               initial_writer_delay=args.initial_writer_delay,
+                               segment_duration=args.segment_duration,
+                               write_period=args.write_period,
+                               reconnect_attempts=-1,
+                               reconnect_delay=0.05,
+                               reconnect_max_delay=0.5)
+                for i in range(args.streams)]
+    engine = Engine(configs, max_workers=args.max_workers)
+
+    samples = []
+
+    def sample():
+        start = time.time()
+        while time.time() - start < args.duration:
+            time.sleep(0.5)
+            samples.append(rss_mb())
+        engine.stop()
+
+    SegmentFile.write = timed_write
+    sampler = threading.Thread(target=sample, daemon=True)
+    io_start = proc_io()
+    switches_start = context_switches()
+    cpu_start = time.process_time()
+    wall_start = time.time()
+    try:
+        sampler.start()
+        engine.start()
+    finally:
+        SegmentFile.write = original_write
+    cpu = time.process_time() - cpu_start
+    wall = time.time() - wall_start
+    io_end = proc_io()
+    switches = context_switches() - switches_start
+
+    stats = engine.stats()
+    packets = sum(s["packets"] for s in stats.values())
+    written = sum(f.stat().st_size for f in output.glob("*/*.mp3"))
+    shutil.rmtree(output)
+    latencies_ms = np.concatenate(latencies) * 1000 if latencies else np.zeros(1)
+    clock_errors_ms = np.abs(clock_errors or [0.0]) * 1000
+    startups = list(first_writes.values()) or [0.0]
+    per_packet = max(packets, 1)
+    return {
+        "streams": args.streams,
+        "wall_seconds": round(wall, 2),
+        "packets": packets,
+        "packets_per_second": round(packets / wall, 1),
+        "realtime_factor": round(packets / wall / args.streams * FRAME_SECONDS, 2),
+        "bytes_written": written,
+        "cpu_percent_per_stream": round(100 * cpu / wall / args.streams, 4),
+        "rss_mb_max": round(max(samples), 1) if samples else None,
+        "latency_ms_p50": round(float(np.percentile(latencies_ms, 50)), 2),
+        "latency_ms_p99": round(float(np.percentile(latencies_ms, 99)), 2),
+        "latency_ms_max": round(float(latencies_ms.max()), 2),
+        "read_syscalls_per_packet": round((io_end["syscr"] - io_start["syscr"]) / per_packet, 3),
+        "write_syscalls_per_packet": round((io_end["syscw"] - io_start["syscw"]) / per_packet,
+                                           3),
+        "context_switches_per_packet": round(switches / per_packet, 3),
+        "startup_seconds_p50": round(float(np.median(startups)), 3),
+        "startup_seconds_max": round(max(startups), 3),
+        "clock_error_ms_p50": round(float(np.percentile(clock_errors_ms, 50)), 2),
+        "clock_error_ms_p99": round(float(np.percentile(clock_errors_ms, 99)), 2),
+        "reconnects": sum(s["reconnects"] for s in stats.values()),
+        "failed_streams": sum(1 for s in engine.streams
+                              if s.recorder.reader_unhandled_exception),
+    }
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> dict:
+    """Relative change of each metric against the baseline, and the regressions
+    beyond ``tolerance``."""
+    changes = {}
+    regressions = []
+    for scenario, metrics in results["scenarios"].items():
+        base = baseline.get("scenarios", {}).get(scenario)
+        if not base:
+            continue
+        changes[scenario] = {}
+        for metric, direction in DIRECTIONS.items():
+            old, new = base.get(metric), metrics.get(metric)
+            if old is None or new is None:
+                continue
+            change = (new - old) / old if old else 0.0
+            changes[scenario][metric] = round(change, 4)
+            if change * direction < -tolerance:
+                regressions.append(f"{scenario}.{metric}: {old} -> {new}")
+    return {"tolerance": tolerance, "changes": changes, "regressions": regressions}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scenarios", nargs="+", choices=list(SCENARIOS),
+                        default=list(SCENARIOS))
+    parser.add_argument("--streams", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=20,
+                        help="Seconds each scenario runs")
+    parser.add_argument("--speed", type=float, default=8,
+                        help="Playback speed of the test server")
+    parser.add_argument("--bitrate", type=int, default=128000)
+    parser.add_argument("--segment-duration", type=int, default=10)
+    parser.add_argument("--write-period", type=float, default=1)
+    parser.add_argument("--initial-writer-delay", type=int, default=5)
+    parser.add_argument("--port", type=int, default=8011)
+    parser.add_argument("--max-workers", type=int, default=None)
+    parser.add_argument("--output", help="Also write the results to this file")
+    parser.add_argument("--baseline", help="Results of an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.1,
+                        help="Relative change of a metric reported as a regression")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+    server = Process(target=test_server_start, args=(args.port,), daemon=True)
+    server.start()
+    wait_for_server(args.port)
+    try:
+        results = {
+            "config": {key: getattr(args, key) for key in (
+                "streams", "duration", "speed", "bitrate", "segment_duration",
+                "write_period", "initial_writer_delay", "max_workers")},
+            "scenarios": {scenario: run(scenario, args) for scenario in args.scenarios},
+        }
+    finally:
+        server.terminate()
+
+    regressions = []
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text(encoding="utf-8"))
+        if baseline.get("config") != results["config"]:
+            print("Warning: the baseline was run with a different configuration",
+                  file=sys.stderr)
+        results["comparison"] = compare(results, baseline, args.tolerance)
+        regressions = results["comparison"]["regressions"]
+    text = json.dumps(results, indent=2)
+    if args.output:
+        Path(args.output).write_text(text + "\n", encoding="utf-8")
+    print(text)
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""Measures the overhead of tracing on the recorder: enqueueing and flushing
+MP3 frames in small batches, without tracing, tracing 1 in ``--sample``
+flushes, and tracing every flush. Each is run ``--rounds`` times, in turn,
+and the fastest round is kept.
+
+    python -m benchmarks.bench_trace --flushes 20000 --sample 100
+"""
+import argparse
+import json
+import tempfile
+import time
+
+from benchmarks.bench_ingest import encode
+from streamrec.config import RecordingConfig
+from streamrec.ingest import NativeDemuxer
+from streamrec.journal import MemoryBudget
+from streamrec.recorder import Recorder
+from streamrec.trace import Tracer
+
+# Frames per flush, about a quarter second of audio
+FRAMES_PER_FLUSH = 10
+
+
+def run(packets: list, flushes: int, sample_every: int) -> dict:
+    with tempfile.TemporaryDirectory() as folder:
+        config = RecordingConfig(url="", output_folder=folder, durability="none",
+                                 index=False, max_queue_bytes=0)
+        recorder = Recorder(config)
+        recorder.budget = MemoryBudget()
+        recorder.session.ts_start = time.time()
+        recorder.tracer = Tracer()
+        if sample_every:
+            recorder.tracer.start(f"{folder}/trace.json", sample_every)
+        start = time.process_time()
+        for i in range(flushes):
+            batch = i % (len(packets) // FRAMES_PER_FLUSH) * FRAMES_PER_FLUSH
+            recorder.enqueue_many(packets[batch:batch + FRAMES_PER_FLUSH])
+            recorder.flush()
+        recorder.close_output()
+        recorder.tracer.stop()
+        cpu = time.process_time() - start
+    return {"cpu_seconds": round(cpu, 3), "us_per_flush": round(cpu / flushes * 1e6, 2)}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--flushes", type=int, default=20000)
+    parser.add_argument("--sample", type=int, default=100)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    packets = NativeDemuxer("mp3").feed(encode("mp3", "mp3", 1))
+    rounds = [[run(packets, args.flushes, sample_every) for sample_every in (0, args.sample, 1)]
+              for _ in range(args.rounds)]
+    off, sampled, every = (min(results, key=lambda r: r["cpu_seconds"])
+                           for results in zip(*rounds))
+    print(json.dumps({
+        "flushes": args.flushes,
+        "off": off,
+        f"1_in_{args.sample}": sampled,
+        "every_flush": every,
+        "sampled_overhead_percent": round(
+            100 * (sampled["cpu_seconds"] / off["cpu_seconds"] - 1), 1),
+        "every_flush_overhead_percent": round(
+            100 * (every["cpu_seconds"] / off["cpu_seconds"] - 1), 1),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""Compares recording every audio track of an MPEG-TS stream in one demux
+pass with recording each track from its own connection, as before.
+
+``--tracks`` MP2 tracks of ``--minutes`` of audio are read from a file as
+fast as possible, and the CPU time and bytes read of both are reported.
+
+    python -m benchmarks.bench_tracks --tracks 4 --minutes 10
+"""
+import argparse
+import io
+import json
+import os
+import tempfile
+import time
+
+import av
+import numpy as np
+
+from streamrec.config import RecordingConfig
+from streamrec.recorder import Recorder
+
+SAMPLE_RATE = 48000
+
+
+def write_stream(path: str, tracks: int, seconds: float):
+    buffer = io.BytesIO()
+    with av.open(buffer, mode="w", format="mpegts") as container:
+        streams = [container.add_stream("mp2", rate=SAMPLE_RATE) for _ in range(tracks)]
+        for stream in streams:
+            stream.layout = "mono"
+        samples = (np.random.uniform(-1, 1, (1, SAMPLE_RATE)) * 2**14).astype(np.int16)
+        for _ in range(int(seconds)):
+            for stream in streams:
+                frame = av.AudioFrame.from_ndarray(samples, format="s16", layout="mono")
+                frame.sample_rate = SAMPLE_RATE
+                for packet in stream.encode(frame):
+                    container.mux(packet)
+        for stream in streams:
+            for packet in stream.encode(None):
+                container.mux(packet)
+    with open(path, "wb") as f:
+        f.write(buffer.getvalue())
+
+
+def record(source: str, output_folder: str, tracks: str) -> float:
+    """CPU seconds to record ``tracks`` of ``source``."""
+    config = RecordingConfig(url=source, output_folder=output_folder, durability="none", max_queue_bytes=0,
+                             tracks=tracks)
+    start = time.process_time()
+    Recorder(config).start()
+    return time.process_time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tracks", type=int, default=4)
+    parser.add_argument("--minutes", type=float, default=10)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        source = f"{tmp}/stream.ts"
+        write_stream(source, args.tracks, args.minutes * 60)
+        size = os.path.getsize(source)
+        single = record(source, f"{tmp}/single", "0")
+        shared = record(source, f"{tmp}/shared", "all")
+        separate = sum(record(source, f"{tmp}/separate{i}", str(i)) for i in range(args.tracks))
+
+    print(json.dumps({
+        "tracks": args.tracks,
+        "minutes": args.minutes,
+        "single_track_cpu_seconds": round(single, 3),
+        "shared_cpu_seconds": round(shared, 3),
+        "separate_cpu_seconds": round(separate, 3),
+        "shared_vs_single": round(shared / single, 2),
+        "shared_bytes_read": size,
+        "separate_bytes_read": size * args.tracks,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
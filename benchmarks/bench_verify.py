@@ -0,0 +1,85 @@
+"""Measures ``streamrec verify`` against a plain sequential read of the same
+segments, both from a cold page cache.
+
+``--hours`` of 128 kbps MP3 are backfilled into an output folder of
+``--segment-duration`` second segments, which are then read once with
+``read()`` and once verified by ``--workers`` processes.
+
+    python -m benchmarks.bench_verify --hours 24 --workers 4
+"""
+import argparse
+import json
+import os
+from pathlib import Path
+import tempfile
+import time
+
+from benchmarks.bench_backfill import write_dump
+from benchmarks.bench_merge import FRAME_SAMPLES, SAMPLE_RATE, START_TS
+from streamrec.backfill import backfill
+from streamrec.config import RecordingConfig
+from streamrec.verify import verify
+
+# Bytes per read() when reading the segments
+READ_SIZE = 1024 * 1024
+
+
+def drop_cache(paths: list[Path]):
+    """Evict the segments from the page cache, so they are read from disk."""
+    for path in paths:
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(fd)
+
+
+def read_all(paths: list[Path]) -> int:
+    total = 0
+    buffer = bytearray(READ_SIZE)
+    for path in paths:
+        with open(path, "rb", buffering=0) as f:
+            while n := f.readinto(buffer):
+                total += n
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--hours", type=float, default=24)
+    parser.add_argument("--segment-duration", type=int, default=60)
+    parser.add_argument("--workers", type=int, default=1)
+    args = parser.parse_args()
+
+    frames = int(args.hours * 3600 * SAMPLE_RATE / FRAME_SAMPLES)
+    with tempfile.TemporaryDirectory() as tmp:
+        write_dump(f"{tmp}/dump.mp3", 0, frames)
+        config = RecordingConfig(url="", output_folder=f"{tmp}/out", durability="none",
+                                 segment_duration=args.segment_duration)
+        backfill(config, [(f"{tmp}/dump.mp3", START_TS)])
+        paths = sorted(Path(config.output_folder).rglob("*.mp3"))
+        os.sync()
+
+        drop_cache(paths)
+        start = time.perf_counter()
+        total = read_all(paths)
+        read_seconds = time.perf_counter() - start
+
+        drop_cache(paths)
+        result = verify(config.output_folder, workers=args.workers)
+
+    print(json.dumps({
+        "hours": args.hours,
+        "segments": result.segments,
+        "megabytes": round(total / 1e6, 1),
+        "workers": args.workers,
+        "read_mb_per_second": round(total / 1e6 / read_seconds, 1),
+        "verify_mb_per_second": round(result.bytes / 1e6 / result.elapsed, 1),
+        "verify_seconds": round(result.elapsed, 2),
+        "problems": len(result.problems),
+        "ten_tb_hours": round(10e12 / (result.bytes / result.elapsed) / 3600, 1),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
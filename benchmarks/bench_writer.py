@@ -0,0 +1,95 @@
+"""Measures packet-to-disk latency and idle writer wakeups of a Recorder.
+
+Packets are fed at real-time rate straight into Recorder.enqueue, so the
+numbers only cover the queue and the writer.
+
+    python -m benchmarks.bench_writer --duration 10
+"""
+import argparse
+from fractions import Fraction
+import json
+import statistics
+import tempfile
+import threading
+import time
+
+import av
+
+from streamrec.config import RecordingConfig
+from streamrec.recorder import Recorder
+from streamrec.segmentfile import SegmentFile
+
+FRAME_SAMPLES = 1152
+SAMPLE_RATE = 44100
+FRAME_SIZE = 417
+
+
+def run(duration: float, **config_values) -> dict:
+    latencies = []
+    wakeups = []
+    original_write = SegmentFile.write
+
+    def timed_write(segment, packets):
+        original_write(segment, packets)
+        now = time.time()
+        latencies.extend((now - packets.received_ts).tolist())
+
+    with tempfile.TemporaryDirectory() as folder:
+        config = RecordingConfig(url="", output_folder=folder,
+                                 initial_writer_delay=0, segment_duration=10,
+                                 **config_values)
+        recorder = Recorder(config)
+        recorder.session.ts_start = time.time()
+        original_wait = recorder.queue_cond.wait
+
+        def counting_wait(timeout=None):
+            wakeups.append(time.time())
+            return original_wait(timeout)
+        recorder.queue_cond.wait = counting_wait
+
+        SegmentFile.write = timed_write
+        writer = threading.Thread(target=recorder.file_writer)
+        writer.start()
+        try:
+            frame_period = FRAME_SAMPLES / SAMPLE_RATE
+            start = time.time()
+            i = 0
+            while time.time() - start < duration:
+                packet = av.Packet(bytes(FRAME_SIZE))
+                packet.pts = i * FRAME_SAMPLES
+                packet.time_base = Fraction(1, SAMPLE_RATE)
+                recorder.enqueue(packet)
+                i += 1
+                time.sleep(max(0.0, start + i * frame_period - time.time()))
+            # Idle: the reader stays connected but no packets arrive
+            idle_start = time.time()
+            time.sleep(2)
+            idle_wakeups = sum(1 for t in wakeups if t > idle_start + 0.1)
+            with recorder.queue_lock:
+                recorder.reader_finished = True
+                recorder.wake_writer()
+            writer.join()
+        finally:
+            SegmentFile.write = original_write
+
+    latencies_ms = sorted(l * 1000 for l in latencies)
+    return {
+        "packets": len(latencies_ms),
+        "latency_ms_p50": round(statistics.median(latencies_ms), 2),
+        "latency_ms_p99": round(latencies_ms[int(len(latencies_ms) * 0.99)], 2),
+        "idle_wakeups_per_second": idle_wakeups / 2,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--duration", type=float, default=10)
+    args = parser.parse_args()
+    print(json.dumps({
+        "period_1s": run(args.duration, write_period=1, flush_packets=0),
+        "event_driven": run(args.duration),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
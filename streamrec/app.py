@@ -1,11 +1,26 @@
 import logging
 import signal
+import sys
+from typing import Optional
 
 import typer
 from typing_extensions import Annotated
 
-from streamrec.config import RecordingConfig
+from streamrec.backfill import backfill as backfill_sources, parse_source
+from streamrec.compaction import PERIODS, CompactionPolicy, Compactor
+from streamrec.config import RecordingConfig, load_stream_configs
+from streamrec.index import rebuild_index
+from streamrec.merge import UnsupportedFormat, merge as merge_replicas
+from streamrec.metrics import MetricsServer
+from streamrec.store import SegmentStore, parse_timestamp
 from streamrec.recorder import Recorder
+from streamrec.relay import Relay, RelayServer
+from streamrec.retention import RetentionPolicy, RetentionWorker
+from streamrec.server import RecordingServer
+from streamrec.storage import UploadPolicy, Uploader, storage_backend
+from streamrec.supervisor import Supervisor
+from streamrec.trace import load_trace, process_tracer, summarize
+from streamrec.verify import format_problem, verify as verify_folder
 
 
 logger = logging.getLogger("main")
@@ -14,32 +29,418 @@ logging.basicConfig(level=logging.INFO)
 app = typer.Typer()
 
 
-@app.command()
+@app.callback(invoke_without_command=True)
 def cli(
+    ctx: typer.Context,
     url: Annotated[
-        str, typer.Option(envvar="URL")],
+        Optional[str], typer.Option(envvar="URL")] = None,
     output_folder: Annotated[
-        str, typer.Option(envvar="OUTPUT_FOLDER")],
+        Optional[str], typer.Option(envvar="OUTPUT_FOLDER")] = None,
     initial_writer_delay: Annotated[
-        int, typer.Option(envvar="INITIAL_WRITER_DELAY")] = 5,
+        int, typer.Option(envvar="INITIAL_WRITER_DELAY",
+                          help="Longest wait for the initial burst to end")] = 5,
+    estimate_skew: Annotated[
+        bool, typer.Option(envvar="ESTIMATE_SKEW")] = True,
     segment_duration: Annotated[
         int, typer.Option(envvar="SEGMENT_DURATION")] = 60,
     write_period: Annotated[
-        int, typer.Option(envvar="WRITE_PERIOD")] = 1,
+        float, typer.Option(envvar="WRITE_PERIOD")] = 1,
+    flush_packets: Annotated[
+        int, typer.Option(envvar="FLUSH_PACKETS")] = 1,
+    flush_bytes: Annotated[
+        int, typer.Option(envvar="FLUSH_BYTES")] = 0,
     close_open_files_on_start: Annotated[
         bool, typer.Option(envvar="CLOSE_OPEN_FILES_ON_START")] = True,
     no_data_timeout: Annotated[
-        int, typer.Option(envvar="NO_DATA_TIMEOUT")] = 30
+        int, typer.Option(envvar="NO_DATA_TIMEOUT")] = 30,
+    durability: Annotated[
+        str, typer.Option(envvar="DURABILITY")] = "on-close",
+    reconnect_attempts: Annotated[
+        int, typer.Option(envvar="RECONNECT_ATTEMPTS",
+                          help="Reconnect attempts in a row (0: never, -1: forever)")] = 0,
+    reconnect_max_delay: Annotated[
+        float, typer.Option(envvar="RECONNECT_MAX_DELAY")] = 30,
+    index: Annotated[
+        bool, typer.Option(envvar="INDEX")] = True,
+    checksum_block: Annotated[
+        int, typer.Option(envvar="CHECKSUM_BLOCK",
+                          help="Bytes per checksum (0: one per segment)")] = 1024 * 1024,
+    native_ingest: Annotated[
+        bool, typer.Option(envvar="NATIVE_INGEST",
+                           help="Split MP3 and AAC streams into frames without libav")] = False,
+    tracks: Annotated[
+        str, typer.Option(envvar="TRACKS",
+                          help="Audio tracks to record: all, or stream indexes and languages "
+                               "like 1,2 or eng,spa")] = "",
+    relay_port: Annotated[
+        int, typer.Option(envvar="RELAY_PORT", help="Relay the stream live on this port")] = 0,
+    max_queue_bytes: Annotated[
+        int, typer.Option(envvar="MAX_QUEUE_BYTES")] = 8 * 1024 * 1024,
+    spill_folder: Annotated[
+        Optional[str], typer.Option(envvar="SPILL_FOLDER")] = None,
+    path_template: Annotated[
+        str, typer.Option(envvar="PATH_TEMPLATE",
+                          help="Sub-folder of each segment, e.g. {yyyy}/{mm}/{dd}/{HH}")] = "",
+    retention_max_age: Annotated[
+        float, typer.Option(envvar="RETENTION_MAX_AGE", help="Seconds (0: keep)")] = 0,
+    retention_max_bytes: Annotated[
+        int, typer.Option(envvar="RETENTION_MAX_BYTES", help="Bytes (0: no limit)")] = 0,
+    retention_move_to: Annotated[
+        Optional[str], typer.Option(envvar="RETENTION_MOVE_TO")] = None,
+    compact_period: Annotated[
+        str, typer.Option(envvar="COMPACT_PERIOD", help="hourly or daily (default: off)")] = "",
+    compact_after: Annotated[
+        float, typer.Option(envvar="COMPACT_AFTER")] = 3600,
+    features: Annotated[
+        bool, typer.Option(envvar="FEATURES",
+                           help="Write loudness, silence and fingerprint sidecars")] = False,
+    storage_url: Annotated[
+        str, typer.Option(envvar="STORAGE_URL",
+                          help="Upload closed segments to a folder or s3://bucket/prefix")] = "",
+    storage_endpoint: Annotated[
+        Optional[str], typer.Option(envvar="STORAGE_ENDPOINT",
+                                    help="URL of an S3-compatible server")] = None,
+    upload_bandwidth: Annotated[
+        float, typer.Option(envvar="UPLOAD_BANDWIDTH",
+                            help="Bytes per second (0: no limit)")] = 0,
+    delete_after_upload: Annotated[
+        bool, typer.Option(envvar="DELETE_AFTER_UPLOAD")] = False,
+    metrics_port: Annotated[
+        int, typer.Option(envvar="METRICS_PORT",
+                          help="Serve Prometheus metrics on this port")] = 0,
+    trace_out: Annotated[
+        Optional[str], typer.Option(envvar="TRACE_OUT",
+                                    help="Write a Chrome trace of the pipeline stages")] = None,
+    trace_sample: Annotated[
+        int, typer.Option(envvar="TRACE_SAMPLE", help="Trace 1 in N flushes")] = 1,
 ):
+    """Record a single stream, or run one of the subcommands."""
+    if ctx.invoked_subcommand:
+        return
+    if not url or not output_folder:
+        raise typer.BadParameter("--url and --output-folder are required")
     config = RecordingConfig(url=url,
                              output_folder=output_folder,
                              initial_writer_delay=initial_writer_delay,
+                             estimate_skew=estimate_skew,
                              segment_duration=segment_duration,
                              write_period=write_period,
+                             flush_packets=flush_packets,
+                             flush_bytes=flush_bytes,
                              close_open_files_on_start=close_open_files_on_start,
-                             network_timeout=no_data_timeout)
+                             network_timeout=no_data_timeout,
+                             durability=durability,
+                             reconnect_attempts=reconnect_attempts,
+                             reconnect_max_delay=reconnect_max_delay,
+                             index=index,
+                             checksum_block=checksum_block,
+                             native_ingest=native_ingest,
+                             tracks=tracks,
+                             max_queue_bytes=max_queue_bytes,
+                             spill_folder=spill_folder,
+                             path_template=path_template,
+                             retention_max_age=retention_max_age,
+                             retention_max_bytes=retention_max_bytes,
+                             retention_move_to=retention_move_to,
+                             compact_period=compact_period,
+                             compact_after=compact_after,
+                             features=features,
+                             storage_url=storage_url,
+                             storage_endpoint=storage_endpoint,
+                             upload_bandwidth=upload_bandwidth,
+                             delete_after_upload=delete_after_upload)
     processor = Recorder(config)
+    relay_server = None
+    if relay_port:
+        relay_server = RelayServer(port=relay_port)
+        relay_server.start()
+        processor.relay = Relay("stream")
+        relay_server.add(processor.relay)
+    metrics_server = None
+    if metrics_port:
+        metrics_server = MetricsServer(processor.stream_stats,
+                                       host="0.0.0.0", port=metrics_port)
+        metrics_server.start()
+    if trace_out:
+        process_tracer.start(trace_out, trace_sample)
     signal.signal(signal.SIGINT, processor.stop)
     signal.signal(signal.SIGTERM, processor.stop)
-    processor.start()
+    try:
+        processor.start()
+    finally:
+        process_tracer.stop()
+    if relay_server:
+        relay_server.stop()
+    if metrics_server:
+        metrics_server.stop()
     logger.info("Exiting main")
+
+
+@app.command()
+def supervise(
+    streams: Annotated[
+        str, typer.Option(envvar="STREAMS")],
+    workers: Annotated[
+        int, typer.Option(envvar="WORKERS", help="Worker processes (default: CPU count)")] = 0,
+    threads_per_worker: Annotated[
+        Optional[int], typer.Option(envvar="THREADS_PER_WORKER")] = None,
+    stats_interval: Annotated[
+        int, typer.Option(envvar="STATS_INTERVAL")] = 10,
+    rebalance_interval: Annotated[
+        int, typer.Option(envvar="REBALANCE_INTERVAL")] = 300,
+    max_queue_bytes: Annotated[
+        int, typer.Option(envvar="MAX_QUEUE_BYTES",
+                          help="Packet bytes queued in memory per worker (0: no limit)")] = 0,
+    metrics_port: Annotated[
+        int, typer.Option(envvar="METRICS_PORT",
+                          help="Serve Prometheus metrics of every stream on this port")] = 0,
+    trace_out: Annotated[
+        Optional[str], typer.Option(envvar="TRACE_OUT",
+                                    help="Write a Chrome trace per worker, e.g. trace.0.json")] = None,
+    trace_sample: Annotated[
+        int, typer.Option(envvar="TRACE_SAMPLE", help="Trace 1 in N flushes")] = 1,
+):
+    """Record every stream in a TOML file across a pool of worker processes.
+
+    Send SIGHUP to reload the file: added streams are started and removed
+    streams are stopped without touching the others.
+    """
+    supervisor = Supervisor(streams,
+                            workers=workers or None,
+                            max_threads=threads_per_worker,
+                            stats_interval=stats_interval,
+                            rebalance_interval=rebalance_interval,
+                            max_queue_bytes=max_queue_bytes,
+                            metrics_port=metrics_port or None,
+                            trace_out=trace_out,
+                            trace_sample=trace_sample)
+    supervisor.run()
+
+
+@app.command()
+def reindex(folder: str):
+    """Rebuild the segment index of an output folder from its files.
+
+    Run it while nothing is recording into the folder.
+    """
+    count = rebuild_index(folder)
+    typer.echo(f"Indexed {count} segments")
+
+
+@app.command()
+def verify(
+    folder: str,
+    workers: Annotated[int, typer.Option(help="Worker processes")] = 1,
+):
+    """Re-hash the closed segments of an output folder against the checksums
+    in its index, and list the blocks and time ranges that changed or went
+    missing. Exits with status 1 if any did."""
+    result = verify_folder(folder, workers)
+    for check in result.problems:
+        for line in format_problem(folder, check):
+            typer.echo(line)
+    typer.echo(f"Verified {result.segments} segments ({result.bytes / 1e9:.2f} GB) in "
+               f"{result.elapsed:.1f} seconds: {len(result.problems)} with problems, "
+               f"{result.unchecked} without checksums")
+    if result.problems:
+        raise typer.Exit(1)
+
+
+@app.command()
+def prune(
+    folder: str,
+    max_age: Annotated[float, typer.Option(help="Seconds (0: keep)")] = 0,
+    max_bytes: Annotated[int, typer.Option(help="Bytes (0: no limit)")] = 0,
+    move_to: Annotated[Optional[str], typer.Option(help="Move instead of deleting")] = None,
+    rate: Annotated[float, typer.Option(help="Segments per second")] = 10,
+):
+    """Delete (or move) the oldest segments of an output folder once, as the
+    retention worker does while recording."""
+    policy = RetentionPolicy(folder, max_age, max_bytes, move_to, rate)
+    expired = RetentionWorker().apply(policy)
+    typer.echo(f"Expired {expired} segments")
+
+
+@app.command()
+def upload(
+    folder: str,
+    storage_url: Annotated[
+        str, typer.Option(envvar="STORAGE_URL", help="A folder or s3://bucket/prefix")],
+    storage_endpoint: Annotated[
+        Optional[str], typer.Option(envvar="STORAGE_ENDPOINT",
+                                    help="URL of an S3-compatible server")] = None,
+    bandwidth: Annotated[float, typer.Option(help="Bytes per second (0: no limit)")] = 0,
+    delete_after_upload: Annotated[bool, typer.Option()] = False,
+    workers: Annotated[int, typer.Option(help="Upload threads")] = 4,
+):
+    """Upload the closed segments of an output folder that the storage does
+    not have yet, such as those closed while the upload queue was full."""
+    policy = UploadPolicy(folder, storage_backend(storage_url, storage_endpoint),
+                          delete_after_upload, bandwidth)
+    uploader = Uploader(max_workers=workers, max_pending=sys.maxsize)
+    uploader.add(policy)
+    uploader.start()
+    try:
+        queued = uploader.catch_up(policy)
+    finally:
+        uploader.stop()
+    typer.echo(f"Uploaded {uploader.uploaded} of {queued} segments, {uploader.failed} failed")
+    if uploader.failed:
+        raise typer.Exit(1)
+
+
+@app.command()
+def compact(
+    folder: str,
+    period: Annotated[str, typer.Option(help="hourly or daily")] = "hourly",
+    min_age: Annotated[
+        float, typer.Option(help="Seconds after the end of a period before compacting it")] = 3600,
+    workers: Annotated[int, typer.Option(help="Worker processes")] = 1,
+):
+    """Concatenate the closed segments of an output folder into hourly or daily
+    archives once. Safe to run while recording."""
+    if period not in PERIODS:
+        raise typer.BadParameter(f"Unknown period {period!r}")
+    compactor = Compactor(max_workers=workers)
+    try:
+        archives = compactor.compact(CompactionPolicy(folder, period, min_age))
+    finally:
+        compactor.stop()
+    typer.echo(f"Wrote {archives} archives")
+
+
+@app.command()
+def merge(
+    output_folder: str,
+    sources: Annotated[list[str], typer.Argument(help="Output folders of the recorders")],
+    start: Annotated[
+        Optional[str], typer.Option(help="Unix timestamp or ISO 8601 date (default: all)")] = None,
+    end: Annotated[
+        Optional[str], typer.Option(help="Unix timestamp or ISO 8601 date (default: all)")] = None,
+    session: Annotated[
+        Optional[list[str]], typer.Option(help="Only merge these sessions (repeatable)")] = None,
+    segment_duration: Annotated[int, typer.Option()] = 60,
+    delete_sources: Annotated[
+        bool, typer.Option(help="Delete the merged segments of the sources")] = False,
+):
+    """Merge the recordings of redundant recorders of a stream into one
+    gap-filled session in OUTPUT_FOLDER. Run it on closed segments."""
+    try:
+        result = merge_replicas(sources, output_folder,
+                                parse_timestamp(start) if start else None,
+                                parse_timestamp(end) if end else None,
+                                sessions=session, delete_sources=delete_sources,
+                                segment_duration=segment_duration)
+    except UnsupportedFormat as e:
+        typer.echo(str(e), err=True)
+        raise typer.Exit(1) from e
+    typer.echo(f"Merged {result.seconds:.1f} seconds into {result.segments} segments, "
+               f"{result.gap_seconds:.1f} seconds missing from every source, "
+               f"{result.deleted} source segments deleted")
+
+
+@app.command()
+def backfill(
+    output_folder: str,
+    sources: Annotated[
+        list[str], typer.Argument(help="Files or pipes (- for standard input), as PATH@START "
+                                       "or PATH with --start")],
+    start: Annotated[
+        Optional[str], typer.Option(help="Unix timestamp or ISO 8601 date of the first packet "
+                                         "of a single source")] = None,
+    name: Annotated[Optional[str], typer.Option(help="Stream name, for {station}")] = None,
+    fmt: Annotated[
+        Optional[str], typer.Option("--format", help="Container format (default: by extension)")] = None,
+    segment_duration: Annotated[int, typer.Option()] = 60,
+    path_template: Annotated[str, typer.Option()] = "",
+    index: Annotated[bool, typer.Option()] = True,
+    durability: Annotated[str, typer.Option()] = "on-close",
+    workers: Annotated[int, typer.Option(help="Worker processes")] = 1,
+):
+    """Write archived dumps of a stream into OUTPUT_FOLDER as recording
+    sessions, as fast as they can be read. The segments and index are the
+    same as those of a live recording of the same packets."""
+    if start is not None and len(sources) > 1:
+        raise typer.BadParameter("--start only applies to a single source, use PATH@START")
+    try:
+        parsed = [parse_source(source, parse_timestamp(start) if start else None)
+                  for source in sources]
+    except ValueError as e:
+        raise typer.BadParameter(str(e)) from e
+    config = RecordingConfig(url="", output_folder=output_folder, name=name,
+                             segment_duration=segment_duration, path_template=path_template,
+                             index=index, durability=durability)
+    for result in backfill_sources(config, parsed, fmt, workers):
+        typer.echo(f"{result.source}: {result.seconds:.1f} seconds in {result.segments} "
+                   f"segments, in {result.elapsed:.1f} seconds")
+
+
+@app.command()
+def trace_summary(
+    path: str,
+    by: Annotated[
+        Optional[str], typer.Option(help="Also split by this span argument, e.g. stream")] = None,
+):
+    """Print the latency percentiles of each pipeline stage in a trace written
+    with --trace-out."""
+    summary = summarize(load_trace(path), by)
+    width = max((len(stage) for stage in summary), default=5)
+    typer.echo(f"{'stage':<{width}} {'count':>8} {'p50 ms':>9} {'p90 ms':>9} "
+               f"{'p99 ms':>9} {'max ms':>9}")
+    for stage, stats in summary.items():
+        typer.echo(f"{stage:<{width}} {stats['count']:>8} {stats['p50']:>9.3f} "
+                   f"{stats['p90']:>9.3f} {stats['p99']:>9.3f} {stats['max']:>9.3f}")
+
+
+@app.command()
+def extract(
+    folder: str,
+    start: Annotated[str, typer.Argument(help="Unix timestamp or ISO 8601 date (UTC by default)")],
+    end: Annotated[str, typer.Argument(help="Unix timestamp or ISO 8601 date (UTC by default)")],
+    output: Annotated[
+        Optional[str], typer.Option("--output", "-o", help="Output file (default: stdout)")] = None,
+):
+    """Write a time range of the recordings in an output folder, without re-encoding."""
+    store = SegmentStore(folder)
+    try:
+        if output:
+            with open(output, "wb") as f:
+                written = store.extract(parse_timestamp(start), parse_timestamp(end), f)
+        else:
+            written = store.extract(parse_timestamp(start), parse_timestamp(end),
+                                    sys.stdout.buffer)
+    finally:
+        store.close()
+    logger.info("Extracted %s bytes", written)
+
+
+@app.command()
+def serve(
+    streams: Annotated[
+        Optional[str], typer.Option(envvar="STREAMS", help="Serve the streams of a TOML file")] = None,
+    folder: Annotated[
+        Optional[list[str]], typer.Option(help="Serve a folder as NAME=PATH (repeatable)")] = None,
+    host: Annotated[str, typer.Option(envvar="HOST")] = "0.0.0.0",
+    port: Annotated[int, typer.Option(envvar="PORT")] = 8080,
+    segment_duration: Annotated[
+        int, typer.Option(help="Segment duration of the --folder recordings")] = 60,
+):
+    """Serve recorded time ranges and HLS playlists over HTTP."""
+    folders, segment_durations = {}, {}
+    if streams:
+        configs = load_stream_configs(streams)
+        folders.update({c.name: c.output_folder for c in configs})
+        segment_durations.update({c.name: c.segment_duration for c in configs})
+    for value in folder or []:
+        name, sep, path = value.partition("=")
+        if not sep:
+            raise typer.BadParameter(f"Expected NAME=PATH: {value}")
+        folders[name] = path
+        segment_durations[name] = segment_duration
+    if not folders:
+        raise typer.BadParameter("--streams or --folder is required")
+    server = RecordingServer(folders, host=host, port=port,
+                             segment_durations=segment_durations)
+    signal.signal(signal.SIGINT, server.stop)
+    signal.signal(signal.SIGTERM, server.stop)
+    server.start()
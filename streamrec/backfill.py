@@ -0,0 +1,207 @@
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+import logging
+import multiprocessing
+from pathlib import Path
+import sys
+import time
+from typing import Iterator
+
+import av
+import numpy as np
+
+from streamrec.config import RecordingConfig
+
+from .index import IndexWriter
+from .ingest import NATIVE_PARSERS, NativeDemuxer
+from .packet import PacketBatch, PacketBatchBuilder
+from .segmentfile import SegmentFile
+from .session import RecordingSession
+from .store import parse_timestamp
+from .timeline import Timeline
+
+logger = logging.getLogger(__name__)
+
+# Bytes read from a source at a time by the native parsers, and the most
+# held in memory
+READ_SIZE = 1024 * 1024
+# Packets demuxed by libav before they are written
+LIBAV_BATCH_PACKETS = 4096
+# Container format of a source by its extension, when not given
+EXTENSION_FORMATS = {
+    ".mp3": "mp3",
+    ".aac": "aac",
+    ".adts": "aac",
+}
+# Source read from standard input
+STDIN = "-"
+
+
+@dataclass
+class BackfillResult:
+    source: str
+    session: str = None
+    packets: int = 0
+    bytes: int = 0
+    # Seconds of audio, from the first packet to the end of the last one
+    seconds: float = 0.0
+    segments: int = 0
+    elapsed: float = 0.0
+
+
+def parse_source(value: str, start_ts: float = None) -> tuple[str, float]:
+    """``(path, start_ts)`` of a ``PATH@START`` source, or of a plain path
+    starting at ``start_ts``."""
+    path, sep, start = value.rpartition("@")
+    if sep:
+        try:
+            return path, parse_timestamp(start)
+        except ValueError:
+            pass
+    if start_ts is None:
+        raise ValueError(f"No start timestamp for {value}")
+    return value, start_ts
+
+
+def source_format(source: str, fmt: str = None) -> str:
+    return fmt or EXTENSION_FORMATS.get(Path(source).suffix.lower())
+
+
+def open_source(source: str):
+    if source == STDIN:
+        return open(sys.stdin.fileno(), "rb", closefd=False)
+    return open(source, "rb")
+
+
+def native_batches(session: RecordingSession, source: str, fmt: str) -> Iterator[PacketBatch]:
+    """Split an MP3 or ADTS source into batches of frames, with no packet
+    objects in between."""
+    demuxer = NativeDemuxer(fmt)
+    with open_source(source) as f:
+        while data := f.read(READ_SIZE):
+            frames = demuxer.frames(data)
+            if not frames:
+                continue
+            durations = np.fromiter((d for _, d in frames), np.int64, len(frames))
+            sizes = np.fromiter((len(frame) for frame, _ in frames), np.int64, len(frames))
+            pts = np.full(len(frames), demuxer.pts, dtype=np.int64)
+            pts[1:] += np.cumsum(durations[:-1])
+            demuxer.pts += int(durations.sum())
+            yield PacketBatch(session, demuxer.time_base, pts, durations,
+                              np.full(len(frames), session.ts_start), sizes,
+                              memoryview(b"".join(frame for frame, _ in frames)))
+
+
+def libav_batches(session: RecordingSession, source: str, fmt: str) -> Iterator[PacketBatch]:
+    """Demux a source with libav, placing its packets as the recorder does."""
+    timeline = Timeline(match_packets=False)
+    builder = PacketBatchBuilder(session)
+    with open_source(source) as f, av.open(f, format=fmt) as container:
+        stream = next(s for s in container.streams if s.type == "audio")
+        for packet in container.demux(stream):
+            # Dropped as the recorder drops them
+            if packet.is_corrupt or packet.size == 0:
+                continue
+            for entry, pts, duration, _ in timeline.add(packet, session.ts_start):
+                builder.append(entry, session.ts_start, pts, duration)
+            if len(builder) >= LIBAV_BATCH_PACKETS:
+                yield builder.build()
+                builder = PacketBatchBuilder(session)
+    if builder:
+        yield builder.build()
+
+
+def read_batches(session: RecordingSession, source: str, fmt: str = None) -> Iterator[PacketBatch]:
+    """Demux a file, a pipe or ``-`` (standard input) as fast as it can be
+    read. MP3 and ADTS are split by the native parsers, other formats by libav."""
+    fmt = source_format(source, fmt)
+    if fmt in NATIVE_PARSERS:
+        return native_batches(session, source, fmt)
+    return libav_batches(session, source, fmt)
+
+
+class Backfill:
+    """Writes an archived dump of a stream as a recording session that starts
+    at ``start_ts``.
+
+    The timeline comes from the pts of the packets alone, so the segments and
+    their index are the same, byte for byte, as those of a live recording of
+    the same packets with the same start and no clock skew.
+    """
+
+    def __init__(self, config: RecordingConfig, start_ts: float):
+        self.config = config
+        self.start_ts = start_ts
+        self.session = RecordingSession(config, ts_start=start_ts)
+        self.index = IndexWriter(config.output_folder, self.session.uuid,
+                                 config.checksum_block) if config.index else None
+        self.segment: SegmentFile = None
+        self.end_ts: float = None
+        self.result: BackfillResult = None
+
+    def write(self, batch: PacketBatch):
+        if self.session.adjusted_ts_start is None:
+            self.session.adjusted_ts_start = self.start_ts - float(batch.seconds_since_start()[0])
+        for segment_ts, packets in batch.split_by_segment():
+            if self.segment and self.segment.segment_ts != segment_ts:
+                self.close_segment()
+            if not self.segment:
+                self.segment = SegmentFile(self.session, segment_ts, index=self.index)
+            self.segment.write(packets)
+        self.result.packets += len(batch)
+        self.result.bytes += batch.nbytes
+        self.end_ts = float(batch.end_ts()[-1])
+
+    def close_segment(self):
+        if self.segment:
+            self.segment.close()
+            self.segment = None
+            self.result.segments += 1
+
+    def run(self, source: str, fmt: str = None) -> BackfillResult:
+        self.result = BackfillResult(source, str(self.session.uuid))
+        start = time.perf_counter()
+        Path(self.config.output_folder).mkdir(parents=True, exist_ok=True)
+        try:
+            for batch in read_batches(self.session, source, fmt):
+                self.write(batch)
+        finally:
+            self.close_segment()
+            if self.index:
+                self.index.close()
+        if self.end_ts is not None:
+            self.result.seconds = self.end_ts - self.start_ts
+        self.result.elapsed = time.perf_counter() - start
+        logger.info("Backfilled %.1f seconds of %s in %.2f seconds", self.result.seconds,
+                    source, self.result.elapsed)
+        return self.result
+
+
+def backfill_source(config: RecordingConfig, source: str, start_ts: float,
+                    fmt: str = None) -> BackfillResult:
+    return Backfill(config, start_ts).run(source, fmt)
+
+
+def backfill(config: RecordingConfig, sources: list[tuple[str, float]], fmt: str = None,
+             workers: int = 1) -> list[BackfillResult]:
+    """Backfill each ``(source, start_ts)`` as its own session, in a pool of
+    ``workers`` processes. Standard input is read in this process."""
+    results: list[BackfillResult] = [None] * len(sources)
+    files = [i for i, (source, _) in enumerate(sources) if source != STDIN]
+    pool = None
+    if workers > 1 and len(files) > 1:
+        pool = ProcessPoolExecutor(min(workers, len(files)),
+                                   mp_context=multiprocessing.get_context("spawn"))
+    try:
+        futures = {}
+        if pool:
+            futures = {i: pool.submit(backfill_source, config, *sources[i], fmt) for i in files}
+        for i, (source, start_ts) in enumerate(sources):
+            if i not in futures:
+                results[i] = backfill_source(config, source, start_ts, fmt)
+        for i, future in futures.items():
+            results[i] = future.result()
+    finally:
+        if pool:
+            pool.shutdown()
+    return results
@@ -0,0 +1,105 @@
+from collections import deque
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Seconds of stream time summarized by one lower envelope point
+BUCKET_SECONDS = 10
+# Lower envelope points kept, one hour of stream time
+MAX_BUCKETS = 360
+# Stream seconds the envelope must span before the skew is fitted
+SKEW_MIN_SPAN = 600
+# Largest skew believed, in seconds per second (1000 ppm)
+MAX_SKEW = 0.001
+# Largest rate at which the timestamps are bent towards the estimate, in
+# seconds per second, so they never go backwards
+MAX_SLEW = 0.01
+# Seconds of stream time over which an estimate error is corrected
+CORRECTION_SECONDS = 60
+# The initial burst of a stream is over once the lowest ``received_ts - pts``
+# has not dropped by more than SETTLE_TOLERANCE for SETTLE_SECONDS
+SETTLE_SECONDS = 0.5
+SETTLE_TOLERANCE = 0.05
+
+
+class ClockEstimator:
+    """Online estimate of the offset between stream time and our clock.
+
+    A packet is never received before it was live, so the offset of the
+    stream, ``received_ts - pts``, is the lower envelope of the observed
+    offsets. The envelope is kept as the minimum of every BUCKET_SECONDS of
+    stream time over the last hour, and once it spans SKEW_MIN_SPAN seconds a
+    line is fitted to it, so a server clock that runs slower or faster than
+    ours is followed too.
+
+    ``arrived`` is called by the reader for every packet, to tell when the
+    initial burst of a connection is over; ``observe`` and ``offset`` are
+    called by the writer.
+    """
+
+    def __init__(self, skew: bool = True):
+        self.skew = skew
+        # Reader
+        self.first_received: float = None
+        self.settle_offset: float = None
+        self.settle_received: float = None
+        self.settled = False
+        # Writer
+        self.buckets: deque[tuple[int, float, float]] = deque(maxlen=MAX_BUCKETS)
+        self.slope = 0.0
+        self.fitted_intercept: float = None
+
+    def arrived(self, seconds: float, received_ts: float):
+        if self.first_received is None:
+            self.first_received = received_ts
+        offset = received_ts - seconds
+        if self.settle_offset is None or offset < self.settle_offset - SETTLE_TOLERANCE:
+            self.settle_offset = offset
+            self.settle_received = received_ts
+        elif received_ts - self.settle_received >= SETTLE_SECONDS:
+            self.settled = True
+
+    def observe(self, seconds: np.ndarray, received_ts: np.ndarray):
+        """Add the packets of a flush, in stream order."""
+        if not len(seconds):
+            return
+        offsets = received_ts - seconds
+        ids = (seconds // BUCKET_SECONDS).astype(np.int64)
+        starts = [0, *(np.flatnonzero(np.diff(ids)) + 1).tolist()]
+        for start, stop in zip(starts, starts[1:] + [len(ids)]):
+            i = start + int(np.argmin(offsets[start:stop]))
+            point = (int(ids[i]), float(seconds[i]), float(offsets[i]))
+            if self.buckets and self.buckets[-1][0] == point[0]:
+                if point[2] < self.buckets[-1][2]:
+                    self.buckets[-1] = point
+                continue
+            if self.buckets:
+                # The last bucket is complete, refit without the one just starting
+                self.fit()
+            self.buckets.append(point)
+
+    def fit(self):
+        points = np.array([(s, o) for _, s, o in self.buckets])
+        self.slope = 0.0
+        if self.skew and points[-1, 0] - points[0, 0] >= SKEW_MIN_SPAN:
+            slope = float(np.polyfit(points[:, 0], points[:, 1], 1)[0])
+            self.slope = min(MAX_SKEW, max(-MAX_SKEW, slope))
+        self.fitted_intercept = float(np.min(points[:, 1] - self.slope * points[:, 0]))
+
+    def offset(self, seconds: float) -> float:
+        """Estimated ``received_ts - pts`` of a packet at ``seconds``, or None
+        before any packet was observed."""
+        if not self.buckets:
+            return None
+        _, last_seconds, last_offset = self.buckets[-1]
+        intercept = last_offset - self.slope * last_seconds
+        if self.fitted_intercept is not None:
+            intercept = min(intercept, self.fitted_intercept)
+        return intercept + self.slope * seconds
+
+    def slew(self, seconds: float, ts: float) -> float:
+        """Rate to apply after ``seconds``, currently mapped to ``ts``, to follow the estimate."""
+        error = seconds + self.offset(seconds) - ts
+        return min(MAX_SLEW, max(-MAX_SLEW, self.slope + error / CORRECTION_SECONDS))
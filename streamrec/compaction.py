@@ -0,0 +1,209 @@
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+import logging
+import multiprocessing
+import os
+from pathlib import Path
+import shutil
+import threading
+import time
+
+from streamrec.config import RecordingConfig, parse_durability
+
+from .features import FeatureExtractor, sidecar_path
+from .index import INDEX_FILENAME, SEGMENT_NAME, IndexedSegment, SegmentIndex
+from .segmentfile import fdatasync, fsync_dir
+from .storage import Uploader
+
+logger = logging.getLogger(__name__)
+
+PERIODS = {"hourly": 3600, "daily": 86400}
+# Seconds between two compaction passes over the folders
+CHECK_INTERVAL = 300
+# Seconds replaced segment files are kept, for readers that already looked them up
+DELETE_GRACE = 60
+
+
+def archive_path(first: IndexedSegment, period: str) -> Path:
+    """Archives are named after their first segment."""
+    return first.path.with_name(f"{first.path.stem}.{period}.mp3")
+
+
+def build_archive(sources: list[str], target: str, sync: bool) -> list[int]:
+    """Concatenate ``sources`` into ``target``, atomically. Returns the size of each source.
+
+    Runs in a worker process.
+    """
+    tmp = target + ".tmp"
+    sizes = []
+    with open(tmp, "wb") as out:
+        for source in sources:
+            with open(source, "rb") as f:
+                size = os.fstat(f.fileno()).st_size
+                copied = 0
+                try:
+                    while copied < size:
+                        n = os.copy_file_range(f.fileno(), out.fileno(), size - copied)
+                        if n == 0:
+                            break
+                        copied += n
+                except (AttributeError, OSError):
+                    f.seek(copied)
+                    out.seek(0, os.SEEK_END)
+                    shutil.copyfileobj(f, out)
+                    copied = size
+                sizes.append(size)
+        out.flush()
+        if sync:
+            fdatasync(out.fileno())
+    os.replace(tmp, target)
+    if sync:
+        fsync_dir(Path(target).parent)
+    return sizes
+
+
+@dataclass
+class CompactionPolicy:
+    folder: str
+    period: str = "hourly"
+    # Seconds after the end of a period before its segments are compacted
+    min_age: float = 3600
+    sync: bool = True
+    # Whether archives get a feature sidecar, as the segments they replace
+    features: bool = False
+
+    @classmethod
+    def from_config(cls, config: RecordingConfig) -> "CompactionPolicy":
+        """The policy of a stream, or None if it does not compact."""
+        if not config.compact_period:
+            return None
+        return cls(config.output_folder, config.compact_period, config.compact_after,
+                   parse_durability(config.durability)[0], config.features)
+
+
+class Compactor:
+    """Concatenates the closed segments of each session and period of output
+    folders into archives, from a background thread.
+
+    Archives are built by a process pool and then swapped into the segment
+    index in one transaction. The replaced files are deleted DELETE_GRACE
+    seconds later, with their feature sidecars. Archives are handed to
+    ``features`` for a sidecar of their own, and to ``uploader``, as closed
+    segments are. An interrupted pass leaves either the segments or the
+    archive in the index, and the next pass carries on from there.
+    """
+
+    def __init__(self, max_workers: int = 1, interval: float = CHECK_INTERVAL,
+                 features: FeatureExtractor = None, uploader: Uploader = None):
+        self.max_workers = max_workers
+        self.interval = interval
+        self.features = features
+        self.uploader = uploader
+        self.policies: dict[str, CompactionPolicy] = {}
+        self.lock = threading.Lock()
+        self.pool: ProcessPoolExecutor = None
+        self.stopped = threading.Event()
+        self.thread: threading.Thread = None
+        self.archives = 0
+
+    def add(self, policy: CompactionPolicy):
+        with self.lock:
+            self.policies[policy.folder] = policy
+
+    def remove(self, folder: str):
+        with self.lock:
+            self.policies.pop(folder, None)
+
+    def groups(self, index: SegmentIndex, policy: CompactionPolicy,
+               now: float) -> list[list[IndexedSegment]]:
+        """Segments to concatenate, by session and period, for periods that
+        ended at least ``min_age`` seconds ago."""
+        period = PERIODS[policy.period]
+        groups: dict[tuple[str, int], list[IndexedSegment]] = {}
+        for segment in index.closed_before(now - policy.min_age):
+            match = SEGMENT_NAME.match(segment.path.name)
+            if match and match["archive"]:
+                continue
+            period_start = int(segment.start_ts // period) * period
+            if period_start + period > now - policy.min_age:
+                continue
+            groups.setdefault((segment.session, period_start), []).append(segment)
+        return [group for group in groups.values() if len(group) > 1]
+
+    def compact(self, policy: CompactionPolicy, now: float = None) -> int:
+        """Compact one folder. Returns the number of archives written."""
+        folder = Path(policy.folder)
+        if not (folder / INDEX_FILENAME).exists():
+            logger.warning("Compaction needs the segment index, skipping %s", folder)
+            return 0
+        now = time.time() if now is None else now
+        if self.pool is None:
+            self.pool = ProcessPoolExecutor(self.max_workers,
+                                            mp_context=multiprocessing.get_context("spawn"))
+        index = SegmentIndex(folder)
+        try:
+            self.delete_replaced(index, now)
+            groups = self.groups(index, policy, now)
+            futures = [self.pool.submit(build_archive, [str(s.path) for s in group],
+                                        str(archive_path(group[0], policy.period)), policy.sync)
+                       for group in groups]
+            archives = 0
+            for group, future in zip(groups, futures):
+                try:
+                    sizes = future.result()
+                except OSError as e:
+                    logger.warning("Could not compact %s: %s", group[0].path, e)
+                    continue
+                path = archive_path(group[0], policy.period)
+                if sizes != [s.size for s in group]:
+                    # A segment changed since it was indexed
+                    logger.warning("Segment sizes do not match the index, not compacting %s",
+                                   path)
+                    path.unlink(missing_ok=True)
+                    continue
+                index.replace_with_archive(group, path, now + DELETE_GRACE)
+                logger.info("Compacted %s segments into %s", len(group), path)
+                if policy.features and self.features:
+                    self.features.submit(path)
+                if self.uploader:
+                    self.uploader.submit(policy.folder, path)
+                archives += 1
+            self.archives += archives
+            return archives
+        finally:
+            index.close()
+
+    @staticmethod
+    def delete_replaced(index: SegmentIndex, now: float):
+        paths = index.pending_deletes(now)
+        for path in paths:
+            path.unlink(missing_ok=True)
+            sidecar_path(path).unlink(missing_ok=True)
+        if paths:
+            index.forget_deletes(paths)
+
+    def run(self):
+        while True:
+            with self.lock:
+                policies = list(self.policies.values())
+            for policy in policies:
+                if self.stopped.is_set():
+                    return
+                try:
+                    self.compact(policy)
+                # pylint: disable=broad-except
+                except Exception:
+                    logger.exception("Compaction failed for %s", policy.folder)
+            if self.stopped.wait(self.interval):
+                return
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name="compaction", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread:
+            self.thread.join(30)
+        if self.pool:
+            self.pool.shutdown(wait=True, cancel_futures=True)
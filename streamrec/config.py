@@ -1,12 +1,178 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, fields
+import re
+import time
+
+try:
+    import tomllib
+except ModuleNotFoundError:  # Python < 3.11
+    try:
+        import tomli as tomllib
+    except ModuleNotFoundError:
+        tomllib = None
 
 
 @dataclass
 class RecordingConfig:
     url: str
     output_folder: str
+    # The first packets are written once the initial burst of the stream is
+    # over, so the clock offset can be estimated, or at most this many seconds
+    # after the first packet. The estimate is refined as packets arrive, and
+    # with estimate_skew it also follows a server clock running at another rate
     initial_writer_delay: int = 5
+    estimate_skew: bool = True
     segment_duration: int = 60
-    write_period: int = 1
+    # Flush triggers: whichever fires first. A segment boundary crossed by the
+    # queued packets, or a stop, always flushes right away
+    write_period: float = 1  # maximum seconds a packet waits before being written
+    flush_packets: int = 1  # 0 disables
+    flush_bytes: int = 0  # 0 disables
     close_open_files_on_start: bool = True
     network_timeout: int = 30
+    name: str = None
+    # "none", "on-close" (fdatasync the segment and its folder when it is
+    # closed) or "every-N-seconds" (on-close plus fdatasync every N seconds)
+    durability: str = "on-close"
+    # Reconnect after the connection drops: attempts in a row before giving up
+    # (0 never reconnects, -1 retries forever), with exponential backoff and
+    # jitter between reconnect_delay and reconnect_max_delay seconds
+    reconnect_attempts: int = 0
+    reconnect_delay: float = 0.1
+    reconnect_max_delay: float = 30
+    # Keep a time index of the segments in output_folder/index.sqlite
+    index: bool = True
+    # Bytes covered by each CRC-32 the index keeps of a segment, checked by
+    # streamrec verify (0: one for the whole segment)
+    checksum_block: int = 1024 * 1024
+    # Split MP3 and AAC (ADTS) streams into frames without libav, which
+    # still demuxes every other format
+    native_ingest: bool = False
+    # Audio tracks demuxed from the one connection: "all", or stream indexes
+    # and languages, e.g. "1,2" or "eng,spa" ("": the first audio track).
+    # Each track is recorded into a sub-folder of output_folder named after
+    # its index and language, e.g. "track1-eng"
+    tracks: str = ""
+    # Packet bytes kept in memory while the writer is behind (0: no limit).
+    # Beyond that, queued packets are spilled to a journal in spill_folder
+    # (default: a streamrec-spill folder in the system temp folder) and
+    # written back in order once the writer catches up
+    max_queue_bytes: int = 8 * 1024 * 1024
+    spill_folder: str = None
+    # Sub-folder of output_folder for each segment, e.g.
+    # "{station}/{yyyy}/{mm}/{dd}/{HH}" (UTC, from the segment start). Empty
+    # writes every segment straight into output_folder
+    path_template: str = ""
+    # Delete segments older than this many seconds, or the oldest ones while
+    # the folder holds more than this many bytes (0 disables), or move them
+    # to retention_move_to instead, at most retention_rate files per second
+    retention_max_age: float = 0
+    retention_max_bytes: int = 0
+    retention_move_to: str = None
+    retention_rate: float = 10
+    # Concatenate the closed segments of each "hourly" or "daily" period into
+    # one archive file, compact_after seconds after the period ends ("" disables)
+    compact_period: str = ""
+    compact_after: float = 3600
+    # Write a sidecar with the loudness, silences and fingerprint of each
+    # closed segment, computed by a process pool off the reader and writer
+    features: bool = False
+    # Upload closed segments to storage_url: a folder, file:///folder or
+    # s3://bucket/prefix, on storage_endpoint for S3-compatible servers (by
+    # default AWS, with the credentials of AWS_ACCESS_KEY_ID and
+    # AWS_SECRET_ACCESS_KEY), sending at most upload_bandwidth bytes per
+    # second (0: no limit). The local copy is deleted once it is uploaded if
+    # delete_after_upload
+    storage_url: str = ""
+    storage_endpoint: str = None
+    upload_bandwidth: float = 0
+    delete_after_upload: bool = False
+
+    def __post_init__(self):
+        parse_durability(self.durability)
+        format_path_template(self.path_template, "station", 0)
+        if self.tracks:
+            parse_tracks(self.tracks)
+        if self.compact_period not in ("", "hourly", "daily"):
+            raise ValueError(f"Invalid compact period: {self.compact_period!r}, "
+                             "expected 'hourly' or 'daily'")
+
+    @property
+    def station(self) -> str:
+        """The stream name as a single path component."""
+        return (self.name or "stream").replace("/", "_")
+
+
+PATH_TEMPLATE_FIELDS = ("station", "yyyy", "mm", "dd", "HH")
+
+
+def format_path_template(template: str, station: str, ts: float) -> str:
+    """The sub-folder for a segment starting at ``ts`` (UTC)."""
+    if not template:
+        return ""
+    t = time.gmtime(ts)
+    try:
+        path = template.format(station=station, yyyy=f"{t.tm_year:04d}", mm=f"{t.tm_mon:02d}",
+                               dd=f"{t.tm_mday:02d}", HH=f"{t.tm_hour:02d}")
+    except (KeyError, IndexError, ValueError) as e:
+        raise ValueError(f"Invalid path template: {template!r}, the fields are "
+                         f"{', '.join(PATH_TEMPLATE_FIELDS)}") from e
+    if path.startswith("/") or ".." in path.split("/"):
+        raise ValueError(f"Path template must stay inside the output folder: {template!r}")
+    return path
+
+
+def parse_durability(durability: str) -> tuple[bool, float]:
+    """Return ``(sync_on_close, sync_interval)`` for a durability setting."""
+    if durability == "none":
+        return False, None
+    if durability == "on-close":
+        return True, None
+    match = re.fullmatch(r"every-(\d+(?:\.\d+)?)-seconds?", durability)
+    if not match or float(match.group(1)) <= 0:
+        raise ValueError(f"Invalid durability: {durability!r}, expected "
+                         "'none', 'on-close' or 'every-N-seconds'")
+    return True, float(match.group(1))
+
+
+def parse_tracks(tracks: str) -> list:
+    """The stream indexes (ints) and languages (lowercase strs) of a tracks
+    setting, or None for "all"."""
+    if tracks.strip().lower() == "all":
+        return None
+    selectors = []
+    for item in tracks.split(","):
+        item = item.strip()
+        if not item:
+            raise ValueError(f"Invalid tracks: {tracks!r}, expected 'all' or a "
+                             "comma-separated list of stream indexes and languages")
+        selectors.append(int(item) if item.isdigit() else item.lower())
+    return selectors
+
+
+def load_stream_configs(path: str) -> list[RecordingConfig]:
+    """Load stream configs from a TOML file.
+
+    Values in the ``[defaults]`` table apply to every ``[[stream]]`` entry.
+    ``output_folder`` may reference the stream name as ``{name}``.
+    """
+    if tomllib is None:
+        raise RuntimeError("Reading stream files needs Python 3.11+ or the tomli package")
+    with open(path, "rb") as f:
+        data = tomllib.load(f)
+    defaults = data.get("defaults", {})
+    known = {f.name for f in fields(RecordingConfig)}
+    configs = []
+    for entry in data.get("stream", []):
+        values = {**defaults, **entry}
+        unknown = set(values) - known
+        if unknown:
+            raise ValueError(f"Unknown stream options: {', '.join(sorted(unknown))}")
+        values.setdefault("name", values.get("url"))
+        if "output_folder" in values:
+            values["output_folder"] = values["output_folder"].format(name=values["name"])
+        configs.append(RecordingConfig(**values))
+    names = [c.name for c in configs]
+    duplicates = {n for n in names if names.count(n) > 1}
+    if duplicates:
+        raise ValueError(f"Duplicate stream names: {', '.join(sorted(duplicates))}")
+    return configs
@@ -0,0 +1,472 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import replace
+import logging
+import signal
+import threading
+import time
+from urllib.parse import urljoin, urlsplit
+
+import av
+import av.container
+import av.error
+
+from streamrec.config import RecordingConfig
+
+from .compaction import CompactionPolicy, Compactor
+from .features import FeatureExtractor
+from .ingest import NativeDemuxer, NATIVE_PARSERS, content_type_format
+from .journal import process_budget
+from .recorder import Recorder, format_ts
+from .relay import Relay, RelayServer
+from .retention import RetentionPolicy, RetentionWorker
+from .storage import UploadPolicy, Uploader
+from .timeline import backoff_delay
+
+logger = logging.getLogger("engine")
+
+CHUNK_SIZE = 16 * 1024
+AVIO_BUFFER_SIZE = 4096
+MAX_REDIRECTS = 5
+
+# Bytes to buffer before libav probes the stream
+OPEN_THRESHOLD = 16 * 1024
+
+# Largest frame (or page) of each format, used to keep enough bytes buffered
+# so that a demux job never has to wait for the network
+MAX_FRAME_SIZE = {
+    "mp3": 2 * 1024,
+    "aac": 8 * 1024,
+}
+DEFAULT_MAX_FRAME_SIZE = 64 * 1024
+
+
+class StreamFeed:
+    """Byte buffer filled from the event loop and read by libav in the executor."""
+
+    def __init__(self, timeout: float):
+        self.timeout = timeout
+        self.buffer = bytearray()
+        self.cond = threading.Condition()
+        self.eof = False
+
+    def feed(self, data: bytes):
+        with self.cond:
+            self.buffer += data
+            self.cond.notify()
+
+    def close(self):
+        with self.cond:
+            self.eof = True
+            self.cond.notify()
+
+    def pending(self) -> int:
+        return len(self.buffer)
+
+    def take(self) -> bytes:
+        """All the buffered bytes, without waiting."""
+        with self.cond:
+            data = bytes(self.buffer)
+            self.buffer.clear()
+            return data
+
+    def read(self, size: int) -> bytes:
+        with self.cond:
+            if not self.cond.wait_for(lambda: self.buffer or self.eof, self.timeout):
+                return b""
+            data = bytes(self.buffer[:size])
+            del self.buffer[:size]
+            return data
+
+
+class HTTPError(ConnectionError):
+    pass
+
+
+async def open_http_stream(url: str, timeout: float) -> tuple[asyncio.StreamReader, asyncio.StreamWriter, dict[str, str]]:
+    for _ in range(MAX_REDIRECTS + 1):
+        parts = urlsplit(url)
+        if parts.scheme not in ("http", "https"):
+            raise ValueError(f"Unsupported URL scheme: {url}")
+        tls = parts.scheme == "https"
+        port = parts.port or (443 if tls else 80)
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(parts.hostname, port, ssl=tls or None), timeout)
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+        request = (f"GET {path} HTTP/1.0\r\n"
+                   f"Host: {parts.netloc}\r\n"
+                   "User-Agent: streamrec\r\n"
+                   "Icy-MetaData: 0\r\n"
+                   "Connection: close\r\n\r\n")
+        writer.write(request.encode())
+        await writer.drain()
+
+        status_line = await asyncio.wait_for(reader.readline(), timeout)
+        status = status_line.decode("latin-1").split(maxsplit=2)
+        if len(status) < 2 or not status[1].isdigit():
+            writer.close()
+            raise HTTPError(f"Invalid status line: {status_line!r}")
+        headers = {}
+        while True:
+            line = await asyncio.wait_for(reader.readline(), timeout)
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        code = int(status[1])
+        if code in (301, 302, 303, 307, 308) and "location" in headers:
+            writer.close()
+            url = urljoin(url, headers["location"])
+            continue
+        if code != 200:
+            writer.close()
+            raise HTTPError(f"HTTP {code} from {url}")
+        return reader, writer, headers
+    raise HTTPError(f"Too many redirects: {url}")
+
+
+class EngineStream:
+
+    def __init__(self, config: RecordingConfig, engine: "Engine"):
+        self.config = config
+        self.engine = engine
+        self.recorder = Recorder(config)
+        self.recorder.on_flush_due = self.on_flush_due
+        self.feed = StreamFeed(config.network_timeout)
+        self.format: str = None
+        self.writer: asyncio.StreamWriter = None
+        self.container: av.container.InputContainer = None
+        self.demuxer: NativeDemuxer = None
+        self.packets = None
+        self.demux_future: asyncio.Future = None
+        self.demux_done = asyncio.Event()
+        self.reader_finished = asyncio.Event()
+        self.stopped = asyncio.Event()
+        self.flush_wanted = asyncio.Event()
+        self.name = config.name or config.url
+        self.bytes_read = 0
+        self.demux_cpu = 0.0
+        self.write_cpu = 0.0
+
+    def on_flush_due(self):
+        # Called from executor threads with the recorder's queue lock held
+        self.engine.loop.call_soon_threadsafe(self.flush_wanted.set)
+
+    def max_frame_size(self) -> int:
+        return MAX_FRAME_SIZE.get(self.format, DEFAULT_MAX_FRAME_SIZE)
+
+    def demux(self) -> bool:
+        cpu_start = time.thread_time()
+        try:
+            with self.recorder.tracer.trace("demux", stream=self.recorder.config.station):
+                return self._demux()
+        finally:
+            self.demux_cpu += time.thread_time() - cpu_start
+
+    def _demux(self) -> bool:
+        if self.demuxer:
+            return self.demux_native()
+        if not self.container:
+            self.container = av.open(self.feed, format=self.format,
+                                     buffer_size=AVIO_BUFFER_SIZE)
+            stream = next(
+                s for s in self.container.streams if s.type == "audio")
+            self.packets = self.container.demux(stream)
+        watermark = AVIO_BUFFER_SIZE + self.max_frame_size()
+        for packet in self.packets:
+            self.recorder.enqueue(packet)
+            if self.recorder.stopping:
+                return False
+            if not self.feed.eof and self.feed.pending() < watermark:
+                return True
+        return False
+
+    def demux_native(self) -> bool:
+        packets = self.demuxer.feed(self.feed.take())
+        if packets:
+            self.recorder.enqueue_many(packets)
+        return not (self.recorder.stopping or self.feed.eof)
+
+    def schedule_demux(self):
+        if self.demux_future or self.demux_done.is_set():
+            return
+        threshold = AVIO_BUFFER_SIZE + self.max_frame_size()
+        if not (self.container or self.demuxer):
+            threshold = max(threshold, OPEN_THRESHOLD)
+        if self.feed.pending() < threshold and not self.feed.eof:
+            return
+        loop = asyncio.get_running_loop()
+        self.demux_future = loop.run_in_executor(self.engine.executor, self.demux)
+        self.demux_future.add_done_callback(self.on_demux_done)
+
+    def on_demux_done(self, future: asyncio.Future):
+        self.demux_future = None
+        if future.cancelled():
+            self.demux_done.set()
+            return
+        exc = future.exception()
+        if exc:
+            self.on_reader_error(exc)
+        if exc or not future.result():
+            self.demux_done.set()
+            self.close_connection()
+        else:
+            self.schedule_demux()
+
+    def on_reader_error(self, e: BaseException):
+        if isinstance(e, (OSError, asyncio.TimeoutError, av.error.ConnectionResetError,
+                          av.error.ConnectionRefusedError, av.error.OSError,
+                          av.error.TimeoutError)):
+            logger.warning("[%s] Connection error: %s", self.config.url, e)
+        else:
+            logger.error("[%s] Reader exception: %s", self.config.url, e)
+            self.recorder.reader_unhandled_exception = e
+        if not self.recorder.reader_exception:
+            self.recorder.reader_exception = e
+
+    async def read_connection(self) -> bool:
+        """Read and demux one connection until it ends. Returns whether it was opened."""
+        try:
+            reader, self.writer, headers = await open_http_stream(
+                self.config.url, self.config.network_timeout)
+            self.format = content_type_format(headers.get("content-type", ""))
+            if self.config.native_ingest and self.format in NATIVE_PARSERS:
+                self.demuxer = NativeDemuxer(self.format)
+            while not self.recorder.stopping and not self.demux_done.is_set():
+                chunk = await asyncio.wait_for(reader.read(CHUNK_SIZE),
+                                               self.config.network_timeout)
+                if not chunk:
+                    break
+                self.bytes_read += len(chunk)
+                self.feed.feed(chunk)
+                self.schedule_demux()
+        # pylint: disable=broad-except
+        except Exception as e:
+            if not (self.recorder.stopping or self.demux_done.is_set()):
+                self.on_reader_error(e)
+        finally:
+            self.feed.close()
+            self.close_connection()
+        if not self.recorder.stopping and (self.container or self.feed.pending()):
+            self.schedule_demux()
+        if self.demux_future:
+            await self.demux_done.wait()
+        opened = self.container is not None or bool(self.demuxer and self.demuxer.pts)
+        if self.container:
+            await asyncio.get_running_loop().run_in_executor(
+                self.engine.executor, self.container.close)
+        self.recorder.end_connection()
+        return opened
+
+    def reset_connection(self):
+        self.feed = StreamFeed(self.config.network_timeout)
+        self.format = None
+        self.writer = None
+        self.container = None
+        self.demuxer = None
+        self.packets = None
+        self.demux_done.clear()
+        self.recorder.timeline.new_connection()
+
+    async def read(self):
+        session = self.recorder.session
+        session.ts_start = time.time()
+        logger.info("[%s] Starting reader: %s",
+                    self.config.url, format_ts(session.ts_start))
+        attempt = 0
+        while True:
+            if await self.read_connection():
+                attempt = 0
+            recorder = self.recorder
+            if (recorder.stopping or recorder.reader_unhandled_exception
+                    or not recorder.can_reconnect(attempt)):
+                break
+            delay = backoff_delay(attempt, self.config.reconnect_delay,
+                                  self.config.reconnect_max_delay)
+            attempt += 1
+            logger.info("[%s] Reconnecting in %.2f seconds (attempt %s)",
+                        self.config.url, delay, attempt)
+            try:
+                await asyncio.wait_for(self.stopped.wait(), delay)
+                break
+            except asyncio.TimeoutError:
+                pass
+            self.reset_connection()
+        with self.recorder.queue_lock:
+            self.recorder.reader_finished = True
+        self.reader_finished.set()
+        self.flush_wanted.set()
+
+    async def write(self):
+        loop = asyncio.get_running_loop()
+        recorder = self.recorder
+        while True:
+            with recorder.queue_lock:
+                if recorder.reader_finished and not recorder.has_pending():
+                    break
+                due = recorder.flush_due()
+                timeout = recorder.flush_timeout()
+                self.flush_wanted.clear()
+            if due:
+                await loop.run_in_executor(self.engine.executor, self.flush)
+                continue
+            try:
+                await asyncio.wait_for(self.flush_wanted.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        await loop.run_in_executor(self.engine.executor, recorder.close_output)
+
+    def flush(self):
+        cpu_start = time.thread_time()
+        self.recorder.flush()
+        self.write_cpu += time.thread_time() - cpu_start
+
+    def close_connection(self):
+        if self.writer:
+            self.writer.close()
+
+    def stop(self):
+        self.recorder.stopping = True
+        self.stopped.set()
+        self.flush_wanted.set()
+        self.feed.close()
+        self.close_connection()
+
+    async def run(self):
+        await asyncio.gather(self.read(), self.write())
+
+
+class Engine:
+    """Records many streams from a single event loop.
+
+    Network reads run on the loop, while libav demuxing and segment writes
+    are handed to a bounded thread pool. Streams can be added and removed
+    while the engine runs; a persistent engine keeps running with no streams
+    until it is stopped. ``max_queue_bytes`` caps the packets queued in memory
+    by all the streams together; beyond it, streams spill to their journals.
+    """
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, configs: list[RecordingConfig], max_workers: int = None,
+                 persistent: bool = False, relay_server: RelayServer = None,
+                 max_queue_bytes: int = None):
+        self.configs = configs
+        if max_queue_bytes is not None:
+            process_budget.limit = max_queue_bytes
+        self.relay_server = relay_server
+        self.retention = RetentionWorker()
+        self.features = FeatureExtractor()
+        self.uploader = Uploader()
+        self.compactor = Compactor(features=self.features, uploader=self.uploader)
+        self.max_workers = max_workers
+        self.persistent = persistent
+        self.executor: ThreadPoolExecutor = None
+        self.streams: list[EngineStream] = []
+        self.tasks: dict[EngineStream, asyncio.Task] = {}
+        self.loop: asyncio.AbstractEventLoop = None
+        self.finished: asyncio.Event = None
+        self.ready = threading.Event()
+        self.stopping = False
+
+    def _add_stream(self, config: RecordingConfig):
+        if self.stopping:
+            return
+        if config.tracks:
+            logger.warning("[%s] The engine records the first audio track only, "
+                           "ignoring tracks=%r", config.url, config.tracks)
+            config = replace(config, tracks="")
+        stream = EngineStream(config, self)
+        stream.recorder.prepare_output()
+        if self.relay_server:
+            stream.recorder.relay = Relay(stream.name)
+            self.relay_server.add(stream.recorder.relay)
+        policy = RetentionPolicy.from_config(config)
+        if policy:
+            self.retention.add(policy)
+        compaction_policy = CompactionPolicy.from_config(config)
+        if compaction_policy:
+            self.compactor.add(compaction_policy)
+        if config.features:
+            stream.recorder.features = self.features
+        upload_policy = UploadPolicy.from_config(config)
+        if upload_policy:
+            self.uploader.add(upload_policy)
+            stream.recorder.uploader = self.uploader
+        self.streams.append(stream)
+        task = asyncio.ensure_future(stream.run())
+        self.tasks[stream] = task
+        task.add_done_callback(lambda _: self._on_stream_done(stream))
+
+    def _on_stream_done(self, stream: EngineStream):
+        del self.tasks[stream]
+        if not self.tasks and (self.stopping or not self.persistent):
+            self.finished.set()
+
+    def _remove_stream(self, name: str):
+        for stream in self.streams:
+            if stream.name == name:
+                logger.info("Removing stream %s", name)
+                stream.stop()
+                if self.relay_server:
+                    self.relay_server.remove(name)
+                self.retention.remove(stream.config.output_folder)
+                self.compactor.remove(stream.config.output_folder)
+                self.uploader.remove(stream.config.output_folder)
+                self.streams.remove(stream)
+                return
+
+    def add_stream(self, config: RecordingConfig):
+        self.loop.call_soon_threadsafe(self._add_stream, config)
+
+    def remove_stream(self, name: str):
+        self.loop.call_soon_threadsafe(self._remove_stream, name)
+
+    def stats(self) -> dict[str, dict]:
+        return {stream.name: {"bytes": stream.bytes_read,
+                              "cpu": stream.demux_cpu + stream.write_cpu,
+                              **stream.recorder.stats()}
+                for stream in list(self.streams)}
+
+    async def run(self):
+        self.loop = asyncio.get_running_loop()
+        self.finished = asyncio.Event()
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                           thread_name_prefix="engine")
+        for config in self.configs:
+            self._add_stream(config)
+        self.retention.start()
+        self.compactor.start()
+        self.features.start()
+        self.uploader.start()
+        self.ready.set()
+        if self.stopping or not (self.tasks or self.persistent):
+            self._stop()
+        try:
+            await self.finished.wait()
+        finally:
+            self.retention.stop()
+            self.compactor.stop()
+            self.executor.shutdown(wait=True)
+            self.features.stop()
+            self.uploader.stop()
+        logger.info("All streams finished")
+
+    def _stop(self):
+        self.stopping = True
+        for stream in self.tasks:
+            stream.stop()
+        if not self.tasks:
+            self.finished.set()
+
+    def stop(self, sig=None, _frame=None):
+        if sig:
+            logger.info("Received signal %s", signal.Signals(sig).name)
+        self.stopping = True
+        if self.loop and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self._stop)
+
+    def start(self):
+        asyncio.run(self.run())
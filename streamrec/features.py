@@ -0,0 +1,267 @@
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+import logging
+import multiprocessing
+import os
+from pathlib import Path
+import queue
+import struct
+import threading
+
+import av
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+SIDECAR_SUFFIX = ".features"
+# Sample rate segments are decoded to, in mono
+FEATURE_RATE = 22050
+# Seconds per silence detection window, level below which a window is
+# silent, in dBFS, and shortest silence reported, in seconds
+SILENCE_WINDOW = 0.1
+SILENCE_DB = -50.0
+MIN_SILENCE = 1.0
+# Fingerprint: one 32 bit value per hop, from the energy of 33 bands between
+# FINGERPRINT_LOW and FINGERPRINT_HIGH Hz in a window of FINGERPRINT_FRAME samples
+FINGERPRINTS_PER_SECOND = 4
+FINGERPRINT_FRAME = 2048
+FINGERPRINT_LOW = 300
+FINGERPRINT_HIGH = 2000
+# Segments waiting for a worker; beyond it, newly closed segments are skipped
+MAX_BACKLOG = 64
+# Seconds between checks that the backlog thread is still alive while stopping
+STOP_POLL = 0.5
+
+# magic, version, fingerprints per second, duration, and the number of
+# loudness values, silences and fingerprints
+HEADER = struct.Struct("<4sHHdIII")
+MAGIC = b"SRFT"
+VERSION = 1
+
+# BS.1770 K-weighting (high shelf then high pass), defined at 48 kHz
+K_WEIGHTING = (
+    ((1.53512485958697, -2.69169618940638, 1.19839281085285),
+     (1.0, -1.69065929318241, 0.73248077421585)),
+    ((1.0, -2.0, 1.0),
+     (1.0, -1.99004745483398, 0.99007225036621)),
+)
+
+
+@dataclass
+class SegmentFeatures:
+    """Audio features of a segment, as stored in its sidecar. Times are in
+    seconds from the start of the segment."""
+    duration: float
+    # dBFS and LUFS of each second, the last one possibly partial
+    rms: np.ndarray
+    loudness: np.ndarray
+    # (start, end) of each silence
+    silences: np.ndarray
+    # uint32 per 1 / FINGERPRINTS_PER_SECOND seconds
+    fingerprint: np.ndarray
+    fingerprints_per_second: int = FINGERPRINTS_PER_SECOND
+
+
+def sidecar_path(segment_path: Path) -> Path:
+    return segment_path.with_name(segment_path.name + SIDECAR_SUFFIX)
+
+
+def decode(path: str) -> np.ndarray:
+    """The samples of a segment, mono float32 at FEATURE_RATE."""
+    resampler = av.AudioResampler(format="flt", layout="mono", rate=FEATURE_RATE)
+    chunks = []
+    with av.open(path) as container:
+        stream = container.streams.audio[0]
+        for frame in container.decode(stream):
+            for resampled in resampler.resample(frame):
+                chunks.append(resampled.to_ndarray()[0])
+        for resampled in resampler.resample(None):
+            chunks.append(resampled.to_ndarray()[0])
+    return np.concatenate(chunks) if chunks else np.zeros(0, np.float32)
+
+
+def mean_square(samples: np.ndarray, window: int) -> np.ndarray:
+    """Mean square of each ``window`` samples, the last window possibly partial."""
+    if not len(samples):
+        return np.zeros(0)
+    starts = np.arange(0, len(samples), window)
+    sums = np.add.reduceat(samples.astype(np.float64) ** 2, starts)
+    return sums / np.diff(np.append(starts, len(samples)))
+
+
+def k_weighting(freqs: np.ndarray) -> np.ndarray:
+    """Power gain of the K-weighting filter at ``freqs`` Hz."""
+    z = np.exp(-2j * np.pi * freqs / 48000)
+    gain = np.ones(len(freqs))
+    for b, a in K_WEIGHTING:
+        gain *= np.abs(np.polyval(b[::-1], z) / np.polyval(a[::-1], z)) ** 2
+    return gain
+
+
+def loudness(samples: np.ndarray) -> np.ndarray:
+    """LUFS of each second, K-weighted in the frequency domain."""
+    if not len(samples):
+        return np.zeros(0)
+    seconds = -(-len(samples) // FEATURE_RATE)
+    blocks = np.zeros((seconds, FEATURE_RATE), np.float32)
+    blocks.flat[:len(samples)] = samples
+    power = np.abs(np.fft.rfft(blocks, axis=1)) ** 2
+    freqs = np.fft.rfftfreq(FEATURE_RATE, 1 / FEATURE_RATE)
+    # Bins other than DC and Nyquist stand for two of the full spectrum
+    weights = k_weighting(freqs) * 2
+    weights[0] /= 2
+    if FEATURE_RATE % 2 == 0:
+        weights[-1] /= 2
+    counts = np.full(seconds, FEATURE_RATE)
+    counts[-1] = len(samples) - (seconds - 1) * FEATURE_RATE
+    ms = power @ weights / FEATURE_RATE / counts
+    return -0.691 + 10 * np.log10(ms + 1e-12)
+
+
+def silences(samples: np.ndarray) -> np.ndarray:
+    """``(start, end)`` of the runs of silent windows of at least MIN_SILENCE seconds."""
+    window = int(SILENCE_WINDOW * FEATURE_RATE)
+    silent = 10 * np.log10(mean_square(samples, window) + 1e-12) < SILENCE_DB
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], silent.astype(np.int8), [0]))))
+    runs = edges.reshape(-1, 2) * window / FEATURE_RATE
+    runs[:, 1] = np.minimum(runs[:, 1], len(samples) / FEATURE_RATE)
+    return runs[runs[:, 1] - runs[:, 0] >= MIN_SILENCE]
+
+
+def fingerprint(samples: np.ndarray) -> np.ndarray:
+    """One bit per band and hop: whether the energy difference between
+    neighbouring bands grew since the previous hop."""
+    if len(samples) < FINGERPRINT_FRAME:
+        return np.zeros(0, np.uint32)
+    hop = FEATURE_RATE // FINGERPRINTS_PER_SECOND
+    frames = np.lib.stride_tricks.sliding_window_view(samples, FINGERPRINT_FRAME)[::hop]
+    power = np.abs(np.fft.rfft(frames * np.hanning(FINGERPRINT_FRAME), axis=1)) ** 2
+    edges = np.geomspace(FINGERPRINT_LOW, FINGERPRINT_HIGH, 34) * FINGERPRINT_FRAME / FEATURE_RATE
+    bands = np.add.reduceat(power, np.round(edges).astype(int), axis=1)[:, :33]
+    diff = bands[:, :-1] - bands[:, 1:]
+    bits = np.diff(diff, axis=0, prepend=0) > 0
+    return np.packbits(bits, axis=1, bitorder="little").view("<u4")[:, 0]
+
+
+def compute_features(samples: np.ndarray) -> SegmentFeatures:
+    return SegmentFeatures(len(samples) / FEATURE_RATE,
+                           10 * np.log10(mean_square(samples, FEATURE_RATE) + 1e-12),
+                           loudness(samples), silences(samples), fingerprint(samples))
+
+
+def write_sidecar(path: Path, features: SegmentFeatures):
+    """Write ``features`` to ``path`` atomically."""
+    tmp = path.with_name(path.name + ".part")
+    with open(tmp, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, features.fingerprints_per_second,
+                            features.duration, len(features.rms), len(features.silences),
+                            len(features.fingerprint)))
+        f.write(features.rms.astype("<f4").tobytes())
+        f.write(features.loudness.astype("<f4").tobytes())
+        f.write(features.silences.astype("<f4").tobytes())
+        f.write(features.fingerprint.astype("<u4").tobytes())
+    os.replace(tmp, path)
+
+
+def read_sidecar(path: Path) -> SegmentFeatures:
+    data = Path(path).read_bytes()
+    magic, version, per_second, duration, seconds, n_silences, n_fingerprint = \
+        HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"Not a feature sidecar: {path}")
+    offset = HEADER.size
+    arrays = []
+    for dtype, count in (("<f4", seconds), ("<f4", seconds), ("<f4", 2 * n_silences),
+                         ("<u4", n_fingerprint)):
+        arrays.append(np.frombuffer(data, dtype, count, offset))
+        offset += 4 * count
+    rms, loud, silence, prints = arrays
+    return SegmentFeatures(duration, rms, loud, silence.reshape(-1, 2), prints, per_second)
+
+
+def extract(segment_path: str):
+    """Decode a segment once and write its sidecar. Runs in a worker process."""
+    features = compute_features(decode(segment_path))
+    write_sidecar(sidecar_path(Path(segment_path)), features)
+
+
+def lower_priority():
+    try:
+        os.nice(10)
+    except OSError:
+        pass
+
+
+class FeatureExtractor:
+    """Writes a feature sidecar for closed segments, in a process pool.
+
+    ``submit`` only puts the path in a queue of at most ``max_backlog``
+    segments, and skips it when the queue is full, so the writer never waits.
+    A background thread hands the queue to the workers, which run at a lower
+    priority, one segment per worker at a time.
+    """
+
+    def __init__(self, max_workers: int = 1, max_backlog: int = MAX_BACKLOG):
+        self.max_workers = max_workers
+        self.backlog: queue.Queue[str] = queue.Queue(max_backlog)
+        self.slots = threading.Semaphore(max_workers)
+        self.pool: ProcessPoolExecutor = None
+        self.thread: threading.Thread = None
+        self.extracted = 0
+        self.failed = 0
+        self.dropped = 0
+
+    def submit(self, segment_path: Path):
+        try:
+            self.backlog.put_nowait(str(segment_path))
+        except queue.Full:
+            self.dropped += 1
+            logger.warning("Feature backlog full, skipping %s", segment_path)
+
+    def done(self, segment_path: str, future):
+        self.slots.release()
+        try:
+            future.result()
+            self.extracted += 1
+        # pylint: disable=broad-except
+        except Exception as e:
+            self.failed += 1
+            logger.warning("Could not extract features of %s: %s", segment_path, e)
+
+    def run(self):
+        while True:
+            segment_path = self.backlog.get()
+            if segment_path is None:
+                return
+            self.slots.acquire()  # pylint: disable=consider-using-with
+            future = self.pool.submit(extract, segment_path)
+            future.add_done_callback(lambda f, p=segment_path: self.done(p, f))
+
+    def start(self):
+        self.pool = ProcessPoolExecutor(self.max_workers, initializer=lower_priority,
+                                        mp_context=multiprocessing.get_context("spawn"))
+        self.thread = threading.Thread(target=self.run, name="features", daemon=True)
+        self.thread.start()
+
+    def stop(self, wait: bool = True):
+        """Stop after the segments already queued, unless not ``wait``.
+
+        Never blocks on a full backlog that no thread takes from: when the
+        extractor was not started or its thread died.
+        """
+        if not wait:
+            try:
+                while True:
+                    self.backlog.get_nowait()
+            except queue.Empty:
+                pass
+        while self.thread and self.thread.is_alive():
+            try:
+                self.backlog.put(None, timeout=STOP_POLL)
+                break
+            except queue.Full:
+                continue
+        if self.thread:
+            self.thread.join()
+        if self.pool:
+            self.pool.shutdown(wait=True)
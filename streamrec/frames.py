@@ -0,0 +1,196 @@
+from typing import Callable, NamedTuple
+
+# Bitrates in kbps by (MPEG-1, layer) and (MPEG-2/2.5, layer), for bitrate
+# indexes 1 to 14
+MP3_BITRATES = {
+    (True, 1): (32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+    (True, 2): (32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    (True, 3): (32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (False, 1): (32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+    (False, 2): (8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    (False, 3): (8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+# Sample rates by version bits: MPEG-2.5, reserved, MPEG-2, MPEG-1
+MP3_SAMPLE_RATES = {
+    0: (11025, 12000, 8000),
+    2: (22050, 24000, 16000),
+    3: (44100, 48000, 32000),
+}
+# Sample rates of ADTS headers, by sampling frequency index
+ADTS_SAMPLE_RATES = (96000, 88200, 64000, 48000, 44100, 32000, 24000, 22050, 16000, 12000,
+                     11025, 8000, 7350)
+ADTS_HEADER_SIZE = 7
+
+
+class FrameHeader(NamedTuple):
+    length: int
+    samples: int
+    sample_rate: int
+
+    @property
+    def duration(self) -> float:
+        return self.samples / self.sample_rate
+
+
+def parse_mp3_header(data, offset: int = 0) -> FrameHeader:
+    """Parse the MPEG audio frame header at ``offset``, or return None if there is none."""
+    if len(data) - offset < 4:
+        return None
+    b1, b2, b3 = data[offset + 1], data[offset + 2], data[offset + 3]
+    if data[offset] != 0xFF or b1 & 0xE0 != 0xE0:
+        return None
+    version = (b1 >> 3) & 0x03
+    layer = 4 - ((b1 >> 1) & 0x03)
+    bitrate_index = b2 >> 4
+    sample_rate_index = (b2 >> 2) & 0x03
+    if (version == 1 or layer == 4 or bitrate_index in (0, 15)
+            or sample_rate_index == 3):
+        return None
+    mpeg1 = version == 3
+    bitrate = MP3_BITRATES[(mpeg1, layer)][bitrate_index - 1] * 1000
+    sample_rate = MP3_SAMPLE_RATES[version][sample_rate_index]
+    padding = (b2 >> 1) & 0x01
+    if layer == 1:
+        return FrameHeader((12 * bitrate // sample_rate + padding) * 4, 384, sample_rate)
+    samples = 1152 if mpeg1 or layer == 2 else 576
+    return FrameHeader(samples // 8 * bitrate // sample_rate + padding, samples, sample_rate)
+
+
+def parse_adts_header(data, offset: int = 0) -> FrameHeader:
+    """Parse the ADTS (AAC) frame header at ``offset``, or return None if there is none."""
+    if len(data) - offset < ADTS_HEADER_SIZE:
+        return None
+    if data[offset] != 0xFF or data[offset + 1] & 0xF6 != 0xF0:
+        return None
+    sample_rate_index = (data[offset + 2] >> 2) & 0x0F
+    length = (((data[offset + 3] & 0x03) << 11) | (data[offset + 4] << 3)
+              | (data[offset + 5] >> 5))
+    if sample_rate_index >= len(ADTS_SAMPLE_RATES) or length < ADTS_HEADER_SIZE:
+        return None
+    blocks = (data[offset + 6] & 0x03) + 1
+    return FrameHeader(length, 1024 * blocks, ADTS_SAMPLE_RATES[sample_rate_index])
+
+
+# Formats split into frames by their headers, without libav. AAC streams are ADTS
+NATIVE_PARSERS: dict[str, Callable] = {
+    "mp3": parse_mp3_header,
+    "aac": parse_adts_header,
+}
+
+
+def frame_format(data, offset: int = 0) -> str:
+    """The format of the frame at ``offset``, from its header, or None."""
+    for fmt, parse in NATIVE_PARSERS.items():
+        if parse(data, offset):
+            return fmt
+    return None
+
+
+def find_frame(data, offset: int, ts: float, target: float) -> tuple[int, float, FrameHeader]:
+    """Walk the MP3 frames from ``offset``, which starts at ``ts``, to the one
+    playing at ``target``.
+
+    Returns the offset, start timestamp and header of that frame. The header
+    is None when the data ends (or stops being MP3) before ``target``.
+    """
+    while True:
+        header = parse_mp3_header(data, offset)
+        if not header or offset + header.length > len(data):
+            return offset, ts, None
+        if ts + header.duration > target:
+            return offset, ts, header
+        offset += header.length
+        ts += header.duration
+
+
+def is_info_frame(frame: bytes) -> bool:
+    """Whether an MP3 frame is a Xing, Info or VBRI header, which encoders
+    write in place of the first frame and holds no audio."""
+    head = bytes(frame[:64])
+    return b"Xing" in head or b"Info" in head or b"VBRI" in head
+
+
+def id3_tag_size(data, offset: int = 0) -> int:
+    """Size of the ID3v2 tag at ``offset``, 0 if there is none, or None if
+    ``data`` ends before its header does."""
+    if len(data) - offset < 10:
+        return None if data[offset:offset + 3] == b"ID3"[:len(data) - offset] else 0
+    if data[offset:offset + 3] != b"ID3":
+        return 0
+    size = 0
+    for byte in data[offset + 6:offset + 10]:
+        size = (size << 7) | (byte & 0x7F)
+    footer = 10 if data[offset + 5] & 0x10 else 0
+    return 10 + size + footer
+
+
+class FrameSplitter:
+    """Splits an MP3 or ADTS byte stream, fed in chunks, into whole frames.
+
+    Bytes before the first frame, ID3v2 tags and anything that stops being a
+    frame are skipped. A frame is only trusted to start a stream, or a run
+    after skipped bytes, when the next frame follows it.
+    """
+
+    def __init__(self, parse: Callable[[bytes, int], FrameHeader]):
+        self.parse = parse
+        self.buffer = b""
+        self.synced = False
+        self.skipped = 0
+        # Bytes of an ID3 tag still to come
+        self.skip_pending = 0
+        # MP3 headers by their first 3 bytes, which are all the frame length
+        # and duration depend on
+        self.cache: dict[bytes, FrameHeader] = {}
+
+    def header(self, data, offset: int) -> FrameHeader:
+        if self.parse is not parse_mp3_header:
+            return self.parse(data, offset)
+        key = data[offset:offset + 3]
+        header = self.cache.get(key)
+        if header is None:
+            header = self.parse(data, offset)
+            if header and len(self.cache) < 64:
+                self.cache[key] = header
+        return header
+
+    def feed(self, data: bytes) -> list[tuple[memoryview, FrameHeader]]:
+        """Return the frames completed by ``data``, as views that stay valid."""
+        if self.skip_pending:
+            skip = min(self.skip_pending, len(data))
+            self.skip_pending -= skip
+            data = data[skip:]
+        buffer = self.buffer + data
+        view = memoryview(buffer)
+        frames = []
+        offset = 0
+        end = len(buffer)
+        # Shorter than any header: wait for the rest
+        while end - offset >= ADTS_HEADER_SIZE:
+            header = self.header(buffer, offset) if buffer[offset] == 0xFF else None
+            if header and self.synced and offset + header.length <= end:
+                frames.append((view[offset:offset + header.length], header))
+                offset += header.length
+                continue
+            if header:
+                following = offset + header.length
+                if following + 4 > end:
+                    # Wait for more data to tell whether this is a frame
+                    break
+                if self.parse(buffer, following):
+                    self.synced = True
+                    continue
+            self.synced = False
+            skip = id3_tag_size(buffer, offset)
+            if skip is None:
+                break
+            if not skip:
+                next_sync = buffer.find(b"\xff", offset + 1)
+                skip = next_sync - offset if next_sync >= 0 else end - offset
+            self.skipped += skip
+            if offset + skip > end:
+                self.skip_pending = offset + skip - end
+                skip = end - offset
+            offset += skip
+        self.buffer = buffer[offset:]
+        return frames
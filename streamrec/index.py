@@ -0,0 +1,545 @@
+from dataclasses import dataclass
+from datetime import datetime, timezone
+import itertools
+import logging
+import mmap
+import os
+from pathlib import Path
+import re
+import sqlite3
+from typing import Iterator
+from uuid import UUID
+import zlib
+
+import av
+import numpy as np
+
+from streamrec.packet import PacketBatch
+
+logger = logging.getLogger(__name__)
+
+INDEX_FILENAME = "index.sqlite"
+# Seconds of audio between two time to byte offset checkpoints
+CHECKPOINT_INTERVAL = 1.0
+# Jumps between the end of a packet and the start of the next one larger than
+# this (in seconds) are recorded as gaps, negative ones as discontinuities
+GAP_TOLERANCE = 0.1
+# Seconds between index commits while a segment is open
+COMMIT_INTERVAL = 10.0
+# Longest lock wait when several writers share an index
+BUSY_TIMEOUT = 30
+# Bytes covered by each CRC-32 of a segment, 0 for one per segment
+CHECKSUM_BLOCK = 1024 * 1024
+
+SEGMENT_NAME = re.compile(
+    r"^(?P<ts>\d{8}-\d{6})-UTC_(?P<session>[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12})"
+    r"(?:\.(?P<archive>hourly|daily))?\.mp3$")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS segments (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    session TEXT NOT NULL,
+    start_ts REAL NOT NULL,
+    end_ts REAL,
+    size INTEGER
+);
+CREATE INDEX IF NOT EXISTS segments_start_ts ON segments (start_ts);
+CREATE INDEX IF NOT EXISTS segments_end_ts ON segments (end_ts);
+CREATE TABLE IF NOT EXISTS checkpoints (
+    segment_id INTEGER NOT NULL REFERENCES segments (id),
+    ts REAL NOT NULL,
+    offset INTEGER NOT NULL,
+    PRIMARY KEY (segment_id, ts)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS gaps (
+    session TEXT NOT NULL,
+    ts REAL NOT NULL,
+    duration REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS gaps_ts ON gaps (ts);
+CREATE TABLE IF NOT EXISTS checksums (
+    segment_id INTEGER NOT NULL REFERENCES segments (id),
+    offset INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    crc INTEGER NOT NULL,
+    PRIMARY KEY (segment_id, offset)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS pending_deletes (
+    path TEXT PRIMARY KEY,
+    after REAL NOT NULL
+);
+"""
+
+
+def block_checksums(data, start: int, end: int,
+                    block_size: int = CHECKSUM_BLOCK) -> list[tuple[int, int, int]]:
+    """``(offset, size, crc)`` of the blocks of ``data[start:end]``, a bytes-like
+    object such as an mmap."""
+    step = block_size or max(end - start, 1)
+    checksums = []
+    with memoryview(data) as view:
+        for offset in range(start, end, step):
+            with view[offset:min(offset + step, end)] as block:
+                checksums.append((offset, len(block), zlib.crc32(block)))
+    return checksums
+
+
+def file_checksums(path: Path, start: int = 0,
+                   block_size: int = CHECKSUM_BLOCK) -> list[tuple[int, int, int]]:
+    """``(offset, size, crc)`` of the blocks of a file from ``start``."""
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size <= start:
+            return []
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return block_checksums(data, start, size, block_size)
+
+
+def connect(path: Path) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+@dataclass
+class IndexedSegment:
+    id: int
+    path: Path
+    session: str
+    start_ts: float
+    end_ts: float
+    size: int
+
+
+class SegmentIndex:
+    """Looks up the segments of an output folder by timestamp.
+
+    Segments are ordered by their start timestamp, so every lookup is a
+    B-tree search. Segments that are still being written have no end yet.
+    """
+
+    def __init__(self, folder: str):
+        self.folder = Path(folder)
+        self.conn = connect(self.folder / INDEX_FILENAME)
+
+    def close(self):
+        self.conn.close()
+
+    def segment(self, row: tuple) -> IndexedSegment:
+        segment_id, path, session, start_ts, end_ts, size = row
+        return IndexedSegment(segment_id, self.folder / path, session, start_ts, end_ts, size)
+
+    def get(self, path: Path) -> IndexedSegment:
+        """The segment at ``path``, if it is indexed."""
+        row = self.conn.execute("SELECT * FROM segments WHERE path = ?",
+                                (str(Path(path).relative_to(self.folder)),)).fetchone()
+        return self.segment(row) if row else None
+
+    def find(self, ts: float) -> IndexedSegment:
+        """The segment that covers ``ts``, if any."""
+        row = self.conn.execute(
+            "SELECT * FROM segments WHERE start_ts <= ? ORDER BY start_ts DESC LIMIT 1",
+            (ts,)).fetchone()
+        if not row or (row[4] is not None and row[4] <= ts):
+            return None
+        return self.segment(row)
+
+    def locate(self, ts: float) -> tuple[IndexedSegment, int]:
+        """The segment that covers ``ts`` and the byte offset of the last
+        checkpoint at or before it."""
+        segment = self.find(ts)
+        if not segment:
+            return None
+        return segment, self.checkpoint_before(segment, ts)[1]
+
+    def checkpoint_before(self, segment: IndexedSegment, ts: float) -> tuple[float, int]:
+        """``(ts, offset)`` of the last checkpoint at or before ``ts``."""
+        checkpoint = self.conn.execute(
+            "SELECT ts, offset FROM checkpoints WHERE segment_id = ? AND ts <= ? "
+            "ORDER BY ts DESC LIMIT 1", (segment.id, ts)).fetchone()
+        return checkpoint or (segment.start_ts, 0)
+
+    def checkpoint_after(self, segment: IndexedSegment, ts: float) -> tuple[float, int]:
+        """``(ts, offset)`` of the first checkpoint at or after ``ts``, if any."""
+        return self.conn.execute(
+            "SELECT ts, offset FROM checkpoints WHERE segment_id = ? AND ts >= ? "
+            "ORDER BY ts LIMIT 1", (segment.id, ts)).fetchone()
+
+    def checkpoints(self, segment: IndexedSegment) -> list[tuple[float, int]]:
+        return self.conn.execute(
+            "SELECT ts, offset FROM checkpoints WHERE segment_id = ? ORDER BY ts",
+            (segment.id,)).fetchall()
+
+    def checksums(self, segment: IndexedSegment) -> list[tuple[int, int, int]]:
+        """``(offset, size, crc)`` of the checksummed blocks of a segment, in order."""
+        return self.conn.execute(
+            "SELECT offset, size, crc FROM checksums WHERE segment_id = ? ORDER BY offset",
+            (segment.id,)).fetchall()
+
+    def checksum_end(self, segment: IndexedSegment) -> int:
+        """Offset where the checksummed blocks of a segment end."""
+        return self.conn.execute(
+            "SELECT COALESCE(MAX(offset + size), 0) FROM checksums WHERE segment_id = ?",
+            (segment.id,)).fetchone()[0]
+
+    def closed_checksums(self) -> Iterator[tuple[IndexedSegment, list[tuple[int, int, int]]]]:
+        """Every closed segment, with the ``(offset, size, crc)`` of its
+        checksummed blocks, in one pass over the index."""
+        rows = self.conn.execute(
+            "SELECT s.*, c.offset, c.size, c.crc FROM segments s "
+            "LEFT JOIN checksums c ON c.segment_id = s.id "
+            "WHERE s.end_ts IS NOT NULL ORDER BY s.id, c.offset")
+        for _, group in itertools.groupby(rows, key=lambda row: row[0]):
+            group = list(group)
+            yield self.segment(group[0][:6]), [row[6:] for row in group if row[6] is not None]
+
+    def segments(self, start: float, end: float) -> list[IndexedSegment]:
+        """Segments overlapping ``[start, end)``, in order."""
+        first = self.find(start)
+        first_ts = first.start_ts if first else start
+        rows = self.conn.execute(
+            "SELECT * FROM segments WHERE start_ts >= ? AND start_ts < ? ORDER BY start_ts",
+            (first_ts, end)).fetchall()
+        return [self.segment(row) for row in rows]
+
+    def latest(self, count: int) -> list[IndexedSegment]:
+        """The last ``count`` closed segments, in order."""
+        rows = self.conn.execute(
+            "SELECT * FROM segments WHERE end_ts IS NOT NULL ORDER BY start_ts DESC LIMIT ?",
+            (count,)).fetchall()
+        return [self.segment(row) for row in reversed(rows)]
+
+    def oldest(self, count: int, after: float = None) -> list[IndexedSegment]:
+        """The first ``count`` closed segments starting after ``after``, in order."""
+        rows = self.conn.execute(
+            "SELECT * FROM segments WHERE end_ts IS NOT NULL AND start_ts > ? "
+            "ORDER BY start_ts LIMIT ?",
+            (float("-inf") if after is None else after, count)).fetchall()
+        return [self.segment(row) for row in rows]
+
+    def sessions(self) -> list[tuple[str, float, float]]:
+        """``(session, start_ts, end_ts)`` of the closed segments of each session."""
+        return self.conn.execute(
+            "SELECT session, MIN(start_ts), MAX(end_ts) FROM segments WHERE end_ts IS NOT NULL "
+            "GROUP BY session ORDER BY MIN(start_ts)").fetchall()
+
+    def session_segments(self, session: str, start: float, end: float) -> list[IndexedSegment]:
+        """Closed segments of one session overlapping ``[start, end)``, in order."""
+        rows = self.conn.execute(
+            "SELECT * FROM segments WHERE session = ? AND end_ts IS NOT NULL "
+            "AND start_ts < ? AND end_ts > ? ORDER BY start_ts", (session, end, start)).fetchall()
+        return [self.segment(row) for row in rows]
+
+    def total_size(self) -> int:
+        """Bytes in the closed segments."""
+        return self.conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM segments WHERE end_ts IS NOT NULL").fetchone()[0]
+
+    def closed_before(self, ts: float) -> list[IndexedSegment]:
+        """Closed segments that end by ``ts``, by session and start."""
+        rows = self.conn.execute(
+            "SELECT * FROM segments WHERE end_ts IS NOT NULL AND end_ts <= ? "
+            "ORDER BY session, start_ts", (ts,)).fetchall()
+        return [self.segment(row) for row in rows]
+
+    def replace_with_archive(self, members: list[IndexedSegment], path: Path,
+                             delete_after: float) -> IndexedSegment:
+        """Swap segments for the archive holding their concatenation, in one transaction.
+
+        The checkpoints and checksums of the members are moved to the archive,
+        shifted by the offset of each member, which also gets a checkpoint at
+        its start.
+        The member files are left to delete once ``delete_after`` has passed.
+        """
+        offsets = [0]
+        for member in members[:-1]:
+            offsets.append(offsets[-1] + member.size)
+        relative = str(path.relative_to(self.folder))
+        start_ts = members[0].start_ts
+        end_ts = max(m.end_ts for m in members)
+        size = offsets[-1] + members[-1].size
+        with self.conn:
+            cursor = self.conn.execute(
+                "INSERT OR REPLACE INTO segments (path, session, start_ts, end_ts, size) "
+                "VALUES (?, ?, ?, ?, ?)", (relative, members[0].session, start_ts, end_ts, size))
+            archive_id = cursor.lastrowid
+            for member, offset in zip(members, offsets):
+                self.conn.execute("INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?)",
+                                  (archive_id, member.start_ts, offset))
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO checkpoints "
+                    "SELECT ?, ts, offset + ? FROM checkpoints WHERE segment_id = ?",
+                    (archive_id, offset, member.id))
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO checksums "
+                    "SELECT ?, offset + ?, size, crc FROM checksums WHERE segment_id = ?",
+                    (archive_id, offset, member.id))
+                self.conn.execute("DELETE FROM checkpoints WHERE segment_id = ?", (member.id,))
+                self.conn.execute("DELETE FROM checksums WHERE segment_id = ?", (member.id,))
+                self.conn.execute("DELETE FROM segments WHERE id = ?", (member.id,))
+                self.conn.execute("INSERT OR REPLACE INTO pending_deletes VALUES (?, ?)",
+                                  (str(member.path.relative_to(self.folder)), delete_after))
+        return IndexedSegment(archive_id, path, members[0].session, start_ts, end_ts, size)
+
+    def pending_deletes(self, now: float) -> list[Path]:
+        """Files replaced by archives that can be deleted at ``now``."""
+        rows = self.conn.execute("SELECT path FROM pending_deletes WHERE after <= ?",
+                                 (now,)).fetchall()
+        return [self.folder / path for path, in rows]
+
+    def forget_deletes(self, paths: list[Path]):
+        with self.conn:
+            self.conn.executemany("DELETE FROM pending_deletes WHERE path = ?",
+                                  [(str(p.relative_to(self.folder)),) for p in paths])
+
+    def open_segments(self) -> list[IndexedSegment]:
+        """Segments without an end: being written, or left open by a crash."""
+        rows = self.conn.execute(
+            "SELECT * FROM segments WHERE end_ts IS NULL ORDER BY start_ts").fetchall()
+        return [self.segment(row) for row in rows]
+
+    def finish(self, segment: IndexedSegment, end_ts: float, size: int,
+               checkpoints: list[tuple[float, int]] = (),
+               checksums: list[tuple[int, int, int]] = ()):
+        """Close a segment left open, adding the ``(ts, offset)`` checkpoints
+        and ``(offset, size, crc)`` checksums found in it."""
+        with self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?)",
+                                  [(segment.id, ts, offset) for ts, offset in checkpoints])
+            self.conn.executemany("INSERT OR REPLACE INTO checksums VALUES (?, ?, ?, ?)",
+                                  [(segment.id, *checksum) for checksum in checksums])
+            self.conn.execute("UPDATE segments SET end_ts = ?, size = ? WHERE id = ?",
+                              (end_ts, size, segment.id))
+
+    def remove(self, segment: IndexedSegment):
+        with self.conn:
+            self.conn.execute("DELETE FROM checkpoints WHERE segment_id = ?", (segment.id,))
+            self.conn.execute("DELETE FROM checksums WHERE segment_id = ?", (segment.id,))
+            self.conn.execute("DELETE FROM segments WHERE id = ?", (segment.id,))
+
+    def gaps(self, start: float, end: float, session: str = None) -> list[tuple[float, float]]:
+        """``(ts, duration)`` of the gaps recorded between ``start`` and ``end``."""
+        if session is not None:
+            return self.conn.execute(
+                "SELECT ts, duration FROM gaps WHERE session = ? AND ts >= ? AND ts < ? "
+                "ORDER BY ts", (session, start, end)).fetchall()
+        return self.conn.execute(
+            "SELECT ts, duration FROM gaps WHERE ts >= ? AND ts < ? ORDER BY ts",
+            (start, end)).fetchall()
+
+
+# pylint: disable=too-many-instance-attributes
+class IndexWriter:
+    """Appends the segments of one session to the index of its output folder.
+
+    Checkpoints are buffered and committed every COMMIT_INTERVAL seconds of
+    audio and when a segment is closed, so the index costs one small
+    transaction per interval instead of one per write. The bytes of each
+    segment are checksummed as they are written, with a CRC-32 every
+    ``checksum_block`` bytes (or one for the whole segment with 0).
+    """
+
+    def __init__(self, folder: str, session: UUID, checksum_block: int = CHECKSUM_BLOCK):
+        self.folder = Path(folder)
+        self.session = str(session)
+        self.checksum_block = checksum_block
+        self.conn: sqlite3.Connection = None
+        self.segment_id: int = None
+        self.size = 0
+        self.next_checkpoint: float = None
+        self.last_end: float = None
+        self.last_commit: float = None
+        self.checkpoints: list[tuple[int, float, int]] = []
+        self.gaps: list[tuple[str, float, float]] = []
+        self.block_offset = 0
+        self.block_crc = 0
+        self.checksums: list[tuple[int, int, int, int]] = []
+
+    def connection(self) -> sqlite3.Connection:
+        if self.conn is None:
+            self.conn = connect(self.folder / INDEX_FILENAME)
+        return self.conn
+
+    def open_segment(self, path: Path, start_ts: float):
+        conn = self.connection()
+        with conn:
+            cursor = conn.execute(
+                "INSERT OR REPLACE INTO segments (path, session, start_ts) VALUES (?, ?, ?)",
+                (str(path.relative_to(self.folder)), self.session, start_ts))
+        self.segment_id = cursor.lastrowid
+        self.size = 0
+        self.block_offset = 0
+        self.block_crc = 0
+        self.next_checkpoint = start_ts
+        self.last_commit = start_ts
+
+    def add(self, packets: PacketBatch):
+        """Record the packets just appended to the open segment."""
+        ts = packets.adjusted_ts()
+        ends = packets.end_ts()
+        offsets = packets.offsets() + self.size
+        self.checksum(packets.payload)
+
+        previous_ends = np.empty_like(ends)
+        previous_ends[1:] = ends[:-1]
+        previous_ends[0] = ts[0] if self.last_end is None else self.last_end
+        jumps = ts - previous_ends
+        for i in np.flatnonzero(np.abs(jumps) > GAP_TOLERANCE):
+            self.gaps.append((self.session, float(previous_ends[i]), float(jumps[i])))
+        self.last_end = float(ends[-1])
+
+        # First packet at or after each checkpoint time
+        if ts[-1] >= self.next_checkpoint:
+            count = int((ts[-1] - self.next_checkpoint) // CHECKPOINT_INTERVAL) + 1
+            checkpoint_ts = self.next_checkpoint + CHECKPOINT_INTERVAL * np.arange(count)
+            indices = np.unique(np.searchsorted(ts, checkpoint_ts, side="left"))
+            self.checkpoints += [(self.segment_id, float(ts[i]), int(offsets[i]))
+                                 for i in indices]
+            self.next_checkpoint += count * CHECKPOINT_INTERVAL
+
+        if self.last_end - self.last_commit >= COMMIT_INTERVAL:
+            self.commit()
+
+    def checksum(self, payload):
+        """Add the bytes appended to the open segment to the checksum of its blocks."""
+        view = memoryview(payload).cast("B")
+        start = 0
+        while start < len(view):
+            end = len(view)
+            if self.checksum_block:
+                end = min(end, start + self.block_offset + self.checksum_block - self.size)
+            self.block_crc = zlib.crc32(view[start:end], self.block_crc)
+            self.size += end - start
+            start = end
+            if self.size - self.block_offset == self.checksum_block:
+                self.end_block()
+
+    def end_block(self):
+        if self.size > self.block_offset:
+            self.checksums.append((self.segment_id, self.block_offset,
+                                   self.size - self.block_offset, self.block_crc))
+        self.block_offset = self.size
+        self.block_crc = 0
+
+    def commit(self, end_ts: float = None):
+        conn = self.connection()
+        with conn:
+            conn.executemany("INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?)",
+                             self.checkpoints)
+            conn.executemany("INSERT OR REPLACE INTO checksums VALUES (?, ?, ?, ?)",
+                             self.checksums)
+            conn.executemany("INSERT INTO gaps VALUES (?, ?, ?)", self.gaps)
+            if end_ts is not None:
+                conn.execute("UPDATE segments SET end_ts = ?, size = ? WHERE id = ?",
+                             (end_ts, self.size, self.segment_id))
+        self.checkpoints = []
+        self.gaps = []
+        self.checksums = []
+        self.last_commit = self.last_end
+
+    def close_segment(self):
+        if self.segment_id is None:
+            return
+        self.end_block()
+        self.commit(end_ts=self.last_end)
+        self.segment_id = None
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+
+def scan_segment(path: Path) -> tuple[list[float], list[int], float]:
+    """Seconds since the first packet and byte offset of every packet of a
+    segment file, and its duration."""
+    times, offsets = [], []
+    duration = 0.0
+    offset = 0
+    with av.open(str(path)) as container:
+        stream = next(s for s in container.streams if s.type == "audio")
+        first_pts = None
+        for packet in container.demux(stream):
+            if packet.size == 0 or packet.pts is None:
+                continue
+            if first_pts is None:
+                first_pts = packet.pts
+            seconds = float((packet.pts - first_pts) * packet.time_base)
+            times.append(seconds)
+            offsets.append(packet.pos if packet.pos is not None and packet.pos >= 0 else offset)
+            offset += packet.size
+            duration = seconds + float((packet.duration or 0) * packet.time_base)
+    return times, offsets, duration
+
+
+def rebuild_index(folder: str) -> int:
+    """Rebuild the index of an output folder from its segment files.
+
+    File names only keep whole seconds, so a segment that continues the
+    previous one of its session starts where that one ended. Gaps inside a
+    file cannot be recovered, and the checksums are taken from the files as
+    they are now. Segments already copied into an archive of their session
+    are skipped. Returns the number of indexed segments.
+    """
+    folder = Path(folder)
+    segments = []
+    for path in folder.rglob("*.mp3"):
+        match = SEGMENT_NAME.match(path.name)
+        if not match:
+            continue
+        start_ts = datetime.strptime(match["ts"], "%Y%m%d-%H%M%S").replace(
+            tzinfo=timezone.utc).timestamp()
+        # Archives sort before the first segment they hold
+        segments.append((match["session"], start_ts, not match["archive"], path))
+    segments.sort()
+
+    tmp_path = folder / (INDEX_FILENAME + ".tmp")
+    tmp_path.unlink(missing_ok=True)
+    conn = sqlite3.connect(tmp_path)
+    conn.executescript(SCHEMA)
+    indexed = 0
+    last_session, last_end, archive_end = None, None, None
+    for session, start_ts, is_segment, path in segments:
+        if is_segment and session == last_session and archive_end and start_ts < archive_end:
+            continue
+        try:
+            times, offsets, duration = scan_segment(path)
+        # pylint: disable=broad-except
+        except Exception as e:
+            logger.warning("Skipping unreadable segment %s: %s", path, e)
+            continue
+        if session == last_session and int(last_end) == start_ts:
+            start_ts = last_end
+        if session == last_session and start_ts - last_end > GAP_TOLERANCE:
+            conn.execute("INSERT INTO gaps VALUES (?, ?, ?)",
+                         (session, last_end, start_ts - last_end))
+        cursor = conn.execute(
+            "INSERT INTO segments (path, session, start_ts, end_ts, size) VALUES (?, ?, ?, ?, ?)",
+            (str(path.relative_to(folder)), session, start_ts, start_ts + duration,
+             path.stat().st_size))
+        checkpoints = []
+        next_checkpoint = 0.0
+        for seconds, offset in zip(times, offsets):
+            if seconds >= next_checkpoint:
+                checkpoints.append((cursor.lastrowid, start_ts + seconds, offset))
+                next_checkpoint = (seconds // CHECKPOINT_INTERVAL + 1) * CHECKPOINT_INTERVAL
+        conn.executemany("INSERT INTO checkpoints VALUES (?, ?, ?)", checkpoints)
+        conn.executemany("INSERT INTO checksums VALUES (?, ?, ?, ?)",
+                         [(cursor.lastrowid, *c) for c in file_checksums(path)])
+        if session != last_session:
+            archive_end = None
+        if not is_segment:
+            archive_end = start_ts + duration
+        last_session, last_end = session, start_ts + duration
+        indexed += 1
+    conn.commit()
+    conn.close()
+    index_path = folder / INDEX_FILENAME
+    for suffix in ("-wal", "-shm"):
+        Path(str(index_path) + suffix).unlink(missing_ok=True)
+    os.replace(tmp_path, index_path)
+    logger.info("Indexed %s segments in %s", indexed, folder)
+    return indexed
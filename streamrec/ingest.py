@@ -0,0 +1,96 @@
+from fractions import Fraction
+import logging
+from urllib.parse import urlsplit
+import urllib.request
+
+from .frames import NATIVE_PARSERS, FrameSplitter, is_info_frame
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE_FORMATS = {
+    "audio/mpeg": "mp3",
+    "audio/mp3": "mp3",
+    "audio/aac": "aac",
+    "audio/aacp": "aac",
+    "audio/x-aac": "aac",
+    "audio/ogg": "ogg",
+    "application/ogg": "ogg",
+}
+
+# URL schemes opened with urllib for native ingest. Others always go to libav
+NATIVE_SCHEMES = ("http", "https")
+# Bytes read from the connection at a time
+READ_SIZE = 64 * 1024
+
+
+def content_type_format(content_type: str) -> str:
+    """The container format of a Content-Type header, or None."""
+    return CONTENT_TYPE_FORMATS.get(content_type.split(";")[0].strip().lower())
+
+
+class RawPacket(bytes):
+    """A frame found without libav, with the av.Packet attributes the recorder uses."""
+
+    is_corrupt = False
+
+    def __new__(cls, data: bytes, pts: int, duration: int, time_base: Fraction):
+        packet = super().__new__(cls, data)
+        packet.pts = pts
+        packet.duration = duration
+        packet.time_base = time_base
+        packet.size = len(packet)
+        return packet
+
+
+class NativeDemuxer:
+    """Turns the body of an MP3 or ADTS stream into packets, in place of libav.
+
+    pts count samples from the start of the connection, in a time base of
+    the first frame's sample rate.
+    """
+
+    def __init__(self, fmt: str):
+        self.fmt = fmt
+        self.splitter = FrameSplitter(NATIVE_PARSERS[fmt])
+        self.time_base: Fraction = None
+        self.sample_rate: int = None
+        self.pts = 0
+
+    @property
+    def skipped(self) -> int:
+        return self.splitter.skipped
+
+    def feed(self, data: bytes) -> list[RawPacket]:
+        packets = []
+        for frame, duration in self.frames(data):
+            packets.append(RawPacket(frame, self.pts, duration, self.time_base))
+            self.pts += duration
+        return packets
+
+    def frames(self, data: bytes) -> list[tuple[memoryview, int]]:
+        """The frames completed by ``data`` with their durations in ``time_base``
+        units, without making packets of them. Does not advance ``pts``."""
+        frames = []
+        for frame, header in self.splitter.feed(data):
+            if self.time_base is None and self.fmt == "mp3" and is_info_frame(frame):
+                continue
+            if self.time_base is None:
+                self.sample_rate = header.sample_rate
+                self.time_base = Fraction(1, header.sample_rate)
+            duration = header.samples
+            if header.sample_rate != self.sample_rate:
+                duration = round(header.samples * self.sample_rate / header.sample_rate)
+            frames.append((frame, duration))
+        return frames
+
+
+def is_native_url(url: str) -> bool:
+    """Whether ``url`` can be read without libav, if its format allows it."""
+    return urlsplit(url).scheme.lower() in NATIVE_SCHEMES
+
+
+def open_stream(url: str, timeout: float):
+    """Open an HTTP stream for reading its body, without ICY metadata."""
+    request = urllib.request.Request(url, headers={"User-Agent": "streamrec",
+                                                   "Icy-MetaData": "0"})
+    return urllib.request.urlopen(request, timeout=timeout)  # pylint: disable=consider-using-with
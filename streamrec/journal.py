@@ -0,0 +1,149 @@
+from collections import deque
+from fractions import Fraction
+import logging
+import os
+from pathlib import Path
+import struct
+import threading
+
+import numpy as np
+
+from .packet import PacketBatch
+from .segmentfile import writev_all
+from .session import RecordingSession
+
+logger = logging.getLogger(__name__)
+
+# Packet count, time base numerator and denominator, and payload size of a record
+RECORD_HEADER = struct.Struct("<qqqq")
+# Bytes of the pts, duration, received ts and size columns per packet
+COLUMN_BYTES = 4 * 8
+
+
+def queued_bytes(packets: int, payload: int) -> int:
+    """Memory taken by queued packets: their payload plus their columns."""
+    return payload + packets * COLUMN_BYTES
+
+
+class MemoryBudget:
+    """Bytes of packets queued in memory by all the recorders of a process.
+
+    A limit of 0 means no limit. When it is exceeded, only the owners above
+    their share of the limit, split among the owners holding memory, are over
+    it, so a stalled stream spills rather than the healthy ones.
+    """
+
+    def __init__(self, limit: int = 0):
+        self.limit = limit
+        self.used = 0
+        # Bytes held by each owner
+        self.owners: dict[object, int] = {}
+        self.lock = threading.Lock()
+
+    def reserve(self, nbytes: int, owner: object = None):
+        with self.lock:
+            self.used += nbytes
+            self.owners[owner] = self.owners.get(owner, 0) + nbytes
+
+    def release(self, nbytes: int, owner: object = None):
+        with self.lock:
+            self.used = max(0, self.used - nbytes)
+            held = self.owners.pop(owner, 0) - nbytes
+            if held > 0:
+                self.owners[owner] = held
+
+    def exceeded(self) -> bool:
+        return bool(self.limit) and self.used > self.limit
+
+    def over_share(self, owner: object = None) -> bool:
+        """Whether the limit is exceeded and ``owner`` holds more than its share."""
+        with self.lock:
+            if not self.exceeded():
+                return False
+            return self.owners.get(owner, 0) > self.limit / len(self.owners)
+
+
+process_budget = MemoryBudget()
+
+
+class SpillJournal:
+    """Append-only local file of packet batches, taken back in the order they were appended.
+
+    Each record is a header followed by the columns and the payload of one
+    batch. The file is truncated whenever every record has been taken back,
+    so it only grows while the writer is behind.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        self.lock = threading.Lock()
+        # (offset, size, packets, received ts of the first packet) of pending records
+        self.records: deque[tuple[int, int, int, float]] = deque()
+        self.write_offset = 0
+        self.spilled_bytes = 0
+        self.spilled_packets = 0
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    @property
+    def pending_bytes(self) -> int:
+        with self.lock:
+            return sum(size for _, size, _, _ in self.records)
+
+    @property
+    def pending_packets(self) -> int:
+        with self.lock:
+            return sum(packets for _, _, packets, _ in self.records)
+
+    def oldest_received_ts(self) -> float:
+        """Received ts of the oldest packet not taken back yet, or None."""
+        with self.lock:
+            return self.records[0][3] if self.records else None
+
+    def append(self, batch: PacketBatch):
+        if not len(batch):
+            return
+        header = RECORD_HEADER.pack(len(batch), batch.time_base.numerator,
+                                    batch.time_base.denominator, len(batch.payload))
+        buffers = [header, batch.pts, batch.durations, batch.received_ts, batch.sizes,
+                   batch.payload]
+        with self.lock:
+            os.lseek(self.fd, self.write_offset, os.SEEK_SET)
+            size = writev_all(self.fd, buffers)
+            self.records.append((self.write_offset, size, len(batch),
+                                 float(batch.received_ts[0])))
+            self.write_offset += size
+            self.spilled_bytes += len(batch.payload)
+            self.spilled_packets += len(batch)
+
+    def pop(self, session: RecordingSession) -> PacketBatch:
+        """Read back the oldest record, or return None if there is none."""
+        with self.lock:
+            if not self.records:
+                return None
+            offset, size, _, _ = self.records.popleft()
+            data = os.pread(self.fd, size, offset)
+            if len(data) != size:
+                raise IOError(f"Short read from spill journal {self.path}")
+            if not self.records:
+                os.ftruncate(self.fd, 0)
+                self.write_offset = 0
+        count, numerator, denominator, payload_size = RECORD_HEADER.unpack_from(data)
+        columns = []
+        position = RECORD_HEADER.size
+        for dtype in (np.int64, np.int64, np.float64, np.int64):
+            columns.append(np.frombuffer(data, dtype=dtype, count=count, offset=position))
+            position += count * 8
+        payload = memoryview(data)[position:position + payload_size]
+        return PacketBatch(session, Fraction(numerator, denominator), *columns, payload)
+
+    def close(self):
+        os.close(self.fd)
+        if self.records:
+            logger.warning("Closing spill journal %s with %s records pending",
+                           self.path, len(self.records))
+        else:
+            self.path.unlink(missing_ok=True)
@@ -0,0 +1,364 @@
+import bisect
+from dataclasses import dataclass, field
+from fractions import Fraction
+import logging
+import mmap
+from pathlib import Path
+import zlib
+
+import numpy as np
+
+from streamrec.config import RecordingConfig
+
+from .index import GAP_TOLERANCE, IndexedSegment, IndexWriter, SegmentIndex
+from .frames import NATIVE_PARSERS, frame_format
+from .packet import PacketBatch
+from .retention import RetentionPolicy, RetentionWorker
+from .segmentfile import SegmentFile
+from .session import RecordingSession
+
+logger = logging.getLogger(__name__)
+
+# Seconds of the merged timeline processed at a time. Memory is bounded by
+# the frames of every replica over one window
+WINDOW_SECONDS = 600
+# Largest difference, in seconds, between the timestamps two replicas give
+# the same frame. Frames are read this far beyond each window
+MAX_OFFSET = 5
+# Timestamps closer than this, in seconds, are the same
+EPSILON = 0.001
+
+
+class UnsupportedFormat(Exception):
+    """A replica segment that is neither MP3 nor ADTS."""
+
+
+@dataclass(eq=False)
+class Replica:
+    """The segments of one recording session in one of the source folders."""
+    index: SegmentIndex
+    session: str
+    # Added to the timestamps of the replica to put them on the merged timeline
+    offset: float = 0.0
+    # Seconds of the merged timeline taken from this replica
+    used: float = 0.0
+
+
+@dataclass
+class Frames:
+    """The frames of a replica over a window, column-wise, with their bytes."""
+    ts: np.ndarray
+    samples: np.ndarray
+    sizes: np.ndarray
+    hashes: np.ndarray
+    payload: bytes
+    sample_rate: int
+    fmt: str = None
+
+    def __post_init__(self):
+        self.ends = self.ts + self.samples / self.sample_rate if len(self.ts) else self.ts
+        self.starts = np.zeros(len(self.sizes), dtype=np.int64)
+        np.cumsum(self.sizes[:-1], out=self.starts[1:])
+        # Frames that do not follow the previous one
+        self.breaks = np.flatnonzero(self.ts[1:] - self.ends[:-1] > GAP_TOLERANCE) + 1
+
+    def __len__(self) -> int:
+        return len(self.ts)
+
+    def shift(self, seconds: float):
+        self.ts += seconds
+        self.ends += seconds
+
+    def run_end(self, i: int, end: float) -> int:
+        """End of the run of consecutive frames from ``i``, cut at frames starting at ``end``."""
+        following = self.breaks[np.searchsorted(self.breaks, i, side="right"):]
+        stop = int(following[0]) if len(following) else len(self)
+        return min(stop, int(np.searchsorted(self.ts, end - EPSILON)))
+
+
+def read_frames(replica: Replica, start: float, end: float, sample_rate: int = None,
+                fmt: str = None) -> Frames:
+    """Frames of a replica playing in ``[start, end)`` of the merged timeline.
+
+    Segments are split into frames as MP3 or ADTS, by the header of their
+    first frame, and raise UnsupportedFormat if it is neither. Frame
+    timestamps add up from the last checkpoint, and jump at the gaps
+    recorded in the index. Segments in another format than ``fmt``, and
+    frames at another sample rate than ``sample_rate``, are left out.
+    """
+    ts, samples, sizes, hashes = [], [], [], []
+    payload = bytearray()
+    raw_start, raw_end = start - replica.offset, end - replica.offset
+    for segment in replica.index.session_segments(replica.session, raw_start, raw_end):
+        frame_ts, offset = replica.index.checkpoint_before(segment, raw_start)
+        checkpoints = {o: t for t, o in replica.index.checkpoints(segment) if o > offset}
+        gaps = replica.index.gaps(frame_ts - EPSILON, segment.end_ts, replica.session)
+        gap = 0
+        try:
+            with open(segment.path, "rb") as f, \
+                    mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                segment_fmt = frame_format(data, offset)
+                if segment_fmt is None:
+                    raise UnsupportedFormat(f"{segment.path} is neither MP3 nor ADTS")
+                if fmt and segment_fmt != fmt:
+                    logger.warning("Skipping %s segment %s in a %s merge", segment_fmt,
+                                   segment.path, fmt)
+                    continue
+                fmt = segment_fmt
+                parse = NATIVE_PARSERS[fmt]
+                while frame_ts < raw_end:
+                    header = parse(data, offset)
+                    if not header or offset + header.length > len(data):
+                        break
+                    while gap < len(gaps) and gaps[gap][0] <= frame_ts + EPSILON:
+                        if gaps[gap][0] >= frame_ts - EPSILON:
+                            frame_ts += gaps[gap][1]
+                        gap += 1
+                    frame_ts = checkpoints.get(offset, frame_ts)
+                    sample_rate = sample_rate or header.sample_rate
+                    if (frame_ts + header.duration > raw_start
+                            and header.sample_rate == sample_rate):
+                        frame = data[offset:offset + header.length]
+                        ts.append(frame_ts)
+                        samples.append(header.samples)
+                        sizes.append(header.length)
+                        hashes.append(zlib.crc32(frame))
+                        payload += frame
+                    offset += header.length
+                    frame_ts += header.duration
+        except (OSError, ValueError) as e:
+            logger.warning("Could not read segment %s: %s", segment.path, e)
+    return Frames(np.array(ts, dtype=np.float64) + replica.offset,
+                  np.array(samples, dtype=np.int64), np.array(sizes, dtype=np.int64),
+                  np.array(hashes, dtype=np.uint32), bytes(payload), sample_rate or 1, fmt)
+
+
+@dataclass
+class MergeResult:
+    segments: int = 0
+    # Seconds of audio in the merged session, and seconds no replica had
+    seconds: float = 0.0
+    gap_seconds: float = 0.0
+    # Seconds taken from each replica session
+    used: dict[str, float] = field(default_factory=dict)
+    deleted: int = 0
+
+
+# pylint: disable=too-many-instance-attributes
+class Merger:
+    """Merges the recordings of redundant recorders of a stream into one session.
+
+    Every session of the source folders (or the ``sessions`` given) is a
+    replica. The merged session follows one replica while it has audio. Where
+    it has a gap, it continues with the replica holding the frame that follows
+    the last one written. That frame is found by its content hash near its
+    timestamp, which also aligns the clocks of the two replicas. Replicas
+    with no matching frame continue at their own timestamps. The result is
+    written to ``output_folder`` as a new session, with its index.
+    Replica segments are only deleted once the merged session has all of
+    their audio.
+
+    Replicas are read in windows of WINDOW_SECONDS, so memory does not
+    depend on the length of the recordings.
+    """
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, sources: list[str], output_folder: str, sessions: list[str] = None,
+                 segment_duration: int = 60, durability: str = "on-close",
+                 window: float = WINDOW_SECONDS):
+        self.indexes = [SegmentIndex(folder) for folder in sources]
+        self.replicas = [Replica(index, session)
+                         for index in self.indexes for session, _, _ in index.sessions()
+                         if not sessions or session in sessions]
+        self.window = window
+        self.config = RecordingConfig(url="", output_folder=output_folder,
+                                      segment_duration=segment_duration, durability=durability)
+        self.session = RecordingSession(self.config)
+        self.index = IndexWriter(output_folder, self.session.uuid)
+        self.segment: SegmentFile = None
+        self.sample_rate: int = None
+        self.fmt: str = None
+        self.current: Replica = None
+        self.ts_out: float = None
+        self.last_hash: int = None
+        # [start, end] of the runs of audio written, in order
+        self.written: list[list[float]] = []
+        self.result = MergeResult()
+
+    def close(self):
+        for index in self.indexes:
+            index.close()
+
+    def span(self) -> tuple[float, float]:
+        """Start and end of the closed segments of all the replicas."""
+        spans = [(start, end) for index in self.indexes for session, start, end in index.sessions()
+                 if any(r.index is index and r.session == session for r in self.replicas)]
+        if not spans:
+            return None, None
+        return min(s for s, _ in spans), max(e for _, e in spans)
+
+    def run(self, start: float = None, end: float = None,
+            delete_sources: bool = False) -> MergeResult:
+        """Merge ``[start, end)`` (by default, everything), then delete the
+        replica segments inside it that were merged if ``delete_sources``."""
+        first, last = self.span()
+        start = first if start is None else start
+        end = last if end is None else end
+        if start is None or end is None or end <= start:
+            return self.result
+        self.session.adjusted_ts_start = start
+        self.ts_out = start
+        Path(self.config.output_folder).mkdir(parents=True, exist_ok=True)
+        try:
+            for window_start in np.arange(start, end, self.window):
+                window_end = min(window_start + self.window, end)
+                frames = {}
+                for replica in self.replicas:
+                    frames[replica] = read_frames(replica, window_start - MAX_OFFSET,
+                                                  window_end + MAX_OFFSET, self.sample_rate,
+                                                  self.fmt)
+                    if len(frames[replica]) and self.sample_rate is None:
+                        self.sample_rate = frames[replica].sample_rate
+                        self.fmt = frames[replica].fmt
+                self.merge_window(frames, window_end)
+            self.result.gap_seconds = end - start - self.result.seconds
+        finally:
+            self.close_segment()
+            self.index.close()
+        self.result.used = {r.session: r.used for r in self.replicas}
+        if delete_sources and not self.result.segments:
+            logger.warning("Nothing was merged, keeping the sources")
+        elif delete_sources:
+            for replica in self.replicas:
+                for segment in replica.index.session_segments(replica.session, start, end):
+                    if (segment.start_ts >= start and segment.end_ts <= end
+                            and self.merged(replica, segment)):
+                        self.result.deleted += self.delete(replica.index, segment)
+        return self.result
+
+    def merged(self, replica: Replica, segment: IndexedSegment) -> bool:
+        """Whether the merged session has all the audio of a replica segment,
+        leaving out the gaps recorded in it."""
+        parts, ts = [], segment.start_ts
+        for gap_ts, duration in replica.index.gaps(segment.start_ts, segment.end_ts,
+                                                   replica.session):
+            if duration > 0:
+                parts.append((ts, gap_ts))
+                ts = gap_ts + duration
+        parts.append((ts, segment.end_ts))
+        return all(self.covers(s + replica.offset, e + replica.offset)
+                   for s, e in parts if e - s > GAP_TOLERANCE)
+
+    def covers(self, start: float, end: float) -> bool:
+        """Whether one run of written audio spans ``[start, end]``."""
+        i = bisect.bisect_right(self.written, [start + GAP_TOLERANCE, float("inf")]) - 1
+        return i >= 0 and self.written[i][1] >= end - GAP_TOLERANCE
+
+    @staticmethod
+    def delete(index: SegmentIndex, segment: IndexedSegment) -> bool:
+        return RetentionWorker.expire(RetentionPolicy(str(index.folder)), index, segment)
+
+    def merge_window(self, frames: dict[Replica, Frames], end: float):
+        while self.ts_out < end - EPSILON:
+            if self.current:
+                f = frames[self.current]
+                i = int(np.searchsorted(f.ends, self.ts_out + EPSILON, side="right"))
+                if (i < len(f) and f.ts[i] >= self.ts_out - EPSILON
+                        and f.ts[i] - self.ts_out <= GAP_TOLERANCE):
+                    stop = f.run_end(i, end)
+                    if stop <= i:
+                        return
+                    self.write(self.current, f, i, stop)
+                    continue
+            if not self.switch(frames, end):
+                return
+
+    def switch(self, frames: dict[Replica, Frames], end: float) -> bool:
+        """Continue with the replica that has the audio after ``ts_out``.
+        Returns False if none has any before ``end``."""
+        candidates = []
+        for replica, f in frames.items():
+            k = self.find_last_written(f) if replica is not self.current else None
+            if k is not None:
+                # Align the replica on the frame both have, and continue after it
+                delta = self.ts_out - float(f.ends[k])
+                f.shift(delta)
+                replica.offset += delta
+                k += 1
+                follows = k not in f.breaks
+            else:
+                k = int(np.searchsorted(f.ends, self.ts_out + EPSILON, side="right"))
+                follows = False
+            if k < len(f) and f.ts[k] < end:
+                candidates.append((not follows, float(f.ts[k]), replica is not self.current,
+                                   replica))
+        if not candidates:
+            return False
+        _, start, _, replica = min(candidates, key=lambda c: c[:3])
+        if start < self.ts_out - EPSILON:
+            if self.result.seconds:
+                # Starts before the last frame written ends: follow it
+                frames[replica].shift(self.ts_out - start)
+                replica.offset += self.ts_out - start
+            else:
+                self.ts_out = start
+        elif start > self.ts_out + GAP_TOLERANCE:
+            logger.info("No replica has %.3f seconds at %.3f", start - self.ts_out, self.ts_out)
+            self.ts_out = start
+        self.current = replica
+        return True
+
+    def find_last_written(self, f: Frames) -> int:
+        """Index of the frame written last in another replica, if it has it."""
+        if self.last_hash is None:
+            return None
+        matches = np.flatnonzero(f.hashes == self.last_hash)
+        if not len(matches):
+            return None
+        distances = np.abs(f.ends[matches] - self.ts_out)
+        if np.min(distances) > MAX_OFFSET:
+            return None
+        return int(matches[np.argmin(distances)])
+
+    def write(self, replica: Replica, f: Frames, i: int, stop: int):
+        """Append frames ``[i, stop)`` of a replica to the merged session."""
+        base = self.session.adjusted_ts_start
+        pts = np.zeros(stop - i, dtype=np.int64)
+        np.cumsum(f.samples[i:stop - 1], out=pts[1:])
+        pts += round((float(f.ts[i]) - base) * self.sample_rate)
+        payload = memoryview(f.payload)[f.starts[i]:f.starts[stop - 1] + f.sizes[stop - 1]]
+        batch = PacketBatch(self.session, Fraction(1, self.sample_rate), pts,
+                            f.samples[i:stop], f.ts[i:stop], f.sizes[i:stop], payload)
+        for segment_ts, packets in batch.split_by_segment():
+            if self.segment and self.segment.segment_ts != segment_ts:
+                self.close_segment()
+            if not self.segment:
+                self.segment = SegmentFile(self.session, segment_ts, index=self.index)
+            self.segment.write(packets)
+        end_ts = base + int(pts[-1] + f.samples[stop - 1]) / self.sample_rate
+        run_start = max(self.ts_out, float(f.ts[i]))
+        seconds = end_ts - run_start
+        if self.written and run_start - self.written[-1][1] <= GAP_TOLERANCE:
+            self.written[-1][1] = end_ts
+        else:
+            self.written.append([run_start, end_ts])
+        replica.used += seconds
+        self.result.seconds += seconds
+        self.ts_out = end_ts
+        self.last_hash = int(f.hashes[stop - 1])
+
+    def close_segment(self):
+        if self.segment:
+            self.segment.close()
+            self.segment = None
+            self.result.segments += 1
+
+
+def merge(sources: list[str], output_folder: str, start: float = None, end: float = None,
+          sessions: list[str] = None, delete_sources: bool = False, **kwargs) -> MergeResult:
+    """Merge the replicas in ``sources`` into one session in ``output_folder``."""
+    merger = Merger(sources, output_folder, sessions, **kwargs)
+    try:
+        return merger.run(start, end, delete_sources)
+    finally:
+        merger.close()
@@ -0,0 +1,203 @@
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import logging
+import threading
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds of the write time buckets, in seconds
+WRITE_SECONDS_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1,
+                         2.5, 5, 10)
+# Upper bounds of the packets per flush buckets
+FLUSH_PACKETS_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 4096)
+
+# Stats key: (metric name, type, help, labels)
+METRICS = {
+    "bytes": ("streamrec_read_bytes_total", "counter",
+              "Bytes read from the network", ""),
+    "cpu": ("streamrec_cpu_seconds_total", "counter",
+            "CPU time spent demuxing and writing", ""),
+    "packets": ("streamrec_packets_total", "counter", "Packets demuxed", ""),
+    "packet_bytes": ("streamrec_packet_bytes_total", "counter",
+                     "Payload bytes of the packets demuxed", ""),
+    "corrupt": ("streamrec_dropped_packets_total", "counter",
+                "Packets dropped by the reader", 'reason="corrupt"'),
+    "empty": ("streamrec_dropped_packets_total", "counter",
+              "Packets dropped by the reader", 'reason="empty"'),
+    "queue_depth": ("streamrec_queue_depth", "gauge",
+                    "Packets waiting to be written, in memory and spilled", ""),
+    "spilled_bytes": ("streamrec_spilled_bytes_total", "counter",
+                      "Bytes spilled to the journal while the writer was behind", ""),
+    "replay_lag": ("streamrec_replay_lag_seconds", "gauge",
+                   "Age of the oldest packet in the spill journal", ""),
+    "flush_packets": ("streamrec_flush_packets", "histogram", "Packets written per flush", ""),
+    "write_seconds": ("streamrec_write_seconds", "histogram", "Time to write one flush", ""),
+    "segments_closed": ("streamrec_segments_closed_total", "counter", "Segments closed", ""),
+    "reconnects": ("streamrec_reconnects_total", "counter", "Reconnects to the stream", ""),
+    "gap": ("streamrec_gap_seconds_total", "counter",
+            "Seconds of audio missed while disconnected", ""),
+    "clock_drift": ("streamrec_clock_drift_seconds", "gauge",
+                    "How far received times ran ahead of the stream timestamps since the start",
+                    ""),
+}
+
+
+class Histogram:
+    """Cumulative histogram with fixed buckets, updated by a single thread."""
+
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def snapshot(self) -> dict:
+        return {"buckets": self.buckets, "counts": list(self.counts), "sum": self.sum}
+
+
+# pylint: disable=too-many-instance-attributes
+class StreamMetrics:
+    """Counters of one stream.
+
+    Every counter has a single owner, the reader or the writer, which
+    updates it without a lock. Collectors read the values as they are.
+    """
+
+    def __init__(self):
+        # Reader
+        self.packets = 0
+        self.packet_bytes = 0
+        self.corrupt = 0
+        self.empty = 0
+        # Writer
+        self.flush_packets = Histogram(FLUSH_PACKETS_BUCKETS)
+        self.write_seconds = Histogram(WRITE_SECONDS_BUCKETS)
+        self.segments_closed = 0
+        self.first_clock_offset: float = None
+        self.clock_drift = 0.0
+
+    def clock_offset(self, offset: float):
+        """Record the smallest ``received_ts - ts`` of a flush, which only
+        changes when the two clocks drift apart."""
+        if self.first_clock_offset is None:
+            self.first_clock_offset = offset
+        self.clock_drift = offset - self.first_clock_offset
+
+    def snapshot(self) -> dict:
+        return {
+            "packets": self.packets,
+            "packet_bytes": self.packet_bytes,
+            "corrupt": self.corrupt,
+            "empty": self.empty,
+            "flush_packets": self.flush_packets.snapshot(),
+            "write_seconds": self.write_seconds.snapshot(),
+            "segments_closed": self.segments_closed,
+            "clock_drift": self.clock_drift,
+        }
+
+
+def escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_value(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render(stats: dict[str, dict]) -> str:
+    """Prometheus text format of per-stream stats, as returned by Engine.stats."""
+    lines = []
+    declared = set()
+    for key, (name, kind, help_text, labels) in METRICS.items():
+        for stream, values in stats.items():
+            if key not in values:
+                continue
+            if name not in declared:
+                declared.add(name)
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+            stream_labels = f'stream="{escape_label(str(stream))}"'
+            if labels:
+                stream_labels += "," + labels
+            value = values[key]
+            if kind != "histogram":
+                lines.append(f"{name}{{{stream_labels}}} {format_value(value)}")
+                continue
+            cumulative = 0
+            for bound, count in zip(value["buckets"] + ("+Inf",), value["counts"]):
+                cumulative += count
+                lines.append(f'{name}_bucket{{{stream_labels},le="{bound}"}} {cumulative}')
+            lines.append(f"{name}_sum{{{stream_labels}}} {format_value(value['sum'])}")
+            lines.append(f"{name}_count{{{stream_labels}}} {cumulative}")
+    return "\n".join(lines) + "\n"
+
+
+class MetricsServer:
+    """Serves ``render(source())`` as a Prometheus endpoint from a background thread."""
+
+    def __init__(self, source: Callable[[], dict], host: str = "127.0.0.1", port: int = 9108):
+        self.source = source
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):  # pylint: disable=invalid-name
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = render(server.source()).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self.port = self.httpd.server_address[1]
+        self.thread: threading.Thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name="metrics",
+                                       daemon=True)
+        self.thread.start()
+        logger.info("Serving metrics on port %s", self.port)
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class MetricsReporter:
+    """Calls ``callback(source())`` every ``interval`` seconds from a background thread."""
+
+    def __init__(self, source: Callable[[], dict], callback: Callable[[dict], None],
+                 interval: float = 10):
+        self.source = source
+        self.callback = callback
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread: threading.Thread = None
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.callback(self.source())
+            # pylint: disable=broad-except
+            except Exception:
+                logger.exception("Metrics callback failed")
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name="metrics-reporter", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread:
+            self.thread.join(5)
@@ -1,5 +1,8 @@
+from array import array
+from fractions import Fraction
 from time import time
 import av
+import numpy as np
 
 from .session import RecordingSession
 
@@ -23,3 +26,120 @@ class PacketWithReceivedTS:
         ts = self.get_adjusted_ts()
         segment_duration = self.session.config.segment_duration
         return int(ts // segment_duration) * segment_duration
+
+
+class PacketBatch:
+    """Packets of one session stored column-wise.
+
+    pts, durations (in ``time_base`` units), received timestamps and sizes are
+    NumPy arrays, and the payloads of all packets are one contiguous buffer.
+    Slicing a batch returns a view sharing the same memory.
+    """
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, session: RecordingSession, time_base: Fraction,
+                 pts: np.ndarray, durations: np.ndarray, received_ts: np.ndarray,
+                 sizes: np.ndarray, payload: memoryview):
+        self.session = session
+        self.time_base = time_base
+        self.pts = pts
+        self.durations = durations
+        self.received_ts = received_ts
+        self.sizes = sizes
+        self.payload = payload
+
+    def __len__(self) -> int:
+        return len(self.pts)
+
+    def __getitem__(self, index: slice) -> "PacketBatch":
+        start, stop, _ = index.indices(len(self))
+        offsets = self.offsets()
+        payload_start = int(offsets[start]) if start < len(self) else len(self.payload)
+        payload_stop = int(offsets[stop]) if stop < len(self) else len(self.payload)
+        return PacketBatch(self.session, self.time_base,
+                           self.pts[start:stop], self.durations[start:stop],
+                           self.received_ts[start:stop], self.sizes[start:stop],
+                           self.payload[payload_start:payload_stop])
+
+    @property
+    def nbytes(self) -> int:
+        return len(self.payload)
+
+    def offsets(self) -> np.ndarray:
+        """Start offset of each packet within the payload."""
+        offsets = np.zeros(len(self), dtype=np.int64)
+        np.cumsum(self.sizes[:-1], out=offsets[1:])
+        return offsets
+
+    def seconds_since_start(self) -> np.ndarray:
+        return self.pts * float(self.time_base)
+
+    def adjusted_ts(self) -> np.ndarray:
+        return self.session.to_ts(self.seconds_since_start())
+
+    def end_ts(self) -> np.ndarray:
+        """Adjusted timestamp at which each packet ends."""
+        return self.adjusted_ts() + self.durations * float(self.time_base)
+
+    def guess_session_start(self) -> float:
+        return float(np.min(self.received_ts - self.seconds_since_start()))
+
+    def split_by_segment(self) -> list[tuple[int, "PacketBatch"]]:
+        """Split the batch at segment boundaries in one pass.
+
+        Returns ``(segment_ts, batch)`` pairs in order. pts must not decrease
+        within the batch.
+        """
+        if not len(self):
+            return []
+        duration = self.session.config.segment_duration
+        ts = self.adjusted_ts()
+        first = int(ts[0] // duration) * duration
+        last = int(ts[-1] // duration) * duration
+        boundaries = np.arange(first + duration, last + duration, duration)
+        splits = np.searchsorted(ts, boundaries, side="left")
+        starts = [0, *splits.tolist()]
+        stops = [*splits.tolist(), len(self)]
+        segment_starts = [first, *boundaries.tolist()]
+        return [(int(segment_ts), self[start:stop])
+                for segment_ts, start, stop in zip(segment_starts, starts, stops)
+                if stop > start]
+
+
+class PacketBatchBuilder:
+    """Accumulates demuxed packets into a PacketBatch without keeping the av.Packet objects."""
+
+    def __init__(self, session: RecordingSession):
+        self.session = session
+        self.time_base: Fraction = None
+        self.pts = array("q")
+        self.durations = array("q")
+        self.received_ts = array("d")
+        self.sizes = array("q")
+        self.payload = bytearray()
+
+    def __len__(self) -> int:
+        return len(self.pts)
+
+    @property
+    def nbytes(self) -> int:
+        return len(self.payload)
+
+    def append(self, packet: av.Packet, received_ts: float = None,
+               pts: int = None, duration: int = None):
+        """Append a packet, optionally overriding its pts and duration (in ``time_base`` units)."""
+        if self.time_base is None:
+            self.time_base = packet.time_base
+        self.pts.append(packet.pts if pts is None else pts)
+        self.durations.append((packet.duration or 0) if duration is None else duration)
+        self.received_ts.append(time() if received_ts is None else received_ts)
+        self.sizes.append(packet.size)
+        self.payload += packet
+
+    def build(self) -> PacketBatch:
+        return PacketBatch(self.session, self.time_base,
+                           np.frombuffer(self.pts, dtype=np.int64),
+                           np.frombuffer(self.durations, dtype=np.int64),
+                           np.frombuffer(self.received_ts, dtype=np.float64),
+                           np.frombuffer(self.sizes, dtype=np.int64),
+                           memoryview(self.payload))
@@ -1,21 +1,42 @@
-from itertools import groupby
 import logging
 from pathlib import Path
-import re
 import signal
+import tempfile
 import time
 import threading
 import av
 import av.container
 import av.error
+import numpy as np
 
-from streamrec.config import RecordingConfig
+from streamrec.config import RecordingConfig, parse_durability
 
-from .packet import PacketWithReceivedTS
+from .packet import PacketBatch, PacketBatchBuilder
 from .segmentfile import SegmentFile
+from .clock import ClockEstimator
+from .compaction import CompactionPolicy, Compactor
+from .features import FeatureExtractor
+from .index import INDEX_FILENAME, IndexWriter
+from .ingest import (NATIVE_PARSERS, READ_SIZE, NativeDemuxer, content_type_format,
+                     is_native_url, open_stream)
+from .journal import MemoryBudget, SpillJournal, process_budget, queued_bytes
+from .metrics import StreamMetrics
+from .recovery import recover_open_segments
+from .relay import Relay
+from .retention import RetentionPolicy, RetentionWorker
 from .session import RecordingSession
+from .storage import UploadPolicy, Uploader
+from .timeline import Timeline, backoff_delay
+from .trace import Tracer, process_tracer
+from .tracks import select_tracks, track_config, track_label
 
 logger = logging.getLogger("recorder")
+reader_logger = logging.getLogger("recorder.reader")
+
+# Packets of all the tracks demuxed, or seconds waited, before each track
+# queues its packets as one batch
+TRACK_BATCH_PACKETS = 64
+TRACK_BATCH_SECONDS = 0.05
 
 
 def format_ts(ts: float) -> str:
@@ -30,8 +51,32 @@ class Recorder:
         self.config = config
         self.session = RecordingSession(config)
         self.current_segment: SegmentFile = None
-        self.queue: list[PacketWithReceivedTS] = []
+        self.queue = PacketBatchBuilder(self.session)
         self.queue_lock = threading.Lock()
+        self.queue_cond = threading.Condition(self.queue_lock)
+        self.queue_since: float = None
+        self.queue_segment_ts: int = None
+        self.boundary_crossed = False
+        self.budget: MemoryBudget = process_budget
+        self.tracer: Tracer = process_tracer
+        self.journal: SpillJournal = None
+        self.on_flush_due = None
+        self.metrics = StreamMetrics()
+        self.relay: Relay = None
+        self.index = IndexWriter(config.output_folder, self.session.uuid,
+                                 config.checksum_block) if config.index else None
+        self.retention: RetentionWorker = None
+        self.compactor: Compactor = None
+        self.features: FeatureExtractor = None
+        self.uploader: Uploader = None
+        # With config.tracks, the recorder of each track by stream index. The
+        # reader of this recorder feeds them, and it writes nothing itself
+        self.tracks: dict[int, Recorder] = {}
+        self.timeline = Timeline(match_packets=config.reconnect_attempts != 0)
+        self.clock = ClockEstimator(skew=config.estimate_skew)
+        self.disconnected_at: float = None
+        self.last_resume_seconds: float = None
+        self.stopped = threading.Event()
         self.stopping = False
         self.reader_finished = False
         self.container: av.container.InputContainer = None
@@ -41,47 +86,353 @@ class Recorder:
         self.reader_unhandled_exception: Exception = None
 
     def close_open_files(self):
-        path = Path(self.config.output_folder)
-        for f in path.glob("*.tmp"):
-            # renname without tmp
-            logger.warning("Found open file %s, renaming", f)
-            new_name = re.sub(r"\.tmp$", "", f.name)
-            f.rename(new_name)
-
-    def calc_adjusted_ts_start(self, packets: list[PacketWithReceivedTS]):
+        sync_on_close, _ = parse_durability(self.config.durability)
+        if self.config.tracks:
+            for index in sorted(Path(self.config.output_folder).glob(f"*/{INDEX_FILENAME}")):
+                recover_open_segments(str(index.parent), sync=sync_on_close)
+            return
+        recover_open_segments(self.config.output_folder, sync=sync_on_close)
+
+    def outputs(self) -> list["Recorder"]:
+        """The recorders that write segments: those of the tracks with
+        config.tracks, or this one."""
+        return list(self.tracks.values()) if self.config.tracks else [self]
+
+    def add_track(self, stream: av.stream.Stream) -> "Recorder":
+        """Start recording a track of the stream into its own sub-folder, with
+        its own timeline, clock estimate, segments and writer thread."""
+        track = Recorder(track_config(self.config, track_label(stream)))
+        track.session.ts_start = self.session.ts_start
+        track.budget = self.budget
+        track.tracer = self.tracer
+        track.features = self.features
+        track.uploader = self.uploader
+        # The relay serves the first track
+        if self.relay and not self.tracks:
+            track.relay, self.relay = self.relay, None
+        self.add_policies(track.config)
+        track.prepare_output()
+        self.tracks[stream.index] = track
+        logger.info("Recording track %s into %s", stream.index, track.config.output_folder)
+        track.writer_thread = threading.Thread(target=track.file_writer)
+        track.writer_thread.start()
+        return track
+
+    def calc_adjusted_ts_start(self, packets: PacketBatch):
         s = self.session
-        s.adjusted_ts_start = min(p.guess_session_start() for p in packets)
+        s.clock_anchor = float(packets.seconds_since_start()[0])
+        s.adjusted_ts_start = self.clock.offset(s.clock_anchor)
         buffer_secs = self.session.ts_start - s.adjusted_ts_start
         logger.info("Adjusted TS start: %s, buffer: %.2f seconds",
                     format_ts(s.adjusted_ts_start), buffer_secs)
 
-    def stream_reader(self):
+    def update_clock(self, packets: PacketBatch):
+        """Refine the clock estimate with the packets about to be written, and
+        bend the timestamps from the first of them on towards it."""
+        seconds = packets.seconds_since_start()
+        self.clock.observe(seconds, packets.received_ts)
+        if self.session.adjusted_ts_start is None:
+            self.calc_adjusted_ts_start(packets)
+            return
+        anchor = float(seconds[0])
+        self.session.rebase(anchor, self.clock.slew(anchor, float(self.session.to_ts(anchor))))
+
+    def clock_ready(self) -> bool:
+        """Whether the first packets can be timestamped: once the initial burst
+        is over, or initial_writer_delay seconds after the first packet.
+
+        Must be called with queue_lock held.
+        """
+        if self.session.adjusted_ts_start is not None or self.clock.settled:
+            return True
+        first = self.clock.first_received
+        return first is not None and time.time() - first >= self.config.initial_writer_delay
+
+    def accept(self, packet: av.Packet) -> bool:
+        """Whether a demuxed packet is queued, counting the dropped ones."""
+        if packet.is_corrupt:
+            reader_logger.warning("Corrupt packet")
+            self.metrics.corrupt += 1
+            return False
+        if packet.size == 0:
+            reader_logger.warning("Packet with size 0")
+            self.metrics.empty += 1
+            return False
+        return True
+
+    def enqueue(self, packet: av.Packet):
+        if not self.accept(packet):
+            return
+        self.metrics.packets += 1
+        self.metrics.packet_bytes += packet.size
+        self.enqueue_entries(self.timeline.add(packet, time.time()))
+
+    def enqueue_many(self, packets: list):
+        """Enqueue packets received together, such as the frames of one read."""
+        received_ts = time.time()
+        entries = []
+        for packet in packets:
+            entries += self.timeline.add(packet, received_ts)
+        self.metrics.packets += len(packets)
+        self.metrics.packet_bytes += sum(packet.size for packet in packets)
+        self.enqueue_entries(entries)
+
+    def end_connection(self):
+        self.enqueue_entries(self.timeline.end_connection())
+        self.disconnected_at = time.monotonic()
+
+    def enqueue_entries(self, entries: list[tuple[av.Packet, int, int, float]]):
+        if not entries:
+            return
+        if self.disconnected_at is not None:
+            self.last_resume_seconds = time.monotonic() - self.disconnected_at
+            self.disconnected_at = None
+            logger.info("Resumed %.3f seconds after disconnect", self.last_resume_seconds)
+        trace = self.tracer.trace("enqueue", stream=self.config.station, packets=len(entries))
+        spilled = None
+        with trace, trace.lock("queue_lock", self.queue_lock):
+            was_due = self.flush_due()
+            if not self.queue:
+                self.queue_since = time.monotonic()
+                self.queue.time_base = self.timeline.time_base
+            self.budget.reserve(queued_bytes(len(entries), sum(p.size for p, *_ in entries)),
+                                self)
+            for packet, pts, duration, received_ts in entries:
+                self.queue.append(packet, received_ts, pts, duration)
+                if not self.clock.settled:
+                    self.clock.arrived(pts * self.timeline.seconds_per_tick, received_ts)
+            if self.session.adjusted_ts_start is not None:
+                # pts never decrease, so a boundary was crossed if the last
+                # packet is in another segment than the first one queued
+                segment_duration = self.config.segment_duration
+                for pts in (entries[0][1], entries[-1][1]):
+                    ts = self.session.to_ts(pts * self.timeline.seconds_per_tick)
+                    segment_ts = int(ts // segment_duration) * segment_duration
+                    if self.queue_segment_ts is None:
+                        self.queue_segment_ts = segment_ts
+                    elif segment_ts != self.queue_segment_ts:
+                        self.boundary_crossed = True
+            if self.over_memory_limit():
+                spilled = self.reset_queue().build()
+            # Wake the writer on the first packet, so it can wait for the latency
+            # deadline, and whenever a size or boundary trigger fires
+            elif len(self.queue) == len(entries) or (self.flush_due() and not was_due):
+                self.wake_writer()
+        if spilled is not None:
+            self.spill(spilled)
+        if self.relay:
+            for packet, *_ in entries:
+                self.relay.write(packet)
+
+    def queue_memory(self) -> int:
+        return queued_bytes(len(self.queue), self.queue.nbytes)
+
+    def over_memory_limit(self) -> bool:
+        """Must be called with queue_lock held."""
+        limit = self.config.max_queue_bytes
+        return bool(self.queue) and (bool(limit) and self.queue_memory() > limit
+                                     or self.budget.over_share(self))
+
+    def reset_queue(self) -> PacketBatchBuilder:
+        """Swap the queue for an empty one and return it. Must be called with queue_lock held."""
+        queue = self.queue
+        self.budget.release(self.queue_memory(), self)
+        self.queue = PacketBatchBuilder(self.session)
+        self.queue_since = None
+        self.queue_segment_ts = None
+        self.boundary_crossed = False
+        return queue
+
+    def spill(self, packets: PacketBatch):
+        """Append packets taken from the queue to the spill journal and wake
+        the writer. Called without queue_lock, so that the disk write does not
+        hold the writer; only the reader appends, so records stay in order."""
+        trace = self.tracer.trace("spill", stream=self.config.station, packets=len(packets))
+        with trace:
+            if self.journal is None:
+                folder = (self.config.spill_folder
+                          or Path(tempfile.gettempdir()) / "streamrec-spill")
+                self.journal = SpillJournal(Path(folder) / f"{self.session.uuid}.journal")
+            if not self.journal:
+                logger.warning("Writer is behind, spilling queued packets to %s",
+                               self.journal.path)
+            self.journal.append(packets)
+        with self.queue_lock:
+            self.wake_writer()
+
+    def has_pending(self) -> bool:
+        """Whether packets wait in memory or in the journal. Must be called with queue_lock held."""
+        return bool(self.queue) or bool(self.journal)
+
+    def wake_writer(self):
+        """Must be called with queue_lock held."""
+        self.queue_cond.notify()
+        if self.on_flush_due:
+            self.on_flush_due()
+
+    def flush_due(self) -> bool:
+        """Must be called with queue_lock held."""
+        if self.journal:
+            return True
+        if not self.queue:
+            return False
+        if self.stopping or self.reader_finished:
+            return True
+        if not self.clock_ready():
+            return False
+        c = self.config
+        return (self.boundary_crossed
+                or (c.flush_packets and len(self.queue) >= c.flush_packets)
+                or (c.flush_bytes and self.queue.nbytes >= c.flush_bytes)
+                or time.monotonic() - self.queue_since >= c.write_period)
+
+    def flush_timeout(self) -> float:
+        """Seconds until the latency trigger fires, or None if the queue is empty.
+
+        Must be called with queue_lock held.
+        """
+        if self.journal:
+            return 0.0
+        if not self.queue:
+            return None
+        if not self.clock_ready():
+            return max(0.0, self.clock.first_received + self.config.initial_writer_delay
+                       - time.time())
+        return max(0.0, self.queue_since + self.config.write_period - time.monotonic())
+
+    def flush(self):
+        trace = self.tracer.trace("flush", stream=self.config.station)
+        with trace:
+            # Spilled packets are older than the queued ones, so the queue waits
+            # until the journal is empty
+            with trace.lock("queue_lock", self.queue_lock):
+                queue = None if self.journal else self.reset_queue()
+
+            with trace.span("build"):
+                if queue is None:
+                    packets = self.journal.pop(self.session)
+                    if not self.journal:
+                        logger.info("Writer caught up with the spill journal")
+                elif queue:
+                    packets = queue.build()
+                else:
+                    return
+            trace.tag(packets=len(packets))
+
+            with trace.span("clock"):
+                self.update_clock(packets)
+
+            start = time.perf_counter()
+            self.metrics.flush_packets.observe(len(packets))
+            self.metrics.clock_offset(float(np.min(packets.received_ts - packets.adjusted_ts())))
+            with trace.span("split"):
+                batches = packets.split_by_segment()
+            for segment_ts, packets in batches:
+                # Close if segment finished
+                if self.current_segment:
+                    if self.current_segment.segment_ts != segment_ts:
+                        with trace.span("close", segment=self.current_segment.segment_ts):
+                            self.close_segment()
+
+                # Open if its a new segment
+                if not self.current_segment:
+                    self.current_segment = SegmentFile(session=self.session,
+                                                       segment_ts=segment_ts,
+                                                       index=self.index,
+                                                       features=self.features)
+
+                # Write packets
+                with trace.span("write", segment=segment_ts):
+                    self.current_segment.write(packets)
+            self.metrics.write_seconds.observe(time.perf_counter() - start)
+
+    def close_segment(self):
+        if self.current_segment:
+            self.current_segment.close()
+            if self.uploader:
+                self.uploader.submit(self.config.output_folder, self.current_segment.get_path())
+            self.current_segment = None
+            self.metrics.segments_closed += 1
+
+    def close_output(self):
+        self.close_segment()
+        if self.journal is not None:
+            self.journal.close()
+        with self.queue_lock:
+            self.budget.release(self.queue_memory(), self)
+        if self.index:
+            self.index.close()
+        if self.relay:
+            self.relay.close()
+
+    @property
+    def reconnects(self) -> int:
+        return self.timeline.reconnects
+
+    @property
+    def gap_seconds(self) -> float:
+        return self.timeline.total_gap
+
+    @property
+    def queue_depth(self) -> int:
+        """Packets waiting to be written, in memory and in the spill journal."""
+        spilled = self.journal.pending_packets if self.journal else 0
+        return len(self.queue) + spilled
+
+    @property
+    def spilled_bytes(self) -> int:
+        return self.journal.spilled_bytes if self.journal else 0
+
+    @property
+    def replay_lag(self) -> float:
+        """Seconds since the oldest packet still in the spill journal was received."""
+        oldest = self.journal.oldest_received_ts() if self.journal else None
+        return max(0.0, time.time() - oldest) if oldest is not None else 0.0
+
+    def stream_stats(self) -> dict[str, dict]:
+        """The stats of each track with config.tracks, or of this stream, by name."""
+        return {recorder.config.station: recorder.stats() for recorder in self.outputs()}
+
+    def stats(self) -> dict:
+        """Metrics of the stream, as rendered by streamrec.metrics.render."""
+        return {**self.metrics.snapshot(),
+                "reconnects": self.reconnects,
+                "gap": self.gap_seconds,
+                "queue_depth": self.queue_depth,
+                "spilled_bytes": self.spilled_bytes,
+                "replay_lag": self.replay_lag}
+
+    def can_reconnect(self, attempt: int) -> bool:
+        attempts = self.config.reconnect_attempts
+        return attempts < 0 or attempt < attempts
+
+    def read_connection(self) -> bool:
+        """Demux one connection until it ends. Returns whether any packet was received."""
         fn_logger = logging.getLogger("recorder.reader")
-        self.session.ts_start = time.time()
-        fn_logger.info("Starting reader: %s", format_ts(self.session.ts_start))
+        received = False
+        response, fmt = None, None
         try:
-            self.container = av.open(
-                self.config.url, options={'timeout': str(self.config.network_timeout * 10**6)})
-            stream = next(
-                s for s in self.container.streams if s.type == "audio")
-            for packet in self.container.demux(stream):
-                if packet.is_corrupt:
-                    fn_logger.warning("Corrupt packet")
-                    continue
-                if packet.size == 0:
-                    fn_logger.warning("Packet with size 0")
-                    continue
-                with self.queue_lock:
-                    p = PacketWithReceivedTS(
-                        session=self.session, packet=packet)
-                    self.queue.append(p)
-                if self.stopping:
-                    break
-            self.container.close()
+            if (self.config.native_ingest and not self.config.tracks
+                    and is_native_url(self.config.url)):
+                response = open_stream(self.config.url, self.config.network_timeout)
+                fmt = content_type_format(response.headers.get("Content-Type", ""))
+            if fmt in NATIVE_PARSERS:
+                received = self.read_native(response, NativeDemuxer(fmt))
+            else:
+                # Without a native parser, libav demuxes the response already open
+                self.container = av.open(
+                    response or self.config.url, format=fmt,
+                    options={'timeout': str(self.config.network_timeout * 10**6)})
+                packets = self.container.demux(self.demuxed_streams())
+                if self.config.tracks:
+                    received = self.demux_tracks(packets)
+                else:
+                    received = self.demux(packets)
+                self.container.close()
             fn_logger.info("Reader finished successfully")
         # pylint: disable=broad-except
         except Exception as e:
-            if any(isinstance(e, exc) for exc in [av.error.ConnectionResetError, av.error.ConnectionRefusedError, av.error.OSError, av.error.TimeoutError]):
+            if any(isinstance(e, exc) for exc in [av.error.ConnectionResetError, av.error.ConnectionRefusedError, av.error.OSError, av.error.TimeoutError, OSError]):
                 fn_logger.warning("Connection error: %s", e)
             else:
                 fn_logger.error("Reader exception: %s", e)
@@ -89,66 +440,183 @@ class Recorder:
                 self.reader_unhandled_exception = e
             self.reader_exception = e
         finally:
-            self.reader_finished = True
+            if response:
+                response.close()
+        for recorder in self.outputs():
+            recorder.end_connection()
+        return received
+
+    def demuxed_streams(self) -> list[av.stream.Stream]:
+        """The streams to demux: the first audio stream, or with config.tracks
+        the selected ones, whose recorders are added on the first connection."""
+        if not self.config.tracks:
+            return [next(s for s in self.container.streams if s.type == "audio")]
+        if not self.tracks:
+            for stream in select_tracks(self.container.streams, self.config.tracks):
+                self.add_track(stream)
+        streams = [s for s in self.container.streams if s.index in self.tracks]
+        if not streams:
+            raise ValueError("None of the recorded tracks is in the stream")
+        return streams
+
+    def demux(self, packets) -> bool:
+        received = False
+        while True:
+            with self.tracer.trace("demux", stream=self.config.station):
+                packet = next(packets, None)
+            if packet is None:
+                break
+            self.enqueue(packet)
+            received = True
+            if self.stopping:
+                break
+        return received
+
+    def demux_tracks(self, packets) -> bool:
+        """Hand the packets of one demux pass to the recorder of their track,
+        in batches of the packets demuxed together."""
+        received = False
+        pending: dict[Recorder, list[av.Packet]] = {}
+        count, since = 0, None
+        try:
+            while True:
+                with self.tracer.trace("demux", stream=self.config.station):
+                    packet = next(packets, None)
+                if packet is None:
+                    break
+                received = True
+                track = self.tracks[packet.stream.index]
+                if track.accept(packet):
+                    pending.setdefault(track, []).append(packet)
+                    count += 1
+                    since = since or time.monotonic()
+                if (count >= TRACK_BATCH_PACKETS
+                        or since and time.monotonic() - since >= TRACK_BATCH_SECONDS):
+                    for track, batch in pending.items():
+                        track.enqueue_many(batch)
+                    pending, count, since = {}, 0, None
+                if self.stopping:
+                    break
+        finally:
+            for track, batch in pending.items():
+                track.enqueue_many(batch)
+        return received
+
+    def read_native(self, response, demuxer: NativeDemuxer) -> bool:
+        received = False
+        while not self.stopping:
+            data = response.read1(READ_SIZE)
+            if not data:
+                break
+            with self.tracer.trace("demux", stream=self.config.station):
+                packets = demuxer.feed(data)
+            if packets:
+                self.enqueue_many(packets)
+                received = True
+        return received
+
+    def stream_reader(self):
+        fn_logger = logging.getLogger("recorder.reader")
+        self.session.ts_start = time.time()
+        fn_logger.info("Starting reader: %s", format_ts(self.session.ts_start))
+        attempt = 0
+        try:
+            while True:
+                if self.read_connection():
+                    attempt = 0
+                if (self.stopping or self.reader_unhandled_exception
+                        or not self.can_reconnect(attempt)):
+                    break
+                delay = backoff_delay(attempt, self.config.reconnect_delay,
+                                      self.config.reconnect_max_delay)
+                attempt += 1
+                fn_logger.info("Reconnecting in %.2f seconds (attempt %s)", delay, attempt)
+                if self.stopped.wait(delay):
+                    break
+                for recorder in self.outputs():
+                    recorder.timeline.new_connection()
+        finally:
+            for recorder in {self, *self.outputs()}:
+                with recorder.queue_lock:
+                    recorder.reader_finished = True
+                    recorder.wake_writer()
 
     def file_writer(self):
         fn_logger = logging.getLogger("recorder.writer")
-        fn_logger.info("Waiting %s seconds before starting writer "
-                       "to have enough packets to calculate adjusted TS start",
-                       self.config.initial_writer_delay)
-        time.sleep(self.config.initial_writer_delay)
-        fn_logger.info("Starting writer, will write every %s seconds",
-                       self.config.write_period)
-        while len(self.queue) > 0 or not self.reader_finished:
-            time.sleep(self.config.write_period)
-            fn_logger.debug("Queue size: %s", len(self.queue))
-
-            if len(self.queue) == 0:
-                continue
-
-            with self.queue_lock:
-                packets = self.queue
-                self.queue = []
-
-            if not self.session.adjusted_ts_start:
-                self.calc_adjusted_ts_start(packets)
-
-            by_segment = groupby(packets, key=lambda p: p.get_segment_ts())
-            for segment_ts, packets in by_segment:
-                # Close if segment finished
-                if self.current_segment:
-                    if self.current_segment.segment_ts != segment_ts:
-                        self.current_segment.close()
-                        self.current_segment = None
-
-                # Open if its a new segment
-                if not self.current_segment:
-                    self.current_segment = SegmentFile(session=self.session,
-                                                       segment_ts=segment_ts)
+        fn_logger.info("Starting writer")
+        while True:
+            with self.queue_cond:
+                while not self.flush_due() and not (self.reader_finished
+                                                    and not self.has_pending()):
+                    self.queue_cond.wait(self.flush_timeout())
+                if not self.has_pending():
+                    break
+                fn_logger.debug("Queue size: %s", len(self.queue))
 
-                # Write packets
-                self.current_segment.write(packets)
+            self.flush()
 
-        if self.current_segment:
-            self.current_segment.close()
+        self.close_output()
         fn_logger.info("Writer finished")
 
+    def request_stop(self):
+        self.stopped.set()
+        for recorder in {self, *self.outputs()}:
+            with recorder.queue_lock:
+                recorder.stopping = True
+                recorder.wake_writer()
+
     def stop(self, sig, _frame):
         logger.info("Received signal %s", signal.Signals(sig).name)
-        self.stopping = True
+        self.request_stop()
 
-    def start(self):
+    def prepare_output(self):
         Path(self.config.output_folder).mkdir(parents=True, exist_ok=True)
 
         if self.config.close_open_files_on_start:
             self.close_open_files()
 
+    def add_policies(self, config: RecordingConfig):
+        """Hand the output folder of ``config`` to the background workers."""
+        for worker, policy in ((self.retention, RetentionPolicy.from_config(config)),
+                               (self.compactor, CompactionPolicy.from_config(config)),
+                               (self.uploader, UploadPolicy.from_config(config))):
+            if worker and policy:
+                worker.add(policy)
+
+    def start(self):
+        self.prepare_output()
+        if RetentionPolicy.from_config(self.config):
+            self.retention = RetentionWorker()
+            self.retention.start()
+        if self.config.features and not self.features:
+            self.features = FeatureExtractor()
+            self.features.start()
+        if UploadPolicy.from_config(self.config) and not self.uploader:
+            self.uploader = Uploader()
+            self.uploader.start()
+        if CompactionPolicy.from_config(self.config):
+            self.compactor = Compactor(features=self.features, uploader=self.uploader)
+            self.compactor.start()
+        # The folders of the tracks are added as they are found
+        if not self.config.tracks:
+            self.add_policies(self.config)
+
         self.reader_thread = threading.Thread(target=self.stream_reader)
         self.reader_thread.start()
 
-        self.writer_thread = threading.Thread(target=self.file_writer)
-        self.writer_thread.start()
+        if not self.config.tracks:
+            self.writer_thread = threading.Thread(target=self.file_writer)
+            self.writer_thread.start()
 
         self.reader_thread.join()
-        self.writer_thread.join()
+        for recorder in self.outputs():
+            recorder.writer_thread.join()
+        if self.retention:
+            self.retention.stop()
+        if self.compactor:
+            self.compactor.stop()
+        if self.features:
+            self.features.stop()
+        if self.uploader:
+            self.uploader.stop()
         logger.info("All threads finished")
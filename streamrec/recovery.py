@@ -0,0 +1,142 @@
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from functools import partial
+import logging
+import mmap
+import os
+from pathlib import Path
+from typing import Callable
+
+from .frames import NATIVE_PARSERS, FrameHeader, frame_format, parse_mp3_header
+from .index import (CHECKPOINT_INTERVAL, INDEX_FILENAME, SegmentIndex, file_checksums,
+                    scan_segment)
+from .segmentfile import fdatasync, fsync_dir
+
+logger = logging.getLogger(__name__)
+
+# Files recovered in parallel. The work is mostly waiting on the disk
+RECOVERY_WORKERS = 16
+
+
+@dataclass
+class RecoveredSegment:
+    path: Path
+    size: int
+    # None when the end could not be found
+    end_ts: float
+    truncated: int = 0
+    checkpoints: list[tuple[float, int]] = field(default_factory=list)
+    checksums: list[tuple[int, int, int]] = field(default_factory=list)
+
+
+def walk_frames(data, offset: int, ts: float,
+                parse: Callable[..., FrameHeader] = parse_mp3_header
+                ) -> tuple[int, float, list[tuple[float, int]]]:
+    """Walk the complete frames from ``offset``, which starts at ``ts``,
+    with the header parser of their format.
+
+    Returns the offset and timestamp where they stop, and a ``(ts, offset)``
+    checkpoint every CHECKPOINT_INTERVAL seconds after ``ts``.
+    """
+    checkpoints = []
+    next_checkpoint = ts + CHECKPOINT_INTERVAL
+    while True:
+        header = parse(data, offset)
+        if not header or offset + header.length > len(data):
+            return offset, ts, checkpoints
+        if ts >= next_checkpoint:
+            checkpoints.append((ts, offset))
+            next_checkpoint += CHECKPOINT_INTERVAL
+        offset += header.length
+        ts += header.duration
+
+
+def recover_segment(path: Path, checkpoint: tuple[float, int] = (0.0, 0), sync: bool = True,
+                    scan: bool = False, checksum_from: int = None) -> RecoveredSegment:
+    """Finalize the segment ``path`` from its .tmp file, or return None if neither exists.
+
+    The file is scanned from ``checkpoint``, a ``(ts, offset)`` frame start,
+    and cut after its last complete frame, as MP3 or ADTS by the header at the
+    checkpoint. Files in other formats are kept whole, and with ``scan``
+    their end is found with libav.
+    With ``checksum_from``, the bytes kept from that offset are checksummed.
+    """
+    tmp_path = path.with_name(path.name + ".tmp")
+    source = tmp_path if tmp_path.exists() else path
+    ts, offset = checkpoint
+    try:
+        f = open(source, "r+b")
+    except FileNotFoundError:
+        return None
+    with f:
+        size = os.fstat(f.fileno()).st_size
+        end, end_ts, checkpoints = size, None, []
+        if size > offset:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                fmt = frame_format(data, offset)
+                if fmt:
+                    end, end_ts, checkpoints = walk_frames(data, offset, ts,
+                                                           NATIVE_PARSERS[fmt])
+        elif size == offset:
+            end_ts = ts
+        if end < size:
+            f.truncate(end)
+        if sync:
+            fdatasync(f.fileno())
+    if end_ts is None and scan:
+        try:
+            end_ts = ts + scan_segment(source)[2]
+        # pylint: disable=broad-except
+        except Exception as e:
+            logger.warning("Could not find the end of %s: %s", source, e)
+    checksums = file_checksums(source, checksum_from) if checksum_from is not None else []
+    if source == tmp_path:
+        os.rename(tmp_path, path)
+    return RecoveredSegment(path, end, end_ts, size - end, checkpoints, checksums)
+
+
+def recover_open_segments(folder: str, sync: bool = True,
+                          max_workers: int = RECOVERY_WORKERS) -> int:
+    """Finalize the segments of an output folder left open by a recorder that
+    did not shut down cleanly. Returns the number of recovered files.
+
+    Open segments are taken from the index, so startup does not depend on the
+    size of the folder. Folders without an index are walked instead.
+    """
+    folder = Path(folder)
+    if not (folder / INDEX_FILENAME).exists():
+        paths = [Path(root) / name[:-len(".tmp")] for root, _, names in os.walk(folder)
+                 for name in names if name.endswith(".tmp")]
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            recovered = [r for r in pool.map(partial(recover_segment, sync=sync), paths) if r]
+    else:
+        index = SegmentIndex(folder)
+        try:
+            segments = index.open_segments()
+            checkpoints = [index.checkpoint_before(s, float("inf")) for s in segments]
+            # The bytes written since the last commit have no checksums yet
+            checksum_ends = [index.checksum_end(s) for s in segments]
+            with ThreadPoolExecutor(max_workers=max_workers) as pool:
+                results = list(pool.map(
+                    lambda path, checkpoint, checksum_from: recover_segment(
+                        path, checkpoint, sync, scan=True, checksum_from=checksum_from),
+                    [s.path for s in segments], checkpoints, checksum_ends))
+            recovered = []
+            for segment, (ts, _), result in zip(segments, checkpoints, results):
+                if result is None:
+                    logger.warning("Removing missing segment %s from the index", segment.path)
+                    index.remove(segment)
+                    continue
+                index.finish(segment, ts if result.end_ts is None else result.end_ts,
+                             result.size, result.checkpoints, result.checksums)
+                recovered.append(result)
+        finally:
+            index.close()
+    for result in recovered:
+        logger.warning("Recovered open segment %s%s", result.path,
+                       f", dropped a partial frame of {result.truncated} bytes"
+                       if result.truncated else "")
+    if sync:
+        for parent in {result.path.parent for result in recovered}:
+            fsync_dir(parent)
+    return len(recovered)
@@ -0,0 +1,256 @@
+import asyncio
+from collections import deque
+import logging
+import threading
+from urllib.parse import unquote, urlsplit
+
+logger = logging.getLogger(__name__)
+
+# Bytes of audio kept for listeners: about 1 minute at 128 kbps
+RING_SIZE = 1024 * 1024
+# Bytes sent to a new listener right away, so playback starts immediately
+BURST_SIZE = 64 * 1024
+# Packet start positions remembered to place new listeners on a frame boundary
+BOUNDARIES = 4096
+CHUNK_SIZE = 16 * 1024
+REQUEST_TIMEOUT = 10
+MAX_HEADERS = 100
+
+
+class Overrun(Exception):
+    """The data at a read cursor was overwritten before it was read."""
+
+
+class RingBuffer:
+    """Fixed-size byte ring with one writer and any number of readers.
+
+    Positions are absolute byte counts. The writer never waits for readers:
+    a reader that falls more than ``capacity`` bytes behind gets Overrun.
+    Readers copy without a lock and check afterwards that the writer did not
+    reach the copied bytes in the meantime.
+    """
+
+    def __init__(self, capacity: int = RING_SIZE):
+        self.capacity = capacity
+        self.buffer = bytearray(capacity)
+        # Everything before head is readable; the writer is filling up to reserved
+        self.head = 0
+        self.reserved = 0
+
+    def write(self, data):
+        data = memoryview(data).cast("B")
+        if data.nbytes > self.capacity:
+            data = data[-self.capacity:]
+        size = data.nbytes
+        self.reserved = self.head + size
+        start = self.head % self.capacity
+        first = min(size, self.capacity - start)
+        self.buffer[start:start + first] = data[:first]
+        self.buffer[:size - first] = data[first:]
+        self.head = self.reserved
+
+    def read(self, cursor: int, size: int) -> bytes:
+        """Copy up to ``size`` bytes from ``cursor``, or b"" if there is nothing new."""
+        head = self.head
+        if cursor < head - self.capacity:
+            raise Overrun()
+        size = min(size, head - cursor)
+        if size <= 0:
+            return b""
+        start = cursor % self.capacity
+        first = min(size, self.capacity - start)
+        data = bytes(self.buffer[start:start + first]) + bytes(self.buffer[:size - first])
+        if cursor < self.reserved - self.capacity:
+            raise Overrun()
+        return data
+
+
+class Relay:
+    """Live copy of the packets of one stream, read by the listeners of a RelayServer.
+
+    ``write`` is called by the recorder for every packet and does the same
+    work whatever the number of listeners: a copy into the ring and at most
+    one wake-up of the relay event loop.
+    """
+
+    def __init__(self, name: str, capacity: int = RING_SIZE, burst: int = BURST_SIZE):
+        self.name = name
+        self.ring = RingBuffer(capacity)
+        self.burst = burst
+        self.boundaries: deque[int] = deque(maxlen=BOUNDARIES)
+        self.lock = threading.Lock()
+        self.loop: asyncio.AbstractEventLoop = None
+        self.data_available: asyncio.Event = None
+        self.wake_pending = False
+        self.closed = False
+        self.listeners = 0
+        self.dropped = 0
+
+    def attach(self, loop: asyncio.AbstractEventLoop):
+        """Must be called from ``loop``."""
+        self.loop = loop
+        self.data_available = asyncio.Event()
+
+    def write(self, data):
+        with self.lock:
+            self.boundaries.append(self.ring.head)
+        self.ring.write(data)
+        self.wake()
+
+    def close(self):
+        self.closed = True
+        self.wake()
+
+    def wake(self):
+        if self.loop and not self.wake_pending:
+            self.wake_pending = True
+            try:
+                self.loop.call_soon_threadsafe(self.notify)
+            except RuntimeError:
+                # The relay loop has been closed
+                pass
+
+    def notify(self):
+        self.wake_pending = False
+        event, self.data_available = self.data_available, asyncio.Event()
+        event.set()
+
+    def start_position(self) -> int:
+        """The first packet boundary within ``burst`` bytes of the newest data."""
+        with self.lock:
+            boundaries = list(self.boundaries)
+        oldest = max(self.ring.head - min(self.burst, self.ring.capacity), 0)
+        for position in boundaries:
+            if position >= oldest:
+                return position
+        return self.ring.head
+
+
+class RelayServer:
+    """Serves live relays over HTTP as progressive audio with ICY headers.
+
+    Every listener has its own cursor into the relay's ring. Listeners that
+    cannot keep up are disconnected once the ring overwrites their cursor.
+    """
+
+    def __init__(self, host: str = "0.0.0.0", port: int = 8000):
+        self.host = host
+        self.port = port
+        self.relays: dict[str, Relay] = {}
+        self.loop: asyncio.AbstractEventLoop = None
+        self.server: asyncio.AbstractServer = None
+        self.ready = threading.Event()
+        self.thread: threading.Thread = None
+
+    def add(self, relay: Relay):
+        self.ready.wait()
+        self.relays[relay.name] = relay
+        self.loop.call_soon_threadsafe(relay.attach, self.loop)
+
+    def remove(self, name: str):
+        relay = self.relays.pop(name, None)
+        if relay:
+            relay.close()
+
+    def find(self, path: str) -> Relay:
+        name = unquote(urlsplit(path).path.strip("/"))
+        if not name and len(self.relays) == 1:
+            return next(iter(self.relays.values()))
+        return self.relays.get(name)
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        relay = None
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), REQUEST_TIMEOUT)
+            for _ in range(MAX_HEADERS):
+                line = await asyncio.wait_for(reader.readline(), REQUEST_TIMEOUT)
+                if line in (b"\r\n", b"\n", b""):
+                    break
+            parts = request_line.decode("latin-1").split()
+            relay = self.find(parts[1]) if len(parts) == 3 and parts[0] == "GET" else None
+            if not relay or relay.data_available is None:
+                writer.write(b"HTTP/1.0 404 Not Found\r\nContent-Length: 0\r\n\r\n")
+                await writer.drain()
+                return
+            writer.write(("HTTP/1.0 200 OK\r\n"
+                          "Content-Type: audio/mpeg\r\n"
+                          f"icy-name: {relay.name}\r\n"
+                          "Cache-Control: no-cache\r\n"
+                          "Connection: close\r\n\r\n").encode("latin-1"))
+            relay.listeners += 1
+            await self.stream(relay, writer)
+        except (ConnectionError, asyncio.TimeoutError):
+            pass
+        finally:
+            if relay and relay.data_available is not None:
+                relay.listeners = max(0, relay.listeners - 1)
+            writer.close()
+
+    @staticmethod
+    async def drain(relay: Relay, writer: asyncio.StreamWriter, cursor: int) -> bool:
+        """Wait until the socket takes the data written so far.
+
+        Returns False if, meanwhile, the ring overwrote data after ``cursor``,
+        which means the listener cannot keep up.
+        """
+        if writer.transport.get_write_buffer_size() <= CHUNK_SIZE:
+            return True
+        drain = asyncio.ensure_future(writer.drain())
+        try:
+            while not relay.closed:
+                if relay.ring.head - cursor > relay.ring.capacity:
+                    return False
+                waiter = asyncio.ensure_future(relay.data_available.wait())
+                await asyncio.wait((drain, waiter), return_when=asyncio.FIRST_COMPLETED)
+                waiter.cancel()
+                if drain.done():
+                    drain.result()
+                    return True
+            return True
+        finally:
+            drain.cancel()
+
+    async def stream(self, relay: Relay, writer: asyncio.StreamWriter):
+        cursor = relay.start_position()
+        while not relay.closed:
+            waiter = relay.data_available
+            try:
+                data = relay.ring.read(cursor, CHUNK_SIZE)
+            except Overrun:
+                data = None
+            if data == b"":
+                await waiter.wait()
+                continue
+            if data is None or not await self.drain(relay, writer, cursor + len(data)):
+                relay.dropped += 1
+                logger.info("Dropping slow listener of %s", relay.name)
+                return
+            writer.write(data)
+            cursor += len(data)
+
+    async def run(self):
+        self.loop = asyncio.get_running_loop()
+        self.server = await asyncio.start_server(self.handle, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        logger.info("Relaying on %s:%s", self.host, self.port)
+        self.ready.set()
+        try:
+            async with self.server:
+                await self.server.serve_forever()
+        except asyncio.CancelledError:
+            pass
+
+    def start(self):
+        """Run the server in a background thread."""
+        self.thread = threading.Thread(target=asyncio.run, args=(self.run(),),
+                                       name="relay", daemon=True)
+        self.thread.start()
+        self.ready.wait()
+
+    def stop(self):
+        for name in list(self.relays):
+            self.remove(name)
+        if self.loop and self.server:
+            self.loop.call_soon_threadsafe(self.server.close)
+        if self.thread:
+            self.thread.join(5)
@@ -0,0 +1,150 @@
+from dataclasses import dataclass
+import logging
+import os
+from pathlib import Path
+import shutil
+import threading
+import time
+
+from streamrec.config import RecordingConfig
+
+from .features import sidecar_path
+from .index import INDEX_FILENAME, SegmentIndex
+from .segmentfile import known_folders
+
+logger = logging.getLogger(__name__)
+
+# Seconds between two retention passes over the folders
+CHECK_INTERVAL = 60
+# Segments looked up in the index at a time
+BATCH_SIZE = 256
+
+
+@dataclass
+class RetentionPolicy:
+    folder: str
+    max_age: float = 0
+    max_bytes: int = 0
+    move_to: str = None
+    # Segments deleted or moved per second
+    rate: float = 10
+
+    @classmethod
+    def from_config(cls, config: RecordingConfig) -> "RetentionPolicy":
+        """The policy of a stream, or None if it keeps everything."""
+        if not config.retention_max_age and not config.retention_max_bytes:
+            return None
+        return cls(config.output_folder, config.retention_max_age, config.retention_max_bytes,
+                   config.retention_move_to, config.retention_rate)
+
+
+class RetentionWorker:
+    """Deletes or moves the oldest closed segments of output folders from a
+    background thread.
+
+    Segments are found in the segment index, oldest first, and removed at
+    most ``rate`` per second, so the worker does not compete with the
+    writers for the disk.
+    """
+
+    def __init__(self, interval: float = CHECK_INTERVAL):
+        self.interval = interval
+        self.policies: dict[str, RetentionPolicy] = {}
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread: threading.Thread = None
+        self.expired = 0
+
+    def add(self, policy: RetentionPolicy):
+        with self.lock:
+            self.policies[policy.folder] = policy
+
+    def remove(self, folder: str):
+        with self.lock:
+            self.policies.pop(folder, None)
+
+    def apply(self, policy: RetentionPolicy, now: float = None) -> int:
+        """Expire the segments of one folder past its policy. Returns how many."""
+        folder = Path(policy.folder)
+        if not (folder / INDEX_FILENAME).exists():
+            logger.warning("Retention needs the segment index, skipping %s", folder)
+            return 0
+        now = time.time() if now is None else now
+        index = SegmentIndex(folder)
+        expired = 0
+        try:
+            excess = index.total_size() - policy.max_bytes if policy.max_bytes else 0
+            after = None
+            while not self.stopped.is_set():
+                segments = index.oldest(BATCH_SIZE, after)
+                for segment in segments:
+                    too_old = policy.max_age and segment.end_ts <= now - policy.max_age
+                    if not too_old and excess <= 0:
+                        return expired
+                    if self.expire(policy, index, segment):
+                        excess -= segment.size or 0
+                        expired += 1
+                    after = segment.start_ts
+                    if self.stopped.wait(1 / policy.rate):
+                        break
+                if len(segments) < BATCH_SIZE:
+                    break
+            return expired
+        finally:
+            index.close()
+            self.expired += expired
+
+    @staticmethod
+    def expire(policy: RetentionPolicy, index: SegmentIndex, segment) -> bool:
+        folder = Path(policy.folder)
+        try:
+            if policy.move_to:
+                target = Path(policy.move_to) / segment.path.relative_to(folder)
+                target.parent.mkdir(parents=True, exist_ok=True)
+                shutil.move(segment.path, target)
+                if sidecar_path(segment.path).exists():
+                    shutil.move(sidecar_path(segment.path), sidecar_path(target))
+            else:
+                segment.path.unlink(missing_ok=True)
+                sidecar_path(segment.path).unlink(missing_ok=True)
+        except OSError as e:
+            logger.warning("Could not expire segment %s: %s", segment.path, e)
+            return False
+        index.remove(segment)
+        # Remove the folders left empty, up to the output folder
+        parent = segment.path.parent
+        while parent != folder and folder in parent.parents:
+            try:
+                os.rmdir(parent)
+            except OSError:
+                break
+            known_folders.discard(parent)
+            parent = parent.parent
+        return True
+
+    def run(self):
+        while True:
+            with self.lock:
+                policies = list(self.policies.values())
+            for policy in policies:
+                if self.stopped.is_set():
+                    return
+                try:
+                    expired = self.apply(policy)
+                # pylint: disable=broad-except
+                except Exception:
+                    logger.exception("Retention failed for %s", policy.folder)
+                    continue
+                if expired:
+                    logger.info("Expired %s segments in %s", expired, policy.folder)
+            if self.stopped.wait(self.interval):
+                return
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name="retention", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread:
+            self.thread.join(5)
@@ -1,38 +1,125 @@
-from itertools import tee
 from pathlib import Path
 from datetime import datetime, timezone
-from typing import Iterable
 import logging
 import os
+import time
 
 
-from streamrec.packet import PacketWithReceivedTS
+from streamrec.config import format_path_template, parse_durability
+from streamrec.features import FeatureExtractor
+from streamrec.index import IndexWriter
+from streamrec.packet import PacketBatch
 from streamrec.session import RecordingSession
 
 logger = logging.getLogger(__name__)
 
+IOV_MAX = os.sysconf("SC_IOV_MAX") if hasattr(os, "sysconf") else 1024
+fdatasync = getattr(os, "fdatasync", os.fsync)
+
+# Folders known to exist, so each one is only created once per process
+known_folders: set[Path] = set()
+
+
+def writev_all(fd: int, buffers: list) -> int:
+    """Write all buffers with as few writev calls as possible, handling short writes."""
+    views = [memoryview(b).cast("B") for b in buffers]
+    total = 0
+    i = 0
+    while i < len(views):
+        written = os.writev(fd, views[i:i + IOV_MAX])
+        total += written
+        while i < len(views) and written >= views[i].nbytes:
+            written -= views[i].nbytes
+            i += 1
+        if written:
+            views[i] = views[i][written:]
+    return total
+
+
+def fsync_dir(path: Path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def ensure_folder(path: Path, sync: bool = False):
+    """Create ``path`` and its missing parents, syncing the folders they were added to."""
+    if path in known_folders:
+        return
+    missing = []
+    parent = path
+    while not parent.is_dir():
+        missing.append(parent)
+        parent = parent.parent
+    for folder in reversed(missing):
+        folder.mkdir(exist_ok=True)
+        if sync:
+            fsync_dir(folder.parent)
+    known_folders.add(path)
+
 
 class SegmentFile:
-    def __init__(self, session: RecordingSession, segment_ts: float):
+    def __init__(self, session: RecordingSession, segment_ts: float,
+                 index: IndexWriter = None, features: FeatureExtractor = None):
         self.session = session
+        self.index = index
+        self.features = features
         self.config = session.config
         self.segment_ts = segment_ts
-        self.first_packet: PacketWithReceivedTS = None
+        self.first_ts: float = None
+        self.sync_on_close, self.sync_interval = parse_durability(self.config.durability)
+        self.fd: int = None
+        self.last_sync: float = None
+
+    def write(self, packets: PacketBatch):
+        if not len(packets):
+            return
+        if self.first_ts is None:
+            self.first_ts = float(packets.adjusted_ts()[0])
+        if self.fd is None:
+            self.open()
+        writev_all(self.fd, [packets.payload])
+        if self.index:
+            self.index.add(packets)
+        if self.sync_interval and time.monotonic() - self.last_sync >= self.sync_interval:
+            fdatasync(self.fd)
+            self.last_sync = time.monotonic()
 
-    def write(self, packets: Iterable[PacketWithReceivedTS]):
-        if not self.first_packet:
-            packets, tee_packets = tee(packets)
-            self.first_packet = next(tee_packets)
-        with open(self.get_path(tmp=True), "ab") as file:
-            for packet in packets:
-                file.write(packet.packet)
+    def open(self):
+        path = self.get_path(tmp=True)
+        ensure_folder(path.parent, self.sync_on_close)
+        # Indexed before it exists, so crash recovery finds every open file
+        if self.index:
+            self.index.open_segment(self.get_path(), self.first_ts)
+        flags = os.O_WRONLY | os.O_CREAT | os.O_APPEND
+        try:
+            self.fd = os.open(path, flags, 0o644)
+        except FileNotFoundError:
+            # The folder was removed (by retention) since it was created
+            known_folders.discard(path.parent)
+            ensure_folder(path.parent, self.sync_on_close)
+            self.fd = os.open(path, flags, 0o644)
+        self.last_sync = time.monotonic()
 
     def close(self):
         logger.info("Closing segment %s", self.get_path())
+        if self.fd is not None:
+            if self.sync_on_close:
+                fdatasync(self.fd)
+            os.close(self.fd)
+            self.fd = None
         os.rename(self.get_path(tmp=True), self.get_path())
+        if self.index:
+            self.index.close_segment()
+        if self.sync_on_close:
+            fsync_dir(self.get_path().parent)
+        if self.features:
+            self.features.submit(self.get_path())
 
     def get_path(self, tmp=False) -> Path:
-        ts = self.first_packet.get_adjusted_ts()
+        ts = self.first_ts
         if ts < self.segment_ts:
             logger.error("First packet ts %s is less than segment ts %s",
                          ts, self.segment_ts)
@@ -41,4 +128,5 @@ class SegmentFile:
         filename = f"{ts_str}_{self.session.uuid}.mp3"
         if tmp:
             filename += ".tmp"
-        return Path(self.config.output_folder) / filename
+        folder = format_path_template(self.config.path_template, self.config.station, ts)
+        return Path(self.config.output_folder) / folder / filename
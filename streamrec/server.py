@@ -0,0 +1,346 @@
+import asyncio
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from http import HTTPStatus
+import logging
+import math
+from pathlib import Path
+import re
+import threading
+import time
+from urllib.parse import quote, unquote, urlsplit
+
+from streamrec.store import Piece, SegmentStore, parse_duration, parse_timestamp
+
+logger = logging.getLogger(__name__)
+
+# Seconds to wait for the next request on a kept-alive connection
+REQUEST_TIMEOUT = 60
+MAX_HEADERS = 100
+# Closed segments listed in live playlists
+LIVE_SEGMENTS = 6
+# Segment duration of the folders served, when not given
+SEGMENT_DURATION = 60
+# Playlists of ranges that will not change, kept in memory
+PLAYLIST_CACHE_SIZE = 1024
+# Threads that query the index and cut ranges, so that a slow query or disk
+# read does not hold the event loop. Each one has its own index connections
+PLANNING_WORKERS = 8
+
+AUDIO_TYPE = "audio/mpeg"
+PLAYLIST_TYPE = "application/vnd.apple.mpegurl"
+RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+class RequestError(Exception):
+    def __init__(self, status: HTTPStatus, message: str = None):
+        super().__init__(message or status.phrase)
+        self.status = status
+
+
+def parse_range(value: str, total: int) -> tuple[int, int]:
+    """Parse a single ``Range: bytes=`` header into an inclusive ``(first, last)``
+    byte range, or None to send everything."""
+    match = RANGE.match(value.strip()) if value else None
+    if not match or not any(match.groups()):
+        return None
+    first, last = match.groups()
+    if not first:
+        first, last = max(0, total - int(last)), total - 1
+    else:
+        first, last = int(first), min(int(last), total - 1) if last else total - 1
+    if first > last or first >= total:
+        raise RequestError(HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE)
+    return first, last
+
+
+def format_program_date_time(ts: float) -> str:
+    return datetime.fromtimestamp(ts, tz=timezone.utc).isoformat(timespec="milliseconds")
+
+
+class RecordingServer:
+    """Serves the recordings of one or more output folders over HTTP.
+
+    - ``/<station>/<start>/<duration or end>`` returns the audio of a time
+      range, e.g. ``/station/2026-10-18T14:00:00Z/PT30M``. It supports Range
+      requests, and the bytes go from the segment files to the socket with
+      sendfile.
+    - ``/<station>/<start>/<duration or end>.m3u8`` returns an HLS playlist of
+      the range, pointing at byte ranges of the segment files.
+    - ``/<station>/live.m3u8`` is a live HLS playlist of the last segments.
+      Its media sequence numbers are segment slots, the start of a segment
+      divided by the segment duration of the station in
+      ``segment_durations``.
+    - ``/<station>/segments/<file>`` returns a segment file.
+
+    Index queries, playlists and range cuts run in a pool of
+    ``workers`` threads; only sendfile runs on the event loop.
+    """
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, folders: dict[str, str], host: str = "0.0.0.0", port: int = 8080,
+                 workers: int = PLANNING_WORKERS, segment_durations: dict[str, int] = None):
+        self.folders = {name: Path(folder) for name, folder in folders.items()}
+        self.segment_durations = segment_durations or {}
+        self.host = host
+        self.port = port
+        self.executor = ThreadPoolExecutor(workers, thread_name_prefix="server")
+        # Stores by station and thread, as index connections are not shared
+        self.stores: dict[tuple[str, int], SegmentStore] = {}
+        self.playlists: OrderedDict[tuple, bytes] = OrderedDict()
+        self.lock = threading.Lock()
+        self.server: asyncio.AbstractServer = None
+        self.loop: asyncio.AbstractEventLoop = None
+        self.ready = threading.Event()
+
+    def store(self, station: str) -> SegmentStore:
+        """The store of a station for the calling thread."""
+        if station not in self.folders:
+            raise RequestError(HTTPStatus.NOT_FOUND)
+        key = (station, threading.get_ident())
+        with self.lock:
+            if key not in self.stores:
+                self.stores[key] = SegmentStore(self.folders[station])
+            return self.stores[key]
+
+    async def blocking(self, fn, *args):
+        """Run ``fn`` in the planning pool."""
+        return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                request_line = await asyncio.wait_for(reader.readline(), REQUEST_TIMEOUT)
+                if not request_line:
+                    break
+                parts = request_line.decode("latin-1").split()
+                headers = {}
+                for _ in range(MAX_HEADERS):
+                    line = await asyncio.wait_for(reader.readline(), REQUEST_TIMEOUT)
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                if len(parts) != 3:
+                    await self.send(writer, HTTPStatus.BAD_REQUEST, keep_alive=False)
+                    break
+                method, target, version = parts
+                keep_alive = (version == "HTTP/1.1"
+                              and headers.get("connection", "").lower() != "close")
+                try:
+                    await self.dispatch(method, target, headers, writer, keep_alive)
+                except RequestError as e:
+                    await self.send(writer, e.status, str(e).encode(), "text/plain",
+                                    keep_alive=keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.TimeoutError):
+            pass
+        # pylint: disable=broad-except
+        except Exception as e:
+            logger.exception("Error handling request: %s", e)
+        finally:
+            writer.close()
+
+    async def dispatch(self, method: str, target: str, headers: dict[str, str],
+                       writer: asyncio.StreamWriter, keep_alive: bool):
+        if method not in ("GET", "HEAD"):
+            raise RequestError(HTTPStatus.METHOD_NOT_ALLOWED)
+        head = method == "HEAD"
+        path = [unquote(p) for p in urlsplit(target).path.split("/") if p]
+        if len(path) == 2 and path[1] == "live.m3u8":
+            body = await self.blocking(self.live_playlist, path[0])
+            await self.send(writer, HTTPStatus.OK, body, PLAYLIST_TYPE,
+                            {"Cache-Control": "no-cache"}, keep_alive, head)
+        elif len(path) >= 3 and path[1] == "segments":
+            piece = await self.blocking(self.segment_piece, path[0], path[2:])
+            await self.send_pieces(writer, [piece], headers, keep_alive, head,
+                                   {"Cache-Control": "max-age=31536000, immutable"})
+        elif len(path) == 3:
+            station, start, until = path
+            if until.endswith(".m3u8"):
+                start_ts, end_ts = self.parse_range(start, until[:-len(".m3u8")])
+                body, complete = await self.blocking(self.range_playlist, station, start_ts,
+                                                     end_ts)
+                cache = "max-age=31536000, immutable" if complete else "no-cache"
+                await self.send(writer, HTTPStatus.OK, body, PLAYLIST_TYPE,
+                                {"Cache-Control": cache}, keep_alive, head)
+            else:
+                if until.endswith(".mp3"):
+                    until = until[:-len(".mp3")]
+                start_ts, end_ts = self.parse_range(start, until)
+                pieces = await self.blocking(self.plan, station, start_ts, end_ts)
+                if not pieces:
+                    raise RequestError(HTTPStatus.NOT_FOUND, "Nothing recorded in this range")
+                await self.send_pieces(writer, pieces, headers, keep_alive, head)
+        else:
+            raise RequestError(HTTPStatus.NOT_FOUND)
+
+    @staticmethod
+    def parse_range(start: str, until: str) -> tuple[float, float]:
+        try:
+            start_ts = parse_timestamp(start)
+            if until[:1] in ("P", "p"):
+                end_ts = start_ts + parse_duration(until)
+            else:
+                end_ts = parse_timestamp(until)
+        except ValueError as e:
+            raise RequestError(HTTPStatus.BAD_REQUEST, str(e)) from e
+        if end_ts <= start_ts:
+            raise RequestError(HTTPStatus.BAD_REQUEST, "The range ends before it starts")
+        return start_ts, end_ts
+
+    def plan(self, station: str, start: float, end: float) -> list[Piece]:
+        return self.store(station).plan(start, end)
+
+    def segment_piece(self, station: str, parts: list[str]) -> Piece:
+        folder = self.store(station).folder.resolve()
+        path = folder.joinpath(*parts).resolve()
+        if (folder not in path.parents or path.suffix != ".mp3"
+                or not path.is_file()):
+            raise RequestError(HTTPStatus.NOT_FOUND)
+        return Piece(path, 0, path.stat().st_size, None, None)
+
+    def segment_uri(self, station: str, path: Path) -> str:
+        relative = path.relative_to(self.store(station).folder)
+        return f"/{quote(station)}/segments/{quote(relative.as_posix())}"
+
+    def playlist(self, station: str, pieces: list[Piece], media_sequence: int,
+                 complete: bool, byte_ranges: bool) -> bytes:
+        durations = [piece.end_ts - piece.start_ts for piece in pieces]
+        lines = ["#EXTM3U",
+                 f"#EXT-X-VERSION:{4 if byte_ranges else 3}",
+                 f"#EXT-X-TARGETDURATION:{math.ceil(max(durations, default=1))}",
+                 f"#EXT-X-MEDIA-SEQUENCE:{media_sequence}"]
+        if complete:
+            lines.append("#EXT-X-PLAYLIST-TYPE:VOD")
+        for piece, duration in zip(pieces, durations):
+            lines.append(f"#EXT-X-PROGRAM-DATE-TIME:{format_program_date_time(piece.start_ts)}")
+            lines.append(f"#EXTINF:{duration:.3f},")
+            if byte_ranges:
+                lines.append(f"#EXT-X-BYTERANGE:{piece.size}@{piece.start}")
+            lines.append(self.segment_uri(station, piece.path))
+        if complete:
+            lines.append("#EXT-X-ENDLIST")
+        return ("\n".join(lines) + "\n").encode()
+
+    def range_playlist(self, station: str, start: float, end: float) -> tuple[bytes, bool]:
+        """HLS playlist of a time range, and whether it is final.
+
+        A range is final once it is in the past and all its segments are
+        closed; final playlists are cached.
+        """
+        key = (station, start, end)
+        with self.lock:
+            if key in self.playlists:
+                self.playlists.move_to_end(key)
+                return self.playlists[key], True
+        pieces = self.plan(station, start, end)
+        closed = [piece for piece in pieces if piece.path.suffix == ".mp3"]
+        complete = len(closed) == len(pieces) and end <= time.time()
+        body = self.playlist(station, closed, 0, complete, byte_ranges=True)
+        if complete:
+            with self.lock:
+                self.playlists[key] = body
+                if len(self.playlists) > PLAYLIST_CACHE_SIZE:
+                    self.playlists.popitem(last=False)
+        return body, complete
+
+    def live_playlist(self, station: str) -> bytes:
+        """HLS playlist of the last closed segment slots recorded without a break.
+
+        When sessions overlap (e.g. after a reconnect), each slot lists the
+        longest of its segments, once none of them is still open. The media
+        sequence number of a segment is its slot, so it does not change
+        between refreshes.
+        """
+        index = self.store(station).index
+        duration = self.segment_durations.get(station, SEGMENT_DURATION)
+        open_slots = {int(s.start_ts // duration) for s in index.open_segments()}
+        slots = {}
+        for segment in index.latest(2 * LIVE_SEGMENTS):
+            slot = int(segment.start_ts // duration)
+            best = slots.get(slot)
+            if slot not in open_slots and (
+                    best is None
+                    or segment.end_ts - segment.start_ts > best.end_ts - best.start_ts):
+                slots[slot] = segment
+        run = []
+        for slot in sorted(slots, reverse=True)[:LIVE_SEGMENTS]:
+            if run and slot != run[-1] - 1:
+                break
+            run.append(slot)
+        run.reverse()
+        pieces = [Piece(s.path, 0, s.size, s.start_ts, s.end_ts)
+                  for s in (slots[slot] for slot in run)]
+        media_sequence = run[0] if run else 0
+        return self.playlist(station, pieces, media_sequence, complete=False, byte_ranges=False)
+
+    # pylint: disable=too-many-arguments
+    async def send(self, writer: asyncio.StreamWriter, status: HTTPStatus, body: bytes = b"",
+                   content_type: str = None, headers: dict[str, str] = None,
+                   keep_alive: bool = True, head: bool = False):
+        lines = [f"HTTP/1.1 {status.value} {status.phrase}",
+                 f"Content-Length: {len(body)}",
+                 f"Connection: {'keep-alive' if keep_alive else 'close'}"]
+        if content_type:
+            lines.append(f"Content-Type: {content_type}")
+        lines += [f"{name}: {value}" for name, value in (headers or {}).items()]
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+        if not head:
+            writer.write(body)
+        await writer.drain()
+
+    async def send_pieces(self, writer: asyncio.StreamWriter, pieces: list[Piece],
+                          request_headers: dict[str, str], keep_alive: bool, head: bool,
+                          headers: dict[str, str] = None):
+        total = sum(piece.size for piece in pieces)
+        byte_range = parse_range(request_headers.get("range"), total)
+        first, last = byte_range or (0, total - 1)
+        status = HTTPStatus.PARTIAL_CONTENT if byte_range else HTTPStatus.OK
+        lines = [f"HTTP/1.1 {status.value} {status.phrase}",
+                 f"Content-Type: {AUDIO_TYPE}",
+                 f"Content-Length: {last - first + 1}",
+                 "Accept-Ranges: bytes",
+                 f"Connection: {'keep-alive' if keep_alive else 'close'}"]
+        if byte_range:
+            lines.append(f"Content-Range: bytes {first}-{last}/{total}")
+        lines += [f"{name}: {value}" for name, value in (headers or {}).items()]
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+        await writer.drain()
+        if head:
+            return
+        loop = asyncio.get_running_loop()
+        position = 0
+        for piece in pieces:
+            skip = max(0, first - position)
+            count = min(piece.size, last + 1 - position) - skip
+            position += piece.size
+            if count <= 0:
+                continue
+            with open(piece.path, "rb") as f:
+                await loop.sendfile(writer.transport, f, piece.start + skip, count)
+
+    async def run(self):
+        self.loop = asyncio.get_running_loop()
+        self.server = await asyncio.start_server(self.handle, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        logger.info("Serving %s on %s:%s", ", ".join(self.folders), self.host, self.port)
+        self.ready.set()
+        try:
+            async with self.server:
+                await self.server.serve_forever()
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self.executor.shutdown()
+            for store in self.stores.values():
+                store.close()
+
+    def stop(self, _sig=None, _frame=None):
+        if self.loop and self.server:
+            self.loop.call_soon_threadsafe(self.server.close)
+
+    def start(self):
+        asyncio.run(self.run())
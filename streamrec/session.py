@@ -14,3 +14,19 @@ class RecordingSession:
     ts_start: float = None
     adjusted_ts_start: float = None
     uuid: UUID = field(default_factory=uuid1)
+    # From clock_anchor seconds of stream time on, timestamps advance by
+    # 1 + clock_slew seconds per second, to follow the clock estimate
+    clock_anchor: float = 0.0
+    clock_slew: float = 0.0
+
+    def to_ts(self, seconds):
+        """Timestamps of stream times ``seconds`` (a float or an array)."""
+        return self.adjusted_ts_start + seconds + (seconds - self.clock_anchor) * self.clock_slew
+
+    def rebase(self, seconds: float, slew: float):
+        """Change the slew from ``seconds`` on, without moving any earlier timestamp."""
+        if seconds < self.clock_anchor:
+            return
+        self.adjusted_ts_start += (seconds - self.clock_anchor) * self.clock_slew
+        self.clock_anchor = seconds
+        self.clock_slew = slew
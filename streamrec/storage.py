@@ -0,0 +1,422 @@
+from collections import deque
+from dataclasses import dataclass
+import datetime
+import hashlib
+import hmac
+import http.client
+import io
+import logging
+import os
+from pathlib import Path
+import threading
+import time
+from urllib.parse import quote, urlsplit
+from xml.etree import ElementTree
+
+from streamrec.config import RecordingConfig
+
+from .index import SegmentIndex
+from .retention import RetentionPolicy, RetentionWorker
+from .timeline import backoff_delay
+
+logger = logging.getLogger(__name__)
+
+# Upload threads per process
+UPLOAD_WORKERS = 4
+# Segments waiting for an upload thread; beyond it, newly closed segments
+# stay local until `streamrec upload` catches up
+MAX_PENDING = 10000
+# Attempts per request, and the first delay between them in seconds
+UPLOAD_ATTEMPTS = 5
+RETRY_DELAY = 1.0
+RETRY_MAX_DELAY = 30.0
+# Files larger than this are uploaded in parts of this size. S3 needs at
+# least 5 MiB per part but the last one
+PART_SIZE = 8 * 1024 * 1024
+# Bytes sent between bandwidth checks
+CHUNK_SIZE = 64 * 1024
+# Seconds before an unresponsive storage server is given up
+NETWORK_TIMEOUT = 60
+S3_NAMESPACE = "{http://s3.amazonaws.com/doc/2006-03-01/}"
+
+
+class StorageError(Exception):
+    """An upload that failed; ``retry`` tells whether it may succeed later."""
+
+    def __init__(self, message: str, retry: bool = True):
+        super().__init__(message)
+        self.retry = retry
+
+
+class RateLimiter:
+    """Token bucket shared by the threads sending to one destination.
+    A rate of 0 means no limit."""
+
+    def __init__(self, rate: float = 0):
+        self.rate = rate
+        self.lock = threading.Lock()
+        # When the bytes sent so far will have been allowed
+        self.next_free = time.monotonic()
+
+    def consume(self, nbytes: int):
+        if not self.rate:
+            return
+        with self.lock:
+            now = time.monotonic()
+            # At most a second of unused bandwidth carries over
+            self.next_free = max(self.next_free, now - 1.0) + nbytes / self.rate
+            wait = self.next_free - now
+        if wait > 0:
+            time.sleep(wait)
+
+
+def read_chunks(f, size: int, limiter: RateLimiter):
+    """``size`` bytes of ``f`` in chunks, at the pace of ``limiter``."""
+    while size > 0:
+        chunk = f.read(min(CHUNK_SIZE, size))
+        if not chunk:
+            return
+        limiter.consume(len(chunk))
+        size -= len(chunk)
+        yield chunk
+
+
+class StorageBackend:
+    """Where closed segments are uploaded, by key (their path in the output folder)."""
+
+    def put(self, path: Path, key: str, limiter: RateLimiter):
+        raise NotImplementedError
+
+    def size(self, key: str) -> int:
+        """Size of the object at ``key``, or None if there is none."""
+        raise NotImplementedError
+
+
+class LocalStorage(StorageBackend):
+    """Copies segments to another folder, such as a network mount."""
+
+    def __init__(self, root: str):
+        self.root = Path(root)
+
+    def put(self, path: Path, key: str, limiter: RateLimiter):
+        target = self.root / key
+        tmp = target.with_name(target.name + ".part")
+        try:
+            target.parent.mkdir(parents=True, exist_ok=True)
+            with open(path, "rb") as src, open(tmp, "wb") as dst:
+                for chunk in read_chunks(src, os.fstat(src.fileno()).st_size, limiter):
+                    dst.write(chunk)
+                dst.flush()
+                os.fsync(dst.fileno())
+            os.replace(tmp, target)
+        except FileNotFoundError as e:
+            raise StorageError(str(e), retry=False) from e
+        except OSError as e:
+            raise StorageError(str(e)) from e
+
+    def size(self, key: str) -> int:
+        try:
+            return (self.root / key).stat().st_size
+        except FileNotFoundError:
+            return None
+
+
+def sign_v4(method: str, host: str, path: str, query: dict[str, str], headers: dict[str, str],
+            payload_hash: str, access_key: str, secret_key: str, region: str,
+            now: datetime.datetime) -> dict[str, str]:
+    """``headers`` with the AWS Signature Version 4 headers added."""
+    amz_date = now.strftime("%Y%m%dT%H%M%SZ")
+    headers = {**{k.lower(): str(v).strip() for k, v in headers.items()},
+               "host": host, "x-amz-date": amz_date, "x-amz-content-sha256": payload_hash}
+    signed = sorted(headers)
+    canonical_query = "&".join(f"{quote(k, safe='-_.~')}={quote(v, safe='-_.~')}"
+                               for k, v in sorted(query.items()))
+    canonical_request = "\n".join([
+        method, quote(path, safe="/-_.~"), canonical_query,
+        "".join(f"{name}:{headers[name]}\n" for name in signed), ";".join(signed),
+        payload_hash])
+    scope = f"{amz_date[:8]}/{region}/s3/aws4_request"
+    string_to_sign = "\n".join(["AWS4-HMAC-SHA256", amz_date, scope,
+                                hashlib.sha256(canonical_request.encode()).hexdigest()])
+    key = ("AWS4" + secret_key).encode()
+    for part in (amz_date[:8], region, "s3", "aws4_request"):
+        key = hmac.new(key, part.encode(), hashlib.sha256).digest()
+    signature = hmac.new(key, string_to_sign.encode(), hashlib.sha256).hexdigest()
+    headers["authorization"] = (f"AWS4-HMAC-SHA256 Credential={access_key}/{scope}, "
+                                f"SignedHeaders={';'.join(signed)}, Signature={signature}")
+    return headers
+
+
+# pylint: disable=too-many-instance-attributes
+class S3Storage(StorageBackend):
+    """Uploads segments to a bucket of S3 or an S3-compatible server (MinIO,
+    Ceph, R2...), with path-style URLs. Files larger than ``part_size`` are
+    sent as multipart uploads, and each request is retried on its own.
+    """
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, bucket: str, prefix: str = "", endpoint: str = None,
+                 access_key: str = None, secret_key: str = None, region: str = None,
+                 part_size: int = PART_SIZE, attempts: int = UPLOAD_ATTEMPTS,
+                 retry_delay: float = RETRY_DELAY):
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        self.region = region or os.environ.get("AWS_REGION", "us-east-1")
+        endpoint = endpoint or f"https://s3.{self.region}.amazonaws.com"
+        url = urlsplit(endpoint)
+        self.secure = url.scheme == "https"
+        self.host = url.netloc
+        self.access_key = access_key or os.environ.get("AWS_ACCESS_KEY_ID", "")
+        self.secret_key = secret_key or os.environ.get("AWS_SECRET_ACCESS_KEY", "")
+        self.part_size = part_size
+        self.attempts = attempts
+        self.retry_delay = retry_delay
+        # One keep-alive connection per upload thread
+        self.local = threading.local()
+
+    def object_path(self, key: str) -> str:
+        return f"/{self.bucket}/{self.prefix + '/' if self.prefix else ''}{key}"
+
+    def connection(self) -> http.client.HTTPConnection:
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            cls = http.client.HTTPSConnection if self.secure else http.client.HTTPConnection
+            conn = self.local.conn = cls(self.host, timeout=NETWORK_TIMEOUT)
+        return conn
+
+    # pylint: disable=too-many-arguments
+    def request(self, method: str, path: str, query: dict[str, str] = None, body: bytes = b"",
+                headers: dict[str, str] = None,
+                limiter: RateLimiter = None) -> tuple[int, dict[str, str], bytes]:
+        """Send a signed request, retrying it on connection errors and server
+        errors. Returns the status, the headers (lowercase) and the body."""
+        query = query or {}
+        payload_hash = hashlib.sha256(body).hexdigest()
+        url = quote(path, safe="/-_.~")
+        if query:
+            url += "?" + "&".join(f"{k}={quote(v, safe='-_.~')}" if v else k
+                                  for k, v in query.items())
+        headers = {**(headers or {}), "content-length": str(len(body))}
+        attempt = 0
+        while True:
+            signed = sign_v4(method, self.host, path, query, headers, payload_hash,
+                             self.access_key, self.secret_key, self.region,
+                             datetime.datetime.now(datetime.timezone.utc))
+            data = body
+            if limiter and limiter.rate and body:
+                data = read_chunks(io.BytesIO(body), len(body), limiter)
+            conn = self.connection()
+            try:
+                conn.request(method, url, body=data, headers=signed)
+                response = conn.getresponse()
+                content = response.read()
+                status = response.status
+                if status < 300 or (method == "HEAD" and status == 404):
+                    return status, {k.lower(): v for k, v in response.getheaders()}, content
+                error = StorageError(f"{method} {path}: {status} {content[:200]!r}",
+                                     retry=status >= 500 or status == 429)
+            except (OSError, http.client.HTTPException) as e:
+                conn.close()
+                self.local.conn = None
+                error = StorageError(f"{method} {path}: {e}")
+            attempt += 1
+            if not error.retry or attempt >= self.attempts:
+                raise error
+            delay = backoff_delay(attempt - 1, self.retry_delay, RETRY_MAX_DELAY)
+            logger.info("%s, retrying in %.2f seconds", error, delay)
+            time.sleep(delay)
+
+    def put(self, path: Path, key: str, limiter: RateLimiter):
+        object_path = self.object_path(key)
+        try:
+            size = os.stat(path).st_size
+            if size <= self.part_size:
+                self.request("PUT", object_path, body=Path(path).read_bytes(),
+                             headers={"content-type": "audio/mpeg"}, limiter=limiter)
+                return
+            self.put_multipart(path, object_path, size, limiter)
+        except FileNotFoundError as e:
+            raise StorageError(str(e), retry=False) from e
+
+    def put_multipart(self, path: Path, object_path: str, size: int, limiter: RateLimiter):
+        _, _, content = self.request("POST", object_path, {"uploads": ""},
+                                     headers={"content-type": "audio/mpeg"})
+        result = ElementTree.fromstring(content)
+        upload_id = result.findtext(f"{S3_NAMESPACE}UploadId") or result.findtext("UploadId")
+        if not upload_id:
+            raise StorageError(f"No upload id for {object_path}: {content[:200]!r}")
+        try:
+            etags = []
+            with open(path, "rb") as f:
+                for number, offset in enumerate(range(0, size, self.part_size), 1):
+                    f.seek(offset)
+                    part = f.read(min(self.part_size, size - offset))
+                    _, headers, _ = self.request(
+                        "PUT", object_path, {"partNumber": str(number), "uploadId": upload_id},
+                        body=part, limiter=limiter)
+                    etags.append(headers.get("etag"))
+            complete = "".join(f"<Part><PartNumber>{number}</PartNumber><ETag>{etag}</ETag></Part>"
+                               for number, etag in enumerate(etags, 1))
+            self.request("POST", object_path, {"uploadId": upload_id},
+                         body=f"<CompleteMultipartUpload>{complete}</CompleteMultipartUpload>"
+                         .encode())
+        except (StorageError, OSError):
+            try:
+                self.request("DELETE", object_path, {"uploadId": upload_id})
+            except StorageError as e:
+                logger.warning("Could not abort the upload of %s: %s", object_path, e)
+            raise
+
+    def size(self, key: str) -> int:
+        status, headers, _ = self.request("HEAD", self.object_path(key))
+        if status == 404:
+            return None
+        return int(headers["content-length"])
+
+
+def storage_backend(url: str, endpoint: str = None) -> StorageBackend:
+    """The backend of ``s3://bucket/prefix``, ``file:///folder`` or a folder."""
+    parts = urlsplit(url)
+    if parts.scheme == "s3":
+        return S3Storage(parts.netloc, parts.path, endpoint)
+    if parts.scheme == "file":
+        return LocalStorage(parts.path)
+    if parts.scheme:
+        raise ValueError(f"Unsupported storage URL: {url}")
+    return LocalStorage(url)
+
+
+@dataclass
+class UploadPolicy:
+    folder: str
+    backend: StorageBackend
+    delete_after_upload: bool = False
+    # Bytes per second sent for this folder (0: no limit)
+    bandwidth: float = 0
+
+    def __post_init__(self):
+        self.limiter = RateLimiter(self.bandwidth)
+
+    @classmethod
+    def from_config(cls, config: RecordingConfig) -> "UploadPolicy":
+        """The policy of a stream, or None if it keeps its segments local."""
+        if not config.storage_url:
+            return None
+        return cls(config.output_folder, storage_backend(config.storage_url,
+                                                         config.storage_endpoint),
+                   config.delete_after_upload, config.upload_bandwidth)
+
+
+class Uploader:
+    """Uploads closed segments to the storage backend of their output folder
+    from a pool of threads.
+
+    ``submit`` only appends the path to a queue of at most ``max_pending``
+    segments, and leaves the segment local when the queue is full, so the
+    writer never waits for the network. Each request is retried with
+    backoff. Once a segment is uploaded, its local copy is deleted if the
+    policy says so, and removed from the index.
+    """
+
+    def __init__(self, max_workers: int = UPLOAD_WORKERS, max_pending: int = MAX_PENDING):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.policies: dict[str, UploadPolicy] = {}
+        self.pending: deque[tuple[str, Path]] = deque()
+        self.cond = threading.Condition()
+        self.stopping = False
+        self.threads: list[threading.Thread] = []
+        self.uploaded = 0
+        self.uploaded_bytes = 0
+        self.failed = 0
+        self.deferred = 0
+
+    def add(self, policy: UploadPolicy):
+        with self.cond:
+            self.policies[str(policy.folder)] = policy
+
+    def remove(self, folder: str):
+        with self.cond:
+            self.policies.pop(str(folder), None)
+
+    def submit(self, folder: str, path: Path):
+        with self.cond:
+            if len(self.pending) >= self.max_pending:
+                self.deferred += 1
+                logger.warning("Upload queue full, leaving %s local", path)
+                return
+            self.pending.append((str(folder), Path(path)))
+            self.cond.notify()
+
+    def upload(self, policy: UploadPolicy, path: Path) -> bool:
+        key = path.relative_to(policy.folder).as_posix()
+        try:
+            size = path.stat().st_size
+            policy.backend.put(path, key, policy.limiter)
+        except (StorageError, OSError) as e:
+            self.failed += 1
+            logger.error("Could not upload %s: %s", path, e)
+            return False
+        self.uploaded += 1
+        self.uploaded_bytes += size
+        if policy.delete_after_upload:
+            self.delete_local(policy, path)
+        return True
+
+    @staticmethod
+    def delete_local(policy: UploadPolicy, path: Path):
+        index = SegmentIndex(policy.folder)
+        try:
+            segment = index.get(path)
+            if segment:
+                RetentionWorker.expire(RetentionPolicy(policy.folder), index, segment)
+            else:
+                path.unlink(missing_ok=True)
+        finally:
+            index.close()
+
+    def run(self):
+        while True:
+            with self.cond:
+                while not self.pending and not self.stopping:
+                    self.cond.wait()
+                if not self.pending:
+                    return
+                folder, path = self.pending.popleft()
+                policy = self.policies.get(folder)
+            if policy:
+                self.upload(policy, path)
+
+    def start(self):
+        self.stopping = False
+        self.threads = [threading.Thread(target=self.run, name=f"upload-{i}", daemon=True)
+                        for i in range(self.max_workers)]
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self, wait: bool = True):
+        """Stop after the segments already queued, unless not ``wait``."""
+        with self.cond:
+            if not wait:
+                self.pending.clear()
+            self.stopping = True
+            self.cond.notify_all()
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+    def catch_up(self, policy: UploadPolicy) -> int:
+        """Queue the closed segments of the folder of ``policy`` that its
+        backend does not have, or has with another size. Returns how many."""
+        index = SegmentIndex(policy.folder)
+        try:
+            segments = index.closed_before(float("inf"))
+        finally:
+            index.close()
+        queued = 0
+        for segment in segments:
+            key = segment.path.relative_to(policy.folder).as_posix()
+            if policy.backend.size(key) != segment.size:
+                self.submit(policy.folder, segment.path)
+                queued += 1
+        return queued
@@ -0,0 +1,180 @@
+from dataclasses import dataclass
+from datetime import datetime, timezone
+import io
+import logging
+import mmap
+import os
+from pathlib import Path
+import re
+from typing import BinaryIO, Iterator
+
+from streamrec.frames import find_frame
+from streamrec.index import IndexedSegment, SegmentIndex
+
+logger = logging.getLogger(__name__)
+
+ISO_DURATION = re.compile(
+    r"^P(?:(?P<days>\d+(?:\.\d+)?)D)?"
+    r"(?:T(?:(?P<hours>\d+(?:\.\d+)?)H)?(?:(?P<minutes>\d+(?:\.\d+)?)M)?"
+    r"(?:(?P<seconds>\d+(?:\.\d+)?)S)?)?$", re.IGNORECASE)
+DURATION_SECONDS = {"days": 86400, "hours": 3600, "minutes": 60, "seconds": 1}
+
+
+def parse_timestamp(value: str) -> float:
+    """Parse a Unix timestamp or an ISO 8601 date (UTC unless it has an offset)."""
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    if value.endswith(("Z", "z")):
+        value = value[:-1] + "+00:00"
+    dt = datetime.fromisoformat(value)
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.timestamp()
+
+
+def parse_duration(value: str) -> float:
+    """Parse an ISO 8601 duration such as ``PT30M`` or ``PT1H2M3.5S`` into seconds."""
+    match = ISO_DURATION.match(value)
+    if not match or value.upper() in ("P", "PT") or value.upper().endswith("T"):
+        raise ValueError(f"Invalid duration: {value}")
+    return sum(float(amount) * DURATION_SECONDS[unit]
+               for unit, amount in match.groupdict().items() if amount)
+
+
+@dataclass
+class Piece:
+    """Bytes ``[start, end)`` of a segment file, playing from ``start_ts`` to ``end_ts``."""
+    path: Path
+    start: int
+    end: int
+    start_ts: float
+    end_ts: float
+
+    @property
+    def size(self) -> int:
+        return self.end - self.start
+
+
+def segment_file(segment: IndexedSegment) -> Path:
+    """The file of a segment, which still has its .tmp suffix while it is written."""
+    if segment.end_ts is None:
+        tmp = segment.path.with_name(segment.path.name + ".tmp")
+        if tmp.exists():
+            return tmp
+    return segment.path
+
+
+class SegmentStore:
+    """Reads time ranges of the recordings in an output folder.
+
+    Ranges are found through the segment index and cut at frame boundaries,
+    then copied as they are: with ``os.sendfile`` into files and sockets, or
+    as ``memoryview`` slices of a memory map.
+    """
+
+    def __init__(self, folder: str):
+        self.folder = Path(folder)
+        self.index = SegmentIndex(folder)
+
+    def close(self):
+        self.index.close()
+
+    def plan(self, start: float, end: float) -> list[Piece]:
+        """The pieces of segment files that make up ``[start, end)``, in order.
+
+        When segments overlap (e.g. two sessions recording at the same
+        time), each one continues where the previous piece ended.
+        """
+        pieces = []
+        cursor = start
+        for segment in self.index.segments(start, end):
+            if segment.end_ts is not None and segment.end_ts <= cursor:
+                continue
+            piece = self.cut(segment, max(cursor, start), end)
+            if piece and piece.size:
+                pieces.append(piece)
+                cursor = piece.end_ts
+        return pieces
+
+    def cut(self, segment: IndexedSegment, start: float, end: float) -> Piece:
+        path = segment_file(segment)
+        try:
+            size = path.stat().st_size if segment.end_ts is None else segment.size
+        except FileNotFoundError:
+            logger.warning("Missing segment file %s", path)
+            return None
+        whole_start = start <= segment.start_ts
+        whole_end = segment.end_ts is not None and end >= segment.end_ts
+        if whole_start and whole_end:
+            return Piece(path, 0, size, segment.start_ts, segment.end_ts)
+        if not size:
+            return None
+
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ) as data:
+            if whole_start:
+                start_offset, start_ts = 0, segment.start_ts
+            else:
+                checkpoint_ts, checkpoint_offset = self.index.checkpoint_before(segment, start)
+                start_offset, start_ts, header = find_frame(
+                    data, checkpoint_offset, checkpoint_ts, start)
+                if not header and start_offset == checkpoint_offset:
+                    # Not MP3: cut at the checkpoint
+                    start_offset, start_ts = checkpoint_offset, checkpoint_ts
+            if whole_end:
+                end_offset, end_ts = size, segment.end_ts
+            else:
+                checkpoint_ts, checkpoint_offset = self.index.checkpoint_before(
+                    segment, max(start_ts, end))
+                checkpoint_offset = max(checkpoint_offset, start_offset)
+                end_offset, end_ts, header = find_frame(
+                    data, checkpoint_offset, max(checkpoint_ts, start_ts), end)
+                if header and end_ts < end:
+                    end_offset += header.length
+                    end_ts += header.duration
+                elif not header and end_offset == checkpoint_offset:
+                    after = self.index.checkpoint_after(segment, end)
+                    end_ts, end_offset = after or (segment.end_ts or end, size)
+        return Piece(path, start_offset, end_offset, start_ts, end_ts)
+
+    def extract(self, start: float, end: float, out: BinaryIO) -> int:
+        """Write ``[start, end)`` to ``out``. Returns the number of bytes written."""
+        try:
+            out_fd = out.fileno()
+        except (AttributeError, io.UnsupportedOperation):
+            out_fd = None
+        if out_fd is not None:
+            out.flush()
+        written = 0
+        for piece in self.plan(start, end):
+            if out_fd is not None:
+                with open(piece.path, "rb") as f:
+                    offset = piece.start
+                    while offset < piece.end:
+                        sent = os.sendfile(out_fd, f.fileno(), offset, piece.end - offset)
+                        if not sent:
+                            break
+                        offset += sent
+                    written += offset - piece.start
+            else:
+                for view in self.read_piece(piece):
+                    written += out.write(view)
+        return written
+
+    def read(self, start: float, end: float) -> Iterator[memoryview]:
+        """Yield the bytes of ``[start, end)`` as views of memory mapped files.
+
+        Each view is only valid until the next one is requested.
+        """
+        for piece in self.plan(start, end):
+            yield from self.read_piece(piece)
+
+    @staticmethod
+    def read_piece(piece: Piece) -> Iterator[memoryview]:
+        if not piece.size:
+            return
+        with open(piece.path, "rb") as f, \
+                mmap.mmap(f.fileno(), piece.end, access=mmap.ACCESS_READ) as data:
+            with memoryview(data) as view, view[piece.start:piece.end] as chunk:
+                yield chunk
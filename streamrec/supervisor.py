@@ -0,0 +1,345 @@
+from dataclasses import dataclass, field, replace
+import logging
+import multiprocessing
+from multiprocessing.connection import Connection, wait
+import os
+from pathlib import Path
+import signal
+import threading
+import time
+
+from streamrec.config import RecordingConfig, load_stream_configs
+
+from .engine import Engine
+from .metrics import MetricsServer
+from .trace import process_tracer
+
+logger = logging.getLogger("supervisor")
+
+STATS_TIMEOUT = 5
+STOP_TIMEOUT = 30
+
+
+def worker_main(conn: Connection, max_threads: int, max_queue_bytes: int = None,
+                trace_out: str = None, trace_sample: int = 1):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    if trace_out:
+        process_tracer.start(trace_out, trace_sample)
+    engine = Engine([], max_workers=max_threads, persistent=True,
+                    max_queue_bytes=max_queue_bytes)
+    signal.signal(signal.SIGTERM, engine.stop)
+
+    def serve_commands():
+        engine.ready.wait()
+        while True:
+            try:
+                command, arg = conn.recv()
+            except (EOFError, OSError):
+                command, arg = "stop", None
+            if command == "add":
+                engine.add_stream(arg)
+            elif command == "remove":
+                engine.remove_stream(arg)
+            elif command == "stats":
+                conn.send((arg, engine.stats()))
+            elif command == "stop":
+                engine.stop()
+                return
+
+    threading.Thread(target=serve_commands, daemon=True).start()
+    try:
+        engine.start()
+    finally:
+        process_tracer.stop()
+
+
+@dataclass
+class StreamLoad:
+    bytes: float = 0
+    cpu: float = 0
+    ts: float = None
+    bytes_rate: float = None
+    cpu_rate: float = None
+
+    def update(self, stats: dict[str, float], ts: float):
+        if self.ts is not None and stats["bytes"] >= self.bytes and ts > self.ts:
+            elapsed = ts - self.ts
+            self.bytes_rate = (stats["bytes"] - self.bytes) / elapsed
+            self.cpu_rate = (stats["cpu"] - self.cpu) / elapsed
+        self.bytes = stats["bytes"]
+        self.cpu = stats["cpu"]
+        self.ts = ts
+
+
+def stream_weights(loads: dict[str, StreamLoad]) -> dict[str, float]:
+    """Weight of each stream as its share of measured CPU plus its share of bytes.
+
+    Streams without measurements yet get the average weight.
+    """
+    measured = {n: l for n, l in loads.items() if l.bytes_rate is not None}
+    total_bytes = sum(l.bytes_rate for l in measured.values())
+    total_cpu = sum(l.cpu_rate for l in measured.values())
+    weights = {}
+    for name, load in measured.items():
+        weight = 0.0
+        if total_bytes:
+            weight += load.bytes_rate / total_bytes
+        if total_cpu:
+            weight += load.cpu_rate / total_cpu
+        weights[name] = weight
+    default = sum(weights.values()) / len(weights) if weights else 1.0
+    for name in loads:
+        weights.setdefault(name, default or 1.0)
+    return weights
+
+
+def plan_move(assignment: dict[int, set[str]], weights: dict[str, float],
+              threshold: float) -> tuple[str, int, int]:
+    """Pick one stream to move from the busiest worker to the idlest one.
+
+    Returns ``(stream, source, target)``, or None when the gap between both
+    workers is below ``threshold`` times the average worker load.
+    """
+    if len(assignment) < 2:
+        return None
+    loads = {w: sum(weights[s] for s in streams)
+             for w, streams in assignment.items()}
+    source = max(loads, key=loads.get)
+    target = min(loads, key=loads.get)
+    gap = loads[source] - loads[target]
+    margin = threshold * sum(loads.values()) / len(loads)
+    if gap <= margin:
+        return None
+    # The best stream leaves both workers closest to even; it is only moved
+    # if that shrinks the gap by more than the margin, so moves never flap
+    stream = min(assignment[source], key=lambda s: abs(gap - 2 * weights[s]))
+    if abs(gap - 2 * weights[stream]) >= gap - margin:
+        return None
+    return stream, source, target
+
+
+@dataclass
+class WorkerHandle:
+    index: int
+    process: multiprocessing.Process = None
+    conn: Connection = None
+    streams: set[str] = field(default_factory=set)
+    restarts: int = 0
+
+
+# pylint: disable=too-many-instance-attributes
+class Supervisor:
+    """Spreads stream configs across a pool of worker processes, each running an Engine."""
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, streams_path: str, workers: int = None, max_threads: int = None,
+                 stats_interval: float = 10, rebalance_interval: float = 300,
+                 imbalance_threshold: float = 0.25, max_queue_bytes: int = None,
+                 metrics_port: int = None, trace_out: str = None, trace_sample: int = 1):
+        self.streams_path = streams_path
+        self.max_threads = max_threads
+        self.max_queue_bytes = max_queue_bytes
+        self.metrics_port = metrics_port
+        # Each worker writes its own trace, trace_out with the worker index
+        # before the suffix
+        self.trace_out = trace_out
+        self.trace_sample = trace_sample
+        # Last stats reported for each stream by its worker
+        self.stats: dict[str, dict] = {}
+        self.stats_interval = stats_interval
+        self.rebalance_interval = rebalance_interval
+        self.imbalance_threshold = imbalance_threshold
+        self.workers = [WorkerHandle(i) for i in range(workers or os.cpu_count())]
+        self.configs: dict[str, RecordingConfig] = {}
+        self.loads: dict[str, StreamLoad] = {}
+        # Number of the last stats request, which workers send back with
+        # their reply so that late replies to earlier ones are dropped
+        self.stats_request = 0
+        self.stopping = False
+        self.reload_requested = False
+
+    def start_worker(self, worker: WorkerHandle):
+        conn, child_conn = multiprocessing.Pipe()
+        worker.conn = conn
+        trace_out = None
+        if self.trace_out:
+            path = Path(self.trace_out)
+            trace_out = str(path.with_name(f"{path.stem}.{worker.index}{path.suffix}"))
+        worker.process = multiprocessing.Process(
+            target=worker_main, args=(child_conn, self.max_threads, self.max_queue_bytes,
+                                      trace_out, self.trace_sample),
+            name=f"streamrec-worker-{worker.index}", daemon=True)
+        worker.process.start()
+        child_conn.close()
+        for name in worker.streams:
+            worker.conn.send(("add", self.configs[name]))
+        logger.info("Started worker %s (pid %s) with %s streams",
+                    worker.index, worker.process.pid, len(worker.streams))
+
+    def send(self, worker: WorkerHandle, command: str, arg=None):
+        try:
+            worker.conn.send((command, arg))
+        except (BrokenPipeError, OSError):
+            logger.warning("Worker %s is not reachable", worker.index)
+
+    def assignment(self) -> dict[int, set[str]]:
+        return {w.index: w.streams for w in self.workers}
+
+    def add_stream(self, config: RecordingConfig, initial: bool = False):
+        weights = stream_weights(self.loads)
+        worker = min(self.workers,
+                     key=lambda w: sum(weights.get(s, 0) for s in w.streams))
+        self.configs[config.name] = config
+        self.loads[config.name] = StreamLoad()
+        worker.streams.add(config.name)
+        logger.info("Adding stream %s to worker %s", config.name, worker.index)
+        if not initial:
+            # Other live streams may share the output folder
+            config = replace(config, close_open_files_on_start=False)
+        self.send(worker, "add", config)
+
+    def remove_stream(self, name: str):
+        for worker in self.workers:
+            if name in worker.streams:
+                logger.info("Removing stream %s from worker %s", name, worker.index)
+                worker.streams.remove(name)
+                self.send(worker, "remove", name)
+        self.configs.pop(name, None)
+        self.loads.pop(name, None)
+
+    def reload(self):
+        logger.info("Reloading %s", self.streams_path)
+        try:
+            configs = {c.name: c for c in load_stream_configs(self.streams_path)}
+        # pylint: disable=broad-except
+        except Exception as e:
+            logger.error("Could not reload streams, keeping current ones: %s", e)
+            return
+        for name in list(self.configs):
+            if name not in configs or configs[name] != self.configs[name]:
+                self.remove_stream(name)
+        for name, config in configs.items():
+            if name not in self.configs:
+                self.add_stream(config)
+
+    def check_workers(self):
+        for worker in self.workers:
+            if not worker.process.is_alive():
+                worker.restarts += 1
+                logger.error("Worker %s exited with code %s, restarting (restart #%s)",
+                             worker.index, worker.process.exitcode, worker.restarts)
+                worker.conn.close()
+                self.start_worker(worker)
+
+    def collect_stats(self):
+        now = time.time()
+        self.stats_request += 1
+        for worker in self.workers:
+            self.send(worker, "stats", self.stats_request)
+        replies = self.receive_stats()
+        for worker in self.workers:
+            stats = replies.get(worker.index)
+            if stats is None:
+                continue
+            for name, values in stats.items():
+                if name in self.loads and name in worker.streams:
+                    self.loads[name].update(values, now)
+                    self.stats[name] = values
+        self.stats = {name: values for name, values in self.stats.items()
+                      if name in self.configs}
+
+    def receive_stats(self) -> dict[int, dict]:
+        """The replies of the workers to the last stats request, by worker
+        index. All of them are waited for together, for at most STATS_TIMEOUT."""
+        deadline = time.monotonic() + STATS_TIMEOUT
+        waiting = {worker.conn: worker for worker in self.workers
+                   if worker.conn and not worker.conn.closed}
+        replies = {}
+        while waiting:
+            ready = wait(list(waiting), max(0.0, deadline - time.monotonic()))
+            if not ready:
+                break
+            for conn in ready:
+                try:
+                    request, stats = conn.recv()
+                except (EOFError, OSError):
+                    del waiting[conn]
+                    continue
+                if request == self.stats_request:
+                    replies[waiting.pop(conn).index] = stats
+        for worker in waiting.values():
+            logger.warning("Worker %s did not report stats", worker.index)
+        return replies
+
+    def rebalance(self):
+        if any(load.bytes_rate is None for load in self.loads.values()):
+            return
+        move = plan_move(self.assignment(), stream_weights(self.loads),
+                         self.imbalance_threshold)
+        if not move:
+            return
+        name, source, target = move
+        logger.info("Rebalancing: moving stream %s from worker %s to worker %s",
+                    name, source, target)
+        self.workers[source].streams.remove(name)
+        self.send(self.workers[source], "remove", name)
+        self.workers[target].streams.add(name)
+        # The source worker may still be closing the current segment
+        self.send(self.workers[target], "add",
+                  replace(self.configs[name], close_open_files_on_start=False))
+        self.loads[name] = StreamLoad()
+
+    def on_reload_signal(self, _sig, _frame):
+        self.reload_requested = True
+
+    def stop(self, sig, _frame):
+        logger.info("Received signal %s", signal.Signals(sig).name)
+        self.stopping = True
+
+    def shutdown(self):
+        for worker in self.workers:
+            self.send(worker, "stop")
+        deadline = time.time() + STOP_TIMEOUT
+        for worker in self.workers:
+            worker.process.join(max(0, deadline - time.time()))
+            if worker.process.is_alive():
+                logger.warning("Worker %s did not stop, terminating", worker.index)
+                worker.process.terminate()
+                worker.process.join()
+
+    def run(self):
+        signal.signal(signal.SIGINT, self.stop)
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGHUP, self.on_reload_signal)
+
+        metrics_server = None
+        if self.metrics_port:
+            metrics_server = MetricsServer(lambda: self.stats, host="0.0.0.0",
+                                           port=self.metrics_port)
+            metrics_server.start()
+        for worker in self.workers:
+            self.start_worker(worker)
+        for config in load_stream_configs(self.streams_path):
+            self.add_stream(config, initial=True)
+
+        next_stats = time.time() + self.stats_interval
+        next_rebalance = time.time() + self.rebalance_interval
+        while not self.stopping:
+            time.sleep(0.5)
+            if self.stopping:
+                break
+            self.check_workers()
+            if self.reload_requested:
+                self.reload_requested = False
+                self.reload()
+            if time.time() >= next_stats:
+                next_stats = time.time() + self.stats_interval
+                self.collect_stats()
+            if time.time() >= next_rebalance:
+                next_rebalance = time.time() + self.rebalance_interval
+                self.rebalance()
+        self.shutdown()
+        if metrics_server:
+            metrics_server.stop()
+        logger.info("Supervisor finished")
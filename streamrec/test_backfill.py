@@ -0,0 +1,101 @@
+from pathlib import Path
+import tempfile
+import unittest
+from unittest import mock
+
+from streamrec.backfill import backfill
+from streamrec.config import RecordingConfig
+from streamrec.index import SegmentIndex
+from streamrec.ingest import NativeDemuxer
+from streamrec.journal import MemoryBudget
+from streamrec.recorder import Recorder
+from streamrec.test_index import START_TS
+from streamrec.test_ingest import encode
+
+
+def without_session(path: Path) -> str:
+    """The path of a segment without the session id that ends its name."""
+    return str(path.parent / path.name.rsplit("_", 1)[0])
+
+
+def folder_files(folder: str) -> dict[str, bytes]:
+    return {without_session(path.relative_to(folder)): path.read_bytes()
+            for path in sorted(Path(folder).rglob("*.mp3"))}
+
+
+def folder_segments(folder: str) -> list[tuple]:
+    index = SegmentIndex(folder)
+    try:
+        return [(without_session(Path(s.path).relative_to(folder)), s.start_ts, s.end_ts,
+                 s.size) for s in index.segments(0, float("inf"))]
+    finally:
+        index.close()
+
+
+class TestBackfill(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.data = encode("mp3", "mp3", 25)
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.source = Path(self.tmp.name) / "dump.mp3"
+        self.source.write_bytes(self.data)
+
+    def config(self, name: str) -> RecordingConfig:
+        return RecordingConfig(url="", output_folder=str(Path(self.tmp.name) / name),
+                               segment_duration=10, durability="none",
+                               path_template="{station}/{HH}", name="station")
+
+    def record_live(self, config: RecordingConfig, start_ts: float):
+        """Record the packets of the dump as the live recorder does, with a
+        clock estimate that never moves from ``start_ts``."""
+        recorder = Recorder(config)
+        recorder.budget = MemoryBudget()
+        recorder.prepare_output()
+        recorder.session.adjusted_ts_start = start_ts
+        demuxer = NativeDemuxer("mp3")
+        with mock.patch.object(recorder, "update_clock"):
+            for i in range(0, len(self.data), 4096):
+                packets = demuxer.feed(self.data[i:i + 4096])
+                if packets:
+                    recorder.enqueue_many(packets)
+                    recorder.flush()
+        recorder.close_output()
+
+    def test_same_as_live_recording(self):
+        start_ts = START_TS + 3.25
+        live, backfilled = self.config("live"), self.config("backfill")
+        self.record_live(live, start_ts)
+        [result] = backfill(backfilled, [(str(self.source), start_ts)])
+        self.assertEqual(folder_files(backfilled.output_folder), folder_files(live.output_folder))
+        self.assertEqual(len(folder_files(backfilled.output_folder)), 3)
+        self.assertEqual(folder_segments(backfilled.output_folder),
+                         folder_segments(live.output_folder))
+        self.assertEqual(result.segments, 3)
+        self.assertAlmostEqual(result.seconds, 25, delta=0.1)
+
+    def test_libav_source(self):
+        source = Path(self.tmp.name) / "dump.ogg"
+        source.write_bytes(encode("libopus", "ogg", 5, 48000))
+        config = self.config("backfill")
+        [result] = backfill(config, [(str(source), START_TS)])
+        [segment] = folder_segments(config.output_folder)
+        self.assertEqual(segment[1], START_TS)
+        self.assertAlmostEqual(segment[2] - START_TS, 5, delta=0.05)
+        self.assertEqual(segment[3], result.bytes)
+
+    def test_sources_in_parallel(self):
+        config = self.config("backfill")
+        results = backfill(config, [(str(self.source), START_TS),
+                                    (str(self.source), START_TS + 100)], workers=2)
+        self.assertEqual(len({r.session for r in results}), 2)
+        segments = folder_segments(config.output_folder)
+        self.assertEqual(len(segments), 6)
+        self.assertEqual(segments[0][1], START_TS)
+        self.assertEqual(segments[3][1], START_TS + 100)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,78 @@
+import unittest
+
+import numpy as np
+
+from streamrec.clock import MAX_SLEW, SETTLE_SECONDS, ClockEstimator
+from streamrec.config import RecordingConfig
+from streamrec.session import RecordingSession
+
+START_TS = 1_700_000_000.0
+FRAME = 0.026
+
+
+def live_packets(first: float, last: float, offset: float, skew: float = 0.0,
+                 jitter: float = 0.02) -> tuple[np.ndarray, np.ndarray]:
+    """Stream seconds and received timestamps of packets received ``offset``
+    plus a random delay after they were live."""
+    seconds = np.arange(first, last, FRAME)
+    delays = np.random.default_rng(0).uniform(0, jitter, len(seconds))
+    return seconds, START_TS + offset + seconds * (1 + skew) + delays
+
+
+class TestClockEstimator(unittest.TestCase):
+    def test_settles_after_burst(self):
+        clock = ClockEstimator()
+        # 5 seconds of buffered audio received at once
+        for seconds in np.arange(0, 5, FRAME):
+            clock.arrived(seconds, START_TS)
+        self.assertFalse(clock.settled)
+        seconds = 5.0
+        while not clock.settled:
+            clock.arrived(seconds, START_TS + seconds - 5)
+            seconds += FRAME
+        self.assertAlmostEqual(seconds - 5, SETTLE_SECONDS, delta=2 * FRAME)
+
+    def test_offset_is_lower_envelope(self):
+        clock = ClockEstimator()
+        self.assertIsNone(clock.offset(0))
+        seconds, received = live_packets(0, 120, -5)
+        clock.observe(seconds, received)
+        self.assertAlmostEqual(clock.offset(60) - START_TS, -5, delta=0.001)
+
+    def test_follows_skew(self):
+        clock = ClockEstimator()
+        skew = 0.0002
+        for hour in range(2):
+            clock.observe(*live_packets(hour * 3600, (hour + 1) * 3600, 0, skew))
+        self.assertAlmostEqual(clock.slope, skew, delta=0.00002)
+        self.assertAlmostEqual(clock.offset(7200) - START_TS, 7200 * skew, delta=0.02)
+
+        fixed = ClockEstimator(skew=False)
+        for hour in range(2):
+            fixed.observe(*live_packets(hour * 3600, (hour + 1) * 3600, 0, skew))
+        self.assertEqual(fixed.slope, 0)
+
+    def test_slew_is_bounded(self):
+        clock = ClockEstimator()
+        clock.observe(*live_packets(0, 10, 0))
+        self.assertEqual(clock.slew(5, START_TS + 5 + 100), -MAX_SLEW)
+        self.assertEqual(clock.slew(5, START_TS + 5 - 100), MAX_SLEW)
+        self.assertAlmostEqual(clock.slew(5, START_TS + 5), 0, delta=0.001)
+
+
+class TestSessionClock(unittest.TestCase):
+    def test_rebase_keeps_timestamps_monotonic(self):
+        session = RecordingSession(RecordingConfig(url="", output_folder=""),
+                                   adjusted_ts_start=START_TS)
+        seconds = np.arange(0, 30, FRAME)
+        ts = []
+        for i, start in enumerate(range(0, 30, 10)):
+            session.rebase(float(start), MAX_SLEW if i % 2 else -MAX_SLEW)
+            batch = seconds[(seconds >= start) & (seconds < start + 10)]
+            ts.append(session.to_ts(batch))
+        self.assertAlmostEqual(ts[1][0], START_TS + 10 - 10 * MAX_SLEW, delta=2 * FRAME)
+        self.assertTrue(np.all(np.diff(np.concatenate(ts)) > 0))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,111 @@
+from dataclasses import replace
+import tempfile
+import unittest
+from unittest import mock
+
+from streamrec.compaction import (DELETE_GRACE, CompactionPolicy, Compactor, archive_path,
+                                  build_archive)
+from streamrec.config import RecordingConfig
+from streamrec.index import IndexWriter, SegmentIndex, rebuild_index
+from streamrec.segmentfile import SegmentFile
+from streamrec.session import RecordingSession
+from streamrec.store import SegmentStore
+from streamrec.test_index import START_TS, encode_mp3, make_batch
+from streamrec.verify import verify
+
+
+class TestCompaction(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.packets = encode_mp3(12)
+        cls.compactor = Compactor()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.compactor.stop()
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        config = RecordingConfig(url="", output_folder=self.folder.name, segment_duration=2,
+                                 durability="none")
+        session = RecordingSession(config=config)
+        session.adjusted_ts_start = START_TS
+        index = IndexWriter(self.folder.name, session.uuid)
+        segment = None
+        for segment_ts, batch in make_batch(session, self.packets).split_by_segment():
+            if segment:
+                segment.close()
+            segment = SegmentFile(session, segment_ts, index=index)
+            segment.write(batch)
+        segment.close()
+        index.close()
+        self.policy = CompactionPolicy(self.folder.name, "hourly", min_age=60, sync=False)
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def read(self, start: float, end: float) -> bytes:
+        store = SegmentStore(self.folder.name)
+        try:
+            return b"".join(bytes(view) for view in store.read(start, end))
+        finally:
+            store.close()
+
+    def segments(self):
+        index = SegmentIndex(self.folder.name)
+        try:
+            return index.oldest(100)
+        finally:
+            index.close()
+
+    def test_compact(self):
+        segments = self.segments()
+        everything = b"".join(s.path.read_bytes() for s in segments)
+        middle = self.read(START_TS + 3.3, START_TS + 7.9)
+
+        # The hour is not over yet
+        self.assertEqual(self.compactor.compact(self.policy, now=START_TS + 3600), 0)
+        now = START_TS + 3600 + 60
+        self.assertEqual(self.compactor.compact(self.policy, now=now), 1)
+        archives = self.segments()
+        self.assertEqual(len(archives), 1)
+        archive = archives[0]
+        self.assertTrue(archive.path.name.endswith(".hourly.mp3"))
+        self.assertEqual(archive.path.read_bytes(), everything)
+        self.assertEqual(archive.start_ts, segments[0].start_ts)
+        self.assertEqual(archive.end_ts, segments[-1].end_ts)
+        self.assertEqual(self.read(START_TS + 3.3, START_TS + 7.9), middle)
+        result = verify(self.folder.name)
+        self.assertEqual((result.segments, result.unchecked, result.problems), (1, 0, []))
+
+        # The segments are deleted after the grace period
+        self.assertTrue(all(s.path.exists() for s in segments))
+        self.compactor.compact(self.policy, now=now + DELETE_GRACE)
+        self.assertFalse(any(s.path.exists() for s in segments))
+        self.assertEqual(self.segments(), archives)
+
+    def test_submits_archives(self):
+        features, uploader = mock.Mock(), mock.Mock()
+        self.compactor.features, self.compactor.uploader = features, uploader
+        self.addCleanup(setattr, self.compactor, "features", None)
+        self.addCleanup(setattr, self.compactor, "uploader", None)
+        policy = replace(self.policy, features=True)
+        self.assertEqual(self.compactor.compact(policy, now=START_TS + 3600 + 60), 1)
+        [archive] = self.segments()
+        features.submit.assert_called_once_with(archive.path)
+        uploader.submit.assert_called_once_with(self.folder.name, archive.path)
+
+    def test_resume_and_reindex(self):
+        segments = self.segments()
+        # An archive left by an interrupted pass is written again
+        path = archive_path(segments[0], "hourly")
+        build_archive([str(segments[0].path)], str(path), False)
+        self.assertEqual(self.compactor.compact(self.policy, now=START_TS + 7200), 1)
+        self.assertEqual(path.read_bytes(), b"".join(s.path.read_bytes() for s in segments))
+        # Rebuilding while the replaced segments still exist only keeps the archive
+        self.assertEqual(rebuild_index(self.folder.name), 1)
+        self.assertEqual(len(self.segments()), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
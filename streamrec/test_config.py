@@ -1,5 +1,8 @@
+import os
+import tempfile
 import unittest
-from streamrec.config import RecordingConfig
+from streamrec.config import (RecordingConfig, format_path_template, load_stream_configs,
+                              parse_durability, parse_tracks)
 
 
 class TestRecordingConfig(unittest.TestCase):
@@ -27,6 +30,91 @@ class TestRecordingConfig(unittest.TestCase):
         self.assertEqual(config.write_period, 2)
         self.assertFalse(config.close_open_files_on_start)
 
+    def test_durability(self):
+        self.assertEqual(parse_durability("none"), (False, None))
+        self.assertEqual(parse_durability("on-close"), (True, None))
+        self.assertEqual(parse_durability("every-5-seconds"), (True, 5.0))
+        self.assertEqual(parse_durability("every-1-second"), (True, 1.0))
+        with self.assertRaises(ValueError):
+            RecordingConfig(url="http://example.com", output_folder="/tmp",
+                            durability="always")
+
+    def test_path_template(self):
+        self.assertEqual(format_path_template("", "station", 0), "")
+        self.assertEqual(format_path_template("{station}/{yyyy}/{mm}/{dd}/{HH}", "s1",
+                                              1577847600.0),
+                         "s1/2020/01/01/03")
+        for template in ("{minute}", "{0}", "../{yyyy}", "/{yyyy}"):
+            with self.assertRaises(ValueError):
+                RecordingConfig(url="http://example.com", output_folder="/tmp",
+                                path_template=template)
+        config = RecordingConfig(url="http://example.com", output_folder="/tmp", name="a/b")
+        self.assertEqual(config.station, "a_b")
+
+    def test_tracks(self):
+        self.assertIsNone(parse_tracks("all"))
+        self.assertEqual(parse_tracks("1, ENG,3"), [1, "eng", 3])
+        for tracks in ("1,,2", ","):
+            with self.assertRaises(ValueError):
+                RecordingConfig(url="http://example.com", output_folder="/tmp", tracks=tracks)
+
+
+class TestLoadStreamConfigs(unittest.TestCase):
+    def write_toml(self, content: str) -> str:
+        fd, path = tempfile.mkstemp(suffix=".toml")
+        with os.fdopen(fd, "w") as f:
+            f.write(content)
+        self.addCleanup(os.remove, path)
+        return path
+
+    def test_defaults_and_name(self):
+        path = self.write_toml("""
+[defaults]
+output_folder = "/data/{name}"
+segment_duration = 120
+
+[[stream]]
+name = "one"
+url = "http://example.com/one"
+
+[[stream]]
+url = "http://example.com/two"
+output_folder = "/other"
+segment_duration = 30
+""")
+        one, two = load_stream_configs(path)
+        self.assertEqual(one.name, "one")
+        self.assertEqual(one.output_folder, "/data/one")
+        self.assertEqual(one.segment_duration, 120)
+        self.assertEqual(two.name, "http://example.com/two")
+        self.assertEqual(two.output_folder, "/other")
+        self.assertEqual(two.segment_duration, 30)
+
+    def test_unknown_option(self):
+        path = self.write_toml("""
+[[stream]]
+url = "http://example.com"
+output_folder = "/tmp"
+bogus = 1
+""")
+        with self.assertRaises(ValueError):
+            load_stream_configs(path)
+
+    def test_duplicate_names(self):
+        path = self.write_toml("""
+[[stream]]
+name = "a"
+url = "http://example.com/1"
+output_folder = "/tmp"
+
+[[stream]]
+name = "a"
+url = "http://example.com/2"
+output_folder = "/tmp"
+""")
+        with self.assertRaises(ValueError):
+            load_stream_configs(path)
+
 
 if __name__ == '__main__':
     unittest.main()
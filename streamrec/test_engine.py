@@ -0,0 +1,90 @@
+import asyncio
+import tempfile
+import unittest
+
+from streamrec.config import RecordingConfig
+from streamrec.engine import Engine, HTTPError, StreamFeed, open_http_stream
+
+
+class TestStreamFeed(unittest.TestCase):
+    def test_read_in_order(self):
+        feed = StreamFeed(timeout=1)
+        feed.feed(b"abc")
+        feed.feed(b"def")
+        self.assertEqual(feed.pending(), 6)
+        self.assertEqual(feed.read(4), b"abcd")
+        self.assertEqual(feed.read(4), b"ef")
+        self.assertEqual(feed.pending(), 0)
+
+    def test_eof(self):
+        feed = StreamFeed(timeout=1)
+        feed.feed(b"abc")
+        feed.close()
+        self.assertEqual(feed.read(10), b"abc")
+        self.assertEqual(feed.read(10), b"")
+
+    def test_timeout(self):
+        feed = StreamFeed(timeout=0.01)
+        self.assertEqual(feed.read(10), b"")
+
+
+class TestOpenHttpStream(unittest.TestCase):
+    def serve(self, responses: list[bytes]):
+        async def run():
+            async def handle(reader, writer):
+                await reader.readuntil(b"\r\n\r\n")
+                writer.write(responses.pop(0))
+                await writer.drain()
+                writer.close()
+
+            server = await asyncio.start_server(handle, "127.0.0.1", 0)
+            port = server.sockets[0].getsockname()[1]
+            async with server:
+                reader, writer, headers = await open_http_stream(
+                    f"http://127.0.0.1:{port}/stream", timeout=1)
+                body = await reader.read()
+                writer.close()
+                return headers, body
+        return asyncio.run(run())
+
+    def test_headers_and_body(self):
+        headers, body = self.serve([
+            b"HTTP/1.0 200 OK\r\nContent-Type: audio/mpeg\r\n\r\ndata"])
+        self.assertEqual(headers["content-type"], "audio/mpeg")
+        self.assertEqual(body, b"data")
+
+    def test_icy_status_and_redirect(self):
+        headers, body = self.serve([
+            b"HTTP/1.1 302 Found\r\nLocation: /other\r\n\r\n",
+            b"ICY 200 OK\r\nicy-name: test\r\n\r\ndata"])
+        self.assertEqual(headers["icy-name"], "test")
+        self.assertEqual(body, b"data")
+
+    def test_http_error(self):
+        with self.assertRaises(HTTPError):
+            self.serve([b"HTTP/1.0 404 Not Found\r\n\r\n"])
+
+
+class TestEngineStreams(unittest.TestCase):
+    def test_remove_stream_removes_policies(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            config = RecordingConfig(url="http://127.0.0.1:1/", output_folder=f"{tmp}/out",
+                                     name="radio", storage_url=f"{tmp}/remote",
+                                     compact_period="hourly")
+            engine = Engine([], persistent=True)
+
+            async def run():
+                engine.loop = asyncio.get_running_loop()
+                engine._add_stream(config)
+                self.assertIn(config.output_folder, engine.uploader.policies)
+                self.assertTrue(engine.compactor.policies)
+                engine._remove_stream("radio")
+
+            asyncio.run(run())
+            self.assertEqual(engine.uploader.policies, {})
+            self.assertFalse(engine.compactor.policies)
+            self.assertEqual(engine.streams, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
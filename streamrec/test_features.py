@@ -0,0 +1,125 @@
+from pathlib import Path
+import tempfile
+import threading
+import unittest
+
+import numpy as np
+
+from streamrec.config import RecordingConfig
+from streamrec.features import (FEATURE_RATE, FINGERPRINTS_PER_SECOND, FeatureExtractor,
+                                compute_features, read_sidecar, sidecar_path, write_sidecar)
+from streamrec.segmentfile import SegmentFile
+from streamrec.session import RecordingSession
+from streamrec.test_index import START_TS, encode_mp3, make_batch
+
+
+def tone(seconds: float, amplitude: float = 1.0, freq: float = 997) -> np.ndarray:
+    t = np.arange(int(seconds * FEATURE_RATE)) / FEATURE_RATE
+    return (amplitude * np.sin(2 * np.pi * freq * t)).astype(np.float32)
+
+
+def noise(seconds: float, seed: int) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    return rng.uniform(-0.5, 0.5, int(seconds * FEATURE_RATE)).astype(np.float32)
+
+
+class TestFeatures(unittest.TestCase):
+    def test_loudness(self):
+        features = compute_features(tone(3))
+        # A full scale 1 kHz sine is -3.01 LUFS, and -3.01 dBFS RMS
+        np.testing.assert_allclose(features.loudness, -3.01, atol=0.05)
+        np.testing.assert_allclose(features.rms, -3.01, atol=0.05)
+        quiet = compute_features(tone(2.5, 0.1))
+        self.assertEqual(len(quiet.loudness), 3)
+        np.testing.assert_allclose(quiet.loudness, -23.01, atol=0.05)
+
+    def test_silences(self):
+        samples = tone(20, 0.5)
+        samples[10 * FEATURE_RATE:13 * FEATURE_RATE] = 0
+        samples[15 * FEATURE_RATE:int(15.5 * FEATURE_RATE)] = 0
+        samples[-2 * FEATURE_RATE:] = 0
+        features = compute_features(samples)
+        np.testing.assert_allclose(features.silences, [[10, 13], [18, 20]])
+        self.assertEqual(features.duration, 20)
+
+    def test_fingerprint(self):
+        first = compute_features(noise(10, 0)).fingerprint
+        self.assertEqual(len(first), 10 * FINGERPRINTS_PER_SECOND)
+        np.testing.assert_array_equal(compute_features(noise(10, 0)).fingerprint, first)
+        other = compute_features(noise(10, 1)).fingerprint
+        bits = np.unpackbits(np.bitwise_xor(first, other).view(np.uint8))
+        self.assertGreater(bits.mean(), 0.3)
+
+    def test_sidecar_roundtrip(self):
+        samples = noise(5, 0)
+        samples[FEATURE_RATE:3 * FEATURE_RATE] = 0
+        features = compute_features(samples)
+        with tempfile.TemporaryDirectory() as folder:
+            path = Path(folder) / "segment.mp3.features"
+            write_sidecar(path, features)
+            read = read_sidecar(path)
+        self.assertEqual(read.duration, features.duration)
+        np.testing.assert_allclose(read.rms, features.rms, rtol=1e-6)
+        np.testing.assert_allclose(read.loudness, features.loudness, rtol=1e-6)
+        np.testing.assert_allclose(read.silences, features.silences)
+        np.testing.assert_array_equal(read.fingerprint, features.fingerprint)
+
+
+class TestFeatureExtractor(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.addCleanup(self.folder.cleanup)
+        config = RecordingConfig(url="", output_folder=self.folder.name, durability="none",
+                                 segment_duration=3600)
+        self.session = RecordingSession(config=config)
+        self.session.adjusted_ts_start = START_TS
+
+    def write_segment(self, features: FeatureExtractor) -> Path:
+        segment = SegmentFile(self.session, START_TS, features=features)
+        segment.write(make_batch(self.session, encode_mp3(4)))
+        segment.close()
+        return segment.get_path()
+
+    def test_extracts_closed_segments(self):
+        extractor = FeatureExtractor()
+        extractor.start()
+        try:
+            path = self.write_segment(extractor)
+        finally:
+            extractor.stop()
+        self.assertEqual((extractor.extracted, extractor.failed), (1, 0))
+        features = read_sidecar(sidecar_path(path))
+        self.assertAlmostEqual(features.duration, 4, delta=0.1)
+        self.assertEqual(len(features.loudness), np.ceil(features.duration))
+
+    def test_sheds_load(self):
+        extractor = FeatureExtractor(max_backlog=2)
+        for i in range(5):
+            extractor.submit(Path(self.folder.name) / f"{i}.mp3")
+        self.assertEqual(extractor.dropped, 3)
+        self.assertEqual(extractor.backlog.qsize(), 2)
+
+    def test_stops_with_full_backlog(self):
+        # Never started
+        extractor = FeatureExtractor(max_backlog=1)
+        extractor.submit(Path(self.folder.name) / "0.mp3")
+        extractor.stop()
+        # Its thread died
+        extractor.thread = threading.Thread(target=lambda: None)
+        extractor.thread.start()
+        extractor.thread.join()
+        extractor.stop()
+
+    def test_skips_undecodable_segments(self):
+        extractor = FeatureExtractor()
+        extractor.start()
+        path = Path(self.folder.name) / "broken.mp3"
+        path.write_bytes(b"not audio" * 100)
+        extractor.submit(path)
+        extractor.stop()
+        self.assertEqual((extractor.extracted, extractor.failed), (0, 1))
+        self.assertFalse(sidecar_path(path).exists())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,93 @@
+import unittest
+
+from streamrec.frames import (FrameSplitter, find_frame, id3_tag_size, parse_adts_header,
+                              parse_mp3_header)
+
+# MPEG-1 Layer III, 128 kbps, 44100 Hz, no padding
+MP3_HEADER = bytes([0xFF, 0xFB, 0x90, 0x64])
+
+
+def mp3_frame(padding: bool = False) -> bytes:
+    header = bytearray(MP3_HEADER)
+    header[2] |= padding << 1
+    return bytes(header) + bytes(417 + padding - 4)
+
+
+def adts_frame(length: int = 300, sample_rate_index: int = 4, blocks: int = 1) -> bytes:
+    """AAC LC stereo frame of ``length`` bytes, header included."""
+    header = bytes([0xFF, 0xF1, 0x40 | sample_rate_index << 2, 0x80 | length >> 11,
+                    (length >> 3) & 0xFF, (length & 0x07) << 5 | 0x1F, 0xFC | (blocks - 1)])
+    return header + bytes(length - len(header))
+
+
+def id3_tag(size: int) -> bytes:
+    return b"ID3\x04\x00\x00" + bytes([size >> 21 & 0x7F, size >> 14 & 0x7F,
+                                        size >> 7 & 0x7F, size & 0x7F]) + bytes(size)
+
+
+class TestFrames(unittest.TestCase):
+    def test_parse_mp3_header(self):
+        header = parse_mp3_header(MP3_HEADER)
+        self.assertEqual(header.length, 417)
+        self.assertEqual(header.samples, 1152)
+        self.assertEqual(header.sample_rate, 44100)
+        self.assertEqual(parse_mp3_header(mp3_frame(padding=True)).length, 418)
+        # MPEG-2 Layer III, 64 kbps, 22050 Hz
+        header = parse_mp3_header(bytes([0xFF, 0xF3, 0x80, 0x64]))
+        self.assertEqual((header.length, header.samples, header.sample_rate), (208, 576, 22050))
+
+    def test_invalid_headers(self):
+        self.assertIsNone(parse_mp3_header(b"ID3\x04"))
+        self.assertIsNone(parse_mp3_header(bytes([0xFF, 0xFB, 0xF0, 0x64])))
+        self.assertIsNone(parse_mp3_header(MP3_HEADER[:3]))
+
+    def test_parse_adts_header(self):
+        header = parse_adts_header(adts_frame(371))
+        self.assertEqual((header.length, header.samples, header.sample_rate), (371, 1024, 44100))
+        header = parse_adts_header(adts_frame(600, sample_rate_index=3, blocks=2))
+        self.assertEqual((header.length, header.samples, header.sample_rate), (600, 2048, 48000))
+        self.assertIsNone(parse_adts_header(MP3_HEADER + bytes(3)))
+        self.assertIsNone(parse_adts_header(adts_frame(sample_rate_index=13)))
+        self.assertIsNone(parse_mp3_header(adts_frame()))
+
+    def test_id3_tag_size(self):
+        self.assertEqual(id3_tag_size(id3_tag(300)), 310)
+        self.assertEqual(id3_tag_size(mp3_frame()), 0)
+        self.assertIsNone(id3_tag_size(b"ID3\x04"))
+
+    def test_frame_splitter(self):
+        frames = [mp3_frame(padding=i % 3 == 0) for i in range(20)]
+        data = id3_tag(1000) + b"junk\xff\xfb" + b"".join(frames[:10]) + b"\xff\x00"
+        data += b"".join(frames[10:])
+        for chunk_size in (1, 5, 417, 4096, len(data)):
+            splitter = FrameSplitter(parse_mp3_header)
+            found = []
+            for i in range(0, len(data), chunk_size):
+                found += splitter.feed(data[i:i + chunk_size])
+            self.assertEqual([frame for frame, _ in found], frames, chunk_size)
+            self.assertEqual(splitter.skipped, 1010 + 6 + 2)
+
+    def test_frame_splitter_waits_for_next_frame(self):
+        splitter = FrameSplitter(parse_adts_header)
+        # A lone header could be a false sync: it needs the next frame to follow
+        self.assertEqual(splitter.feed(adts_frame(300)), [])
+        self.assertEqual(len(splitter.feed(adts_frame(200))), 2)
+        self.assertEqual(splitter.feed(adts_frame(200)[:100]), [])
+        self.assertEqual(len(splitter.feed(bytes(100))), 1)
+
+    def test_find_frame(self):
+        data = mp3_frame() + mp3_frame(padding=True) + mp3_frame()
+        duration = 1152 / 44100
+        self.assertEqual(find_frame(data, 0, 100.0, 100.0)[:2], (0, 100.0))
+        offset, ts, header = find_frame(data, 0, 100.0, 100 + 1.5 * duration)
+        self.assertEqual((offset, header.length), (417, 418))
+        self.assertAlmostEqual(ts, 100 + duration)
+        offset, _, header = find_frame(data, 0, 100.0, 200.0)
+        self.assertEqual(offset, len(data))
+        self.assertIsNone(header)
+        # A truncated last frame is never returned
+        self.assertEqual(find_frame(data[:-1], 0, 100.0, 200.0)[0], 835)
+
+
+if __name__ == "__main__":
+    unittest.main()
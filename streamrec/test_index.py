@@ -0,0 +1,146 @@
+import io
+from pathlib import Path
+import tempfile
+import unittest
+
+import av
+import numpy as np
+
+from streamrec.config import RecordingConfig
+from streamrec.index import INDEX_FILENAME, IndexWriter, SegmentIndex, rebuild_index
+from streamrec.packet import PacketBatch, PacketBatchBuilder
+from streamrec.segmentfile import SegmentFile
+from streamrec.session import RecordingSession
+
+START_TS = 1577836800.0  # 2020-01-01 00:00:00 UTC
+SAMPLE_RATE = 44100
+
+
+def encode_mp3(seconds: float) -> list[av.Packet]:
+    """Encode noise as MP3 and demux it back into packets."""
+    buffer = io.BytesIO()
+    with av.open(buffer, mode="w", format="mp3") as container:
+        stream = container.add_stream("mp3", rate=SAMPLE_RATE)
+        samples = (np.random.uniform(-1, 1, (1, int(seconds * SAMPLE_RATE))) * 2**14)
+        frame = av.AudioFrame.from_ndarray(samples.astype(np.int16), format="s16", layout="mono")
+        frame.sample_rate = SAMPLE_RATE
+        for packet in stream.encode(frame) + stream.encode(None):
+            container.mux(packet)
+    buffer.seek(0)
+    with av.open(buffer, format="mp3") as container:
+        return [p for p in container.demux(container.streams.audio[0]) if p.size]
+
+
+def make_batch(session: RecordingSession, packets: list[av.Packet],
+               pts_shift: int = 0) -> PacketBatch:
+    builder = PacketBatchBuilder(session)
+    for packet in packets:
+        builder.append(packet, pts=packet.pts + pts_shift)
+    return builder.build()
+
+
+class TestIndex(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.packets = encode_mp3(25)
+        cls.packet_duration = float(cls.packets[0].duration * cls.packets[0].time_base)
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.config = RecordingConfig(url="", output_folder=self.folder.name,
+                                      segment_duration=10)
+        self.session = RecordingSession(config=self.config)
+        self.session.adjusted_ts_start = START_TS
+        self.writer = IndexWriter(self.folder.name, self.session.uuid)
+
+    def tearDown(self):
+        self.writer.close()
+        self.folder.cleanup()
+
+    def record(self, batches: list[PacketBatch]):
+        segment = None
+        for batch in batches:
+            for segment_ts, packets in batch.split_by_segment():
+                if segment and segment.segment_ts != segment_ts:
+                    segment.close()
+                    segment = None
+                if not segment:
+                    segment = SegmentFile(self.session, segment_ts, index=self.writer)
+                segment.write(packets)
+        segment.close()
+
+    def test_lookups(self):
+        packets = self.packets
+        batches = [make_batch(self.session, packets[i:i + 20])
+                   for i in range(0, len(packets), 20)]
+        self.record(batches)
+
+        index = SegmentIndex(self.folder.name)
+        segments = index.segments(START_TS, START_TS + 30)
+        self.assertEqual(len(segments), 3)
+        self.assertEqual(segments[0].start_ts, START_TS)
+        for previous, segment in zip(segments, segments[1:]):
+            self.assertAlmostEqual(previous.end_ts, segment.start_ts, places=5)
+        for segment in segments:
+            self.assertEqual(segment.size, segment.path.stat().st_size)
+
+        segment, offset = index.locate(START_TS + 12.5)
+        self.assertEqual(segment, segments[1])
+        checkpoints = index.checkpoints(segment)
+        self.assertEqual(len(checkpoints), 10)
+        self.assertEqual(checkpoints[0][1], 0)
+        for second, (ts, _) in enumerate(checkpoints):
+            self.assertGreaterEqual(ts, segment.start_ts + second)
+            self.assertLess(ts, segment.start_ts + second + self.packet_duration)
+        self.assertEqual(offset, checkpoints[2][1])
+        # The checkpoint points at the first byte of a packet
+        with open(segment.path, "rb") as f:
+            f.seek(offset)
+            self.assertEqual(f.read(2)[0], 0xFF)
+
+        self.assertIsNone(index.find(START_TS - 1))
+        self.assertIsNone(index.find(START_TS + 60))
+        self.assertEqual(index.gaps(START_TS, START_TS + 30), [])
+        index.close()
+
+    def test_gaps(self):
+        packets = self.packets
+        pts_per_second = round(1 / packets[0].time_base)
+        self.record([make_batch(self.session, packets[:100]),
+                     make_batch(self.session, packets[200:300], pts_shift=2 * pts_per_second)])
+        index = SegmentIndex(self.folder.name)
+        gaps = index.gaps(START_TS, START_TS + 30)
+        self.assertEqual(len(gaps), 1)
+        ts, duration = gaps[0]
+        self.assertAlmostEqual(ts, START_TS + 100 * self.packet_duration, places=3)
+        self.assertAlmostEqual(duration, 100 * self.packet_duration + 2, places=3)
+        index.close()
+
+    def test_rebuild(self):
+        self.record([make_batch(self.session, self.packets)])
+        index = SegmentIndex(self.folder.name)
+        written = [(s.path, s.start_ts, s.end_ts, s.size)
+                   for s in index.segments(START_TS, START_TS + 30)]
+        written_checkpoints = [index.checkpoints(s) for s in index.segments(START_TS, START_TS + 30)]
+        written_checksums = [index.checksums(s) for s in index.segments(START_TS, START_TS + 30)]
+        index.close()
+        self.writer.close()
+
+        Path(self.folder.name, INDEX_FILENAME).unlink()
+        self.assertEqual(rebuild_index(self.folder.name), 3)
+
+        index = SegmentIndex(self.folder.name)
+        segments = index.segments(START_TS, START_TS + 30)
+        self.assertEqual([(s.path, s.size) for s in segments],
+                         [(path, size) for path, _, _, size in written])
+        for segment, (_, start_ts, end_ts, _) in zip(segments, written):
+            self.assertAlmostEqual(segment.start_ts, start_ts, places=3)
+            self.assertAlmostEqual(segment.end_ts, end_ts, places=3)
+        self.assertEqual([[o for _, o in index.checkpoints(s)] for s in segments],
+                         [[o for _, o in c] for c in written_checkpoints])
+        self.assertEqual([index.checksums(s) for s in segments], written_checksums)
+        index.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,95 @@
+from fractions import Fraction
+import io
+from pathlib import Path
+import tempfile
+import unittest
+
+import av
+import numpy as np
+
+from streamrec.config import RecordingConfig
+from streamrec.ingest import NativeDemuxer, RawPacket, content_type_format, is_native_url
+from streamrec.recorder import Recorder
+
+
+def encode(codec: str, fmt: str, seconds: float, sample_rate: int = 44100) -> bytes:
+    """White noise encoded with libav."""
+    output = io.BytesIO()
+    container = av.open(output, mode="w", format=fmt)
+    stream = container.add_stream(codec, rate=sample_rate)
+    samples = (np.random.default_rng(0).uniform(-1, 1, (1, int(seconds * sample_rate)))
+               * 2**14).astype(np.int16)
+    frame = av.AudioFrame.from_ndarray(samples, format="s16", layout="mono")
+    frame.sample_rate = sample_rate
+    for packet in stream.encode(frame):
+        container.mux(packet)
+    for packet in stream.encode(None):
+        container.mux(packet)
+    container.close()
+    return output.getvalue()
+
+
+def libav_packets(data: bytes, fmt: str) -> list[tuple[int, int, bytes]]:
+    with av.open(io.BytesIO(data), format=fmt) as container:
+        stream = container.streams.audio[0]
+        return [(packet.pts, packet.duration, bytes(packet))
+                for packet in container.demux(stream) if packet.size]
+
+
+class TestNativeDemuxer(unittest.TestCase):
+    def check_matches_libav(self, fmt: str, data: bytes):
+        demuxer = NativeDemuxer(fmt)
+        packets = []
+        for i in range(0, len(data), 1000):
+            packets += demuxer.feed(data[i:i + 1000])
+        expected = libav_packets(data, fmt)
+        self.assertGreater(len(packets), 10)
+        # The last frame is only known to be complete once the next one starts
+        self.assertEqual([bytes(p) for p in packets], [e[2] for e in expected][:len(packets)])
+        self.assertGreaterEqual(len(packets), len(expected) - 1)
+        duration = packets[0].duration
+        self.assertEqual([(p.pts, p.duration) for p in packets],
+                         [(i * duration, duration) for i in range(len(packets))])
+        return packets
+
+    def test_mp3(self):
+        packets = self.check_matches_libav("mp3", encode("mp3", "mp3", 2))
+        self.assertEqual(packets[0].duration, 1152)
+        self.assertEqual(packets[0].time_base, Fraction(1, 44100))
+
+    def test_adts(self):
+        packets = self.check_matches_libav("aac", encode("aac", "adts", 2, 48000))
+        self.assertEqual(packets[0].duration, 1024)
+        self.assertEqual(packets[0].time_base, Fraction(1, 48000))
+
+    def test_raw_packet(self):
+        packet = RawPacket(b"abc", 1152, 1152, Fraction(1, 44100))
+        self.assertEqual((packet.size, bytes(packet), packet.is_corrupt), (3, b"abc", False))
+        self.assertEqual(memoryview(packet).nbytes, 3)
+
+    def test_content_type_format(self):
+        self.assertEqual(content_type_format("audio/mpeg"), "mp3")
+        self.assertEqual(content_type_format("audio/aacp; charset=utf-8"), "aac")
+        self.assertIsNone(content_type_format("text/html"))
+
+    def test_is_native_url(self):
+        self.assertTrue(is_native_url("HTTPS://example.com/stream"))
+        self.assertFalse(is_native_url("rtmp://example.com/live"))
+        self.assertFalse(is_native_url("/tmp/stream.mp3"))
+
+
+class TestNativeIngest(unittest.TestCase):
+    def test_other_urls_go_to_libav(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            source = Path(tmp) / "stream.mp3"
+            source.write_bytes(encode("mp3", "mp3", 3))
+            config = RecordingConfig(url=str(source), output_folder=f"{tmp}/out",
+                                     durability="none", native_ingest=True)
+            recorder = Recorder(config)
+            recorder.start()
+            self.assertIsNone(recorder.reader_unhandled_exception)
+            self.assertTrue(list(Path(config.output_folder).glob("*.mp3")))
+
+
+if __name__ == "__main__":
+    unittest.main()
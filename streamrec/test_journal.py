@@ -0,0 +1,68 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+from streamrec.journal import MemoryBudget, SpillJournal
+from streamrec.test_index import make_batch, encode_mp3
+from streamrec.config import RecordingConfig
+from streamrec.session import RecordingSession
+
+
+class TestSpillJournal(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        config = RecordingConfig(url="", output_folder=self.folder.name)
+        self.session = RecordingSession(config=config)
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_round_trip_in_order(self):
+        journal = SpillJournal(Path(self.folder.name) / "spill" / "test.journal")
+        batch = make_batch(self.session, encode_mp3(2))
+        halves = [batch[:20], batch[20:]]
+        for half in halves:
+            journal.append(half)
+        self.assertEqual(len(journal), 2)
+        self.assertEqual(journal.pending_packets, len(batch))
+        self.assertEqual(journal.spilled_bytes, len(batch.payload))
+        self.assertEqual(journal.oldest_received_ts(), batch.received_ts[0])
+        for half in halves:
+            read = journal.pop(self.session)
+            self.assertEqual(read.time_base, half.time_base)
+            self.assertEqual(read.pts.tolist(), half.pts.tolist())
+            self.assertEqual(read.durations.tolist(), half.durations.tolist())
+            self.assertEqual(read.received_ts.tolist(), half.received_ts.tolist())
+            self.assertEqual(read.sizes.tolist(), half.sizes.tolist())
+            self.assertEqual(bytes(read.payload), bytes(half.payload))
+        self.assertIsNone(journal.pop(self.session))
+        # Emptied journals are truncated
+        self.assertEqual(journal.path.stat().st_size, 0)
+        journal.close()
+        self.assertFalse(journal.path.exists())
+
+
+class TestMemoryBudget(unittest.TestCase):
+    def test_limit(self):
+        budget = MemoryBudget(100)
+        budget.reserve(100)
+        self.assertFalse(budget.exceeded())
+        budget.reserve(1)
+        self.assertTrue(budget.exceeded())
+        budget.release(1000)
+        self.assertEqual(budget.used, 0)
+        self.assertFalse(MemoryBudget().exceeded())
+
+    def test_share(self):
+        budget = MemoryBudget(100)
+        budget.reserve(90, "stalled")
+        budget.reserve(20, "healthy")
+        self.assertTrue(budget.over_share("stalled"))
+        self.assertFalse(budget.over_share("healthy"))
+        budget.release(90, "stalled")
+        self.assertEqual(budget.owners, {"healthy": 20})
+        self.assertFalse(budget.over_share("healthy"))
+
+
+if __name__ == "__main__":
+    unittest.main()
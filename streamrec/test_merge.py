@@ -0,0 +1,147 @@
+from pathlib import Path
+import tempfile
+import unittest
+
+from streamrec.config import RecordingConfig
+from streamrec.index import IndexWriter, SegmentIndex
+from streamrec.ingest import NativeDemuxer
+from streamrec.merge import UnsupportedFormat, merge
+from streamrec.segmentfile import SegmentFile
+from streamrec.session import RecordingSession
+from streamrec.store import SegmentStore
+from streamrec.test_index import START_TS, encode_mp3, make_batch
+from streamrec.test_ingest import encode
+
+
+def write_replica(folder: str, packets: list, offset: float, missing: list[range]) -> str:
+    """Record ``packets`` as a session whose clock is ``offset`` seconds off,
+    without the packets in ``missing``. Returns the session."""
+    config = RecordingConfig(url="", output_folder=folder, segment_duration=5, durability="none")
+    session = RecordingSession(config=config, adjusted_ts_start=START_TS + offset)
+    index = IndexWriter(folder, session.uuid)
+    kept = [p for i, p in enumerate(packets) if not any(i in r for r in missing)]
+    segment = None
+    for segment_ts, batch in make_batch(session, kept).split_by_segment():
+        if segment and segment.segment_ts != segment_ts:
+            segment.close()
+            segment = None
+        if not segment:
+            segment = SegmentFile(session, segment_ts, index=index)
+        segment.write(batch)
+    segment.close()
+    index.close()
+    return str(session.uuid)
+
+
+class TestMerge(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.packets = encode_mp3(30)
+        cls.audio = b"".join(bytes(p) for p in cls.packets)
+        cls.duration = float(cls.packets[0].duration * cls.packets[0].time_base)
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.folders = [str(Path(self.tmp.name) / name) for name in ("a", "b", "c")]
+        self.output = str(Path(self.tmp.name) / "merged")
+
+    def merged_audio(self) -> bytes:
+        store = SegmentStore(self.output)
+        try:
+            return b"".join(bytes(view) for view in store.read(0, float("inf")))
+        finally:
+            store.close()
+
+    def test_fills_gaps_from_other_replicas(self):
+        n = len(self.packets)
+        write_replica(self.folders[0], self.packets, 0.0, [range(100, 200), range(n - 50, n)])
+        write_replica(self.folders[1], self.packets, 0.013, [range(0, 20), range(250, 400)])
+        write_replica(self.folders[2], self.packets, -0.04, [range(0, 230), range(700, 900)])
+        result = merge(self.folders, self.output, segment_duration=10, window=7)
+        self.assertEqual(self.merged_audio(), self.audio)
+        self.assertAlmostEqual(result.seconds, n * self.duration, delta=0.001)
+        self.assertAlmostEqual(sum(result.used.values()), result.seconds, delta=0.001)
+        index = SegmentIndex(self.output)
+        try:
+            self.assertEqual(index.gaps(0, float("inf")), [])
+            [(_, start, end)] = index.sessions()
+        finally:
+            index.close()
+        # On the clock of the replica that starts first
+        self.assertAlmostEqual(start, START_TS, delta=0.001)
+        self.assertAlmostEqual(end - start, n * self.duration, delta=0.001)
+
+    def test_keeps_gaps_no_replica_has(self):
+        write_replica(self.folders[0], self.packets, 0.0, [range(100, 300)])
+        write_replica(self.folders[1], self.packets, 0.02, [range(200, 400)])
+        result = merge(self.folders[:2], self.output)
+        expected = b"".join(bytes(p) for i, p in enumerate(self.packets) if not 200 <= i < 300)
+        self.assertEqual(self.merged_audio(), expected)
+        self.assertAlmostEqual(result.gap_seconds, 100 * self.duration, delta=0.03)
+        index = SegmentIndex(self.output)
+        try:
+            [(ts, duration)] = index.gaps(0, float("inf"))
+        finally:
+            index.close()
+        self.assertAlmostEqual(ts, START_TS + 200 * self.duration, delta=0.03)
+        self.assertAlmostEqual(duration, 100 * self.duration, delta=0.03)
+
+    def test_deletes_sources(self):
+        write_replica(self.folders[0], self.packets, 0.0, [range(100, 200)])
+        write_replica(self.folders[1], self.packets, 0.01, [])
+        result = merge(self.folders[:2], self.output, delete_sources=True)
+        self.assertEqual(self.merged_audio(), self.audio)
+        self.assertGreater(result.deleted, 0)
+        for folder in self.folders[:2]:
+            self.assertEqual(list(Path(folder).rglob("*.mp3")), [])
+            index = SegmentIndex(folder)
+            try:
+                self.assertEqual(index.sessions(), [])
+            finally:
+                index.close()
+
+    def test_merges_adts(self):
+        packets = NativeDemuxer("aac").feed(encode("aac", "adts", 20))
+        write_replica(self.folders[0], packets, 0.0, [range(100, 200)])
+        write_replica(self.folders[1], packets, 0.01, [range(300, 400)])
+        result = merge(self.folders[:2], self.output, delete_sources=True)
+        self.assertEqual(self.merged_audio(), b"".join(packets))
+        self.assertAlmostEqual(result.gap_seconds, 0, delta=0.03)
+        self.assertGreater(result.deleted, 0)
+
+    def sources_kept(self, folders: list[str], segments: int):
+        for folder in folders:
+            self.assertEqual(len(list(Path(folder).rglob("*.mp3"))), segments)
+
+    def test_keeps_sources_of_unsupported_format(self):
+        for folder in self.folders[:2]:
+            write_replica(folder, self.packets, 0.0, [])
+            for path in Path(folder).rglob("*.mp3"):
+                path.write_bytes(b"\0" * path.stat().st_size)
+        segments = len(list(Path(self.folders[0]).rglob("*.mp3")))
+        with self.assertRaises(UnsupportedFormat):
+            merge(self.folders[:2], self.output, delete_sources=True)
+        self.sources_kept(self.folders[:2], segments)
+
+    def test_keeps_sources_of_empty_merge(self):
+        write_replica(self.folders[0], self.packets, 0.0, [])
+        for path in Path(self.folders[0]).rglob("*.mp3"):
+            path.write_bytes(b"")
+        segments = len(list(Path(self.folders[0]).rglob("*.mp3")))
+        result = merge(self.folders[:1], self.output, delete_sources=True)
+        self.assertEqual((result.segments, result.deleted), (0, 0))
+        self.sources_kept(self.folders[:1], segments)
+
+    def test_keeps_sources_not_merged(self):
+        write_replica(self.folders[0], self.packets, 0.0, [])
+        segments = sorted(Path(self.folders[0]).rglob("*.mp3"))
+        # A segment cut short on disk after it was indexed
+        segments[2].write_bytes(segments[2].read_bytes()[:1000])
+        result = merge(self.folders[:1], self.output, delete_sources=True)
+        self.assertEqual(result.deleted, len(segments) - 1)
+        self.assertEqual(sorted(Path(self.folders[0]).rglob("*.mp3")), segments[2:3])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,96 @@
+import tempfile
+import threading
+import time
+import unittest
+import urllib.request
+
+import av
+
+from streamrec.config import RecordingConfig
+from streamrec.metrics import Histogram, MetricsReporter, MetricsServer, render
+from streamrec.recorder import Recorder
+from streamrec.test_recorder import make_packet
+
+
+class TestRender(unittest.TestCase):
+    def test_histogram(self):
+        histogram = Histogram((1, 5))
+        for value in (0.5, 1, 3, 10):
+            histogram.observe(value)
+        self.assertEqual(histogram.counts, [2, 1, 1])
+        self.assertEqual(histogram.sum, 14.5)
+
+    def test_render(self):
+        histogram = Histogram((1, 5))
+        histogram.observe(3)
+        text = render({'a"b': {"packets": 10, "corrupt": 1, "empty": 2, "clock_drift": 0.25,
+                               "write_seconds": histogram.snapshot(), "unknown": 1}})
+        lines = text.splitlines()
+        self.assertIn('streamrec_packets_total{stream="a\\"b"} 10', lines)
+        self.assertIn('streamrec_dropped_packets_total{stream="a\\"b",reason="corrupt"} 1', lines)
+        self.assertIn('streamrec_dropped_packets_total{stream="a\\"b",reason="empty"} 2', lines)
+        self.assertEqual(lines.count("# TYPE streamrec_dropped_packets_total counter"), 1)
+        self.assertIn('streamrec_clock_drift_seconds{stream="a\\"b"} 0.25', lines)
+        self.assertIn('streamrec_write_seconds_bucket{stream="a\\"b",le="1"} 0', lines)
+        self.assertIn('streamrec_write_seconds_bucket{stream="a\\"b",le="5"} 1', lines)
+        self.assertIn('streamrec_write_seconds_bucket{stream="a\\"b",le="+Inf"} 1', lines)
+        self.assertIn('streamrec_write_seconds_count{stream="a\\"b"} 1', lines)
+        self.assertNotIn("unknown", text)
+
+
+class TestRecorderMetrics(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        config = RecordingConfig(url="", output_folder=self.folder.name,
+                                 initial_writer_delay=0, index=False)
+        self.recorder = Recorder(config)
+        self.recorder.session.ts_start = time.time()
+
+    def tearDown(self):
+        self.recorder.close_output()
+        self.folder.cleanup()
+
+    def test_counters(self):
+        recorder = self.recorder
+        for i in range(5):
+            recorder.enqueue(make_packet(i * 26))
+        empty = av.Packet(b"")
+        empty.pts = 130
+        recorder.enqueue(empty)
+        recorder.flush()
+        stats = recorder.stats()
+        self.assertEqual(stats["packets"], 5)
+        self.assertEqual(stats["packet_bytes"], 500)
+        self.assertEqual(stats["empty"], 1)
+        self.assertEqual(stats["queue_depth"], 0)
+        self.assertEqual(sum(stats["flush_packets"]["counts"]), 1)
+        self.assertEqual(stats["flush_packets"]["sum"], 5)
+        self.assertEqual(sum(stats["write_seconds"]["counts"]), 1)
+        self.assertEqual(stats["clock_drift"], 0)
+        recorder.close_segment()
+        self.assertEqual(recorder.stats()["segments_closed"], 1)
+
+    def test_server_and_reporter(self):
+        def source():
+            return {"station": self.recorder.stats()}
+
+        server = MetricsServer(source, port=0)
+        server.start()
+        try:
+            self.recorder.enqueue(make_packet(0))
+            with urllib.request.urlopen(f"http://127.0.0.1:{server.port}/metrics") as response:
+                body = response.read().decode()
+            self.assertIn('streamrec_packets_total{stream="station"} 1', body)
+            self.assertIn('streamrec_queue_depth{stream="station"} 1', body)
+        finally:
+            server.stop()
+
+        reported = threading.Event()
+        reporter = MetricsReporter(source, lambda stats: reported.set(), interval=0.01)
+        reporter.start()
+        self.assertTrue(reported.wait(5))
+        reporter.stop()
+
+
+if __name__ == "__main__":
+    unittest.main()
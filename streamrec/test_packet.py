@@ -1,8 +1,10 @@
+from fractions import Fraction
+from itertools import groupby
 import unittest
 from unittest.mock import MagicMock
 from time import time
 import av
-from streamrec.packet import PacketWithReceivedTS
+from streamrec.packet import PacketBatchBuilder, PacketWithReceivedTS
 from streamrec.session import RecordingSession
 from streamrec.config import RecordingConfig
 
@@ -38,5 +40,55 @@ class TestPacketWithReceivedTS(unittest.TestCase):
         self.assertEqual(self.packet_with_received_ts.get_segment_ts(), 0)
 
 
+class TestPacketBatch(unittest.TestCase):
+    def setUp(self):
+        self.config = RecordingConfig(
+            url="http://example.com", output_folder="/tmp", segment_duration=10)
+        self.session = RecordingSession(config=self.config)
+        self.session.adjusted_ts_start = 1008.5
+        self.packets = []
+        for i in range(100):
+            packet = av.Packet(bytes([i]) * (i % 7 + 1))
+            packet.pts = i * 1152
+            packet.duration = 1152
+            packet.time_base = Fraction(1, 44100)
+            self.packets.append(packet)
+        builder = PacketBatchBuilder(self.session)
+        for i, packet in enumerate(self.packets):
+            builder.append(packet, received_ts=2000.0 + i * 0.01)
+        self.batch = builder.build()
+
+    def test_columns(self):
+        self.assertEqual(len(self.batch), 100)
+        self.assertEqual(self.batch.pts[3], 3 * 1152)
+        self.assertEqual(self.batch.durations[3], 1152)
+        self.assertEqual(self.batch.sizes[3], 4)
+        self.assertEqual(self.batch.nbytes, sum(p.size for p in self.packets))
+        self.assertEqual(bytes(self.batch.payload), b"".join(bytes(p) for p in self.packets))
+
+    def test_slice(self):
+        part = self.batch[10:20]
+        self.assertEqual(len(part), 10)
+        self.assertEqual(part.pts[0], 10 * 1152)
+        self.assertEqual(bytes(part.payload),
+                         b"".join(bytes(p) for p in self.packets[10:20]))
+        self.assertEqual(len(self.batch[100:]), 0)
+
+    def test_guess_session_start(self):
+        expected = min(2000.0 + i * 0.01 - p.pts * p.time_base
+                       for i, p in enumerate(self.packets))
+        self.assertAlmostEqual(self.batch.guess_session_start(), float(expected))
+
+    def test_split_by_segment_matches_per_packet(self):
+        expected = []
+        per_packet = [PacketWithReceivedTS(self.session, p) for p in self.packets]
+        for segment_ts, group in groupby(per_packet, key=lambda p: p.get_segment_ts()):
+            expected.append((segment_ts, [p.packet.pts for p in group]))
+        actual = [(segment_ts, part.pts.tolist())
+                  for segment_ts, part in self.batch.split_by_segment()]
+        self.assertEqual(actual, expected)
+        self.assertEqual(len(actual), 2)
+
+
 if __name__ == '__main__':
     unittest.main()
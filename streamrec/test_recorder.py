@@ -0,0 +1,215 @@
+from fractions import Fraction
+from pathlib import Path
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+import av
+
+from streamrec.config import RecordingConfig
+from streamrec.journal import MemoryBudget, SpillJournal
+from streamrec.recorder import Recorder
+from streamrec.segmentfile import SegmentFile
+
+
+def make_packet(pts: int, size: int = 100) -> av.Packet:
+    packet = av.Packet(bytes(size))
+    packet.pts = pts
+    packet.time_base = Fraction(1, 1000)
+    return packet
+
+
+class TestFlushTriggers(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.config = RecordingConfig(url="", output_folder=self.folder.name,
+                                      initial_writer_delay=0, segment_duration=10,
+                                      write_period=60, flush_packets=0)
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def recorder(self, **values) -> Recorder:
+        for name, value in values.items():
+            setattr(self.config, name, value)
+        recorder = Recorder(self.config)
+        recorder.session.ts_start = time.time()
+        return recorder
+
+    def flush_due(self, recorder: Recorder) -> bool:
+        with recorder.queue_lock:
+            return recorder.flush_due()
+
+    def test_empty_queue(self):
+        recorder = self.recorder(flush_packets=1)
+        self.assertFalse(self.flush_due(recorder))
+        self.assertIsNone(recorder.flush_timeout())
+
+    def test_packets(self):
+        recorder = self.recorder(flush_packets=2)
+        recorder.enqueue(make_packet(0))
+        self.assertFalse(self.flush_due(recorder))
+        recorder.enqueue(make_packet(26))
+        self.assertTrue(self.flush_due(recorder))
+
+    def test_bytes(self):
+        recorder = self.recorder(flush_bytes=250)
+        recorder.enqueue(make_packet(0, 200))
+        self.assertFalse(self.flush_due(recorder))
+        recorder.enqueue(make_packet(26, 200))
+        self.assertTrue(self.flush_due(recorder))
+
+    def test_latency(self):
+        recorder = self.recorder(write_period=0.05)
+        recorder.enqueue(make_packet(0))
+        self.assertFalse(self.flush_due(recorder))
+        self.assertLessEqual(recorder.flush_timeout(), 0.05)
+        time.sleep(0.06)
+        self.assertTrue(self.flush_due(recorder))
+
+    def test_segment_boundary(self):
+        recorder = self.recorder()
+        recorder.session.adjusted_ts_start = 1000.0
+        recorder.enqueue(make_packet(9000))
+        self.assertFalse(self.flush_due(recorder))
+        recorder.enqueue(make_packet(10000))
+        self.assertTrue(self.flush_due(recorder))
+
+    def test_waits_for_initial_burst(self):
+        recorder = self.recorder(flush_packets=1, initial_writer_delay=5)
+        start = time.time()
+        for i in range(200):
+            recorder.enqueue(make_packet(i * 26))
+        self.assertFalse(self.flush_due(recorder))
+        self.assertGreater(recorder.flush_timeout(), 4)
+        time.sleep(0.6)
+        recorder.enqueue(make_packet(199 * 26 + 600))
+        self.assertTrue(self.flush_due(recorder))
+        recorder.flush()
+        self.assertAlmostEqual(recorder.session.adjusted_ts_start, start - 199 * 0.026,
+                               delta=0.1)
+        recorder.close_segment()
+
+    def test_flush_resets_triggers(self):
+        recorder = self.recorder(flush_packets=1)
+        recorder.session.adjusted_ts_start = 1000.0
+        recorder.enqueue(make_packet(0))
+        recorder.flush()
+        self.assertFalse(self.flush_due(recorder))
+        self.assertEqual(recorder.queue.nbytes, 0)
+        recorder.close_segment()
+
+    def test_writer_drains_on_stop(self):
+        recorder = self.recorder()
+        writer = threading.Thread(target=recorder.file_writer)
+        writer.start()
+        recorder.enqueue(make_packet(0))
+        recorder.stop(2, None)
+        with recorder.queue_lock:
+            recorder.reader_finished = True
+            recorder.wake_writer()
+        writer.join(1)
+        self.assertFalse(writer.is_alive())
+        self.assertEqual(len(recorder.queue), 0)
+
+
+class TestSpill(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.spill_folder = tempfile.TemporaryDirectory()
+        self.config = RecordingConfig(url="", output_folder=self.folder.name,
+                                      initial_writer_delay=0, segment_duration=60,
+                                      index=False, max_queue_bytes=2000,
+                                      spill_folder=self.spill_folder.name)
+        self.recorder = Recorder(self.config)
+        self.recorder.budget = MemoryBudget()
+        self.recorder.session.ts_start = time.time()
+        self.recorder.session.adjusted_ts_start = 1020.0
+
+    def tearDown(self):
+        self.folder.cleanup()
+        self.spill_folder.cleanup()
+
+    def enqueue(self, count: int) -> bytes:
+        payloads = [bytes([i % 256]) * 100 for i in range(count)]
+        for i, payload in enumerate(payloads):
+            packet = make_packet(i * 26)
+            packet.update(payload)
+            self.recorder.enqueue(packet)
+        return b"".join(payloads)
+
+    def finish(self, writer: threading.Thread):
+        with self.recorder.queue_lock:
+            self.recorder.reader_finished = True
+            self.recorder.wake_writer()
+        writer.join(5)
+        self.assertFalse(writer.is_alive())
+
+    def output(self) -> bytes:
+        return b"".join(path.read_bytes()
+                        for path in sorted(Path(self.folder.name).iterdir()))
+
+    def test_stalled_writer(self):
+        release = threading.Event()
+        write = SegmentFile.write
+
+        def stalled_write(segment, packets):
+            release.wait(5)
+            write(segment, packets)
+
+        recorder = self.recorder
+        with mock.patch.object(SegmentFile, "write", stalled_write):
+            writer = threading.Thread(target=recorder.file_writer)
+            writer.start()
+            expected = self.enqueue(500)
+            self.assertLessEqual(recorder.queue_memory(), 2000)
+            self.assertGreater(recorder.spilled_bytes, 40000)
+            self.assertGreater(recorder.queue_depth, 400)
+            self.assertGreaterEqual(recorder.replay_lag, 0)
+            release.set()
+            self.finish(writer)
+        self.assertEqual(self.output(), expected)
+        self.assertEqual(recorder.queue_depth, 0)
+        self.assertEqual(recorder.replay_lag, 0)
+        self.assertEqual(list(Path(self.spill_folder.name).iterdir()), [])
+
+    def test_process_budget(self):
+        recorder = self.recorder
+        recorder.config.max_queue_bytes = 0
+        recorder.budget = MemoryBudget(1000)
+        expected = self.enqueue(50)
+        self.assertLessEqual(recorder.budget.used, 1000)
+        self.assertGreater(recorder.spilled_bytes, 0)
+        writer = threading.Thread(target=recorder.file_writer)
+        writer.start()
+        self.finish(writer)
+        self.assertEqual(self.output(), expected)
+        self.assertEqual(recorder.budget.used, 0)
+
+    def test_process_budget_spills_stalled_stream(self):
+        self.recorder.config.max_queue_bytes = 0
+        self.recorder.budget = MemoryBudget(3000)
+        # Another stream whose writer is stalled holds most of the budget
+        self.recorder.budget.reserve(2900, "stalled")
+        self.enqueue(5)
+        self.assertEqual(self.recorder.spilled_bytes, 0)
+        self.assertEqual(len(self.recorder.queue), 5)
+
+    def test_spills_without_queue_lock(self):
+        locked = []
+        append = SpillJournal.append
+
+        def checked_append(journal, packets):
+            locked.append(self.recorder.queue_lock.locked())
+            append(journal, packets)
+
+        with mock.patch.object(SpillJournal, "append", checked_append):
+            self.enqueue(50)
+        self.assertTrue(locked)
+        self.assertFalse(any(locked))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,98 @@
+import os
+from pathlib import Path
+import tempfile
+import unittest
+
+from streamrec.config import RecordingConfig
+from streamrec.index import IndexWriter, SegmentIndex
+from streamrec.ingest import NativeDemuxer
+from streamrec.recovery import recover_open_segments
+from streamrec.segmentfile import SegmentFile
+from streamrec.session import RecordingSession
+from streamrec.test_index import START_TS, encode_mp3, make_batch
+from streamrec.test_ingest import encode
+from streamrec.verify import verify
+
+
+class TestRecovery(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.packets = encode_mp3(25)
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        config = RecordingConfig(url="", output_folder=self.folder.name, segment_duration=10)
+        self.session = RecordingSession(config=config)
+        self.session.adjusted_ts_start = START_TS
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def crash(self, index: IndexWriter = None,
+              packets: list = None) -> tuple[SegmentFile, bytes, float]:
+        """Record the packets, leaving the last segment open with half a frame
+        at its end. Returns that segment, its complete content and its end."""
+        batch = make_batch(self.session, packets or self.packets)
+        segment = None
+        for segment_ts, packets in batch.split_by_segment():
+            if segment:
+                segment.close()
+            segment = SegmentFile(self.session, segment_ts, index=index)
+            segment.write(packets)
+        os.write(segment.fd, bytes(packets.payload[:200]))
+        os.close(segment.fd)
+        if index:
+            index.close()
+        return segment, bytes(packets.payload), float(packets.end_ts()[-1])
+
+    def test_recovers_from_index(self):
+        index = IndexWriter(self.folder.name, self.session.uuid)
+        segment, content, end_ts = self.crash(index)
+        self.assertEqual(recover_open_segments(self.folder.name, sync=False), 1)
+        self.assertFalse(segment.get_path(tmp=True).exists())
+        self.assertEqual(segment.get_path().read_bytes(), content)
+        index = SegmentIndex(self.folder.name)
+        self.assertEqual(index.open_segments(), [])
+        recovered = index.find(end_ts - 0.01)
+        self.assertEqual(recovered.path, segment.get_path())
+        self.assertEqual(recovered.size, len(content))
+        self.assertAlmostEqual(recovered.end_ts, end_ts, places=3)
+        self.assertGreaterEqual(len(index.checkpoints(recovered)), 4)
+        self.assertEqual(index.checksum_end(recovered), len(content))
+        index.close()
+        self.assertEqual(verify(self.folder.name).problems, [])
+        # Nothing is left to recover
+        self.assertEqual(recover_open_segments(self.folder.name, sync=False), 0)
+
+    def test_recovers_adts(self):
+        index = IndexWriter(self.folder.name, self.session.uuid)
+        packets = NativeDemuxer("aac").feed(encode("aac", "adts", 25))
+        segment, content, end_ts = self.crash(index, packets)
+        self.assertEqual(recover_open_segments(self.folder.name, sync=False), 1)
+        self.assertEqual(segment.get_path().read_bytes(), content)
+        index = SegmentIndex(self.folder.name)
+        recovered = index.find(end_ts - 0.01)
+        self.assertEqual(recovered.size, len(content))
+        self.assertAlmostEqual(recovered.end_ts, end_ts, places=3)
+        index.close()
+        self.assertEqual(verify(self.folder.name).problems, [])
+
+    def test_removes_missing_segments(self):
+        index = IndexWriter(self.folder.name, self.session.uuid)
+        segment, _, _ = self.crash(index)
+        segment.get_path(tmp=True).unlink()
+        self.assertEqual(recover_open_segments(self.folder.name, sync=False), 0)
+        index = SegmentIndex(self.folder.name)
+        self.assertEqual(index.open_segments(), [])
+        self.assertEqual(len(index.latest(10)), 2)
+        index.close()
+
+    def test_recovers_without_index(self):
+        segment, content, _ = self.crash()
+        self.assertEqual(recover_open_segments(self.folder.name), 1)
+        self.assertEqual(segment.get_path().read_bytes(), content)
+        self.assertEqual(len(list(Path(self.folder.name).glob("*.tmp"))), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
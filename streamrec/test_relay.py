@@ -0,0 +1,125 @@
+import socket
+import threading
+import time
+import unittest
+
+from streamrec.relay import Overrun, Relay, RelayServer, RingBuffer
+
+
+class TestRingBuffer(unittest.TestCase):
+    def test_wraps_around(self):
+        ring = RingBuffer(10)
+        ring.write(b"abcdef")
+        self.assertEqual(ring.read(0, 100), b"abcdef")
+        ring.write(b"ghijkl")
+        self.assertEqual(ring.head, 12)
+        self.assertEqual(ring.read(2, 100), b"cdefghijkl")
+        self.assertEqual(ring.read(8, 3), b"ijk")
+        self.assertEqual(ring.read(12, 100), b"")
+
+    def test_overrun(self):
+        ring = RingBuffer(10)
+        ring.write(b"abcdef")
+        ring.write(b"ghijkl")
+        with self.assertRaises(Overrun):
+            ring.read(1, 100)
+
+    def test_large_write_keeps_the_end(self):
+        ring = RingBuffer(4)
+        ring.write(b"abcdefgh")
+        self.assertEqual(ring.read(ring.head - 4, 100), b"efgh")
+
+
+class TestRelay(unittest.TestCase):
+    def test_start_position_is_a_packet_boundary(self):
+        relay = Relay("station", capacity=100, burst=25)
+        for _ in range(10):
+            relay.write(bytes(10))
+        self.assertEqual(relay.start_position(), 80)
+        relay = Relay("station", capacity=100, burst=25)
+        self.assertEqual(relay.start_position(), 0)
+
+
+class TestRelayServer(unittest.TestCase):
+    def setUp(self):
+        self.server = RelayServer(host="127.0.0.1", port=0)
+        self.server.start()
+        self.relay = Relay("station", capacity=64 * 1024, burst=0)
+        self.server.add(self.relay)
+        while self.relay.data_available is None:
+            time.sleep(0.01)
+
+    def tearDown(self):
+        self.server.stop()
+
+    def connect(self, path: str = "/station") -> socket.socket:
+        sock = socket.create_connection(("127.0.0.1", self.server.port), timeout=5)
+        sock.sendall(f"GET {path} HTTP/1.0\r\n\r\n".encode())
+        return sock
+
+    def read_headers(self, sock: socket.socket) -> bytes:
+        data = b""
+        while b"\r\n\r\n" not in data:
+            data += sock.recv(1)
+        return data
+
+    def wait_listeners(self, count: int):
+        while self.relay.listeners < count:
+            time.sleep(0.01)
+
+    def test_relays_to_listeners(self):
+        listeners = [self.connect() for _ in range(3)]
+        for sock in listeners:
+            self.assertIn(b"200 OK", self.read_headers(sock))
+        self.wait_listeners(3)
+        packets = [bytes([i]) * 100 for i in range(50)]
+        for packet in packets:
+            self.relay.write(packet)
+        expected = b"".join(packets)
+        for sock in listeners:
+            data = b""
+            while len(data) < len(expected):
+                data += sock.recv(65536)
+            self.assertEqual(data, expected)
+            sock.close()
+
+    def test_drops_slow_listeners(self):
+        slow = self.connect()
+        slow.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+        fast = self.connect()
+        self.read_headers(fast)
+        self.wait_listeners(2)
+        received = []
+
+        def read_fast():
+            while True:
+                data = fast.recv(65536)
+                if not data:
+                    return
+                received.append(len(data))
+
+        reader = threading.Thread(target=read_fast)
+        reader.start()
+        total = 0
+        packet = bytes(1000)
+        start = time.monotonic()
+        while self.relay.dropped == 0 and time.monotonic() - start < 10:
+            self.relay.write(packet)
+            total += len(packet)
+            time.sleep(0.0001)
+        self.assertEqual(self.relay.dropped, 1)
+        self.relay.close()
+        fast.shutdown(socket.SHUT_RDWR)
+        reader.join(5)
+        fast.close()
+        slow.close()
+        self.assertGreater(sum(received), 0)
+
+    def test_unknown_stream(self):
+        sock = self.connect("/other")
+        self.assertIn(b"404", self.read_headers(sock))
+        sock.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,78 @@
+from pathlib import Path
+import tempfile
+import unittest
+
+from streamrec.config import RecordingConfig
+from streamrec.index import IndexWriter, SegmentIndex
+from streamrec.retention import RetentionPolicy, RetentionWorker
+from streamrec.segmentfile import SegmentFile
+from streamrec.session import RecordingSession
+from streamrec.test_index import START_TS, encode_mp3, make_batch
+
+
+class TestRetention(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.packets = encode_mp3(4)
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.config = RecordingConfig(url="", output_folder=self.folder.name, name="station",
+                                      segment_duration=2, path_template="{station}/{HH}")
+        session = RecordingSession(config=self.config)
+        index = IndexWriter(self.folder.name, session.uuid)
+        # The same segments in each of three hours
+        for hour in range(3):
+            session.adjusted_ts_start = START_TS + hour * 3600
+            segment = None
+            for segment_ts, batch in make_batch(session, self.packets).split_by_segment():
+                if segment:
+                    segment.close()
+                segment = SegmentFile(session, segment_ts, index=index)
+                segment.write(batch)
+            segment.close()
+        index.close()
+        self.worker = RetentionWorker()
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def remaining(self) -> list[Path]:
+        index = SegmentIndex(self.folder.name)
+        try:
+            return [s.path for s in index.oldest(100)]
+        finally:
+            index.close()
+
+    def test_max_age(self):
+        per_hour = len(self.remaining()) // 3
+        policy = RetentionPolicy(self.folder.name, max_age=3600, rate=1000)
+        expired = self.worker.apply(policy, now=START_TS + 2 * 3600)
+        self.assertEqual(expired, per_hour)
+        remaining = self.remaining()
+        self.assertEqual(len(remaining), 2 * per_hour)
+        self.assertTrue(all(p.exists() for p in remaining))
+        # The emptied hour folder is removed too
+        hours = sorted(p.name for p in (Path(self.folder.name) / "station").iterdir())
+        self.assertEqual(hours, ["01", "02"])
+
+    def test_max_bytes_and_move(self):
+        sizes = [p.stat().st_size for p in self.remaining()]
+        target = tempfile.TemporaryDirectory()
+        policy = RetentionPolicy(self.folder.name, max_bytes=sum(sizes[3:]),
+                                 move_to=target.name, rate=1000)
+        self.assertEqual(self.worker.apply(policy), 3)
+        self.assertEqual(len(self.remaining()), len(sizes) - 3)
+        moved = sorted(Path(target.name).rglob("*.mp3"))
+        self.assertEqual([p.stat().st_size for p in moved], sizes[:3])
+        self.assertEqual(moved[0].parent.relative_to(target.name), Path("station/00"))
+        target.cleanup()
+
+    def test_from_config(self):
+        self.assertIsNone(RetentionPolicy.from_config(self.config))
+        self.config.retention_max_age = 60
+        self.assertEqual(RetentionPolicy.from_config(self.config).max_age, 60)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,10 +1,15 @@
 from datetime import datetime, timezone
+from fractions import Fraction
+import os
+import tempfile
 import unittest
-from unittest.mock import Mock, patch
+from unittest.mock import patch
 
-from streamrec.segmentfile import SegmentFile
+import av
+
+from streamrec.segmentfile import SegmentFile, known_folders, writev_all
 from streamrec.session import RecordingSession
-from streamrec.packet import PacketWithReceivedTS
+from streamrec.packet import PacketBatch, PacketBatchBuilder
 from streamrec.config import RecordingConfig
 
 
@@ -14,46 +19,140 @@ def utc_timestamp(date_str: str) -> float:
     return dt.timestamp()
 
 
+def make_batch(session: RecordingSession, packets: list[tuple[int, bytes]]) -> PacketBatch:
+    builder = PacketBatchBuilder(session)
+    for pts, data in packets:
+        packet = av.Packet(data)
+        packet.pts = pts
+        packet.time_base = Fraction(1, 1000)
+        builder.append(packet)
+    return builder.build()
+
+
 class TestSegmentFileIntegration(unittest.TestCase):
     def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
         self.config = RecordingConfig(
-            url="http://example.com", output_folder="/tmp")
+            url="http://example.com", output_folder=self.folder.name)
         self.session = RecordingSession(config=self.config)
         self.session.adjusted_ts_start = utc_timestamp("20200101-000000")
 
-    @patch("os.rename")
-    @patch("streamrec.segmentfile.open")
-    def test_write_and_close(self, mock_open, mock_rename):
-        p1 = Mock()
-        p1.pts = 1999
-        p1.time_base = 1 / 1000
-
-        packet1 = PacketWithReceivedTS(
-            session=self.session, packet=p1)
+    def tearDown(self):
+        self.folder.cleanup()
 
-        p2 = Mock()
-        p2.pts = 3000
-        p2.time_base = 1 / 1000
+    def make_segment(self, packets: PacketBatch) -> SegmentFile:
+        segment_ts, _ = packets.split_by_segment()[0]
+        return SegmentFile(session=self.session, segment_ts=segment_ts)
 
-        packet2 = PacketWithReceivedTS(
-            session=self.session, packet=p2)
-
-        packets = [packet1, packet2]
-        it = iter(packets)
+    def test_path_template(self):
+        self.config.path_template = "{station}/{yyyy}/{mm}/{dd}/{HH}"
+        self.config.name = "station"
+        packets = make_batch(self.session, [(3600000, b"abc")])
+        segment_file = self.make_segment(packets)
+        segment_file.write(packets)
+        segment_file.close()
+        self.assertEqual(str(segment_file.get_path()),
+                         f"{self.folder.name}/station/2020/01/01/01/"
+                         f"20200101-010000-UTC_{self.session.uuid}.mp3")
+        self.assertEqual(segment_file.get_path().read_bytes(), b"abc")
+        self.assertIn(segment_file.get_path().parent, known_folders)
+
+        # A cached folder removed since is created again
+        os.remove(segment_file.get_path())
+        os.rmdir(segment_file.get_path().parent)
+        packets = make_batch(self.session, [(3601000, b"def")])
+        segment_file = self.make_segment(packets)
+        segment_file.write(packets)
+        segment_file.close()
+        self.assertEqual(segment_file.get_path().read_bytes(), b"def")
 
-        segment_file = SegmentFile(
-            session=self.session, segment_ts=packet1.get_segment_ts())
+    def test_write_and_close(self):
+        packet1 = make_batch(self.session, [(1999, b"abc")])
+        packet2 = make_batch(self.session, [(3000, b"def")])
 
-        segment_file.write(it)
+        segment_file = self.make_segment(packet1)
+        segment_file.write(packet1)
+        segment_file.write(packet2)
 
         uuid = self.session.uuid
         self.assertEqual(str(segment_file.get_path()),
-                         f"/tmp/20200101-000001-UTC_{uuid}.mp3")
+                         f"{self.folder.name}/20200101-000001-UTC_{uuid}.mp3")
+        self.assertTrue(segment_file.get_path(tmp=True).exists())
 
         segment_file.close()
 
-        mock_open.assert_called()
-        mock_rename.assert_called()
+        self.assertFalse(segment_file.get_path(tmp=True).exists())
+        self.assertEqual(segment_file.get_path().read_bytes(), b"abcdef")
+
+    @patch("streamrec.segmentfile.os.open", wraps=os.open)
+    def test_single_open_per_segment(self, mock_open):
+        packets = make_batch(self.session, [(i * 26, b"x" * 10) for i in range(10)])
+        segment_file = self.make_segment(packets)
+        for i in range(0, 10, 2):
+            segment_file.write(packets[i:i + 2])
+        self.assertEqual(mock_open.call_count, 1)
+        segment_file.close()
+
+    @patch("streamrec.segmentfile.fsync_dir")
+    @patch("streamrec.segmentfile.fdatasync")
+    def test_durability_none(self, mock_fdatasync, mock_fsync_dir):
+        self.config.durability = "none"
+        packet = make_batch(self.session, [(0, b"a")])
+        segment_file = self.make_segment(packet)
+        segment_file.write(packet)
+        segment_file.close()
+        mock_fdatasync.assert_not_called()
+        mock_fsync_dir.assert_not_called()
+
+    @patch("streamrec.segmentfile.fsync_dir")
+    @patch("streamrec.segmentfile.fdatasync")
+    def test_durability_on_close(self, mock_fdatasync, mock_fsync_dir):
+        packet = make_batch(self.session, [(0, b"a")])
+        segment_file = self.make_segment(packet)
+        segment_file.write(packet)
+        mock_fdatasync.assert_not_called()
+        segment_file.close()
+        mock_fdatasync.assert_called_once()
+        mock_fsync_dir.assert_called_once_with(segment_file.get_path().parent)
+
+    @patch("streamrec.segmentfile.time.monotonic")
+    @patch("streamrec.segmentfile.fdatasync")
+    def test_durability_every_n_seconds(self, mock_fdatasync, mock_monotonic):
+        self.config.durability = "every-5-seconds"
+        packet = make_batch(self.session, [(0, b"a")])
+        segment_file = self.make_segment(packet)
+        mock_monotonic.return_value = 100
+        segment_file.write(packet)
+        mock_monotonic.return_value = 103
+        segment_file.write(packet)
+        mock_fdatasync.assert_not_called()
+        mock_monotonic.return_value = 106
+        segment_file.write(packet)
+        mock_fdatasync.assert_called_once()
+        segment_file.close()
+
+
+class TestWritevAll(unittest.TestCase):
+    def test_more_buffers_than_iov_max(self):
+        buffers = [bytes([i % 256]) * 3 for i in range(3000)]
+        with tempfile.TemporaryFile() as f:
+            written = writev_all(f.fileno(), buffers)
+            f.seek(0)
+            self.assertEqual(f.read(), b"".join(buffers))
+        self.assertEqual(written, 9000)
+
+    @patch("streamrec.segmentfile.os.writev")
+    def test_short_writes(self, mock_writev):
+        out = bytearray()
+
+        def short_writev(_fd, views):
+            # Write at most 4 bytes per call
+            data = b"".join(bytes(v) for v in views)[:4]
+            out.extend(data)
+            return len(data)
+        mock_writev.side_effect = short_writev
+        writev_all(0, [b"abc", b"defgh", b"ij"])
+        self.assertEqual(bytes(out), b"abcdefghij")
 
 
 if __name__ == "__main__":
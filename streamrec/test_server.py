@@ -0,0 +1,182 @@
+import http.client
+import tempfile
+from threading import Event, Thread
+import unittest
+from unittest import mock
+
+from streamrec.config import RecordingConfig
+from streamrec.index import IndexWriter
+from streamrec.segmentfile import SegmentFile
+from streamrec.server import RecordingServer, RequestError, parse_range
+from streamrec.session import RecordingSession
+from streamrec.store import SegmentStore
+from streamrec.test_index import START_TS, encode_mp3, make_batch
+
+
+def write_session(folder: str, ts_start: float, packets: list) -> list[SegmentFile]:
+    """Record ``packets`` from ``ts_start`` in 10 second segments."""
+    config = RecordingConfig(url="", output_folder=folder, segment_duration=10)
+    session = RecordingSession(config=config)
+    session.adjusted_ts_start = ts_start
+    index = IndexWriter(folder, session.uuid)
+    segments = []
+    for segment_ts, batch in make_batch(session, packets).split_by_segment():
+        if segments:
+            segments[-1].close()
+        segments.append(SegmentFile(session, segment_ts, index=index))
+        segments[-1].write(batch)
+    segments[-1].close()
+    index.close()
+    return segments
+
+
+class TestParseRange(unittest.TestCase):
+    def test_ranges(self):
+        self.assertIsNone(parse_range(None, 100))
+        self.assertIsNone(parse_range("bytes=0-1,5-6", 100))
+        self.assertEqual(parse_range("bytes=10-19", 100), (10, 19))
+        self.assertEqual(parse_range("bytes=10-", 100), (10, 99))
+        self.assertEqual(parse_range("bytes=-10", 100), (90, 99))
+        self.assertEqual(parse_range("bytes=90-200", 100), (90, 99))
+        with self.assertRaises(RequestError):
+            parse_range("bytes=100-", 100)
+
+
+class TestRecordingServer(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.folder = tempfile.TemporaryDirectory()
+        write_session(cls.folder.name, START_TS, encode_mp3(25))
+
+        cls.server = RecordingServer({"station": cls.folder.name}, host="127.0.0.1", port=0,
+                                     segment_durations={"station": 10})
+        cls.thread = Thread(target=cls.server.start)
+        cls.thread.start()
+        cls.server.ready.wait(5)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+        cls.thread.join(5)
+        cls.folder.cleanup()
+
+    def setUp(self):
+        self.conn = http.client.HTTPConnection("127.0.0.1", self.server.port, timeout=5)
+
+    def tearDown(self):
+        self.conn.close()
+
+    def get(self, path: str, headers: dict = None, method: str = "GET"):
+        self.conn.request(method, path, headers=headers or {})
+        response = self.conn.getresponse()
+        return response, response.read()
+
+    def expected(self, start: float, end: float) -> bytes:
+        store = SegmentStore(self.folder.name)
+        try:
+            return b"".join(bytes(view) for view in store.read(start, end))
+        finally:
+            store.close()
+
+    def test_time_range(self):
+        response, body = self.get("/station/2020-01-01T00:00:05Z/PT10S")
+        self.assertEqual(response.status, 200)
+        self.assertEqual(response.getheader("Content-Type"), "audio/mpeg")
+        self.assertEqual(body, self.expected(START_TS + 5, START_TS + 15))
+        # The connection is kept alive
+        response, body = self.get(f"/station/{START_TS + 5}/{START_TS + 15}.mp3")
+        self.assertEqual(body, self.expected(START_TS + 5, START_TS + 15))
+
+    def test_byte_range(self):
+        expected = self.expected(START_TS + 5, START_TS + 15)
+        response, body = self.get("/station/2020-01-01T00:00:05Z/PT10S",
+                                  {"Range": "bytes=1000-200000"})
+        self.assertEqual(response.status, 206)
+        self.assertEqual(response.getheader("Content-Range"),
+                         f"bytes 1000-{len(expected) - 1}/{len(expected)}")
+        self.assertEqual(body, expected[1000:])
+        response, body = self.get("/station/2020-01-01T00:00:05Z/PT10S", {"Range": "bytes=-100"})
+        self.assertEqual(body, expected[-100:])
+
+    def test_head(self):
+        response, body = self.get("/station/2020-01-01T00:00:05Z/PT10S", method="HEAD")
+        self.assertEqual(response.status, 200)
+        self.assertEqual(body, b"")
+        self.assertEqual(int(response.getheader("Content-Length")),
+                         len(self.expected(START_TS + 5, START_TS + 15)))
+
+    def test_range_playlist(self):
+        response, body = self.get("/station/2020-01-01T00:00:05Z/PT10S.m3u8")
+        self.assertEqual(response.status, 200)
+        lines = body.decode().splitlines()
+        self.assertIn("#EXT-X-ENDLIST", lines)
+        byte_ranges = [line for line in lines if line.startswith("#EXT-X-BYTERANGE")]
+        uris = [line for line in lines if line.startswith("/station/segments/")]
+        self.assertEqual(len(uris), 2)
+        audio = b""
+        for byte_range, uri in zip(byte_ranges, uris):
+            size, offset = map(int, byte_range.split(":")[1].split("@"))
+            _, segment = self.get(uri, {"Range": f"bytes={offset}-{offset + size - 1}"})
+            audio += segment
+        self.assertEqual(audio, self.expected(START_TS + 5, START_TS + 15))
+        self.assertIn(("station", START_TS + 5, START_TS + 15), self.server.playlists)
+
+    def test_live_playlist(self):
+        response, body = self.get("/station/live.m3u8")
+        self.assertEqual(response.status, 200)
+        lines = body.decode().splitlines()
+        self.assertNotIn("#EXT-X-ENDLIST", lines)
+        self.assertEqual(len([line for line in lines if line.startswith("#EXTINF")]), 3)
+        self.assertIn(f"#EXT-X-MEDIA-SEQUENCE:{int(START_TS // 10)}", lines)
+
+    def test_live_playlist_of_overlapping_sessions(self):
+        packets = encode_mp3(20)
+        duration = float(packets[0].duration * packets[0].time_base)
+        with tempfile.TemporaryDirectory() as folder:
+            first = write_session(folder, START_TS, packets[:round(12 / duration)])
+            # A reconnect: the next session overlaps the end of the first one
+            second = write_session(folder, START_TS + 11, packets)
+            server = RecordingServer({"station": folder}, segment_durations={"station": 10})
+            try:
+                lines = server.live_playlist("station").decode().splitlines()
+            finally:
+                for store in server.stores.values():
+                    store.close()
+                server.executor.shutdown()
+        uris = [line.rsplit("/", 1)[1] for line in lines if line.startswith("/station/")]
+        self.assertEqual(uris, [first[0].get_path().name, second[0].get_path().name,
+                                second[1].get_path().name, second[2].get_path().name])
+        self.assertIn(f"#EXT-X-MEDIA-SEQUENCE:{int(START_TS // 10)}", lines)
+
+    def test_slow_query_does_not_block(self):
+        entered, release = Event(), Event()
+        plan = SegmentStore.plan
+
+        def slow_plan(store, start, end):
+            entered.set()
+            release.wait(5)
+            return plan(store, start, end)
+
+        with mock.patch.object(SegmentStore, "plan", slow_plan):
+            slow = Thread(target=self.get, args=("/station/2020-01-01T00:00:05Z/PT10S",))
+            slow.start()
+            self.assertTrue(entered.wait(5))
+            other = http.client.HTTPConnection("127.0.0.1", self.server.port, timeout=2)
+            try:
+                other.request("GET", "/station/live.m3u8")
+                self.assertEqual(other.getresponse().status, 200)
+            finally:
+                other.close()
+                release.set()
+                slow.join(5)
+
+    def test_errors(self):
+        self.assertEqual(self.get("/other/live.m3u8")[0].status, 404)
+        self.assertEqual(self.get("/station/2020-01-02T00:00:00Z/PT10S")[0].status, 404)
+        self.assertEqual(self.get("/station/2020-01-01T00:00:05Z/PX")[0].status, 400)
+        self.assertEqual(self.get("/station/segments/../index.sqlite")[0].status, 404)
+        self.assertEqual(self.get("/station/live.m3u8", method="POST")[0].status, 405)
+
+
+if __name__ == "__main__":
+    unittest.main()
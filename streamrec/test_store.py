@@ -0,0 +1,108 @@
+import io
+import tempfile
+import unittest
+from uuid import uuid1
+
+from streamrec.config import RecordingConfig
+from streamrec.index import IndexWriter
+from streamrec.segmentfile import SegmentFile
+from streamrec.session import RecordingSession
+from streamrec.store import SegmentStore, parse_timestamp
+from streamrec.test_index import START_TS, encode_mp3, make_batch
+
+
+class TestParseTimestamp(unittest.TestCase):
+    def test_formats(self):
+        self.assertEqual(parse_timestamp("1577836800"), START_TS)
+        self.assertEqual(parse_timestamp("2020-01-01T00:00:00Z"), START_TS)
+        self.assertEqual(parse_timestamp("2020-01-01T00:00:00"), START_TS)
+        self.assertEqual(parse_timestamp("2020-01-01T01:00:00+01:00"), START_TS)
+
+
+class TestSegmentStore(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.packets = encode_mp3(25)
+        cls.packet_duration = float(cls.packets[0].duration * cls.packets[0].time_base)
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.config = RecordingConfig(url="", output_folder=self.folder.name,
+                                      segment_duration=10)
+        self.store: SegmentStore = None
+
+    def tearDown(self):
+        if self.store:
+            self.store.close()
+        self.folder.cleanup()
+
+    def record(self, adjusted_ts_start: float, packets: list, close: bool = True):
+        session = RecordingSession(config=self.config, uuid=uuid1())
+        session.adjusted_ts_start = adjusted_ts_start
+        index = IndexWriter(self.folder.name, session.uuid)
+        segment = None
+        batch = make_batch(session, packets, pts_shift=-packets[0].pts)
+        for segment_ts, batch in batch.split_by_segment():
+            if segment:
+                segment.close()
+            segment = SegmentFile(session, segment_ts, index=index)
+            segment.write(batch)
+        if close:
+            segment.close()
+            index.close()
+        else:
+            index.commit()
+        return [(adjusted_ts_start + i * self.packet_duration, bytes(p))
+                for i, p in enumerate(packets)]
+
+    def expected(self, packets: list, start: float, end: float) -> bytes:
+        return b"".join(data for ts, data in packets
+                        if ts < end and ts + self.packet_duration > start)
+
+    def extract(self, start: float, end: float) -> bytes:
+        self.store = self.store or SegmentStore(self.folder.name)
+        out = io.BytesIO()
+        written = self.store.extract(start, end, out)
+        self.assertEqual(written, len(out.getvalue()))
+        return out.getvalue()
+
+    def test_cuts_at_frame_boundaries(self):
+        packets = self.record(START_TS, self.packets)
+        for start, end in [(START_TS + 3.3, START_TS + 4.1),
+                           (START_TS + 8.5, START_TS + 12.5),
+                           (START_TS - 5, START_TS + 1),
+                           (START_TS + 2, START_TS + 60)]:
+            self.assertEqual(self.extract(start, end), self.expected(packets, start, end))
+
+    def test_whole_segments(self):
+        packets = self.record(START_TS, self.packets)
+        self.store = SegmentStore(self.folder.name)
+        plan = self.store.plan(START_TS, START_TS + 60)
+        self.assertEqual([piece.start for piece in plan], [0, 0, 0])
+        self.assertEqual(self.extract(START_TS, START_TS + 60),
+                         b"".join(data for _, data in packets))
+
+    def test_spans_sessions(self):
+        first = self.record(START_TS, self.packets[:300])
+        second = self.record(START_TS + 10, self.packets[300:])
+        packets = [p for p in first if p[0] < START_TS + 10] + second
+        start, end = START_TS + 5, START_TS + 15
+        self.assertEqual(self.extract(start, end), self.expected(packets, start, end))
+
+    def test_open_segment(self):
+        packets = self.record(START_TS, self.packets, close=False)
+        start, end = START_TS + 21, START_TS + 30
+        self.assertEqual(self.extract(start, end), self.expected(packets, start, end))
+
+    def test_sendfile(self):
+        self.record(START_TS, self.packets)
+        start, end = START_TS + 3.3, START_TS + 14.1
+        expected = self.extract(start, end)
+        with tempfile.TemporaryFile() as f:
+            self.assertEqual(self.store.extract(start, end, f), len(expected))
+            f.seek(0)
+            self.assertEqual(f.read(), expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,92 @@
+import multiprocessing
+import time
+import unittest
+from unittest import mock
+
+from streamrec.supervisor import StreamLoad, Supervisor, plan_move, stream_weights
+
+
+class TestStreamLoad(unittest.TestCase):
+    def test_rates(self):
+        load = StreamLoad()
+        load.update({"bytes": 1000, "cpu": 1.0}, ts=10)
+        self.assertIsNone(load.bytes_rate)
+        load.update({"bytes": 3000, "cpu": 1.5}, ts=12)
+        self.assertEqual(load.bytes_rate, 1000)
+        self.assertEqual(load.cpu_rate, 0.25)
+
+    def test_counter_reset(self):
+        load = StreamLoad()
+        load.update({"bytes": 1000, "cpu": 1.0}, ts=10)
+        load.update({"bytes": 3000, "cpu": 1.5}, ts=12)
+        load.update({"bytes": 10, "cpu": 0.1}, ts=14)
+        self.assertEqual(load.bytes_rate, 1000)
+        self.assertEqual(load.bytes, 10)
+
+
+class TestStreamWeights(unittest.TestCase):
+    def test_shares(self):
+        loads = {"a": StreamLoad(bytes_rate=300, cpu_rate=0.1),
+                 "b": StreamLoad(bytes_rate=100, cpu_rate=0.3),
+                 "new": StreamLoad()}
+        weights = stream_weights(loads)
+        self.assertAlmostEqual(weights["a"], 0.75 + 0.25)
+        self.assertAlmostEqual(weights["b"], 0.25 + 0.75)
+        self.assertAlmostEqual(weights["new"], 1.0)
+
+
+class TestPlanMove(unittest.TestCase):
+    def test_balanced(self):
+        assignment = {0: {"a", "b"}, 1: {"c", "d"}}
+        weights = {"a": 1, "b": 1, "c": 1, "d": 1}
+        self.assertIsNone(plan_move(assignment, weights, threshold=0.25))
+
+    def test_moves_from_busiest_to_idlest(self):
+        assignment = {0: {"a", "b", "c"}, 1: {"d"}, 2: {"e", "f"}}
+        weights = {"a": 1, "b": 1, "c": 1, "d": 1, "e": 1, "f": 1}
+        self.assertIn(plan_move(assignment, weights, threshold=0.25),
+                      [(s, 0, 1) for s in "abc"])
+
+    def test_does_not_flap(self):
+        assignment = {0: {"a", "b"}, 1: {"c"}}
+        weights = {"a": 0.4, "b": 0.8, "c": 0.8}
+        self.assertIsNone(plan_move(assignment, weights, threshold=0.25))
+
+    def test_picks_stream_closest_to_half_gap(self):
+        assignment = {0: {"a", "b", "c"}, 1: set()}
+        weights = {"a": 3, "b": 2, "c": 1}
+        self.assertEqual(plan_move(assignment, weights, threshold=0.25), ("a", 0, 1))
+
+
+class TestCollectStats(unittest.TestCase):
+    def test_drops_late_replies(self):
+        supervisor = Supervisor("streams.toml", workers=1)
+        [worker] = supervisor.workers
+        worker.conn, child = multiprocessing.Pipe()
+        self.addCleanup(worker.conn.close)
+        self.addCleanup(child.close)
+        worker.streams = {"a"}
+        supervisor.configs = {"a": None}
+        supervisor.loads = {"a": StreamLoad()}
+        # The reply to a request that timed out arrives before the current one
+        child.send((0, {"a": {"bytes": 1000, "cpu": 1.0}}))
+        child.send((1, {"a": {"bytes": 2000, "cpu": 2.0}}))
+        supervisor.collect_stats()
+        self.assertEqual(child.recv(), ("stats", 1))
+        self.assertEqual(supervisor.stats["a"]["bytes"], 2000)
+        self.assertFalse(worker.conn.poll())
+
+    def test_one_deadline_for_all_workers(self):
+        supervisor = Supervisor("streams.toml", workers=3)
+        for worker in supervisor.workers:
+            worker.conn, child = multiprocessing.Pipe()
+            self.addCleanup(worker.conn.close)
+            self.addCleanup(child.close)
+        start = time.monotonic()
+        with mock.patch("streamrec.supervisor.STATS_TIMEOUT", 0.3):
+            supervisor.collect_stats()
+        self.assertLess(time.monotonic() - start, 0.6)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,114 @@
+from fractions import Fraction
+import unittest
+
+import av
+
+from streamrec.timeline import ALIGN_MAX_PACKETS, Timeline, backoff_delay
+
+DURATION = 26
+
+
+def make_packet(pts: int, payload: int, time_base: Fraction = Fraction(1, 1000)) -> av.Packet:
+    packet = av.Packet(payload.to_bytes(4, "big") * 25)
+    packet.pts = pts
+    packet.duration = round(DURATION * Fraction(1, 1000) / time_base)
+    packet.time_base = time_base
+    return packet
+
+
+def feed(timeline: Timeline, first: int, count: int, pts_start: int, received_ts: float):
+    """Feed packets with payloads first..first+count, returning the queued session pts."""
+    queued = []
+    for i in range(count):
+        pts = pts_start + i * DURATION
+        entries = timeline.add(make_packet(pts, first + i), received_ts + pts / 1000)
+        queued += [entry[1] for entry in entries]
+    return queued
+
+
+class TestBackoff(unittest.TestCase):
+    def test_bounds(self):
+        for attempt in range(10):
+            delay = backoff_delay(attempt, 0.1, 5)
+            expected = min(5, 0.1 * 2 ** attempt)
+            self.assertGreaterEqual(delay, expected / 2)
+            self.assertLessEqual(delay, expected)
+
+
+class TestTimeline(unittest.TestCase):
+    def test_first_connection_keeps_pts(self):
+        timeline = Timeline()
+        self.assertEqual(feed(timeline, 0, 5, 0, 1000.0), [0, 26, 52, 78, 104])
+        self.assertEqual(timeline.last_end, 130)
+
+    def test_new_connection_before_packets_is_not_a_reconnect(self):
+        timeline = Timeline()
+        timeline.new_connection()
+        self.assertEqual(timeline.reconnects, 0)
+        self.assertEqual(feed(timeline, 0, 2, 500, 1000.0), [500, 526])
+
+    def test_repeated_audio_is_dropped(self):
+        timeline = Timeline()
+        feed(timeline, 0, 100, 0, 1000.0)
+        timeline.new_connection()
+        # The server sends its last 20 packets again, with pts from zero
+        queued = feed(timeline, 80, 40, 0, 1003.0)
+        self.assertEqual(queued, [100 * DURATION + i * DURATION for i in range(20)])
+        self.assertEqual(timeline.reconnects, 1)
+        self.assertTrue(timeline.matched)
+        self.assertEqual(timeline.last_gap, 0)
+
+    def test_gap_after_matched_audio(self):
+        timeline = Timeline()
+        feed(timeline, 0, 100, 0, 1000.0)
+        timeline.new_connection()
+        # Packets 95..99 are repeated and 100..109 were lost
+        queued = feed(timeline, 95, 5, 0, 1003.0) + feed(timeline, 110, 10, 15 * DURATION, 1003.0)
+        self.assertEqual(queued[0], 110 * DURATION)
+        self.assertAlmostEqual(timeline.last_gap, 10 * DURATION / 1000)
+        self.assertEqual(timeline.gaps, [(100 * DURATION, 10 * DURATION)])
+
+    def test_unmatched_connection_is_placed_by_reception(self):
+        timeline = Timeline()
+        feed(timeline, 0, 100, 0, 1000.0)
+        timeline.new_connection()
+        # New audio received 5 seconds after the session started
+        queued = feed(timeline, 1000, ALIGN_MAX_PACKETS, 0, 1005.0)
+        self.assertFalse(timeline.matched)
+        self.assertEqual(queued[0], 5000)
+        self.assertAlmostEqual(timeline.last_gap, 5 - 100 * DURATION / 1000)
+
+    def test_unmatched_connection_never_overlaps(self):
+        timeline = Timeline(match_packets=False)
+        feed(timeline, 0, 100, 0, 1000.0)
+        timeline.new_connection()
+        # Received earlier than expected: placed right after the previous end
+        queued = feed(timeline, 1000, ALIGN_MAX_PACKETS, 0, 1000.5)
+        self.assertEqual(queued[0], 100 * DURATION)
+        self.assertEqual(timeline.last_gap, 0)
+
+    def test_end_connection_releases_held_packets(self):
+        timeline = Timeline(match_packets=False)
+        feed(timeline, 0, 10, 0, 1000.0)
+        timeline.new_connection()
+        self.assertEqual(feed(timeline, 1000, 5, 0, 1000.0), [])
+        entries = timeline.end_connection()
+        self.assertEqual([entry[1] for entry in entries],
+                         [260 + i * DURATION for i in range(5)])
+        self.assertEqual(timeline.end_connection(), [])
+
+    def test_rescales_time_base(self):
+        timeline = Timeline(match_packets=False)
+        feed(timeline, 0, 10, 0, 1000.0)
+        timeline.new_connection()
+        entries = []
+        for i in range(ALIGN_MAX_PACKETS):
+            packet = make_packet(i * 26 * 90, 1000 + i, Fraction(1, 90000))
+            entries += timeline.add(packet, 1000.0 + 10 + i * 0.026)
+        _, pts, duration, _ = entries[0]
+        self.assertEqual(pts, 10000)
+        self.assertEqual(duration, DURATION)
+
+
+if __name__ == "__main__":
+    unittest.main()
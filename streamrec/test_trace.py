@@ -0,0 +1,101 @@
+import json
+from pathlib import Path
+import tempfile
+import threading
+import unittest
+
+from streamrec.config import RecordingConfig
+from streamrec.journal import MemoryBudget
+from streamrec.recorder import Recorder
+from streamrec.test_index import START_TS, encode_mp3
+from streamrec.trace import NULL_SPAN, Tracer, load_trace, summarize
+
+
+class TestTracer(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.addCleanup(self.folder.cleanup)
+        self.path = Path(self.folder.name) / "trace.json"
+        self.tracer = Tracer()
+        self.addCleanup(self.tracer.stop)
+
+    def complete_events(self) -> list[dict]:
+        return [e for e in json.loads(self.path.read_text()) if e["ph"] == "X"]
+
+    def test_disabled(self):
+        self.assertIs(self.tracer.trace("flush", stream="a"), NULL_SPAN)
+        self.assertEqual(len(self.tracer.events), 0)
+
+    def test_nested_spans(self):
+        self.tracer.start(self.path)
+        lock = threading.Lock()
+        with self.tracer.trace("flush", stream="a") as trace:
+            with trace.lock("queue_lock", lock):
+                self.assertTrue(lock.locked())
+            with trace.span("write", segment=60):
+                pass
+            trace.tag(packets=3)
+        self.assertFalse(lock.locked())
+        self.tracer.stop()
+        events = {e["name"]: e for e in self.complete_events()}
+        self.assertEqual(set(events), {"flush", "queue_lock", "write"})
+        self.assertEqual(events["flush"]["args"], {"stream": "a", "packets": 3})
+        self.assertEqual(events["write"]["args"], {"stream": "a", "segment": 60})
+        self.assertGreaterEqual(events["write"]["ts"], events["flush"]["ts"])
+        self.assertLessEqual(events["write"]["ts"] + events["write"]["dur"],
+                             events["flush"]["ts"] + events["flush"]["dur"])
+
+    def test_sampling(self):
+        self.tracer.start(self.path, sample_every=10)
+        for _ in range(100):
+            with self.tracer.trace("flush") as trace:
+                with trace.span("write"):
+                    pass
+            with self.tracer.trace("demux"):
+                pass
+        self.tracer.stop()
+        counts = summarize(self.complete_events())
+        self.assertEqual({stage: s["count"] for stage, s in counts.items()},
+                         {"demux": 10, "flush": 10, "write": 10})
+
+    def test_drops_beyond_buffer(self):
+        self.tracer.start(self.path, max_events=5)
+        for _ in range(8):
+            with self.tracer.trace("flush"):
+                pass
+        self.assertEqual(self.tracer.dropped, 3)
+
+    def test_unterminated_trace(self):
+        self.path.write_text('[\n{"name": "flush", "ph": "X", "ts": 1, "dur": 2000, '
+                             '"pid": 1, "tid": 1, "args": {"stream": "a"}},\n')
+        summary = summarize(load_trace(self.path), by="stream")
+        self.assertEqual(summary, {"flush [a]": {"count": 1, "p50": 2.0, "p90": 2.0,
+                                                 "p99": 2.0, "max": 2.0}})
+
+
+class TestRecorderTrace(unittest.TestCase):
+    def test_flush_stages(self):
+        with tempfile.TemporaryDirectory() as folder:
+            config = RecordingConfig(url="", output_folder=folder, durability="none",
+                                     name="station", max_queue_bytes=0)
+            recorder = Recorder(config)
+            recorder.budget = MemoryBudget()
+            recorder.session.ts_start = START_TS
+            recorder.tracer = tracer = Tracer()
+            tracer.start(Path(folder) / "trace.json")
+            try:
+                recorder.enqueue_many(encode_mp3(2))
+                recorder.flush()
+                recorder.close_output()
+            finally:
+                tracer.stop()
+            events = load_trace(Path(folder) / "trace.json")
+        stages = summarize(events)
+        self.assertEqual(set(stages), {"enqueue", "queue_lock", "flush", "build", "clock",
+                                       "split", "write"})
+        self.assertTrue(all(e["args"]["stream"] == "station"
+                            for e in events if e["ph"] == "X"))
+
+
+if __name__ == "__main__":
+    unittest.main()
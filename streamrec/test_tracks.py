@@ -0,0 +1,114 @@
+import io
+from pathlib import Path
+import tempfile
+import unittest
+
+import av
+import numpy as np
+
+from streamrec.config import RecordingConfig
+from streamrec.index import SegmentIndex
+from streamrec.recorder import Recorder
+from streamrec.tracks import select_tracks, track_config, track_label
+
+LANGUAGES = ("eng", "spa", "")
+SAMPLE_RATE = 48000
+
+
+def encode_tracks(seconds: float) -> bytes:
+    """An MPEG-TS stream with an MP2 track of noise per language, the last one
+    without a language."""
+    buffer = io.BytesIO()
+    with av.open(buffer, mode="w", format="mpegts") as container:
+        streams = []
+        for language in LANGUAGES:
+            stream = container.add_stream("mp2", rate=SAMPLE_RATE)
+            stream.layout = "mono"
+            if language:
+                stream.metadata["language"] = language
+            streams.append(stream)
+        for stream in streams:
+            samples = np.random.uniform(-1, 1, (1, int(seconds * SAMPLE_RATE))) * 2**14
+            frame = av.AudioFrame.from_ndarray(samples.astype(np.int16), format="s16",
+                                               layout="mono")
+            frame.sample_rate = SAMPLE_RATE
+            for packet in stream.encode(frame) + stream.encode(None):
+                container.mux(packet)
+    return buffer.getvalue()
+
+
+def track_payloads(path: str) -> dict[int, bytes]:
+    """The packet bytes of each audio track, demuxed on their own."""
+    payloads = {}
+    with av.open(path) as container:
+        for stream in container.streams.audio:
+            with av.open(path) as single:
+                payloads[stream.index] = b"".join(
+                    bytes(p) for p in single.demux(single.streams[stream.index]) if p.size)
+    return payloads
+
+
+class TestTracks(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.data = encode_tracks(5)
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.source = str(Path(self.tmp.name) / "stream.ts")
+        Path(self.source).write_bytes(self.data)
+        self.output = Path(self.tmp.name) / "out"
+
+    def test_select(self):
+        with av.open(self.source) as container:
+            streams = list(container.streams)
+            self.assertEqual([track_label(s) for s in streams],
+                             ["track0-eng", "track1-spa", "track2"])
+            self.assertEqual(select_tracks(streams, "all"), streams)
+            self.assertEqual(select_tracks(streams, "SPA,2"), streams[1:])
+            self.assertEqual(select_tracks(streams, "0,fra"), streams[:1])
+            with self.assertRaises(ValueError):
+                select_tracks(streams, "fra")
+
+    def test_track_config(self):
+        config = RecordingConfig(url="", output_folder="/rec", name="radio",
+                                 tracks="all", storage_url="s3://bucket/radio/")
+        track = track_config(config, "track1-spa")
+        self.assertEqual((track.output_folder, track.station, track.tracks, track.storage_url),
+                         ("/rec/track1-spa", "radio-track1-spa", "", "s3://bucket/radio/track1-spa"))
+
+    def record(self, tracks: str) -> Recorder:
+        config = RecordingConfig(url=self.source, output_folder=str(self.output),
+                                 name="radio", durability="none", tracks=tracks)
+        recorder = Recorder(config)
+        recorder.start()
+        return recorder
+
+    def folder_bytes(self, folder: Path) -> bytes:
+        index = SegmentIndex(str(folder))
+        try:
+            return b"".join(s.path.read_bytes() for s in index.segments(0, float("inf")))
+        finally:
+            index.close()
+
+    def test_records_every_track(self):
+        recorder = self.record("all")
+        payloads = track_payloads(self.source)
+        self.assertEqual(sorted(p.name for p in self.output.iterdir()),
+                         ["track0-eng", "track1-spa", "track2"])
+        for index, label in enumerate(["track0-eng", "track1-spa", "track2"]):
+            self.assertEqual(self.folder_bytes(self.output / label), payloads[index])
+        stats = recorder.stream_stats()
+        self.assertEqual(sorted(stats), ["radio-track0-eng", "radio-track1-spa", "radio-track2"])
+        self.assertTrue(all(s["segments_closed"] for s in stats.values()))
+
+    def test_records_selected_tracks(self):
+        self.record("2,eng")
+        payloads = track_payloads(self.source)
+        self.assertEqual(sorted(p.name for p in self.output.iterdir()), ["track0-eng", "track2"])
+        self.assertEqual(self.folder_bytes(self.output / "track2"), payloads[2])
+
+
+if __name__ == "__main__":
+    unittest.main()
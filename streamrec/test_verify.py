@@ -0,0 +1,114 @@
+import os
+import tempfile
+import unittest
+import zlib
+
+from streamrec.config import RecordingConfig
+from streamrec.index import IndexWriter, SegmentIndex, file_checksums
+from streamrec.segmentfile import SegmentFile
+from streamrec.session import RecordingSession
+from streamrec.test_index import START_TS, encode_mp3, make_batch
+from streamrec.verify import verify
+
+# Small blocks, so each segment has several
+BLOCK = 4096
+
+
+class TestVerify(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.packets = encode_mp3(25)
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.addCleanup(self.folder.cleanup)
+
+    def record(self, checksum_block: int = BLOCK):
+        config = RecordingConfig(url="", output_folder=self.folder.name, segment_duration=10,
+                                 durability="none")
+        session = RecordingSession(config=config)
+        session.adjusted_ts_start = START_TS
+        index = IndexWriter(self.folder.name, session.uuid, checksum_block)
+        segment = None
+        # Batches that do not line up with the blocks
+        for i in range(0, len(self.packets), 7):
+            for segment_ts, packets in make_batch(session, self.packets[i:i + 7]).split_by_segment():
+                if segment and segment.segment_ts != segment_ts:
+                    segment.close()
+                    segment = None
+                if not segment:
+                    segment = SegmentFile(session, segment_ts, index=index)
+                segment.write(packets)
+        segment.close()
+        index.close()
+        index = SegmentIndex(self.folder.name)
+        try:
+            return [(s, index.checksums(s)) for s in index.segments(START_TS, START_TS + 30)]
+        finally:
+            index.close()
+
+    def test_checksums_on_write(self):
+        for segment, checksums in self.record():
+            self.assertEqual(checksums, file_checksums(segment.path, block_size=BLOCK))
+            self.assertEqual([offset for offset, _, _ in checksums],
+                             list(range(0, segment.size, BLOCK)))
+
+    def test_one_checksum_per_segment(self):
+        for segment, checksums in self.record(checksum_block=0):
+            self.assertEqual(checksums, [(0, segment.size, zlib.crc32(segment.path.read_bytes()))])
+
+    def test_intact(self):
+        segments = self.record()
+        result = verify(self.folder.name)
+        self.assertEqual((result.segments, result.unchecked, result.problems), (3, 0, []))
+        self.assertEqual(result.bytes, sum(s.path.stat().st_size for s, _ in segments))
+
+    def test_damage(self):
+        segments = self.record()
+        (first, _), (second, second_checksums), (third, _) = segments
+        # A flipped byte in the second block of the first segment
+        with open(first.path, "r+b") as f:
+            f.seek(BLOCK + 100)
+            byte = f.read(1)
+            f.seek(BLOCK + 100)
+            f.write(bytes([byte[0] ^ 0xFF]))
+        # The second segment lost its last block and a half
+        last_offset, _, _ = second_checksums[-1]
+        os.truncate(second.path, last_offset - BLOCK // 2)
+        third.path.unlink()
+
+        for workers in (1, 2):
+            result = verify(self.folder.name, workers=workers)
+            self.assertEqual(result.segments, 3)
+            self.assertEqual([c.segment.path for c in result.problems],
+                             [first.path, second.path, third.path])
+            changed, truncated, missing = result.problems
+            [block] = changed.bad_blocks
+            self.assertEqual((block.offset, block.size, block.reason), (BLOCK, BLOCK, "changed"))
+            # The checkpoints around the block, one second apart
+            self.assertLess(block.start_ts, block.end_ts)
+            self.assertLessEqual(block.end_ts - block.start_ts, 2)
+            self.assertGreaterEqual(block.start_ts, first.start_ts)
+            self.assertEqual([(b.offset, b.reason) for b in truncated.bad_blocks],
+                             [(last_offset - BLOCK, "missing"), (last_offset, "missing")])
+            self.assertEqual(truncated.bad_blocks[-1].end_ts, second.end_ts)
+            self.assertEqual((missing.status, missing.bad_blocks), ("missing", []))
+
+    def test_extra_bytes_and_unchecked(self):
+        segments = self.record()
+        (first, _), (second, _), _ = segments
+        with open(first.path, "ab") as f:
+            f.write(b"\0" * 10)
+        index = SegmentIndex(self.folder.name)
+        with index.conn:
+            index.conn.execute("DELETE FROM checksums WHERE segment_id = ?", (second.id,))
+        index.close()
+        result = verify(self.folder.name)
+        self.assertEqual(result.unchecked, 1)
+        [check] = result.problems
+        self.assertEqual([(b.offset, b.size, b.reason) for b in check.bad_blocks],
+                         [(first.size, 10, "extra")])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,161 @@
+from collections import OrderedDict
+from fractions import Fraction
+import logging
+import random
+
+import av
+
+logger = logging.getLogger(__name__)
+
+# Packets remembered to recognise audio that a new connection sends again
+RECENT_PACKETS = 2048
+# Consecutive packets that must match the same offset to trust an alignment
+MATCH_RUN = 3
+# Packets or seconds of a new connection held back while looking for a match
+ALIGN_MAX_PACKETS = 512
+ALIGN_MAX_SECONDS = 0.5
+
+
+def backoff_delay(attempt: int, initial: float, maximum: float) -> float:
+    """Exponential backoff with jitter: a random delay in [d/2, d]."""
+    delay = min(maximum, initial * 2 ** attempt)
+    return random.uniform(delay / 2, delay)
+
+
+# pylint: disable=too-many-instance-attributes
+class Timeline:
+    """Maps the pts of every connection of a session onto one continuous timeline.
+
+    The first connection defines the time base and pts 0. When a new
+    connection starts, its first packets are held back until they can be
+    placed: if they repeat audio that was already received (servers usually
+    send a burst of buffered audio), the repeated packets are dropped and the
+    rest continue right after them. Otherwise the new connection is placed
+    using the received timestamps, never before the end of the previous one.
+    """
+
+    def __init__(self, match_packets: bool = True):
+        self.time_base: Fraction = None
+        self.seconds_per_tick: float = None
+        self.offset = 0
+        self.last_pts: int = None
+        self.last_end: int = None
+        self.min_guess: float = None
+        self.recent: OrderedDict[int, int] = OrderedDict() if match_packets else None
+        self.aligning = False
+        self.held: list[tuple[av.Packet, float, int]] = []
+        self.resume_from: int = None
+        self.matched = False
+        self.match_candidate: int = None
+        self.match_run = 0
+        self.reconnects = 0
+        self.last_gap = 0.0
+        self.total_gap = 0.0
+        self.gaps: list[tuple[int, int]] = []
+
+    def new_connection(self):
+        if self.last_end is None:
+            return
+        self.reconnects += 1
+        self.aligning = True
+        self.held = []
+        self.match_candidate, self.match_run = None, 0
+
+    def end_connection(self) -> list[tuple[av.Packet, int, int, float]]:
+        """Place the packets still held back when a connection ends."""
+        if not self.held:
+            self.aligning = False
+            return []
+        return self.release(self.estimate_offset(), matched=False)
+
+    def rescale(self, value: int, time_base: Fraction) -> int:
+        if time_base is self.time_base or time_base == self.time_base:
+            return value
+        return round(value * time_base / self.time_base)
+
+    def add(self, packet: av.Packet, received_ts: float) -> list[tuple[av.Packet, int, int, float]]:
+        """Return the ``(packet, pts, duration, received_ts)`` entries ready to be queued."""
+        if self.time_base is None:
+            self.time_base = packet.time_base
+            self.seconds_per_tick = float(packet.time_base)
+        if self.aligning:
+            return self.align(packet, received_ts)
+        return self.place(packet, received_ts)
+
+    def place(self, packet: av.Packet, received_ts: float) -> list[tuple[av.Packet, int, int, float]]:
+        pts = self.rescale(packet.pts, packet.time_base) + self.offset
+        if self.resume_from is not None:
+            if pts < self.resume_from:
+                # Audio that the previous connection already delivered
+                return []
+            self.record_gap(pts - self.resume_from)
+            self.resume_from = None
+        duration = self.rescale(packet.duration or 0, packet.time_base)
+        if not duration and self.last_pts is not None:
+            duration = pts - self.last_pts
+        self.last_pts = pts
+        self.last_end = pts + duration
+        guess = received_ts - pts * self.seconds_per_tick
+        if self.min_guess is None or guess < self.min_guess:
+            self.min_guess = guess
+        if self.recent is not None:
+            self.recent[hash(bytes(packet))] = pts
+            if len(self.recent) > RECENT_PACKETS:
+                self.recent.popitem(last=False)
+        return [(packet, pts, duration, received_ts)]
+
+    def align(self, packet: av.Packet, received_ts: float) -> list[tuple[av.Packet, int, int, float]]:
+        packet_hash = hash(bytes(packet)) if self.recent else None
+        self.held.append((packet, received_ts, packet_hash))
+        offset = self.match_offset(packet, packet_hash)
+        if offset is not None:
+            return self.release(offset, matched=True)
+        if (len(self.held) >= ALIGN_MAX_PACKETS
+                or received_ts - self.held[0][1] >= ALIGN_MAX_SECONDS):
+            return self.release(self.estimate_offset(), matched=False)
+        return []
+
+    def match_offset(self, packet: av.Packet, packet_hash: int) -> int:
+        """Offset at which the last MATCH_RUN held packets repeat earlier audio, if any."""
+        old_pts = self.recent.get(packet_hash) if self.recent else None
+        if old_pts is None:
+            self.match_candidate, self.match_run = None, 0
+            return None
+        offset = old_pts - self.rescale(packet.pts, packet.time_base)
+        if offset == self.match_candidate:
+            self.match_run += 1
+        else:
+            self.match_candidate, self.match_run = offset, 1
+        return offset if self.match_run >= MATCH_RUN else None
+
+    def estimate_offset(self) -> int:
+        """Offset that puts the held packets at the same lag behind their reception
+        as the earlier connections."""
+        guess = min(received_ts - float(packet.pts * packet.time_base)
+                    for packet, received_ts, _ in self.held)
+        return round((guess - self.min_guess) / self.seconds_per_tick)
+
+    def release(self, offset: int, matched: bool) -> list[tuple[av.Packet, int, int, float]]:
+        held, self.held = self.held, []
+        self.aligning = False
+        if not matched:
+            # Without a match there is no way to tell repeated audio apart, so
+            # the new connection starts no earlier than the previous one ended
+            first = held[0][0]
+            offset = max(offset, self.last_end - self.rescale(first.pts, first.time_base))
+        self.offset = offset
+        self.resume_from = self.last_end
+        self.matched = matched
+        ready = []
+        for packet, received_ts, _ in held:
+            ready += self.place(packet, received_ts)
+        return ready
+
+    def record_gap(self, gap: int):
+        self.last_gap = float(gap * self.time_base)
+        self.total_gap += self.last_gap
+        if gap:
+            self.gaps.append((self.resume_from, gap))
+        logger.info("Resumed timeline after reconnect #%s (%s), gap: %.3f seconds",
+                    self.reconnects, "matched" if self.matched else "estimated",
+                    self.last_gap)
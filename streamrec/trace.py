@@ -0,0 +1,216 @@
+from collections import deque
+import json
+import logging
+import os
+from pathlib import Path
+import threading
+import time
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Seconds between writes of the buffered events to the trace file
+FLUSH_INTERVAL = 1.0
+# Events buffered in memory; beyond it, new events are dropped until the
+# buffer is written
+MAX_EVENTS = 100_000
+# Percentiles printed by trace-summary
+PERCENTILES = (50, 90, 99)
+
+
+class Span:
+    """A timed stage, recorded as a Chrome trace complete event when it exits.
+
+    ``args`` (stream, segment...) are shown with the event, and inherited by
+    the spans nested in it with ``span``.
+    """
+    __slots__ = ("tracer", "name", "args", "start")
+
+    def __init__(self, tracer: "Tracer", name: str, args: dict):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+        self.start = 0
+
+    def __enter__(self) -> "Span":
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *_exc):
+        self.tracer.record(self.name, self.start, time.perf_counter_ns(), self.args)
+
+    def span(self, name: str, **args) -> "Span":
+        return Span(self.tracer, name, {**self.args, **args})
+
+    def lock(self, name: str, lock: threading.Lock) -> "LockWait":
+        """Hold ``lock`` in a with block, recording the wait to acquire it."""
+        return LockWait(self.span(name), lock)
+
+    def tag(self, **args):
+        self.args.update(args)
+
+
+class LockWait:
+    __slots__ = ("span", "lock")
+
+    def __init__(self, span: Span, lock: threading.Lock):
+        self.span = span
+        self.lock = lock
+
+    def __enter__(self):
+        with self.span:
+            self.lock.acquire()  # pylint: disable=consider-using-with
+
+    def __exit__(self, *_exc):
+        self.lock.release()
+
+
+class NullSpan:
+    """What a tracer returns for what it does not record: nothing is timed."""
+    __slots__ = ()
+
+    def __enter__(self) -> "NullSpan":
+        return self
+
+    def __exit__(self, *_exc):
+        pass
+
+    def span(self, _name: str, **_args) -> "NullSpan":
+        return self
+
+    def lock(self, _name: str, lock: threading.Lock) -> threading.Lock:
+        return lock
+
+    def tag(self, **_args):
+        pass
+
+
+NULL_SPAN = NullSpan()
+
+
+class Tracer:
+    """Records spans of the recording pipeline to a Chrome/Perfetto trace file.
+
+    Only one in ``sample_every`` of the spans started with ``trace`` under
+    each name is recorded, with the spans nested in it, so a flush is traced
+    as a whole. Recording a span only appends a tuple to a buffer; a
+    background thread converts the buffer to trace events and appends them to
+    the file every FLUSH_INTERVAL seconds. The file is a JSON array of events,
+    closed on stop. One left open by a crash still loads in Perfetto and
+    ``load_trace``.
+    """
+
+    def __init__(self):
+        self.path: Path = None
+        self.sample_every = 1
+        self.max_events = MAX_EVENTS
+        self.running = False
+        self.counts: dict[str, int] = {}
+        self.events: deque = deque()
+        self.dropped = 0
+        self.file = None
+        self.thread_names: dict[int, str] = {}
+        self.stopped = threading.Event()
+        self.thread: threading.Thread = None
+
+    def trace(self, name: str, **args) -> Span:
+        """Start a span at the top of a stage, e.g. a flush, if it is sampled."""
+        if not self.running:
+            return NULL_SPAN
+        count = self.counts.get(name, 0)
+        self.counts[name] = count + 1
+        if count % self.sample_every:
+            return NULL_SPAN
+        return Span(self, name, args)
+
+    def record(self, name: str, start: int, end: int, args: dict):
+        if len(self.events) >= self.max_events:
+            self.dropped += 1
+            return
+        self.events.append((name, start, end, threading.get_native_id(), args))
+
+    def write_events(self):
+        pid = os.getpid()
+        lines = []
+        for _ in range(len(self.events)):
+            name, start, end, tid, args = self.events.popleft()
+            if tid not in self.thread_names:
+                self.thread_names.update(
+                    (t.native_id, t.name) for t in threading.enumerate())
+                self.thread_names.setdefault(tid, str(tid))
+                lines.append(json.dumps({"name": "thread_name", "ph": "M", "pid": pid,
+                                         "tid": tid, "args": {"name": self.thread_names[tid]}})
+                             + ",\n")
+            # Formatted by hand, as json.dumps of the whole event is slower
+            lines.append(f'{{"name": "{name}", "ph": "X", "ts": {start / 1000}, '
+                         f'"dur": {(end - start) / 1000}, "pid": {pid}, "tid": {tid}, '
+                         f'"args": {json.dumps(args)}}},\n')
+        if lines:
+            self.file.write("".join(lines))
+            self.file.flush()
+
+    def run(self):
+        while not self.stopped.wait(FLUSH_INTERVAL):
+            self.write_events()
+
+    def start(self, path: str, sample_every: int = 1, max_events: int = MAX_EVENTS):
+        self.path = Path(path)
+        self.sample_every = max(1, sample_every)
+        self.max_events = max_events
+        self.file = open(self.path, "w", encoding="utf-8")  # pylint: disable=consider-using-with
+        self.file.write("[\n")
+        self.file.write(json.dumps({"name": "process_name", "ph": "M", "pid": os.getpid(),
+                                    "args": {"name": f"streamrec {os.getpid()}"}}) + ",\n")
+        self.stopped.clear()
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name="tracer", daemon=True)
+        self.thread.start()
+        logger.info("Tracing 1 in %s flushes to %s", self.sample_every, self.path)
+
+    def stop(self):
+        if not self.running:
+            return
+        self.running = False
+        self.stopped.set()
+        self.thread.join()
+        self.write_events()
+        # The last event, with no comma after it
+        self.file.write(json.dumps({"name": "trace_dropped", "ph": "M", "pid": os.getpid(),
+                                    "args": {"dropped": self.dropped}}) + "\n]\n")
+        self.file.close()
+        self.file = None
+        if self.dropped:
+            logger.warning("Dropped %s trace events, the buffer was full", self.dropped)
+
+
+process_tracer = Tracer()
+
+
+def load_trace(path: str) -> list[dict]:
+    """The events of a trace file, also of one left open by a crash."""
+    text = Path(path).read_text(encoding="utf-8").rstrip()
+    if text.startswith("[") and not text.endswith("]"):
+        text = text.rstrip(",") + "]"
+    events = json.loads(text)
+    return events["traceEvents"] if isinstance(events, dict) else events
+
+
+def summarize(events: list[dict], by: str = None) -> dict[str, dict[str, float]]:
+    """Count, percentiles and maximum in milliseconds of the complete events
+    of each stage, or of each stage and value of the ``by`` argument."""
+    durations: dict[str, list[float]] = {}
+    for event in events:
+        if event.get("ph") != "X":
+            continue
+        key = event["name"]
+        if by:
+            key = f"{key} [{event.get('args', {}).get(by, '')}]"
+        durations.setdefault(key, []).append(event["dur"] / 1000)
+    summary = {}
+    for key, values in sorted(durations.items()):
+        values = np.array(values)
+        summary[key] = {"count": len(values),
+                        **{f"p{p}": float(np.percentile(values, p)) for p in PERCENTILES},
+                        "max": float(values.max())}
+    return summary
@@ -0,0 +1,51 @@
+from dataclasses import replace
+import logging
+from pathlib import Path
+import re
+
+import av.stream
+
+from streamrec.config import RecordingConfig, parse_tracks
+
+logger = logging.getLogger(__name__)
+
+
+def track_language(stream: av.stream.Stream) -> str:
+    return (stream.metadata.get("language") or "").lower()
+
+
+def select_tracks(streams: list[av.stream.Stream], tracks: str) -> list[av.stream.Stream]:
+    """The audio streams a tracks setting selects, in stream order."""
+    audio = [s for s in streams if s.type == "audio"]
+    selectors = parse_tracks(tracks)
+    if selectors is None:
+        selected = audio
+    else:
+        selected = [s for s in audio if s.index in selectors or track_language(s) in selectors]
+        for selector in selectors:
+            if not any(selector in (s.index, track_language(s)) for s in audio):
+                logger.warning("No audio track matches %r", selector)
+    if not selected:
+        raise ValueError(f"No audio track matches {tracks!r}")
+    return selected
+
+
+def track_label(stream: av.stream.Stream) -> str:
+    """Sub-folder of a track, from its index and language: "track1-eng"."""
+    language = re.sub(r"[^\w-]", "_", track_language(stream))
+    return f"track{stream.index}-{language}" if language else f"track{stream.index}"
+
+
+def track_config(config: RecordingConfig, label: str) -> RecordingConfig:
+    """The config of one track of a multi-track recording: its own output
+    folder, stream name and storage prefix. Open files are recovered for all
+    the tracks when the recording starts."""
+    return replace(
+        config,
+        output_folder=str(Path(config.output_folder) / label),
+        name=f"{config.station}-{label}",
+        tracks="",
+        close_open_files_on_start=False,
+        retention_move_to=(str(Path(config.retention_move_to) / label)
+                           if config.retention_move_to else None),
+        storage_url=f"{config.storage_url.rstrip('/')}/{label}" if config.storage_url else "")
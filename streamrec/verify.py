@@ -0,0 +1,169 @@
+from bisect import bisect_left, bisect_right
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+import logging
+import mmap
+import multiprocessing
+import os
+import time
+import zlib
+
+from .index import IndexedSegment, SegmentIndex
+
+logger = logging.getLogger(__name__)
+
+# Segments handed to a worker process at a time
+CHUNK_SEGMENTS = 64
+# Chunks queued per worker, so the index is read as the workers go
+CHUNKS_PER_WORKER = 4
+
+
+@dataclass
+class BadBlock:
+    offset: int
+    size: int
+    # "changed" (the bytes differ), "missing" (past the end of the file) or
+    # "extra" (bytes after the end of the segment)
+    reason: str
+    # Time range of the block, from the checkpoints around it
+    start_ts: float = None
+    end_ts: float = None
+
+
+@dataclass
+class SegmentCheck:
+    segment: IndexedSegment
+    # "ok", "corrupt", "missing" (no file) or "unchecked" (no checksums)
+    status: str
+    bad_blocks: list[BadBlock] = field(default_factory=list)
+
+
+@dataclass
+class VerifyResult:
+    segments: int = 0
+    bytes: int = 0
+    elapsed: float = 0.0
+    unchecked: int = 0
+    # Segments that are corrupt or missing
+    problems: list[SegmentCheck] = field(default_factory=list)
+
+
+def verify_segment(segment: IndexedSegment, checksums: list[tuple[int, int, int]]) -> SegmentCheck:
+    """Hash a segment file against the ``(offset, size, crc)`` of its blocks."""
+    try:
+        f = open(segment.path, "rb")
+    except FileNotFoundError:
+        return SegmentCheck(segment, "missing")
+    if not checksums:
+        f.close()
+        return SegmentCheck(segment, "unchecked")
+    bad_blocks = []
+    with f:
+        size = os.fstat(f.fileno()).st_size
+        expected = checksums[-1][0] + checksums[-1][1]
+        if size:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                if hasattr(data, "madvise"):
+                    data.madvise(mmap.MADV_SEQUENTIAL)
+                with memoryview(data) as view:
+                    for offset, block_size, crc in checksums:
+                        if offset + block_size > size:
+                            bad_blocks.append(BadBlock(offset, block_size, "missing"))
+                            continue
+                        with view[offset:offset + block_size] as block:
+                            if zlib.crc32(block) != crc:
+                                bad_blocks.append(BadBlock(offset, block_size, "changed"))
+        else:
+            bad_blocks = [BadBlock(offset, block_size, "missing")
+                          for offset, block_size, _ in checksums]
+        if size > expected:
+            bad_blocks.append(BadBlock(expected, size - expected, "extra"))
+    return SegmentCheck(segment, "corrupt" if bad_blocks else "ok", bad_blocks)
+
+
+def verify_segments(chunk: list[tuple[IndexedSegment, list]]) -> list[SegmentCheck]:
+    """Runs in a worker process."""
+    return [verify_segment(segment, checksums) for segment, checksums in chunk]
+
+
+def locate_blocks(index: SegmentIndex, check: SegmentCheck):
+    """Set the time range of the bad blocks of a segment, from the checkpoints
+    at or before their start and at or after their end."""
+    segment = check.segment
+    checkpoints = index.checkpoints(segment)
+    offsets = [offset for _, offset in checkpoints]
+    for block in check.bad_blocks:
+        i = bisect_right(offsets, block.offset) - 1
+        block.start_ts = checkpoints[i][0] if i >= 0 else segment.start_ts
+        j = bisect_left(offsets, block.offset + block.size)
+        block.end_ts = checkpoints[j][0] if j < len(checkpoints) else segment.end_ts
+
+
+def chunks(index: SegmentIndex):
+    chunk = []
+    for item in index.closed_checksums():
+        chunk.append(item)
+        if len(chunk) == CHUNK_SEGMENTS:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def verify(folder: str, workers: int = 1) -> VerifyResult:
+    """Re-hash the closed segments of an output folder against the checksums
+    in its index, in a pool of ``workers`` processes. Returns the segments
+    that are missing or whose blocks changed, with their time ranges."""
+    result = VerifyResult()
+    start = time.perf_counter()
+    index = SegmentIndex(folder)
+    pool = None
+    if workers > 1:
+        pool = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"))
+    pending: deque[Future] = deque()
+
+    def collect(checks: list[SegmentCheck]):
+        for check in checks:
+            result.segments += 1
+            result.bytes += check.segment.size or 0
+            if check.status == "unchecked":
+                result.unchecked += 1
+            elif check.status != "ok":
+                locate_blocks(index, check)
+                result.problems.append(check)
+
+    try:
+        for chunk in chunks(index):
+            if pool is None:
+                collect(verify_segments(chunk))
+                continue
+            pending.append(pool.submit(verify_segments, chunk))
+            if len(pending) >= workers * CHUNKS_PER_WORKER:
+                collect(pending.popleft().result())
+        while pending:
+            collect(pending.popleft().result())
+    finally:
+        if pool:
+            pool.shutdown(cancel_futures=True)
+        index.close()
+    result.elapsed = time.perf_counter() - start
+    logger.info("Verified %s segments (%s bytes) of %s in %.1f seconds", result.segments,
+                result.bytes, folder, result.elapsed)
+    return result
+
+
+def format_time_range(start_ts: float, end_ts: float) -> str:
+    return " to ".join(datetime.fromtimestamp(ts, tz=timezone.utc).isoformat(timespec="milliseconds")
+                       for ts in (start_ts, end_ts))
+
+
+def format_problem(folder: str, check: SegmentCheck) -> list[str]:
+    """Report lines for a segment that did not verify."""
+    path = check.segment.path.relative_to(folder)
+    if check.status == "missing":
+        return [f"{path}: missing file, "
+                f"{format_time_range(check.segment.start_ts, check.segment.end_ts)}"]
+    return [f"{path}: {block.reason} bytes {block.offset}-{block.offset + block.size}, "
+            f"{format_time_range(block.start_ts, block.end_ts)}" for block in check.bad_blocks]
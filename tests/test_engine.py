@@ -0,0 +1,97 @@
+import logging
+from multiprocessing import Process
+import os
+from pathlib import Path
+import shutil
+import socket
+from threading import Thread
+import time
+import unittest
+from streamrec.config import RecordingConfig
+from streamrec.engine import Engine
+from .test_server import test_server_start
+
+logger = logging.getLogger(__name__)
+
+PORT = 8001
+
+
+@unittest.skipUnless(os.environ.get("INTEGRATION_TESTS"), "Integration tests")
+class TestEngine(unittest.TestCase):
+
+    def setUp(self):
+        logging.basicConfig(level=os.getenv("LOGLEVEL", "ERROR"))
+        self.output_folder = Path("/tmp/output-engine")
+        shutil.rmtree(self.output_folder, ignore_errors=True)
+        self.server = Process(target=test_server_start, args=(PORT,))
+        self.server.start()
+        while True:
+            try:
+                with socket.create_connection(("localhost", PORT), timeout=1):
+                    break
+            except ConnectionRefusedError:
+                time.sleep(0.1)
+
+    def tearDown(self):
+        self.server.terminate()
+
+    def make_configs(self, n: int, query: str = "") -> list[RecordingConfig]:
+        return [RecordingConfig(url=f"http://localhost:{PORT}/?{query}",
+                                output_folder=str(self.output_folder / str(i)),
+                                initial_writer_delay=1,
+                                segment_duration=1,
+                                write_period=1)
+                for i in range(n)]
+
+    def test_records_all_streams(self):
+        engine = Engine(self.make_configs(5, "speed=2"), max_workers=2)
+        thread = Thread(target=engine.start)
+        thread.start()
+        time.sleep(3)
+        engine.stop()
+        thread.join(5)
+        self.assertFalse(thread.is_alive(), "Engine did not stop")
+        for i, stream in enumerate(engine.streams):
+            self.assertIsNone(stream.recorder.reader_unhandled_exception)
+            files = list((self.output_folder / str(i)).glob("*.mp3"))
+            self.assertGreater(len(files), 0)
+
+    def test_server_close(self):
+        engine = Engine(self.make_configs(3, "limit=2"))
+        thread = Thread(target=engine.start)
+        thread.start()
+        thread.join(10)
+        self.assertFalse(thread.is_alive(), "Engine did not finish")
+        for stream in engine.streams:
+            self.assertIsNone(stream.recorder.reader_unhandled_exception)
+            self.assertTrue(stream.recorder.reader_finished)
+
+    def test_native_ingest(self):
+        configs = self.make_configs(3, "speed=2")
+        for config in configs:
+            config.native_ingest = True
+        engine = Engine(configs)
+        thread = Thread(target=engine.start)
+        thread.start()
+        time.sleep(3)
+        engine.stop()
+        thread.join(5)
+        self.assertFalse(thread.is_alive(), "Engine did not stop")
+        for i, stream in enumerate(engine.streams):
+            self.assertIsNotNone(stream.demuxer)
+            self.assertIsNone(stream.recorder.reader_unhandled_exception)
+            size = sum(f.stat().st_size for f in (self.output_folder / str(i)).glob("*.mp3"))
+            self.assertGreater(size, 0)
+            self.assertEqual(size % 417, 0)
+
+    def test_connection_refused(self):
+        configs = self.make_configs(1)
+        configs[0].url = "http://localhost:1/"
+        engine = Engine(configs)
+        engine.start()
+        self.assertIsNotNone(engine.streams[0].recorder.reader_exception)
+        self.assertIsNone(engine.streams[0].recorder.reader_unhandled_exception)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,8 @@
 import logging
 from multiprocessing import Process
 import os
+from pathlib import Path
+import shutil
 import signal
 import socket
 from threading import Thread
@@ -8,6 +10,7 @@ import time
 import unittest
 from streamrec.recorder import Recorder
 from streamrec.config import RecordingConfig
+from streamrec.features import read_sidecar, sidecar_path
 from .test_server import test_server_start
 
 logger = logging.getLogger(__name__)
@@ -34,6 +37,7 @@ class TestRecorder(unittest.TestCase):
     def tearDown(self):
         if self.server:
             self.server.terminate()
+            self.server.join()
 
     def run_server_process(self):
         self.server = Process(target=test_server_start)
@@ -74,6 +78,7 @@ class TestRecorder(unittest.TestCase):
         self.run_server_process()
         self.config.url = "http://localhost:8000?speed=2"
         self.run_recorder(stop_after=2)
+        self.check_recorder_finished(5)
         self.assertIsNone(self.recorder.reader_exception)
 
     def test_server_close(self):
@@ -102,6 +107,53 @@ class TestRecorder(unittest.TestCase):
         self.check_recorder_finished(6)
         self.assertIsNotNone(self.recorder.reader_exception)
 
+    def test_reconnect(self):
+        self.run_server_process()
+        self.config.url = "http://localhost:8000?limit=1&initial_burst=1"
+        self.config.reconnect_attempts = 3
+        self.config.reconnect_delay = 0.1
+        self.run_recorder(stop_after=4)
+        self.check_recorder_finished(5)
+        self.assertGreaterEqual(self.recorder.reconnects, 1)
+        self.assertLess(self.recorder.last_resume_seconds, 1)
+
+    def test_native_ingest(self):
+        self.run_server_process()
+        shutil.rmtree(self.config.output_folder, ignore_errors=True)
+        self.config.url = "http://localhost:8000?speed=2"
+        self.config.native_ingest = True
+        self.run_recorder(stop_after=2)
+        self.check_recorder_finished(5)
+        self.assertIsNone(self.recorder.reader_exception)
+        self.assertGreater(self.recorder.metrics.packets, 0)
+        sizes = [p.stat().st_size for p in Path(self.config.output_folder).glob("*.mp3")]
+        self.assertGreater(sum(sizes), 0)
+        # Whole frames of the test server, 417 bytes each
+        self.assertEqual(sum(sizes) % 417, 0)
+
+    def test_native_ingest_timeout(self):
+        self.run_server_process()
+        self.config.url = "http://localhost:8000?limit=3&keep_open=True"
+        self.config.network_timeout = 2
+        self.config.native_ingest = True
+        self.run_recorder()
+        self.check_recorder_finished(6)
+        self.assertIsNotNone(self.recorder.reader_exception)
+
+    def test_features(self):
+        self.run_server_process()
+        shutil.rmtree(self.config.output_folder, ignore_errors=True)
+        self.config.url = "http://localhost:8000?speed=2"
+        self.config.features = True
+        self.run_recorder(stop_after=3)
+        self.check_recorder_finished(15)
+        segments = sorted(Path(self.config.output_folder).glob("*.mp3"))
+        self.assertGreater(len(segments), 1)
+        self.assertEqual(self.recorder.features.extracted, len(segments))
+        for segment in segments:
+            features = read_sidecar(sidecar_path(segment))
+            self.assertGreater(len(features.loudness), 0)
+
 
 if __name__ == '__main__':
     unittest.main()
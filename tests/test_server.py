@@ -22,13 +22,20 @@ class TestServer:
     def __init__(self):
         self.httpd = None
         self.packet = self.generate_white_noise_packet()
+        self.packets = {BIT_RATE: self.packet}
 
-    def generate_white_noise_packet(self) -> av.Packet:
+    def packet_for(self, bit_rate: int) -> av.Packet:
+        if bit_rate not in self.packets:
+            self.packets[bit_rate] = self.generate_white_noise_packet(bit_rate)
+        return self.packets[bit_rate]
+
+    def generate_white_noise_packet(self, bit_rate: int = None) -> av.Packet:
         """Generate white noise and encode it as MP3 in memory."""
         output_buffer = io.BytesIO()
         container = av.open(output_buffer, mode='w', format='mp3')
         stream = container.add_stream('mp3', rate=SAMPLE_RATE)
-        # stream.bit_rate = BIT_RATE
+        if bit_rate:
+            stream.bit_rate = bit_rate
         # stream.layout = 'stereo'
         # stream.sample_rate = SAMPLE_RATE
         mono_samples = (np.random.uniform(-1, 1, 100000)
@@ -53,6 +60,13 @@ class TestServer:
 
         keep_open = bool(parsed_qs.get("keep_open", [False])[0])
 
+        bit_rate = int(parsed_qs.get("bitrate", [BIT_RATE])[0])
+        packet = self.packet_for(bit_rate)
+
+        # Pause for stall_for seconds after every stall_every seconds of audio
+        stall_every = float(parsed_qs.get("stall_every", [0])[0])
+        stall_for = float(parsed_qs.get("stall_for", [0])[0])
+
         request.send_response(200)
         request.send_header("Content-Type", "audio/mpeg")
 
@@ -60,12 +74,18 @@ class TestServer:
 
         bytes_sent = 0
         start_ts = time.time()
+        next_stall = stall_every
         try:
             while True:  # Infinite loop to repeat the audio
-                request.wfile.write(self.packet)
-                bytes_sent += self.packet.size
-                seconds_sent = bytes_sent * 8 / BIT_RATE
+                request.wfile.write(packet)
+                bytes_sent += packet.size
+                seconds_sent = bytes_sent * 8 / bit_rate
                 request.wfile.flush()
+                if stall_every and seconds_sent >= next_stall:
+                    time.sleep(stall_for)
+                    # The stall does not count towards the pace
+                    start_ts += stall_for
+                    next_stall += stall_every
                 if limit_seconds and seconds_sent > limit_seconds:
                     if keep_open:
                         logger.info("Limit reached, keeping connection open")
@@ -80,7 +100,7 @@ class TestServer:
             pass  # Client disconnected
         logger.info("Request finished")
 
-    def start(self):
+    def start(self, port: int = PORT):
         server = self
 
         class Handler(http.server.BaseHTTPRequestHandler):
@@ -91,13 +111,13 @@ class TestServer:
             def log_message(self, format, *args):
                 pass  # Suppress log messages
 
-        self.httpd = http.server.ThreadingHTTPServer(("", PORT), Handler)
+        self.httpd = http.server.ThreadingHTTPServer(("", port), Handler)
         self.httpd.serve_forever()
 
 
-def test_server_start():
+def test_server_start(port: int = PORT):
     server = TestServer()
-    server.start()
+    server.start(port)
 
 
 if __name__ == "__main__":